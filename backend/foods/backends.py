@@ -0,0 +1,88 @@
+"""
+Pluggable read backends for the hot read-only endpoints.
+
+Food detail, text search and autocomplete ask the backend named by the
+FOODS_READ_BACKEND setting (a dotted path) before querying the database.
+A backend method returns its answer, or None to let the view fall back to
+the database, so a backend only needs to cover what it can answer exactly:
+
+    FOODS_READ_BACKEND=foods.backends.SnapshotBackend
+
+serves them from the SQLite snapshot (foods.snapshot), which lets edge
+nodes run the read API without Postgres once a snapshot has been built.
+With the setting empty (the default) every request uses the database.
+
+A backend with `uses_database = False` is authoritative: what it does not
+find is answered as not found rather than looked up in the database, the
+dataset version comes from `dataset_version()`, and queries are not
+counted in the query log. Endpoints and search options the backend does
+not cover still need the database.
+"""
+
+import threading
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+from . import snapshot
+
+
+class ReadBackend:
+    """Answers nothing; every request goes to the database"""
+
+    uses_database = True
+
+    def dataset_version(self):
+        """Dataset version being served, or None to read it from the database"""
+        return None
+
+    def food(self, fdc_id):
+        """Food detail fields (see SnapshotReader.food_result), or None"""
+        return None
+
+    def search(self, query, data_type='', category_id='', offset=0, limit=20):
+        """(results, total count) for a plain text search, or None"""
+        return None
+
+    def autocomplete(self, query, limit=10):
+        """List of suggested descriptions, or None"""
+        return None
+
+
+class SnapshotBackend(ReadBackend):
+    """Reads from the newest built SQLite snapshot, if any, and never from the database"""
+
+    uses_database = False
+
+    def dataset_version(self):
+        # The newest snapshot in FOODS_DATA_DIR, so no DatasetRelease query is needed
+        versions = snapshot.files.versions()
+        return versions[-1] if versions else None
+
+    def food(self, fdc_id):
+        reader = snapshot.get_snapshot()
+        return None if reader is None else reader.food(fdc_id)
+
+    def search(self, query, data_type='', category_id='', offset=0, limit=20):
+        reader = snapshot.get_snapshot()
+        return None if reader is None else reader.search(query, data_type, category_id, offset, limit)
+
+    def autocomplete(self, query, limit=10):
+        reader = snapshot.get_snapshot()
+        return None if reader is None else reader.autocomplete(query, limit)
+
+
+_lock = threading.Lock()
+_backend = (None, None)
+
+
+def get_read_backend():
+    """The configured read backend, instantiated once per process"""
+    global _backend
+    path = getattr(settings, 'FOODS_READ_BACKEND', '') or 'foods.backends.ReadBackend'
+    configured, backend = _backend
+    if configured != path:
+        with _lock:
+            backend = import_string(path)()
+            _backend = (path, backend)
+    return backend
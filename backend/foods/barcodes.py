@@ -0,0 +1,202 @@
+"""
+Memory-mapped GTIN -> branded food index for barcode lookups.
+
+Barcode scans are pure key lookups, so `build_barcodes()` writes everything
+the barcode endpoint returns into one file at the end of each import,
+FOODS_DATA_DIR/barcodes/v<version>/gtin.idx:
+
+    header    MAGIC, FORMAT_VERSION, entry count (HEADER)
+    keys      count uint64 normalized GTINs, sorted
+    records   count fixed-width RECORD structs, in key order: fdc_id, serving
+              size, serving grams, the macros per 100 g and the nutrients per
+              serving (NaN for missing), and the offset and length of ...
+    text      ... a JSON array of TEXT_FIELDS per record
+
+GTINs are normalized with linking.normalize_gtin (digits only, leading
+zeros dropped), so a UPC-A, EAN-13 or GTIN-14 rendering of the same code
+finds the same food. When several branded foods share a GTIN the newest
+(highest fdc_id) wins.
+
+`BarcodeIndex.lookup()` binary-searches the keys through a memoryview over
+the mmap and unpacks one record, so a lookup costs a few microseconds and
+no database query; the file is opened once per process and shared by all
+workers through the page cache. The barcode view falls back to the
+database for codes the index does not have.
+"""
+
+import json
+import math
+import mmap
+import os
+import struct
+import tempfile
+from bisect import bisect_left
+
+from .datafiles import KEEP_VERSIONS, VersionedDataFiles
+from .linking import normalize_gtin
+from .models import BrandedFood, Food, FoodNutritionSummary, NutrientLookup
+
+FILENAME = 'gtin.idx'
+MAGIC = b'FOODGTIN'
+FORMAT_VERSION = 1
+CHUNK_SIZE = 10000
+MAX_KEY = 2 ** 64 - 1
+
+MACROS = tuple(NutrientLookup.MACROS)
+SERVING_COLUMNS = tuple(FoodNutritionSummary.SERVING_COLUMNS)
+TEXT_FIELDS = (
+    'description', 'brand_owner', 'brand_name', 'ingredients', 'serving_size_unit', 'gtin_upc',
+    'serving_description',
+)
+HEADER = struct.Struct('<8sII')
+KEY = struct.Struct('<Q')
+RECORD = struct.Struct(f'<Idd{len(MACROS)}d{len(SERVING_COLUMNS)}dQI')
+
+
+def gtin_key(barcode):
+    """Integer key of a barcode, or None if it has no digits or is too long"""
+    digits = normalize_gtin(barcode)
+    if not digits:
+        return None
+    key = int(digits)
+    return key if key <= MAX_KEY else None
+
+
+def _float(value):
+    return math.nan if value is None else float(value)
+
+
+def _value(value):
+    return None if math.isnan(value) else value
+
+
+def _branded_rows():
+    """(key, fdc_id, branded values, description, summary) for every branded food with a GTIN"""
+    summary_columns = ('food_id', 'serving_grams', 'serving_description', *MACROS, *SERVING_COLUMNS)
+    branded = BrandedFood.objects.exclude(gtin_upc__isnull=True).exclude(gtin_upc='').order_by('fdc_id').values(
+        'fdc_id', 'gtin_upc', 'brand_owner', 'brand_name', 'ingredients', 'serving_size', 'serving_size_unit'
+    )
+    chunk = []
+    for row in branded.iterator(chunk_size=CHUNK_SIZE):
+        key = gtin_key(row['gtin_upc'])
+        if key is not None:
+            chunk.append((key, row))
+        if len(chunk) >= CHUNK_SIZE:
+            yield from _with_foods(chunk, summary_columns)
+            chunk = []
+    yield from _with_foods(chunk, summary_columns)
+
+
+def _with_foods(chunk, summary_columns):
+    fdc_ids = [row['fdc_id'] for _, row in chunk]
+    descriptions = dict(Food.objects.filter(fdc_id__in=fdc_ids).values_list('fdc_id', 'description'))
+    summaries = {
+        row['food_id']: row
+        for row in FoodNutritionSummary.objects.filter(food_id__in=fdc_ids).values(*summary_columns)
+    }
+    for key, row in chunk:
+        # Like the database path, a branded row without its food is not found
+        if row['fdc_id'] in descriptions:
+            yield key, row, descriptions[row['fdc_id']], summaries.get(row['fdc_id'], {})
+
+
+def build_barcodes(version, data_dir=None, keep=KEEP_VERSIONS):
+    """Write the GTIN index for a dataset version; returns the number of GTINs"""
+    entries = {}
+    with tempfile.TemporaryFile() as text, files.build(version, data_dir, keep) as tmp_path:
+        # Text goes straight to a spool file; only keys and numbers stay in memory
+        offset = 0
+        for key, row, description, summary in _branded_rows():
+            blob = json.dumps([
+                description, row['brand_owner'], row['brand_name'], row['ingredients'], row['serving_size_unit'],
+                row['gtin_upc'], summary.get('serving_description'),
+            ], separators=(',', ':')).encode()
+            text.write(blob)
+            # Rows come in fdc_id order, so the newest food sharing a GTIN wins
+            entries[key] = (
+                row['fdc_id'], _float(row['serving_size']), _float(summary.get('serving_grams')),
+                *(_float(summary.get(name)) for name in (*MACROS, *SERVING_COLUMNS)), offset, len(blob),
+            )
+            offset += len(blob)
+
+        keys = sorted(entries)
+        text_start = HEADER.size + len(keys) * (KEY.size + RECORD.size)
+        with open(os.path.join(tmp_path, FILENAME), 'wb') as f:
+            f.write(HEADER.pack(MAGIC, FORMAT_VERSION, len(keys)))
+            f.write(struct.pack(f'<{len(keys)}Q', *keys))
+            for key in keys:
+                record = entries[key]
+                f.write(RECORD.pack(*record[:-2], text_start + record[-2], record[-1]))
+            text.seek(0)
+            while True:
+                data = text.read(1 << 20)
+                if not data:
+                    break
+                f.write(data)
+    return len(keys)
+
+
+class BarcodeIndex:
+    """Read-only view of one GTIN index file"""
+
+    def __init__(self, path, version=None):
+        self.version = version
+        with open(path, 'rb') as f:
+            self.mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, format_version, self.count = HEADER.unpack_from(self.mmap)
+        if magic != MAGIC or format_version != FORMAT_VERSION:
+            raise ValueError(f'{path} is not a version {FORMAT_VERSION} GTIN index')
+        keys_end = HEADER.size + self.count * KEY.size
+        self.keys = memoryview(self.mmap)[HEADER.size:keys_end].cast('Q')
+        self.records_start = keys_end
+
+    @classmethod
+    def load(cls, path, version):
+        return cls(os.path.join(path, FILENAME), version)
+
+    def __len__(self):
+        return self.count
+
+    def lookup(self, barcode):
+        """The barcode endpoint's result for a barcode (without `portion`), or None"""
+        key = gtin_key(barcode)
+        if key is None:
+            return None
+        position = bisect_left(self.keys, key)
+        if position == self.count or self.keys[position] != key:
+            return None
+        values = RECORD.unpack_from(self.mmap, self.records_start + position * RECORD.size)
+        fdc_id, serving_size, serving_grams = values[:3]
+        macros = values[3:3 + len(MACROS)]
+        per_serving = values[3 + len(MACROS):-2]
+        offset, length = values[-2:]
+        description, brand_owner, brand_name, ingredients, serving_size_unit, gtin_upc, serving_description = (
+            json.loads(self.mmap[offset:offset + length])
+        )
+        return {
+            'fdc_id': fdc_id,
+            'description': description,
+            'brand_owner': brand_owner,
+            'brand_name': brand_name,
+            'ingredients': ingredients,
+            'serving_size': _value(serving_size),
+            'serving_size_unit': serving_size_unit,
+            'gtin_upc': gtin_upc,
+            'nutrition': {name: _value(value) for name, value in zip(MACROS, macros)},
+            'per_serving': None if math.isnan(serving_grams) else {
+                'grams': serving_grams,
+                'description': serving_description,
+                **{
+                    name: None if math.isnan(value) else round(value, 2)
+                    for name, value in zip(FoodNutritionSummary.SERVING_COLUMNS.values(), per_serving)
+                },
+            },
+        }
+
+
+files = VersionedDataFiles('barcodes', BarcodeIndex.load)
+
+
+def get_index():
+    """GTIN index for the current dataset version, or None if none has been built"""
+    return files.get()
@@ -0,0 +1,246 @@
+"""
+Prebuilt, compressed offline bundles of common foods.
+
+A client bootstraps its local database from one bundle download, then keeps
+it current with the change feed (foods.changes). `build_bundles()` runs at
+the end of each import and writes, under FOODS_DATA_DIR/bundles/v<version>:
+
+    top.<hash>.json.gz               the `top` most popular foods
+    category-<id>.<hash>.json.gz     up to CATEGORY_LIMIT foods per food category
+    manifest.json                    {bundle name: file, sha256, size, foods}
+
+Popularity comes from the query log: each of the TOP_QUERIES most frequent
+searches credits its first RESULTS_PER_QUERY full-text matches with
+hits / position, and barcode lookups credit the scanned food with their
+hits. Foods nobody searched for follow, generic foods (foundation, SR
+legacy, survey) before branded ones.
+
+Each bundle is a gzipped JSON document:
+
+    {"name", "version",
+     "foods": [{"fdc_id", "description", "data_type", "food_category_id",
+                "macros": {calories, protein, ..., sodium per 100 g},
+                "serving": {"grams", "description"} | null,
+                "portions": [[label, gram_weight], ...]}, ...],
+     "prefixes": {"mi": [fdc_id, ...], "mil": [...], ...}}
+
+where `prefixes` maps the first MIN_PREFIX..MAX_PREFIX letters of every
+description word to up to PREFIX_LIMIT fdc_ids, most popular first, for
+offline autocomplete. File names carry a hash of their content, so the
+files are immutable and served with a one-year Cache-Control; only the
+manifest (`/bundles/`) changes between releases.
+"""
+
+import gzip
+import hashlib
+import json
+import os
+import re
+from collections import Counter, defaultdict
+
+from django.contrib.postgres.search import SearchQuery, SearchRank
+from django.db.models.expressions import RawSQL
+
+from .conversions import UNDETERMINED
+from .datafiles import KEEP_VERSIONS, VersionedDataFiles
+from .grouping import DATA_TYPE_PREFERENCE
+from .linking import normalize_gtin, normalized_gtin_sql
+from .models import (
+    BrandedFood, Food, FoodCategory, FoodNutritionSummary, FoodPortion, MeasureUnit, NutrientLookup,
+    QueryLogEntry,
+)
+
+DEFAULT_TOP = 5000
+CATEGORY_LIMIT = 500
+TOP_QUERIES = 1000
+RESULTS_PER_QUERY = 20
+MIN_PREFIX = 2
+MAX_PREFIX = 4
+PREFIX_LIMIT = 20
+HASH_LENGTH = 16
+MACROS = (*NutrientLookup.MACROS, 'sodium')
+WORD_PATTERN = re.compile(r'[a-z0-9]+')
+FILE_PATTERN = re.compile(rf'^[a-z0-9-]+\.[0-9a-f]{{{HASH_LENGTH}}}\.json\.gz$')
+MANIFEST = 'manifest.json'
+
+
+class BundleSet:
+    """The manifest of one published bundle version"""
+
+    def __init__(self, manifest, version=None, path=None):
+        self.manifest = manifest
+        self.version = version
+        self.path = path
+
+    @classmethod
+    def load(cls, path, version):
+        with open(os.path.join(path, MANIFEST)) as f:
+            return cls(json.load(f), version, path)
+
+
+files = VersionedDataFiles('bundles', BundleSet.load)
+
+
+def get_bundles():
+    """Bundles for the current dataset version, or None if none have been built"""
+    return files.get()
+
+
+def find_bundle_file(name, data_dir=None):
+    """Path of a published bundle file, newest version first, or None.
+
+    Names are content-hashed, so a file from an older kept version is
+    identical to a same-named one in a newer version.
+    """
+    if not FILE_PATTERN.match(name):
+        return None
+    for version in reversed(files.versions(data_dir)):
+        path = os.path.join(files.path(version, data_dir), name)
+        if os.path.isfile(path):
+            return path
+    return None
+
+
+def logged_queries(kind):
+    """(params, hits) of the TOP_QUERIES most frequent logged queries of a kind"""
+    return QueryLogEntry.objects.filter(kind=kind).order_by('-hits', '-last_seen').values_list(
+        'params', 'hits'
+    )[:TOP_QUERIES]
+
+
+def popularity():
+    """Counter of fdc_id -> popularity from the logged searches and barcode lookups"""
+    scores = Counter()
+    for params, hits in logged_queries('search'):
+        query = (params.get('q') or '').strip()
+        if len(query) <= 2:
+            continue
+        search_query = SearchQuery(query)
+        matches = Food.objects.filter(search_vector=search_query).annotate(
+            rank=SearchRank('search_vector', search_query)
+        ).order_by('-rank', 'fdc_id').values_list('fdc_id', flat=True)[:RESULTS_PER_QUERY]
+        for position, fdc_id in enumerate(matches):
+            scores[fdc_id] += hits / (position + 1)
+
+    barcodes = Counter()
+    for params, hits in logged_queries('barcode'):
+        gtin = normalize_gtin(params.get('barcode'))
+        if gtin:
+            barcodes[gtin] += hits
+    # Resolved like the barcode endpoint: any rendering of a GTIN, the newest food wins
+    foods = dict(
+        BrandedFood.objects.annotate(gtin_key=RawSQL(normalized_gtin_sql('gtin_upc'), []))
+        .filter(gtin_key__in=list(barcodes)).order_by('fdc_id').values_list('gtin_key', 'fdc_id')
+    )
+    for gtin, fdc_id in foods.items():
+        scores[fdc_id] += barcodes[gtin]
+    return scores
+
+
+def ranked_fdc_ids(foods, scores, limit):
+    """Up to `limit` fdc_ids of a Food queryset: popular first, then generic before branded"""
+    popular = sorted(
+        foods.filter(fdc_id__in=list(scores)).values_list('fdc_id', flat=True),
+        key=lambda fdc_id: (-scores[fdc_id], fdc_id)
+    )[:limit]
+    ranked = list(popular)
+    if len(ranked) < limit:
+        taken = set(ranked)
+        for data_type in DATA_TYPE_PREFERENCE:
+            rest = foods.filter(data_type=data_type).order_by('fdc_id').values_list('fdc_id', flat=True)
+            for fdc_id in rest[:limit + len(taken)].iterator():
+                if fdc_id not in taken:
+                    ranked.append(fdc_id)
+                    if len(ranked) >= limit:
+                        return ranked
+    return ranked
+
+
+def food_entries(fdc_ids):
+    """Bundle entries for fdc_ids, in their order, with four queries"""
+    foods = Food.objects.in_bulk(fdc_ids)
+    summaries = {
+        row['food_id']: row
+        for row in FoodNutritionSummary.objects.filter(food_id__in=fdc_ids).values(
+            'food_id', 'serving_grams', 'serving_description', *MACROS
+        )
+    }
+    portions = defaultdict(list)
+    unit_names = dict(MeasureUnit.objects.values_list('id', 'name'))
+    for fdc_id, amount, unit_id, description, modifier, grams in FoodPortion.objects.filter(
+        fdc_id__in=fdc_ids, gram_weight__gt=0
+    ).order_by('fdc_id', 'seq_num', 'id').values_list(
+        'fdc_id', 'amount', 'measure_unit_id', 'portion_description', 'modifier', 'gram_weight'
+    ):
+        # Labelled as in the unit conversion table
+        unit_name = (unit_names.get(unit_id) or '').strip()
+        if unit_name.lower() == UNDETERMINED:
+            unit_name = ''
+        label = ', '.join(part for part in (unit_name, modifier) if part) or 'portion'
+        portions[fdc_id].append([description or f'{amount or 1:g} {label}', grams])
+
+    entries = []
+    for fdc_id in fdc_ids:
+        food = foods.get(fdc_id)
+        if food is None:
+            continue
+        summary = summaries.get(fdc_id, {})
+        entries.append({
+            'fdc_id': fdc_id,
+            'description': food.description,
+            'data_type': food.data_type,
+            'food_category_id': food.food_category_id,
+            'macros': {name: summary.get(name) for name in MACROS},
+            'serving': (
+                {'grams': summary['serving_grams'], 'description': summary['serving_description']}
+                if summary.get('serving_grams') else None
+            ),
+            'portions': portions[fdc_id],
+        })
+    return entries
+
+
+def prefix_index(entries):
+    """{prefix: [fdc_id, ...]} over description words, in entry order"""
+    prefixes = defaultdict(list)
+    for entry in entries:
+        seen = set()
+        for word in WORD_PATTERN.findall(entry['description'].lower()):
+            for length in range(MIN_PREFIX, min(len(word), MAX_PREFIX) + 1):
+                prefix = word[:length]
+                if prefix in seen:
+                    continue
+                seen.add(prefix)
+                if len(prefixes[prefix]) < PREFIX_LIMIT:
+                    prefixes[prefix].append(entry['fdc_id'])
+    return dict(sorted(prefixes.items()))
+
+
+def write_bundle(path, name, version, fdc_ids):
+    """Write one bundle file; returns its manifest entry"""
+    entries = food_entries(fdc_ids)
+    document = {'name': name, 'version': version, 'foods': entries, 'prefixes': prefix_index(entries)}
+    content = gzip.compress(
+        json.dumps(document, separators=(',', ':')).encode(), compresslevel=9, mtime=0
+    )
+    digest = hashlib.sha256(content).hexdigest()
+    filename = f'{name}.{digest[:HASH_LENGTH]}.json.gz'
+    with open(os.path.join(path, filename), 'wb') as f:
+        f.write(content)
+    return {'file': filename, 'sha256': digest, 'size': len(content), 'foods': len(entries)}
+
+
+def build_bundles(version, top=DEFAULT_TOP, data_dir=None, keep=KEEP_VERSIONS):
+    """Write the top-foods and per-category bundles for a dataset version; returns the manifest"""
+    scores = popularity()
+    with files.build(version, data_dir, keep) as tmp_path:
+        bundles = {'top': write_bundle(tmp_path, 'top', version, ranked_fdc_ids(Food.objects.all(), scores, top))}
+        for category_id in FoodCategory.objects.order_by('id').values_list('id', flat=True):
+            fdc_ids = ranked_fdc_ids(Food.objects.filter(food_category_id=category_id), scores, CATEGORY_LIMIT)
+            if fdc_ids:
+                name = f'category-{category_id}'
+                bundles[name] = write_bundle(tmp_path, name, version, fdc_ids)
+        manifest = {'version': version, 'bundles': bundles}
+        with open(os.path.join(tmp_path, MANIFEST), 'w') as f:
+            json.dump(manifest, f, indent=1)
+    return manifest
@@ -0,0 +1,444 @@
+"""
+Tiered response cache for the foods API.
+
+Lookups go to a small per-process LRU first and then to the shared Django
+cache, so every worker benefits from responses computed by any other worker.
+Keys are built from the normalized request parameters plus the dataset
+version; completing an import bumps the version, which invalidates every
+cached response at once.
+"""
+
+import hashlib
+import json
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import caches
+from rest_framework.response import Response
+
+
+DEFAULT_SETTINGS = {
+    'CACHE_ALIAS': 'default',
+    'TIMEOUT': 60 * 60 * 24,
+    'LOCAL_MAX_ENTRIES': 1024,
+    'LOCAL_TIMEOUT': 60,
+    'VERSION_CHECK_INTERVAL': 5,
+    'LOCK_TIMEOUT': 30,
+    'LOCK_WAIT': 10,
+    'LOCK_POLL_INTERVAL': 0.05,
+}
+
+DATASET_VERSION_KEY = 'foods:dataset_version'
+NAMESPACES_KEY = 'foods:metrics:namespaces'
+
+# Only successful responses and definite "not found" answers are reused.
+CACHEABLE_STATUSES = (200, 404)
+
+
+def get_cache_settings():
+    """FOODS_CACHE settings merged over the defaults"""
+    return {**DEFAULT_SETTINGS, **getattr(settings, 'FOODS_CACHE', {})}
+
+
+def normalize_params(query_params, defaults, casefold=()):
+    """Canonical parameter dict used to build cache keys.
+
+    Only the names in `defaults` are kept, missing values take the default,
+    whitespace is collapsed, and names listed in `casefold` are lowercased.
+    """
+    params = {}
+    for name, default in defaults.items():
+        value = query_params.get(name, default)
+        if isinstance(value, str):
+            value = ' '.join(value.split())
+            if name in casefold:
+                value = value.lower()
+        params[name] = value
+    return params
+
+
+class LocalLRUCache:
+    """Bounded in-process LRU cache with per-entry expiry"""
+
+    def __init__(self, max_entries, timeout):
+        self.max_entries = max_entries
+        self.timeout = timeout
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Return a (hit, value) pair"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return False, None
+            expires, value = entry
+            if expires <= time.monotonic():
+                del self._entries[key]
+                return False, None
+            self._entries.move_to_end(key)
+            return True, value
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.timeout, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class CacheMetrics:
+    """Hit/miss counters per namespace.
+
+    Counts are kept per process and folded into shared counters every
+    `flush_every` events, so the metrics endpoint can report totals across
+    all workers without a shared-cache write on every request.
+    """
+
+    EVENTS = ('local_hits', 'shared_hits', 'misses', 'coalesced')
+
+    def __init__(self, flush_every=100):
+        self.flush_every = flush_every
+        self._counts = {}
+        self._pending = {}
+        self._pending_total = 0
+        self._lock = threading.Lock()
+
+    def record(self, namespace, event, shared):
+        with self._lock:
+            key = (namespace, event)
+            self._counts[key] = self._counts.get(key, 0) + 1
+            self._pending[key] = self._pending.get(key, 0) + 1
+            self._pending_total += 1
+            if self._pending_total < self.flush_every:
+                return
+            pending, self._pending, self._pending_total = self._pending, {}, 0
+        self._flush(pending, shared)
+
+    def _flush(self, pending, shared):
+        for (namespace, event), count in pending.items():
+            key = self.shared_key(namespace, event)
+            try:
+                shared.incr(key, count)
+            except ValueError:
+                if not shared.add(key, count, None):
+                    shared.incr(key, count)
+
+    @staticmethod
+    def shared_key(namespace, event):
+        return f'foods:metrics:{namespace}:{event}'
+
+    def snapshot(self, namespaces, shared):
+        """Per-process and shared counts for each namespace"""
+        shared_counts = shared.get_many([
+            self.shared_key(namespace, event)
+            for namespace in namespaces for event in self.EVENTS
+        ])
+        result = {}
+        for namespace in namespaces:
+            process = {event: self._counts.get((namespace, event), 0) for event in self.EVENTS}
+            totals = {
+                event: shared_counts.get(self.shared_key(namespace, event), 0)
+                for event in self.EVENTS
+            }
+            lookups = totals['local_hits'] + totals['shared_hits'] + totals['misses']
+            totals['hit_rate'] = (
+                round((totals['local_hits'] + totals['shared_hits']) / lookups, 4) if lookups else None
+            )
+            result[namespace] = {'process': process, 'shared': totals}
+        return result
+
+
+class _Flight:
+    """A computation in progress that other threads can wait on"""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """Collapse concurrent computations of the same key into one.
+
+    Within a process, callers for a key that is already being computed wait
+    on the leader's result. Across processes, the leader holds a short-lived
+    lock in the shared cache; callers that fail to take it poll the shared
+    cache (via `peek`) for the leader's result instead of recomputing. A
+    caller gives up waiting after `wait_timeout` seconds and computes the
+    value itself, so a crashed leader never blocks requests for long.
+    """
+
+    def __init__(self, lock_timeout, wait_timeout, poll_interval, cache_alias='default'):
+        self.lock_timeout = lock_timeout
+        self.wait_timeout = wait_timeout
+        self.poll_interval = poll_interval
+        self.cache_alias = cache_alias
+        self._flights = {}
+        self._lock = threading.Lock()
+
+    def run(self, key, compute, peek):
+        """Return (leader, value); `leader` is True when this call ran `compute`"""
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+
+        if not leader:
+            if flight.done.wait(self.wait_timeout) and flight.error is None:
+                return False, flight.result
+            return True, compute()
+
+        try:
+            leader, flight.result = self._run_locked(key, compute, peek)
+            return leader, flight.result
+        except BaseException as exc:
+            flight.error = exc
+            raise
+        finally:
+            with self._lock:
+                del self._flights[key]
+            flight.done.set()
+
+    def _run_locked(self, key, compute, peek):
+        """Run `compute` under the cross-process lock, or wait for its holder"""
+        shared = caches[self.cache_alias]
+        lock_key = f'{key}:lock'
+        token = uuid.uuid4().hex
+        deadline = time.monotonic() + self.wait_timeout
+
+        while not shared.add(lock_key, token, self.lock_timeout):
+            # Another process is computing this key; wait for its result
+            time.sleep(self.poll_interval)
+            value = peek()
+            if value is not None:
+                return False, value
+            if time.monotonic() >= deadline:
+                return True, compute()
+
+        try:
+            return True, compute()
+        finally:
+            if shared.get(lock_key) == token:
+                shared.delete(lock_key)
+
+
+class TieredResponseCache:
+    """Per-process LRU in front of the shared cache, keyed on dataset version"""
+
+    def __init__(self, options=None):
+        self.options = options or get_cache_settings()
+        self.local = LocalLRUCache(self.options['LOCAL_MAX_ENTRIES'], self.options['LOCAL_TIMEOUT'])
+        self.metrics = CacheMetrics()
+        self.single_flight = SingleFlight(
+            self.options['LOCK_TIMEOUT'], self.options['LOCK_WAIT'],
+            self.options['LOCK_POLL_INTERVAL'], self.options['CACHE_ALIAS']
+        )
+        self.namespaces = set()
+        self._version = None
+        self._version_checked_at = 0.0
+
+    @property
+    def shared(self):
+        return caches[self.options['CACHE_ALIAS']]
+
+    def get_dataset_version(self):
+        """Current dataset version, re-read every few seconds.
+
+        Comes from the read backend when it serves a fixed dataset (see
+        foods.backends), else from the shared cache or the database.
+        """
+        now = time.monotonic()
+        if self._version is not None and now - self._version_checked_at < self.options['VERSION_CHECK_INTERVAL']:
+            return self._version
+
+        from .backends import get_read_backend
+        version = get_read_backend().dataset_version()
+        if version is None:
+            version = self.shared.get(DATASET_VERSION_KEY)
+        if version is None:
+            from .models import DatasetRelease
+            version = DatasetRelease.current_version()
+            self.shared.add(DATASET_VERSION_KEY, version, None)
+
+        if version != self._version:
+            # Entries for older versions can never be hit again
+            self.local.clear()
+        self._version = version
+        self._version_checked_at = now
+        return version
+
+    def make_key(self, namespace, params):
+        payload = json.dumps(params, sort_keys=True, separators=(',', ':'), default=str)
+        digest = hashlib.sha1(payload.encode('utf-8')).hexdigest()
+        return f'foods:v{self.get_dataset_version()}:{namespace}:{digest}'
+
+    def lookup(self, namespace, params):
+        """Return (source, value) where source is 'local', 'shared' or None on a miss"""
+        self.register(namespace)
+        return self._lookup_key(namespace, self.make_key(namespace, params))
+
+    def _lookup_key(self, namespace, key):
+        hit, value = self.local.get(key)
+        if hit:
+            self.metrics.record(namespace, 'local_hits', self.shared)
+            return 'local', value
+
+        value = self.shared.get(key)
+        if value is not None:
+            self.local.set(key, value)
+            self.metrics.record(namespace, 'shared_hits', self.shared)
+            return 'shared', value
+
+        self.metrics.record(namespace, 'misses', self.shared)
+        return None, None
+
+    def register(self, namespace):
+        """Record a namespace so the metrics endpoint of any process reports it"""
+        if namespace in self.namespaces:
+            return
+        self.namespaces.add(namespace)
+        known = set(self.shared.get(NAMESPACES_KEY) or ())
+        if namespace not in known:
+            self.shared.set(NAMESPACES_KEY, sorted(known | {namespace}), None)
+
+    def store(self, namespace, params, value):
+        self._store_key(self.make_key(namespace, params), value)
+
+    def _store_key(self, key, value):
+        self.local.set(key, value)
+        self.shared.set(key, value, self.options['TIMEOUT'])
+
+    def warm(self, namespace, params, build_response):
+        """Populate the cache for params unless already present; True if built"""
+        self.register(namespace)
+        key = self.make_key(namespace, params)
+        if self.shared.has_key(key):
+            return False
+        response = build_response()
+        if response.status_code not in CACHEABLE_STATUSES:
+            return False
+        self._store_key(key, (response.status_code, response.data))
+        return True
+
+    def respond(self, namespace, params, build_response):
+        """Serve a cached response, or build, cache and return a fresh one.
+
+        `build_response` returns a DRF Response. Responses with a status outside
+        CACHEABLE_STATUSES, or marked `Cache-Control: no-store`, are not stored.
+        Concurrent misses for the same key are coalesced, so only one caller
+        (across threads and processes) runs `build_response` at a time.
+        """
+        self.register(namespace)
+        key = self.make_key(namespace, params)
+        source, cached = self._lookup_key(namespace, key)
+        if source is not None:
+            status_code, data = cached
+            response = Response(data, status=status_code)
+            response['X-Cache'] = f'HIT-{source.upper()}'
+            return response
+
+        def build_and_store():
+            response = build_response()
+            stored = (
+                response.status_code in CACHEABLE_STATUSES
+                and 'no-store' not in response.get('Cache-Control', '')
+            )
+            if stored:
+                self._store_key(key, (response.status_code, response.data))
+            return response.status_code, response.data, stored, response
+
+        def peek():
+            cached = self.shared.get(key)
+            return None if cached is None else (*cached, True, None)
+
+        leader, (status_code, data, stored, response) = self.single_flight.run(key, build_and_store, peek)
+        if leader:
+            response['X-Cache'] = 'MISS'
+            return response
+
+        self.metrics.record(namespace, 'coalesced', self.shared)
+        response = Response(data, status=status_code)
+        if not stored:
+            response['Cache-Control'] = 'no-store'
+        response['X-Cache'] = 'COALESCED'
+        return response
+
+    def invalidate(self, version):
+        """Switch every process to a new dataset version, orphaning old entries"""
+        self.shared.set(DATASET_VERSION_KEY, version, None)
+        self.local.clear()
+        self._version = version
+        self._version_checked_at = time.monotonic()
+
+    def stats(self):
+        return {
+            'dataset_version': self.get_dataset_version(),
+            'local_entries': len(self.local),
+            'local_max_entries': self.local.max_entries,
+            'namespaces': self.metrics.snapshot(
+                sorted(self.namespaces | set(self.shared.get(NAMESPACES_KEY) or ())), self.shared
+            ),
+        }
+
+
+response_cache = TieredResponseCache()
+
+
+class CachedResponseMixin:
+    """Serve GET requests through the tiered response cache.
+
+    Views define `cache_namespace`, `get_cache_params()` which turns query
+    parameters into a canonical dict, and `build_response()` which computes
+    the uncached response from that dict. Queries for which
+    `should_log_query()` is true are counted in the query log used to warm
+    caches after an import.
+    """
+    cache_namespace = None
+
+    def get_cache_params(self, query_params):
+        raise NotImplementedError
+
+    def build_response(self, params):
+        raise NotImplementedError
+
+    def should_log_query(self, params):
+        return False
+
+    def get(self, request, *args, **kwargs):
+        params = self.get_cache_params(request.query_params)
+        response = response_cache.respond(
+            self.cache_namespace, params, lambda: self.build_response(params)
+        )
+        if response.status_code == 200 and self.should_log_query(params):
+            from .backends import get_read_backend
+            from .querylog import query_recorder
+            # Nodes without a database keep no query log
+            if get_read_backend().uses_database:
+                query_recorder.record(self.cache_namespace, params)
+        return response
+
+
+class CachedObjectMixin:
+    """Serve per-object ViewSet actions through the tiered response cache.
+
+    The object's URL lookup value is stored in the cache params under
+    `cache_lookup_param`, next to any action-specific parameters.
+    """
+    cache_lookup_param = 'pk'
+
+    def cached(self, namespace, build_response, **extra_params):
+        lookup = self.kwargs[self.lookup_url_kwarg or self.lookup_field]
+        params = {self.cache_lookup_param: lookup, **extra_params}
+        return response_cache.respond(namespace, params, build_response)
@@ -0,0 +1,177 @@
+"""
+Per-release change log of USDA and CN foods, and the delta feed built on it.
+
+Imports write with plain INSERTs, so instead of instrumenting every write,
+`record_changes()` runs at the end of each import and diffs content
+fingerprints: an md5 per food over its columns, nutrient values and
+portions (USDA foods also their branded_food row; CN foods their weights)
+is computed set-based in SQL and compared with RecordFingerprint, the
+digests stored by the previous release. New keys are logged as inserts,
+changed digests as updates and vanished keys as deletes, all in
+DatasetChange under the release's version; then the stored fingerprints
+are replaced. The first run logs every food as an insert.
+
+`change_page()` answers `/changes/?since=<version>` with compact deltas:
+only each food's latest change counts, split into `upserted` and
+`deleted` ids per source. Pages are cut by an opaque cursor holding the
+upper version bound fixed on the first page and the last change id
+served, so a release landing mid-sync never skips or reorders changes;
+after the last page clients store `version` as their next `since`.
+"""
+
+import base64
+
+from django.db import connection, transaction
+from django.db.models import Subquery
+from rest_framework.exceptions import ValidationError
+
+from .models import (
+    BrandedFood, CNFood, CNNutrientValue, CNWeight, DatasetChange, DatasetRelease, Food, FoodNutrient,
+    FoodPortion, RecordFingerprint,
+)
+
+DEFAULT_LIMIT = 1000
+MAX_LIMIT = 10000
+
+
+def fingerprint_sql():
+    """SELECT of (source, record_id, digest) for every USDA and CN food"""
+    usda, cn = DatasetRelease.SOURCE_USDA, DatasetRelease.SOURCE_CN
+    return (
+        f"SELECT '{usda}'::varchar AS source, f.fdc_id::bigint AS record_id, "
+        f"md5(ROW(f.data_type, f.description, f.food_category_id, f.publication_date, b::text, "
+        f"n.digest, p.digest)::text)::uuid AS digest "
+        f"FROM {Food._meta.db_table} f "
+        f"LEFT JOIN {BrandedFood._meta.db_table} b ON b.fdc_id = f.fdc_id "
+        f"LEFT JOIN (SELECT fdc_id, md5(string_agg(ROW(nutrient_id, amount)::text, ',' ORDER BY nutrient_id, id)) "
+        f"AS digest FROM {FoodNutrient._meta.db_table} GROUP BY fdc_id) n ON n.fdc_id = f.fdc_id "
+        f"LEFT JOIN (SELECT fdc_id, md5(string_agg(ROW(seq_num, amount, measure_unit_id, portion_description, "
+        f"modifier, gram_weight)::text, ',' ORDER BY seq_num, id)) "
+        f"AS digest FROM {FoodPortion._meta.db_table} GROUP BY fdc_id) p ON p.fdc_id = f.fdc_id "
+        f"UNION ALL "
+        f"SELECT '{cn}'::varchar, c.cn_code::bigint, "
+        f"md5(ROW(c.food_category_id, c.descriptor, c.abbreviated_descriptor, c.gtin, c.product_code, "
+        f"c.brand_owner_name, c.brand_name, c.fns_material_number, c.source_code, c.date_added, c.last_modified, "
+        f"c.discontinued_date, c.form_of_food, c.fdc_id, c.gpc_product_code_id, n.digest, w.digest)::text)::uuid "
+        f"FROM {CNFood._meta.db_table} c "
+        f"LEFT JOIN (SELECT cn_food_id, md5(string_agg(ROW(nutrient_id, nutrient_value)::text, ',' "
+        f"ORDER BY nutrient_id)) AS digest FROM {CNNutrientValue._meta.db_table} GROUP BY cn_food_id) n "
+        f"ON n.cn_food_id = c.cn_code "
+        f"LEFT JOIN (SELECT cn_food_id, md5(string_agg(ROW(sequence_num, amount, measure_description, "
+        f"unit_amount, type_of_unit)::text, ',' ORDER BY sequence_num)) "
+        f"AS digest FROM {CNWeight._meta.db_table} GROUP BY cn_food_id) w ON w.cn_food_id = c.cn_code"
+    )
+
+
+def record_changes(version):
+    """Log the foods inserted, updated and deleted since the last recorded release; returns {action: count}"""
+    change_table = DatasetChange._meta.db_table
+    fingerprint_table = RecordFingerprint._meta.db_table
+    counts = {}
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(f'CREATE TEMPORARY TABLE current_fingerprint ON COMMIT DROP AS {fingerprint_sql()}')
+        cursor.execute('CREATE INDEX ON current_fingerprint (source, record_id)')
+        cursor.execute('ANALYZE current_fingerprint')
+        changed = {
+            DatasetChange.ACTION_INSERT: 'p.digest IS NULL',
+            DatasetChange.ACTION_UPDATE: 'p.digest <> c.digest',
+        }
+        for action, condition in changed.items():
+            cursor.execute(
+                f'INSERT INTO {change_table} (version, source, record_id, action) '
+                f'SELECT %s, c.source, c.record_id, %s '
+                f'FROM current_fingerprint c LEFT JOIN {fingerprint_table} p '
+                f'ON p.source = c.source AND p.record_id = c.record_id '
+                f'WHERE {condition} ORDER BY c.source, c.record_id',
+                [version, action]
+            )
+            counts[action] = cursor.rowcount
+        cursor.execute(
+            f'INSERT INTO {change_table} (version, source, record_id, action) '
+            f'SELECT %s, p.source, p.record_id, %s FROM {fingerprint_table} p '
+            f'WHERE NOT EXISTS (SELECT 1 FROM current_fingerprint c '
+            f'WHERE c.source = p.source AND c.record_id = p.record_id) '
+            f'ORDER BY p.source, p.record_id',
+            [version, DatasetChange.ACTION_DELETE]
+        )
+        counts[DatasetChange.ACTION_DELETE] = cursor.rowcount
+
+        cursor.execute(f'DELETE FROM {fingerprint_table}')
+        cursor.execute(
+            f'INSERT INTO {fingerprint_table} (source, record_id, digest) '
+            f'SELECT source, record_id, digest FROM current_fingerprint'
+        )
+        # ON COMMIT DROP only fires at the outermost commit
+        cursor.execute('DROP TABLE current_fingerprint')
+    with connection.cursor() as cursor:
+        cursor.execute(f'ANALYZE {change_table}')
+        cursor.execute(f'ANALYZE {fingerprint_table}')
+    return counts
+
+
+def encode_cursor(until, after):
+    return base64.urlsafe_b64encode(f'{until}:{after}'.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    """(until version, last change id) from a cursor string"""
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        until, after = base64.urlsafe_b64decode(padded.encode()).decode().split(':')
+        return int(until), int(after)
+    except (ValueError, UnicodeDecodeError):
+        raise ValidationError({'cursor': 'Invalid cursor.'})
+
+
+def parse_change_params(query_params):
+    """Canonical `since`, `cursor` and `limit` params, for use in cache keys"""
+    errors = {}
+    try:
+        since = int(query_params.get('since') or 0)
+        if since < 0:
+            raise ValueError
+    except ValueError:
+        errors['since'] = 'A non-negative dataset version is required.'
+        since = 0
+    try:
+        limit = int(query_params.get('limit') or DEFAULT_LIMIT)
+        if not 1 <= limit <= MAX_LIMIT:
+            raise ValueError
+    except ValueError:
+        errors['limit'] = f'An integer between 1 and {MAX_LIMIT} is required.'
+        limit = DEFAULT_LIMIT
+    cursor = (query_params.get('cursor') or '').strip()
+    if cursor:
+        decode_cursor(cursor)
+    if errors:
+        raise ValidationError(errors)
+    return {'since': since, 'cursor': cursor, 'limit': limit}
+
+
+def change_page(since, cursor='', limit=DEFAULT_LIMIT):
+    """One page of the latest change per food after dataset version `since`"""
+    if cursor:
+        until, after = decode_cursor(cursor)
+    else:
+        until, after = DatasetRelease.current_version(), 0
+
+    latest = DatasetChange.objects.filter(version__gt=since, version__lte=until).order_by(
+        'source', 'record_id', '-id'
+    ).distinct('source', 'record_id')
+    rows = list(
+        DatasetChange.objects.filter(id__in=Subquery(latest.values('id')), id__gt=after)
+        .order_by('id').values_list('id', 'source', 'record_id', 'action')[:limit + 1]
+    )
+    more = len(rows) > limit
+    rows = rows[:limit]
+
+    changes = {source: {'upserted': [], 'deleted': []} for source, _ in DatasetRelease.SOURCE_CHOICES}
+    for _, source, record_id, action in rows:
+        key = 'deleted' if action == DatasetChange.ACTION_DELETE else 'upserted'
+        changes[source][key].append(record_id)
+    return {
+        'since': since,
+        'version': max(until, since),
+        'changes': changes,
+        'next_cursor': encode_cursor(until, rows[-1][0]) if more else None,
+    }
@@ -0,0 +1,384 @@
+"""
+Household measure -> gram conversions for every food.
+
+`build_conversions()` runs at the end of each import and flattens every
+source of portion weights into one table of (unit, label, grams per unit)
+rows per food:
+
+* USDA FoodPortion rows. The unit is the MeasureUnit name, or is parsed
+  from the portion description / modifier when the unit is
+  "undetermined".
+* Branded foods. The whole serving (`serving_size` in
+  `serving_size_unit`) becomes a "serving" row, and
+  `household_serving_fulltext` such as "2 slices (56 g)" is parsed into
+  a per-slice weight.
+* Child Nutrition CNWeight rows.
+
+Branded and CN servings given in ml are taken as grams. Their nutrients are
+reported per 100 ml, so the ml amount is the right scale. Those rows are
+flagged `estimated`.
+
+Foods with any gram-weighed volume measure also get a density in g/ml, so
+every other volume unit (tsp, tbsp, cup, fl oz, ml, l, ...) converts too. Mass
+units (g, kg, mg, oz, lb) convert for every food.
+
+The table is written per dataset version to
+FOODS_DATA_DIR/conversions/v<version>/ and loaded fully into memory by each
+process, so conversions never query the database:
+
+    keys.npy       int64   [n_foods] sorted (source << 48) | food id
+    offsets.npy    int64   [n_foods + 1], rows of food i
+    units.npy      int32   [n_rows] index into vocabulary.json "units"
+    labels.npy     int32   [n_rows] index into vocabulary.json "labels"
+    grams.npy      float32 [n_rows] grams per one unit
+    refs.npy       int64   [n_rows] FoodPortion.id / CNWeight.sequence_num, -1 if none
+    estimated.npy  bool    [n_rows]
+    density.npy    float32 [n_foods] g/ml, NaN if unknown
+    vocabulary.json
+"""
+
+import json
+import os
+import re
+from fractions import Fraction
+
+from . import matrix
+from .datafiles import KEEP_VERSIONS, VersionedDataFiles
+from .models import BrandedFood, CNWeight, DatasetRelease, FoodPortion, MeasureUnit
+
+np = matrix.np
+
+SOURCES = {DatasetRelease.SOURCE_USDA: 0, DatasetRelease.SOURCE_CN: 1}
+SOURCE_SHIFT = 48
+ARRAYS = ('keys', 'offsets', 'units', 'labels', 'grams', 'refs', 'estimated', 'density')
+
+MASS_UNITS = {'g': 1.0, 'kg': 1000.0, 'mg': 0.001, 'oz': 28.349523, 'lb': 453.59237}
+VOLUME_UNITS = {
+    'ml': 1.0, 'l': 1000.0, 'tsp': 4.928922, 'tbsp': 14.786765, 'fl oz': 29.573530,
+    'cup': 236.588237, 'pint': 473.176473, 'quart': 946.352946, 'gallon': 3785.411784,
+}
+UNIT_ALIASES = {
+    'gram': 'g', 'grams': 'g', 'gr': 'g', 'grm': 'g', 'kilogram': 'kg', 'milligram': 'mg',
+    'ounce': 'oz', 'ounces': 'oz', 'onz': 'oz', 'pound': 'lb', 'pounds': 'lb', 'lbs': 'lb',
+    'milliliter': 'ml', 'millilitre': 'ml', 'mlt': 'ml', 'liter': 'l', 'litre': 'l', 'ltr': 'l',
+    'teaspoon': 'tsp', 'tsps': 'tsp', 'tablespoon': 'tbsp', 'tbsps': 'tbsp', 'tbs': 'tbsp', 'tbl': 'tbsp',
+    'fl oz': 'fl oz', 'floz': 'fl oz', 'fluid ounce': 'fl oz', 'fluid ounces': 'fl oz',
+    'cups': 'cup', 'c': 'cup', 'pt': 'pint', 'qt': 'quart', 'gal': 'gallon',
+    'pieces': 'piece', 'pc': 'piece', 'pcs': 'piece', 'slices': 'slice', 'servings': 'serving',
+}
+# Count nouns accepted from free-text portion modifiers ("slice, large")
+COUNT_UNITS = {
+    'serving', 'slice', 'piece', 'bar', 'cookie', 'cracker', 'package', 'container', 'can', 'bottle',
+    'packet', 'link', 'patty', 'fillet', 'breast', 'leg', 'wing', 'thigh', 'egg', 'fruit', 'leaf',
+    'stalk', 'clove', 'wedge', 'strip', 'stick', 'roll', 'bun', 'muffin', 'item', 'each',
+}
+UNDETERMINED = 'undetermined'
+DEFAULT_UNIT = 'portion'
+MEASURE_PATTERN = re.compile(
+    r'^\s*(?P<quantity>\d+\s+\d+/\d+|\d+/\d+|\d*\.?\d+)?\s*(?P<unit>fl\.?\s*oz|[a-z][a-z .-]*?)\s*'
+    r'(?:\((?P<weight>\d*\.?\d+)\s*(?P<weight_unit>g|ml|grams?)\s*\))?\s*$',
+    re.IGNORECASE,
+)
+BUILD_BATCH_SIZE = 100000
+
+
+def normalize_unit(unit):
+    """Canonical unit key, e.g. "Tablespoons" -> "tbsp", "fl. oz" -> "fl oz", "slices" -> "slice" """
+    unit = re.sub(r'[\s.]+', ' ', (unit or '').strip().lower()).strip()
+    if unit in UNIT_ALIASES:
+        return UNIT_ALIASES[unit]
+    if unit in MASS_UNITS or unit in VOLUME_UNITS:
+        return unit
+    if len(unit) > 3 and unit.endswith('s') and not unit.endswith('ss'):
+        return UNIT_ALIASES.get(unit[:-1], unit[:-1])
+    return unit
+
+
+def parse_quantity(text):
+    """Number for "2", "1.5", "1/2" or "1 1/2", or None"""
+    text = text.strip()
+    whole, _, fraction = text.partition(' ')
+    try:
+        if fraction:
+            return float(int(whole) + Fraction(fraction))
+        return float(Fraction(text))
+    except (ValueError, ZeroDivisionError):
+        return None
+
+
+def parse_measure(text):
+    """(quantity, unit, grams of the whole measure or None) for "2 slices (56 g)"-style text"""
+    match = MEASURE_PATTERN.match(text or '')
+    if match is None:
+        return None
+    unit = normalize_unit(match['unit'])
+    if not unit:
+        return None
+    quantity = parse_quantity(match['quantity']) if match['quantity'] else 1.0
+    if quantity is None or quantity <= 0:
+        return None
+    weight = float(match['weight']) if match['weight'] else None
+    return quantity, unit, weight
+
+
+def parse_modifier(modifier):
+    """parse_measure() for the leading part of a portion modifier ("cup, chopped"), known units only"""
+    parsed = parse_measure((modifier or '').split(',')[0])
+    if parsed is None or not (parsed[1] in MASS_UNITS or parsed[1] in VOLUME_UNITS or parsed[1] in COUNT_UNITS):
+        return None
+    return parsed
+
+
+def food_key(source, food_id):
+    return (SOURCES[source] << SOURCE_SHIFT) | int(food_id)
+
+
+def convert_mass(unit, quantity=1.0):
+    """Grams in `quantity` of a mass unit, or None"""
+    factor = MASS_UNITS.get(normalize_unit(unit))
+    return None if factor is None else quantity * factor
+
+
+class ConversionIndex:
+    """In-memory unit -> grams table for every food"""
+
+    def __init__(self, arrays, vocabulary, version=None, path=None):
+        self.version = version
+        self.path = path
+        self.keys = arrays['keys']
+        self.offsets = arrays['offsets']
+        self.unit_ids = arrays['units']
+        self.label_ids = arrays['labels']
+        self.unit_grams = arrays['grams']
+        self.refs = arrays['refs']
+        self.estimated = arrays['estimated']
+        self.densities = arrays['density']
+        self.unit_names = vocabulary['units']
+        self.label_names = vocabulary['labels']
+        self.unit_codes = {unit: code for code, unit in enumerate(self.unit_names)}
+
+    @classmethod
+    def load(cls, path, version):
+        arrays = {name: np.load(os.path.join(path, f'{name}.npy')) for name in ARRAYS}
+        with open(os.path.join(path, 'vocabulary.json')) as f:
+            vocabulary = json.load(f)
+        return cls(arrays, vocabulary, version, path)
+
+    def _position(self, source, food_id):
+        key = food_key(source, food_id)
+        position = int(np.searchsorted(self.keys, key))
+        if position < len(self.keys) and self.keys[position] == key:
+            return position
+        return None
+
+    def _rows(self, position):
+        if position is None:
+            return range(0)
+        return range(self.offsets[position], self.offsets[position + 1])
+
+    def _measure(self, row):
+        return {
+            'unit': self.unit_names[self.unit_ids[row]],
+            'label': self.label_names[self.label_ids[row]],
+            'grams': round(float(self.unit_grams[row]), 3),
+            'ref': None if self.refs[row] < 0 else int(self.refs[row]),
+            'estimated': bool(self.estimated[row]),
+        }
+
+    def units(self, source, food_id):
+        """[{unit, label, grams, ref, estimated}] household measures of a food, in source order"""
+        return [self._measure(row) for row in self._rows(self._position(source, food_id))]
+
+    def density(self, source, food_id):
+        """Density in g/ml, or None if unknown"""
+        position = self._position(source, food_id)
+        if position is None or np.isnan(self.densities[position]):
+            return None
+        return float(self.densities[position])
+
+    def default_unit(self, source, food_id):
+        """The food's first household measure, or None"""
+        for row in self._rows(self._position(source, food_id)):
+            return self._measure(row)
+        return None
+
+    def by_ref(self, source, food_id, ref):
+        """The measure of a FoodPortion id / CNWeight sequence number, or None"""
+        for row in self._rows(self._position(source, food_id)):
+            if self.refs[row] == ref:
+                return self._measure(row)
+        return None
+
+    def grams(self, source, food_id, unit, quantity=1.0):
+        """(grams, label) for `quantity` of `unit` of a food, or None if not convertible"""
+        unit = normalize_unit(unit)
+        mass = convert_mass(unit, quantity)
+        if mass is not None:
+            return mass, unit
+
+        position = self._position(source, food_id)
+        code = self.unit_codes.get(unit)
+        if code is not None:
+            for row in self._rows(position):
+                if self.unit_ids[row] == code:
+                    return quantity * float(self.unit_grams[row]), self.label_names[self.label_ids[row]]
+        if position is not None and unit in VOLUME_UNITS and not np.isnan(self.densities[position]):
+            return quantity * VOLUME_UNITS[unit] * float(self.densities[position]), unit
+        return None
+
+
+files = VersionedDataFiles('conversions', ConversionIndex.load)
+
+
+def get_index():
+    """Conversion index for the current dataset version, or None if none has been built"""
+    if np is None:
+        return None
+    return files.get()
+
+
+def measure(source, food_id, unit=None, conversion_index=None):
+    """(label, grams) of one `unit` of a food, or of its first household measure
+    when `unit` is None or "default"; None if not convertible.
+
+    Mass units convert even before the conversion table has been built.
+    """
+    if unit is not None and unit != 'default':
+        grams = convert_mass(unit)
+        if grams is not None:
+            return normalize_unit(unit), grams
+    conversion_index = conversion_index or get_index()
+    if conversion_index is None:
+        return None
+    if unit is None or unit == 'default':
+        default = conversion_index.default_unit(source, food_id)
+        return None if default is None else (default['label'], default['grams'])
+    converted = conversion_index.grams(source, food_id, unit)
+    return None if converted is None else (converted[1], converted[0])
+
+
+def portion_nutrition(source, food_id, per_100g, unit=None, conversion_index=None):
+    """{unit, label, grams, **nutrients} scaling per-100 g `per_100g` values to one measure"""
+    found = measure(source, food_id, unit, conversion_index)
+    if found is None:
+        return None
+    label, grams = found
+    portion = {'unit': unit or 'default', 'label': label, 'grams': round(grams, 2)}
+    for name, value in per_100g.items():
+        portion[name] = None if value is None else round(value * grams / 100, 2)
+    return portion
+
+
+def portion_rows():
+    """(key, unit, label, grams, ref, estimated) for every FoodPortion"""
+    unit_names = dict(MeasureUnit.objects.values_list('id', 'name'))
+    for portion_id, fdc_id, amount, unit_id, description, modifier, gram_weight in FoodPortion.objects.filter(
+        gram_weight__gt=0
+    ).order_by('fdc_id', 'seq_num', 'id').values_list(
+        'id', 'fdc_id', 'amount', 'measure_unit_id', 'portion_description', 'modifier', 'gram_weight'
+    ).iterator(chunk_size=BUILD_BATCH_SIZE):
+        amount = amount or 1
+        unit_name = (unit_names.get(unit_id) or '').strip()
+        if unit_name.lower() == UNDETERMINED:
+            unit_name = ''
+        parsed = parse_measure(description) or parse_modifier(modifier)
+        if unit_name:
+            unit = normalize_unit(unit_name)
+        elif parsed is not None:
+            unit = parsed[1]
+        else:
+            unit = DEFAULT_UNIT
+        measure = ', '.join(part for part in (unit_name, modifier) if part) or unit
+        label = description or f'{amount:g} {measure}'
+        yield food_key(DatasetRelease.SOURCE_USDA, fdc_id), unit, label, gram_weight / amount, portion_id, False
+
+
+def branded_rows():
+    """(key, ...) rows for branded servings and their parsed household measures"""
+    for fdc_id, serving_size, serving_unit, household in BrandedFood.objects.order_by('fdc_id').values_list(
+        'fdc_id', 'serving_size', 'serving_size_unit', 'household_serving_fulltext'
+    ).iterator(chunk_size=BUILD_BATCH_SIZE):
+        key = food_key(DatasetRelease.SOURCE_USDA, fdc_id)
+        serving_unit = normalize_unit(serving_unit)
+        parsed = parse_measure(household)
+
+        grams, estimated = None, False
+        if serving_size and serving_size > 0 and serving_unit in ('g', 'ml', ''):
+            grams, estimated = serving_size, serving_unit != 'g'
+        elif parsed is not None and parsed[2]:
+            grams = parsed[2]
+        if grams is None:
+            continue
+
+        if parsed is not None and parsed[1] not in MASS_UNITS and parsed[1] != 'serving':
+            yield key, parsed[1], household.strip(), grams / parsed[0], -1, estimated
+        label = f'1 serving ({serving_size:g} {serving_unit or "g"})' if serving_size else '1 serving'
+        yield key, 'serving', label, grams, -1, estimated
+
+
+def cn_rows():
+    """(key, ...) rows for every CNWeight"""
+    for cn_code, sequence_num, amount, description, unit_amount, type_of_unit in CNWeight.objects.filter(
+        unit_amount__gt=0
+    ).order_by('cn_food_id', 'sequence_num').values_list(
+        'cn_food_id', 'sequence_num', 'amount', 'measure_description', 'unit_amount', 'type_of_unit'
+    ).iterator(chunk_size=BUILD_BATCH_SIZE):
+        parsed = parse_measure(description)
+        unit = parsed[1] if parsed is not None else DEFAULT_UNIT
+        amount = amount or 1
+        label = f'{amount:g} {description}'.strip()
+        estimated = normalize_unit(type_of_unit) != 'g'
+        yield food_key(DatasetRelease.SOURCE_CN, cn_code), unit, label, unit_amount / amount, sequence_num, estimated
+
+
+def build_arrays(rows):
+    """Index arrays and vocabulary for (key, unit, label, grams, ref, estimated) rows"""
+    rows = sorted(rows, key=lambda row: row[0])
+    units, labels = {}, {}
+    keys, offsets, densities = [], [], []
+    columns = {'units': [], 'labels': [], 'grams': [], 'refs': [], 'estimated': []}
+    food_densities = []
+
+    for index, (key, unit, label, grams, ref, estimated) in enumerate(rows):
+        if not keys or keys[-1] != key:
+            if keys:
+                densities.append(np.median(food_densities) if food_densities else np.nan)
+            keys.append(key)
+            offsets.append(index)
+            food_densities = []
+        columns['units'].append(units.setdefault(unit, len(units)))
+        columns['labels'].append(labels.setdefault(label, len(labels)))
+        columns['grams'].append(grams)
+        columns['refs'].append(ref)
+        columns['estimated'].append(estimated)
+        if unit in VOLUME_UNITS and not estimated:
+            food_densities.append(grams / VOLUME_UNITS[unit])
+    if keys:
+        densities.append(np.median(food_densities) if food_densities else np.nan)
+    offsets.append(len(rows))
+
+    arrays = {
+        'keys': np.array(keys, dtype=np.int64),
+        'offsets': np.array(offsets, dtype=np.int64),
+        'units': np.array(columns['units'], dtype=np.int32),
+        'labels': np.array(columns['labels'], dtype=np.int32),
+        'grams': np.array(columns['grams'], dtype=np.float32),
+        'refs': np.array(columns['refs'], dtype=np.int64),
+        'estimated': np.array(columns['estimated'], dtype=bool),
+        'density': np.array(densities, dtype=np.float32),
+    }
+    return arrays, {'units': list(units), 'labels': list(labels)}
+
+
+def build_conversions(version, data_dir=None, keep=KEEP_VERSIONS):
+    """Build the conversion table for a dataset version; returns (foods, rows)"""
+    if np is None:
+        raise RuntimeError('NumPy is required to build the unit conversion table')
+    rows = [*portion_rows(), *branded_rows(), *cn_rows()]
+    arrays, vocabulary = build_arrays(rows)
+    with files.build(version, data_dir, keep) as tmp_path:
+        for name in ARRAYS:
+            np.save(os.path.join(tmp_path, f'{name}.npy'), arrays[name])
+        with open(os.path.join(tmp_path, 'vocabulary.json'), 'w') as f:
+            json.dump(vocabulary, f)
+    return len(arrays['keys']), len(rows)
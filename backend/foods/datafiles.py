@@ -0,0 +1,119 @@
+"""
+Versioned data files derived from the database at the end of each import.
+
+Each kind of file set (the nutrient matrix, the similarity index, ...) lives
+in its own directory under FOODS_DATA_DIR, with one `v<version>`
+subdirectory per dataset version:
+
+    FOODS_DATA_DIR/<name>/v<version>/*.npy
+
+`VersionedDataFiles.build()` writes into a temporary directory that is
+renamed into place, so readers never see a partial set, and prunes old
+versions. `VersionedDataFiles.get()` opens the newest set for the current
+dataset version once per process (files are typically memory-mapped, so all
+workers share the same page cache pages) and falls back to the newest older
+version while the current one is being built.
+"""
+
+import os
+import shutil
+import threading
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+
+from .cache import response_cache
+
+
+VERSION_PREFIX = 'v'
+KEEP_VERSIONS = 2
+RESCAN_INTERVAL = 5
+
+
+class VersionedDataFiles:
+    """A directory of files rebuilt per dataset version and opened once per process.
+
+    `opener(path, version)` turns a published directory into the object that
+    `get()` returns.
+    """
+
+    def __init__(self, name, opener):
+        self.name = name
+        self.opener = opener
+        self._lock = threading.Lock()
+        self._loaded = None
+        self._checked = (None, 0.0)
+
+    def root(self, data_dir=None):
+        return os.path.join(data_dir or settings.FOODS_DATA_DIR, self.name)
+
+    def path(self, version, data_dir=None):
+        return os.path.join(self.root(data_dir), f'{VERSION_PREFIX}{version}')
+
+    def versions(self, data_dir=None):
+        """Dataset versions that have a published file set, oldest first"""
+        root = self.root(data_dir)
+        if not os.path.isdir(root):
+            return []
+        versions = []
+        for name in os.listdir(root):
+            if name.startswith(VERSION_PREFIX) and name[len(VERSION_PREFIX):].isdigit():
+                versions.append(int(name[len(VERSION_PREFIX):]))
+        return sorted(versions)
+
+    @contextmanager
+    def build(self, version, data_dir=None, keep=KEEP_VERSIONS):
+        """Yield a temporary directory to write into; publish it on success"""
+        root = self.root(data_dir)
+        os.makedirs(root, exist_ok=True)
+        tmp_path = os.path.join(root, f'.{VERSION_PREFIX}{version}.{os.getpid()}.tmp')
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        os.makedirs(tmp_path)
+        try:
+            yield tmp_path
+        except BaseException:
+            shutil.rmtree(tmp_path, ignore_errors=True)
+            raise
+
+        path = self.path(version, data_dir)
+        if os.path.isdir(path):
+            # Rebuilding a version: move the old files aside first. Processes
+            # that already mapped them keep reading the unlinked inodes.
+            stale_path = f'{tmp_path}.old'
+            os.replace(path, stale_path)
+            shutil.rmtree(stale_path, ignore_errors=True)
+        os.replace(tmp_path, path)
+
+        for old in self.versions(data_dir)[:-keep] if keep else []:
+            shutil.rmtree(self.path(old, data_dir), ignore_errors=True)
+
+    def get(self):
+        """Opened file set for the current dataset version, or None if none is built.
+
+        The directory is rescanned at most every RESCAN_INTERVAL seconds while
+        the current version has no file set yet.
+        """
+        version = response_cache.get_dataset_version()
+        loaded = self._loaded
+        if loaded is not None and loaded.version == version:
+            return loaded
+        checked_version, checked_at = self._checked
+        if checked_version == version and time.monotonic() - checked_at < RESCAN_INTERVAL:
+            return loaded
+
+        with self._lock:
+            self._checked = (version, time.monotonic())
+            candidates = [v for v in self.versions() if v <= version]
+            if not candidates:
+                return self._loaded
+            newest = candidates[-1]
+            if self._loaded is None or self._loaded.version != newest:
+                self._loaded = self.opener(self.path(newest), newest)
+            return self._loaded
+
+    def reset(self):
+        """Forget the opened file set, e.g. after changing FOODS_DATA_DIR"""
+        with self._lock:
+            self._loaded = None
+            self._checked = (None, 0.0)
@@ -0,0 +1,258 @@
+"""
+Streaming bulk export of foods with their nutrients.
+
+`export_stream()` writes every food matching the search filters (`q`,
+`data_type`, `category_id`, branded facet filters, nutrient and score
+ranges, ingredient and allergen filters) plus `since_version` as CSV,
+NDJSON or Parquet, in fdc_id order:
+
+    csv      one row per (food, nutrient); a food without nutrients gets one
+             row with empty nutrient columns
+    ndjson   one JSON object per food, with `nutrients` as {nutrient_id: amount}
+    parquet  the CSV rows, ROW_GROUP_SIZE rows per row group (needs pyarrow)
+
+Foods are read through a server-side cursor (`QuerySet.iterator()`) and
+their nutrients fetched CHUNK_SIZE foods at a time, and output is yielded
+as it is produced, so memory stays constant however many foods match.
+`since_version=N` keeps the foods inserted or updated by releases after
+dataset version N, according to the change log (foods.changes).
+`nutrients=1003,1004` limits the nutrients exported.
+
+The same stream backs the `/export/<format>/` endpoint
+(StreamingHttpResponse) and the `export_foods` command.
+"""
+
+import csv
+import io
+import json
+
+from django.contrib.postgres.search import SearchQuery
+from django.core.serializers.json import DjangoJSONEncoder
+from rest_framework.exceptions import ValidationError
+
+from .cache import normalize_params
+from .facets import BRANDED_FACETS, apply_branded_filters, parse_facet_params
+from .filters import apply_nutrient_filters, parse_nutrient_filters
+from .ingredients import apply_ingredient_filters, parse_ingredient_filters
+from .models import DatasetChange, DatasetRelease, Food, FoodCategory, FoodNutrient, Nutrient
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # pragma: no cover - optional dependency
+    pa = pq = None
+
+FORMATS = {
+    'csv': 'text/csv; charset=utf-8',
+    'ndjson': 'application/x-ndjson',
+    'parquet': 'application/vnd.apache.parquet',
+}
+FOOD_COLUMNS = (
+    'fdc_id', 'data_type', 'description', 'food_category_id', 'food_category', 'publication_date',
+    'dataset_version',
+)
+NUTRIENT_COLUMNS = ('nutrient_id', 'nutrient_name', 'unit_name', 'amount')
+CHUNK_SIZE = 2000
+FLUSH_SIZE = 256 * 1024
+ROW_GROUP_SIZE = 100000
+
+
+def parquet_available():
+    """Whether pyarrow is installed, which Parquet output requires"""
+    return pa is not None
+
+
+def parse_export_params(query_params):
+    """Canonical export filters: the search filters plus `since_version` and `nutrients`"""
+    params = normalize_params(query_params, {
+        'q': '', 'data_type': '', 'category_id': '', 'since_version': '0', 'nutrients': '',
+    }, casefold=('q',))
+    errors = {}
+    try:
+        params['since_version'] = int(params['since_version'] or 0)
+        if params['since_version'] < 0:
+            raise ValueError
+    except ValueError:
+        errors['since_version'] = 'A non-negative integer is required.'
+    try:
+        params['nutrients'] = sorted({int(value) for value in params['nutrients'].split(',') if value.strip()})
+    except ValueError:
+        errors['nutrients'] = 'A comma-separated list of nutrient ids is required.'
+    if errors:
+        raise ValidationError(errors)
+
+    nutrient_params = parse_nutrient_filters(query_params)
+    nutrient_params.pop('order_by')
+    params.update(nutrient_params)
+    facet_params = parse_facet_params(query_params)
+    params.update({facet: facet_params[facet] for facet in BRANDED_FACETS})
+    params.update(parse_ingredient_filters(query_params))
+    return params
+
+
+def export_queryset(params):
+    """Food values() queryset for canonical export params, in fdc_id order"""
+    foods = Food.objects.all()
+    if params['data_type']:
+        foods = foods.filter(data_type=params['data_type'])
+    if params['category_id']:
+        foods = foods.filter(food_category_id=params['category_id'])
+    if params['since_version']:
+        foods = foods.filter(fdc_id__in=DatasetChange.objects.filter(
+            source=DatasetRelease.SOURCE_USDA, version__gt=params['since_version']
+        ).values('record_id'))
+    foods = apply_branded_filters(foods, params)
+    foods = apply_nutrient_filters(foods, params)
+    foods = apply_ingredient_filters(foods, params)
+
+    query = params['q']
+    if len(query) > 2:
+        foods = foods.filter(search_vector=SearchQuery(query))
+    elif query:
+        foods = foods.filter(description__icontains=query)
+    columns = [column for column in FOOD_COLUMNS if column != 'food_category']
+    return foods.order_by('fdc_id').values(*columns)
+
+
+def food_records(foods, nutrient_ids=()):
+    """(food dict, [(nutrient_id, amount), ...]) per food, with one nutrient query per CHUNK_SIZE foods"""
+    categories = dict(FoodCategory.objects.values_list('id', 'description'))
+    chunk = []
+    for food in foods.iterator(chunk_size=CHUNK_SIZE):
+        food['food_category'] = categories.get(food['food_category_id'])
+        chunk.append(food)
+        if len(chunk) >= CHUNK_SIZE:
+            yield from _with_nutrients(chunk, nutrient_ids)
+            chunk = []
+    yield from _with_nutrients(chunk, nutrient_ids)
+
+
+def _with_nutrients(foods, nutrient_ids):
+    if not foods:
+        return
+    values = {food['fdc_id']: [] for food in foods}
+    rows = FoodNutrient.objects.filter(fdc_id__in=list(values), amount__isnull=False)
+    if nutrient_ids:
+        rows = rows.filter(nutrient_id__in=nutrient_ids)
+    for fdc_id, nutrient_id, amount in rows.order_by('fdc_id', 'nutrient_id').values_list(
+        'fdc_id', 'nutrient_id', 'amount'
+    ):
+        values[fdc_id].append((nutrient_id, amount))
+    for food in foods:
+        yield food, values[food['fdc_id']]
+
+
+def flat_rows(records):
+    """CSV/Parquet rows (FOOD_COLUMNS + NUTRIENT_COLUMNS) for food records"""
+    nutrients = {
+        nutrient_id: (name, unit)
+        for nutrient_id, name, unit in Nutrient.objects.values_list('id', 'name', 'unit_name')
+    }
+    for food, values in records:
+        base = [food[column] for column in FOOD_COLUMNS]
+        if not values:
+            yield base + [None] * len(NUTRIENT_COLUMNS)
+        for nutrient_id, amount in values:
+            name, unit = nutrients.get(nutrient_id, (None, None))
+            yield base + [nutrient_id, name, unit, amount]
+
+
+def csv_stream(records):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(FOOD_COLUMNS + NUTRIENT_COLUMNS)
+    for row in flat_rows(records):
+        writer.writerow(row)
+        if buffer.tell() >= FLUSH_SIZE:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+
+def ndjson_stream(records):
+    lines = []
+    size = 0
+    for food, values in records:
+        line = json.dumps(
+            {
+                **{column: food[column] for column in FOOD_COLUMNS},
+                'nutrients': {str(nutrient_id): amount for nutrient_id, amount in values},
+            },
+            cls=DjangoJSONEncoder, separators=(',', ':'),
+        )
+        lines.append(line)
+        size += len(line) + 1
+        if size >= FLUSH_SIZE:
+            yield '\n'.join(lines) + '\n'
+            lines, size = [], 0
+    if lines:
+        yield '\n'.join(lines) + '\n'
+
+
+class _StreamSink(io.RawIOBase):
+    """Write-only file whose contents are handed to the response as they are written"""
+
+    def __init__(self):
+        self.chunks = []
+        self.position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def drain(self):
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def parquet_schema():
+    return pa.schema([
+        ('fdc_id', pa.int64()), ('data_type', pa.string()), ('description', pa.string()),
+        ('food_category_id', pa.int64()), ('food_category', pa.string()), ('publication_date', pa.date32()),
+        ('dataset_version', pa.int64()), ('nutrient_id', pa.int64()), ('nutrient_name', pa.string()),
+        ('unit_name', pa.string()), ('amount', pa.float64()),
+    ])
+
+
+def _parquet_table(rows, schema):
+    columns = zip(*rows)
+    return pa.Table.from_arrays(
+        [pa.array(column, type=field.type) for column, field in zip(columns, schema)], schema=schema
+    )
+
+
+def parquet_stream(records):
+    if pa is None:
+        raise RuntimeError('pyarrow is required for Parquet export')
+    schema = parquet_schema()
+    sink = _StreamSink()
+    writer = pq.ParquetWriter(sink, schema, compression='zstd')
+    rows = []
+    for row in flat_rows(records):
+        rows.append(row)
+        if len(rows) >= ROW_GROUP_SIZE:
+            writer.write_table(_parquet_table(rows, schema))
+            rows = []
+            yield sink.drain()
+    if rows:
+        writer.write_table(_parquet_table(rows, schema))
+    writer.close()
+    yield sink.drain()
+
+
+STREAMS = {'csv': csv_stream, 'ndjson': ndjson_stream, 'parquet': parquet_stream}
+
+
+def export_stream(export_format, params):
+    """Iterator of str (CSV, NDJSON) or bytes (Parquet) chunks of the export"""
+    records = food_records(export_queryset(params), params['nutrients'])
+    return STREAMS[export_format](records)
@@ -0,0 +1,220 @@
+"""
+Facet counts for food search.
+
+Search can return the top values of each facet with their counts over the
+whole result (`facets=brand_owner,market_country` or `facets=all`) and be
+filtered on any facet value:
+
+    data_type              Food.data_type            (search param data_type)
+    food_category_id       Food.food_category_id     (search param category_id)
+    branded_food_category  BrandedFood.branded_food_category
+    brand_owner            BrandedFood.brand_owner
+    market_country         BrandedFood.market_country
+
+Instead of a GROUP BY per facet per request, `build_facet_index()` encodes
+every food's facet values as integer codes at the end of each import, one
+array per facet aligned with the sorted fdc_ids, under
+FOODS_DATA_DIR/facets/v<version>/:
+
+    fdc_ids.npy      int64 [n] sorted
+    <facet>.npy      int32 [n] index into vocabulary.json[facet], -1 if none
+    vocabulary.json  {facet: [value, ...], "labels": {facet: [label, ...]}}
+
+Counting a result is then a `bincount` over its rows. Browsing by facet
+filters alone (no text query or nutrient filters) is answered entirely from
+the arrays, including the total and the page of ids. Text searches count the
+ids of their matches, fetched in place of the COUNT(*) query; results larger
+than FACET_SCAN_LIMIT are counted on their first FACET_SCAN_LIMIT ids and
+scaled (`facets_approximate`).
+"""
+
+import json
+import os
+
+from rest_framework.exceptions import ValidationError
+
+from . import matrix
+from .datafiles import KEEP_VERSIONS, VersionedDataFiles
+from .models import BrandedFood, Food, FoodCategory
+
+np = matrix.np
+
+FACETS = ('data_type', 'food_category_id', 'branded_food_category', 'brand_owner', 'market_country')
+# Search param -> facet
+FILTER_PARAMS = {
+    'data_type': 'data_type',
+    'category_id': 'food_category_id',
+    'branded_food_category': 'branded_food_category',
+    'brand_owner': 'brand_owner',
+    'market_country': 'market_country',
+}
+BRANDED_FACETS = ('branded_food_category', 'brand_owner', 'market_country')
+DEFAULT_FACET_LIMIT = 10
+MAX_FACET_LIMIT = 100
+FACET_SCAN_LIMIT = 100000
+BUILD_BATCH_SIZE = 100000
+
+
+def parse_facet_params(query_params):
+    """Canonical `facets`, `facet_limit` and branded facet filter params, for use in cache keys"""
+    requested = {name.strip() for name in (query_params.get('facets') or '').split(',') if name.strip()}
+    if 'all' in requested:
+        requested = set(FACETS)
+    unknown = sorted(requested - set(FACETS))
+    errors = {}
+    if unknown:
+        errors['facets'] = f"Unknown facet(s): {', '.join(unknown)}"
+    try:
+        limit = int(query_params.get('facet_limit') or DEFAULT_FACET_LIMIT)
+        if not 1 <= limit <= MAX_FACET_LIMIT:
+            raise ValueError
+    except ValueError:
+        errors['facet_limit'] = f'An integer between 1 and {MAX_FACET_LIMIT} is required.'
+        limit = DEFAULT_FACET_LIMIT
+    if errors:
+        raise ValidationError(errors)
+
+    params = {'facets': ','.join(name for name in FACETS if name in requested), 'facet_limit': limit}
+    for facet in BRANDED_FACETS:
+        params[facet] = (query_params.get(facet) or '').strip()
+    return params
+
+
+def facet_filters(params):
+    """{facet: value} for the facet filters set in canonical search params"""
+    return {facet: params[param] for param, facet in FILTER_PARAMS.items() if params.get(param)}
+
+
+def apply_branded_filters(foods, params):
+    """Restrict a Food queryset to the branded facet filters in `params`"""
+    branded = {facet: params[facet] for facet in BRANDED_FACETS if params.get(facet)}
+    if branded:
+        foods = foods.filter(fdc_id__in=BrandedFood.objects.filter(**branded).values('fdc_id'))
+    return foods
+
+
+class FacetIndex:
+    """Per-facet value codes for every food, aligned with sorted fdc_ids"""
+
+    def __init__(self, arrays, vocabulary, version=None, path=None):
+        self.version = version
+        self.path = path
+        self.fdc_ids = arrays['fdc_ids']
+        self.codes = {facet: arrays[facet] for facet in FACETS}
+        self.values = {facet: vocabulary[facet] for facet in FACETS}
+        self.labels = vocabulary.get('labels', {})
+        self.lookup = {
+            facet: {str(value): code for code, value in enumerate(values)}
+            for facet, values in self.values.items()
+        }
+
+    @classmethod
+    def load(cls, path, version):
+        arrays = {name: np.load(os.path.join(path, f'{name}.npy')) for name in ('fdc_ids', *FACETS)}
+        with open(os.path.join(path, 'vocabulary.json')) as f:
+            vocabulary = json.load(f)
+        return cls(arrays, vocabulary, version, path)
+
+    def __len__(self):
+        return len(self.fdc_ids)
+
+    def rows(self, fdc_ids):
+        """Row positions of the given fdc_ids, skipping foods not in the index"""
+        fdc_ids = np.asarray(fdc_ids, dtype=np.int64)
+        if not len(self.fdc_ids) or not len(fdc_ids):
+            return np.zeros(0, dtype=np.int64)
+        positions = np.minimum(np.searchsorted(self.fdc_ids, fdc_ids), len(self.fdc_ids) - 1)
+        return positions[self.fdc_ids[positions] == fdc_ids]
+
+    def match(self, filters):
+        """Row positions of the foods matching every {facet: value} filter"""
+        mask = np.ones(len(self.fdc_ids), dtype=bool)
+        for facet, value in filters.items():
+            code = self.lookup[facet].get(str(value))
+            if code is None:
+                return np.zeros(0, dtype=np.int64)
+            mask &= self.codes[facet] == code
+        return np.flatnonzero(mask)
+
+    def counts(self, rows, facets, limit=DEFAULT_FACET_LIMIT, scale=1.0):
+        """{facet: [{value, count[, label]}]}, the top `limit` values of each facet among `rows`"""
+        result = {}
+        for facet in facets:
+            codes = self.codes[facet][rows]
+            counts = np.bincount(codes[codes >= 0], minlength=len(self.values[facet]))
+            present = np.flatnonzero(counts)
+            top = present[np.lexsort((present, -counts[present]))][:limit]
+            labels = self.labels.get(facet)
+            result[facet] = [
+                {
+                    'value': self.values[facet][code],
+                    'count': int(round(counts[code] * scale)),
+                    **({'label': labels[code]} if labels else {}),
+                }
+                for code in top.tolist()
+            ]
+        return result
+
+
+files = VersionedDataFiles('facets', FacetIndex.load)
+
+
+def get_index():
+    """Facet index for the current dataset version, or None if none has been built"""
+    if np is None:
+        return None
+    return files.get()
+
+
+def _encode(values, vocabulary):
+    """Facet codes for raw values, growing `vocabulary`; blanks are -1"""
+    codes = np.full(len(values), -1, dtype=np.int32)
+    for i, value in enumerate(values):
+        if isinstance(value, str):
+            value = value.strip()
+        if value is None or value == '':
+            continue
+        codes[i] = vocabulary.setdefault(value, len(vocabulary))
+    return codes
+
+
+def build_facet_index(version, data_dir=None, keep=KEEP_VERSIONS):
+    """Build the facet index for a dataset version; returns (foods, distinct values)"""
+    if np is None:
+        raise RuntimeError('NumPy is required to build the facet index')
+
+    foods = list(Food.objects.order_by('fdc_id').values_list(
+        'fdc_id', 'data_type', 'food_category_id'
+    ).iterator(chunk_size=BUILD_BATCH_SIZE))
+    fdc_ids = np.array([row[0] for row in foods], dtype=np.int64)
+    vocabularies = {facet: {} for facet in FACETS}
+    arrays = {
+        'fdc_ids': fdc_ids,
+        'data_type': _encode([row[1] for row in foods], vocabularies['data_type']),
+        'food_category_id': _encode([row[2] for row in foods], vocabularies['food_category_id']),
+    }
+    del foods
+
+    branded = list(BrandedFood.objects.order_by('fdc_id').values_list(
+        'fdc_id', *BRANDED_FACETS
+    ).iterator(chunk_size=BUILD_BATCH_SIZE))
+    branded_ids = np.array([row[0] for row in branded], dtype=np.int64)
+    positions = np.minimum(np.searchsorted(fdc_ids, branded_ids), max(len(fdc_ids) - 1, 0))
+    known = fdc_ids[positions] == branded_ids if len(fdc_ids) else np.zeros(len(branded_ids), dtype=bool)
+    for index, facet in enumerate(BRANDED_FACETS, start=1):
+        codes = _encode([row[index] for row in branded], vocabularies[facet])
+        arrays[facet] = np.full(len(fdc_ids), -1, dtype=np.int32)
+        arrays[facet][positions[known]] = codes[known]
+
+    categories = dict(FoodCategory.objects.values_list('id', 'description'))
+    vocabulary = {facet: list(values) for facet, values in vocabularies.items()}
+    vocabulary['labels'] = {
+        'food_category_id': [categories.get(category_id) for category_id in vocabulary['food_category_id']],
+    }
+
+    with files.build(version, data_dir, keep) as tmp_path:
+        for name, array in arrays.items():
+            np.save(os.path.join(tmp_path, f'{name}.npy'), array)
+        with open(os.path.join(tmp_path, 'vocabulary.json'), 'w') as f:
+            json.dump(vocabulary, f)
+    return len(fdc_ids), sum(len(values) for values in vocabularies.values())
@@ -0,0 +1,406 @@
+"""
+Lightweight serializers for the hot read endpoints.
+
+DRF ModelSerializers instantiate and introspect a Field object per attribute
+on every call, which dominates CPU on list and search endpoints. These
+serializers declare their output fields once and build plain dicts, reading
+rows produced by `QuerySet.values()` (or model instances). Computed fields
+are filled for a whole page at once in `prefetch()`, so they cost one query
+per page instead of one per row.
+
+Every serializer supports sparse fieldsets: `?fields=` keeps only the listed
+fields and `?omit=` drops fields. `columns()` then names just the model
+columns the selected fields need, so views can narrow the SQL projection.
+`extra_fields` are only returned when `?fields=` names them.
+"""
+
+from operator import itemgetter
+
+from rest_framework.exceptions import ValidationError
+
+from .models import FoodCategory, FoodNutritionSummary, FoodScore, NutrientLookup, CNNutrientLookup
+
+
+def parse_field_list(value):
+    """Split a comma-separated field list, ignoring blanks"""
+    return [name.strip() for name in (value or '').split(',') if name.strip()]
+
+
+def attribute_path(path):
+    """Getter for a `related__field` path on model instances; None if a link is empty"""
+    names = path.split('__')
+
+    def getter(obj):
+        for name in names:
+            if obj is None:
+                return None
+            obj = getattr(obj, name)
+        return obj
+    return getter
+
+
+def normalize_fieldset(query_params):
+    """Canonical `fields`/`omit` values, for use in cache keys"""
+    return {
+        'fields': ','.join(sorted(set(parse_field_list(query_params.get('fields'))))),
+        'omit': ','.join(sorted(set(parse_field_list(query_params.get('omit'))))),
+    }
+
+
+class FastSerializer:
+    """Base class for dict-building serializers with sparse fieldsets.
+
+    Subclasses set `fields` (output names, in order) and may set
+    `extra_fields` (returned only when requested), `field_sources` mapping
+    an output name to the model column it reads, and `computed_fields`
+    mapping an output name to the columns its `get_<name>(row, context)`
+    method needs.
+    """
+    fields = ()
+    extra_fields = ()
+    field_sources = {}
+    computed_fields = {}
+
+    def __init__(self, fields=None, omit=None):
+        available = (*self.fields, *self.extra_fields)
+        requested = parse_field_list(fields)
+        omitted = parse_field_list(omit)
+
+        unknown = sorted(set(requested + omitted) - set(available))
+        if unknown:
+            raise ValidationError({'fields': f"Unknown field(s): {', '.join(unknown)}"})
+
+        selected = [name for name in available if name in requested] if requested else list(self.fields)
+        self.selected = [name for name in selected if name not in omitted]
+        # No columns would mean values() selecting every column
+        if not self.selected:
+            raise ValidationError({'fields': 'fields and omit leave no fields to return.'})
+
+    @classmethod
+    def from_query_params(cls, query_params):
+        return cls(fields=query_params.get('fields'), omit=query_params.get('omit'))
+
+    def is_selected(self, name):
+        return name in self.selected
+
+    def columns(self):
+        """Model columns needed to produce the selected fields"""
+        columns = []
+        for name in self.selected:
+            if name in self.computed_fields:
+                needed = self.computed_fields[name]
+            else:
+                needed = (self.field_sources.get(name, name),)
+            for column in needed:
+                if column not in columns:
+                    columns.append(column)
+        return columns
+
+    def prefetch(self, rows):
+        """Batch data shared by all rows (e.g. nutrient values); returns a context dict"""
+        return {}
+
+    def serialize(self, rows):
+        """Serialize an iterable of `values()` dicts or model instances"""
+        rows = list(rows)
+        if not rows:
+            return []
+        context = self.prefetch(rows)
+        getter = itemgetter if isinstance(rows[0], dict) else attribute_path
+
+        plan = []
+        for name in self.selected:
+            if name in self.computed_fields:
+                plan.append((name, getattr(self, f'get_{name}'), True))
+            else:
+                plan.append((name, getter(self.field_sources.get(name, name)), False))
+
+        return [
+            {
+                name: (func(row, context) if computed else func(row))
+                for name, func, computed in plan
+            }
+            for row in rows
+        ]
+
+    def serialize_one(self, row):
+        return self.serialize([row])[0]
+
+    @staticmethod
+    def value(row, name):
+        """Read a column from a values() dict or a model instance"""
+        return row[name] if isinstance(row, dict) else getattr(row, name)
+
+
+class FoodNutrientPreviewMixin:
+    """Computed macro fields for USDA foods, fetched for a whole page in one query"""
+    nutrient_fields = {
+        'calories': NutrientLookup.ENERGY_KCAL,
+        'protein': NutrientLookup.PROTEIN,
+        'fat': NutrientLookup.TOTAL_FAT,
+        'carbs': NutrientLookup.CARBS,
+    }
+
+    def prefetch_nutrients(self, rows):
+        nutrient_ids = [
+            nutrient_id for name, nutrient_id in self.nutrient_fields.items() if self.is_selected(name)
+        ]
+        if not nutrient_ids:
+            return {}
+        return NutrientLookup.get_values([self.value(row, 'fdc_id') for row in rows], nutrient_ids)
+
+    def nutrient_value(self, row, context, name):
+        return context['nutrients'][self.value(row, 'fdc_id')][self.nutrient_fields[name]]
+
+    def get_calories(self, row, context):
+        return self.nutrient_value(row, context, 'calories')
+
+    def get_protein(self, row, context):
+        return self.nutrient_value(row, context, 'protein')
+
+    def get_fat(self, row, context):
+        return self.nutrient_value(row, context, 'fat')
+
+    def get_carbs(self, row, context):
+        return self.nutrient_value(row, context, 'carbs')
+
+
+class FoodCategoryNameMixin:
+    """Computed `food_category` description, resolved for a whole page in one query"""
+
+    def prefetch_categories(self, rows):
+        if not self.is_selected('food_category'):
+            return {}
+        category_ids = {self.value(row, 'food_category_id') for row in rows} - {None}
+        return dict(FoodCategory.objects.filter(id__in=category_ids).values_list('id', 'description'))
+
+    def get_food_category(self, row, context):
+        return context['categories'].get(self.value(row, 'food_category_id'))
+
+
+def serving_nutrition(fdc_ids):
+    """{fdc_id: per-serving nutrition} for the foods that have a serving size, in one query"""
+    servings = {}
+    for row in FoodNutritionSummary.objects.filter(
+        food_id__in=fdc_ids, serving_grams__isnull=False
+    ).values('food_id', 'serving_grams', 'serving_description', *FoodNutritionSummary.SERVING_COLUMNS):
+        servings[row['food_id']] = {
+            'grams': row['serving_grams'],
+            'description': row['serving_description'],
+            **{
+                name: None if row[column] is None else round(row[column], 2)
+                for column, name in FoodNutritionSummary.SERVING_COLUMNS.items()
+            },
+        }
+    return servings
+
+
+class ServingNutritionMixin:
+    """`per_serving` values precomputed in the nutrition summary, fetched for a whole page in one query"""
+
+    def prefetch_servings(self, rows):
+        if not self.is_selected('per_serving'):
+            return {}
+        return serving_nutrition([self.value(row, 'fdc_id') for row in rows])
+
+    def get_per_serving(self, row, context):
+        return context['servings'].get(self.value(row, 'fdc_id'))
+
+
+def food_scores(fdc_ids):
+    """{fdc_id: {score name: value}} for the foods that have scores, in one query"""
+    return {
+        row.pop('food_id'): row
+        for row in FoodScore.objects.filter(food_id__in=fdc_ids).values('food_id', *FoodScore.SCORE_COLUMNS)
+    }
+
+
+class FoodScoreMixin:
+    """`scores` precomputed in the food score table, fetched for a whole page in one query"""
+
+    def prefetch_scores(self, rows):
+        if not self.is_selected('scores'):
+            return {}
+        return food_scores([self.value(row, 'fdc_id') for row in rows])
+
+    def get_scores(self, row, context):
+        return context['scores'].get(self.value(row, 'fdc_id'))
+
+
+class FastFoodSerializer(
+    FoodScoreMixin, ServingNutritionMixin, FoodNutrientPreviewMixin, FoodCategoryNameMixin, FastSerializer
+):
+    """Fast counterpart of FoodSerializer; the macros are available through ?fields="""
+    fields = (
+        'fdc_id', 'data_type', 'description', 'food_category_id', 'food_category', 'publication_date',
+        'per_serving', 'scores'
+    )
+    extra_fields = ('calories', 'protein', 'fat', 'carbs')
+    computed_fields = {
+        'food_category': ('food_category_id',),
+        'calories': ('fdc_id',),
+        'protein': ('fdc_id',),
+        'fat': ('fdc_id',),
+        'carbs': ('fdc_id',),
+        'per_serving': ('fdc_id',),
+        'scores': ('fdc_id',),
+    }
+
+    def prefetch(self, rows):
+        return {
+            'categories': self.prefetch_categories(rows),
+            'nutrients': self.prefetch_nutrients(rows),
+            'servings': self.prefetch_servings(rows),
+            'scores': self.prefetch_scores(rows),
+        }
+
+
+class FastFoodSearchSerializer(
+    FoodScoreMixin, ServingNutritionMixin, FoodNutrientPreviewMixin, FoodCategoryNameMixin, FastSerializer
+):
+    """Fast counterpart of FoodSearchSerializer"""
+    fields = (
+        'fdc_id', 'data_type', 'description', 'food_category', 'calories', 'protein', 'fat', 'carbs',
+        'per_serving', 'scores'
+    )
+    computed_fields = {
+        'food_category': ('food_category_id',),
+        'calories': ('fdc_id',),
+        'protein': ('fdc_id',),
+        'fat': ('fdc_id',),
+        'carbs': ('fdc_id',),
+        'per_serving': ('fdc_id',),
+        'scores': ('fdc_id',),
+    }
+
+    def prefetch(self, rows):
+        return {
+            'categories': self.prefetch_categories(rows),
+            'nutrients': self.prefetch_nutrients(rows),
+            'servings': self.prefetch_servings(rows),
+            'scores': self.prefetch_scores(rows),
+        }
+
+
+class FastBrandedFoodSerializer(FastSerializer):
+    """Fast counterpart of BrandedFoodSerializer"""
+    fields = (
+        'fdc_id', 'brand_owner', 'brand_name', 'subbrand_name', 'gtin_upc',
+        'ingredients', 'serving_size', 'serving_size_unit', 'household_serving_fulltext',
+        'branded_food_category', 'data_source', 'package_weight'
+    )
+
+
+class CNMacrosMixin:
+    """Macro values for CN foods, fetched for a whole page in one query"""
+    nutrient_fields = {
+        'calories': CNNutrientLookup.ENERGY_KCAL,
+        'protein': CNNutrientLookup.PROTEIN,
+        'fat': CNNutrientLookup.TOTAL_FAT,
+        'carbs': CNNutrientLookup.CARBS,
+    }
+
+    def prefetch_nutrients(self, rows):
+        codes = [code for name, code in self.nutrient_fields.items() if self.is_selected(name)]
+        if not codes:
+            return {}
+        return CNNutrientLookup.get_values([self.value(row, 'cn_code') for row in rows], codes)
+
+    def nutrient_value(self, row, context, name):
+        return context['nutrients'][self.value(row, 'cn_code')][self.nutrient_fields[name]]
+
+    def get_calories(self, row, context):
+        return self.nutrient_value(row, context, 'calories')
+
+    def get_protein(self, row, context):
+        return self.nutrient_value(row, context, 'protein')
+
+    def get_fat(self, row, context):
+        return self.nutrient_value(row, context, 'fat')
+
+    def get_carbs(self, row, context):
+        return self.nutrient_value(row, context, 'carbs')
+
+
+class FastCNFoodListSerializer(CNMacrosMixin, FastSerializer):
+    """Fast counterpart of CNFoodListSerializer"""
+    fields = (
+        'cn_code', 'descriptor', 'abbreviated_descriptor',
+        'food_category_name', 'brand_name', 'brand_owner_name',
+        'calories', 'protein', 'fat', 'carbs'
+    )
+    field_sources = {'food_category_name': 'food_category__description'}
+    computed_fields = {
+        'calories': ('cn_code',),
+        'protein': ('cn_code',),
+        'fat': ('cn_code',),
+        'carbs': ('cn_code',),
+    }
+
+    def prefetch(self, rows):
+        return {'nutrients': self.prefetch_nutrients(rows)}
+
+
+class FastCNFoodDetailSerializer(FastSerializer):
+    """Fast counterpart of CNFoodDetailSerializer.
+
+    Works on CNFood instances; with `food_category` selected and
+    `nutrient_values__nutrient` and `weights` prefetched it issues no queries.
+    """
+    fields = (
+        'cn_code', 'descriptor', 'abbreviated_descriptor',
+        'food_category_name', 'gtin', 'product_code',
+        'brand_owner_name', 'brand_name', 'fns_material_number',
+        'form_of_food', 'fdc_id', 'date_added', 'last_modified',
+        'nutrient_values', 'weights', 'macros', 'vitamins_minerals'
+    )
+    computed_fields = {
+        'food_category_name': ('food_category',),
+        'nutrient_values': ('cn_code',),
+        'weights': ('cn_code',),
+        'macros': ('cn_code',),
+        'vitamins_minerals': ('cn_code',),
+    }
+    macro_codes = CNNutrientLookup.MACROS
+    vitamin_mineral_codes = CNNutrientLookup.VITAMINS_MINERALS
+
+    def get_food_category_name(self, food, context):
+        return food.food_category.description if food.food_category else None
+
+    def get_nutrient_values(self, food, context):
+        return [
+            {
+                'nutrient_value': value.nutrient_value,
+                'per_unit': value.per_unit,
+                'nutrient_name': value.nutrient.description,
+                'nutrient_unit': value.nutrient.unit,
+                'nutrient_abbrev': value.nutrient.description_abbrev,
+                'amount': value.amount,
+                'canonical_unit': value.nutrient.canonical_unit,
+                'usda_nutrient_id': value.nutrient.nutrient_id,
+            }
+            for value in food.nutrient_values.all()
+        ]
+
+    def get_weights(self, food, context):
+        return [
+            {
+                'sequence_num': weight.sequence_num,
+                'amount': weight.amount,
+                'measure_description': weight.measure_description,
+                'unit_amount': weight.unit_amount,
+                'type_of_unit': weight.type_of_unit,
+            }
+            for weight in food.weights.all()
+        ]
+
+    def values_by_code(self, food):
+        return {value.nutrient_id: value.canonical_value for value in food.nutrient_values.all()}
+
+    def get_macros(self, food, context):
+        values = self.values_by_code(food)
+        return {name: values.get(code) for name, code in self.macro_codes.items()}
+
+    def get_vitamins_minerals(self, food, context):
+        values = self.values_by_code(food)
+        return {name: values.get(code) for name, code in self.vitamin_mineral_codes.items()}
@@ -0,0 +1,118 @@
+"""
+Nutrient range filters and ordering for food search.
+
+`min_<nutrient>=` / `max_<nutrient>=` keep foods whose amount per 100 g lies
+within the bound, and `order_by=<nutrient>` (`-<nutrient>` for descending)
+sorts on it; foods without a value sort last. A nutrient is named by a
+FoodNutritionSummary column (`protein`, `sodium`, ...; `energy` is an alias
+of `calories`), a per-serving column (`calories_per_serving`, ...; only
+foods with a serving size have one), a food score (`nrf9_3`,
+`protein_per_100kcal`, ...; see foods.scores) or any Nutrient.id.
+
+Named nutrients and scores read indexed columns through one join. Other
+nutrient ids become a semi-join on food_nutrient that the
+(nutrient_id, amount) INCLUDE (fdc_id) index answers with an index-only
+scan, so filters never multiply rows.
+"""
+
+from django.db.models import F, OuterRef, Subquery
+from rest_framework.exceptions import ValidationError
+
+from .models import FoodNutrient, FoodNutritionSummary, FoodScore
+
+SUMMARY_COLUMNS = FoodNutritionSummary.NUTRIENT_COLUMNS
+SUMMARY_FIELDS = {*SUMMARY_COLUMNS, *FoodNutritionSummary.SERVING_COLUMNS}
+SCORE_FIELDS = set(FoodScore.SCORE_COLUMNS)
+ALIASES = {'energy': 'calories'}
+SERVING_SUFFIX = '_per_serving'
+SUMMARY_IDS = {nutrient_id: name for name, nutrient_id in SUMMARY_COLUMNS.items()}
+BOUNDS = {'min': 'gte', 'max': 'lte'}
+
+
+def canonical_nutrient(name):
+    """Summary or score column name, or Nutrient.id (as a string), for a nutrient reference"""
+    name = name.lower()
+    if name.endswith(SERVING_SUFFIX):
+        base = name[:-len(SERVING_SUFFIX)]
+        base = ALIASES.get(base, base)
+        return f'{base}{SERVING_SUFFIX}' if base in SUMMARY_COLUMNS else None
+    name = ALIASES.get(name, name)
+    if name in SUMMARY_COLUMNS or name in SCORE_FIELDS:
+        return name
+    if name.isdigit():
+        return SUMMARY_IDS.get(int(name), str(int(name)))
+    return None
+
+
+def parse_nutrient_filters(query_params):
+    """Canonical `min_*`/`max_*` and `order_by` params, for use in cache keys.
+
+    The output is itself valid input, so parsing is idempotent.
+    """
+    filters, errors = {}, {}
+    for key in query_params:
+        bound, _, nutrient = key.partition('_')
+        if bound not in BOUNDS or not nutrient:
+            continue
+        canonical = canonical_nutrient(nutrient)
+        if canonical is None:
+            errors[key] = f'Unknown nutrient "{nutrient}".'
+            continue
+        try:
+            filters[f'{bound}_{canonical}'] = float(query_params.get(key))
+        except (TypeError, ValueError):
+            errors[key] = 'A number is required.'
+
+    order_by = (query_params.get('order_by') or '').strip()
+    if order_by:
+        descending = order_by.startswith('-')
+        canonical = canonical_nutrient(order_by.lstrip('-'))
+        if canonical is None:
+            errors['order_by'] = f'Unknown nutrient "{order_by.lstrip("-")}".'
+        else:
+            order_by = f"{'-' if descending else ''}{canonical}"
+
+    if errors:
+        raise ValidationError(errors)
+    return {**dict(sorted(filters.items())), 'order_by': order_by}
+
+
+def nutrient_filters(params):
+    """The canonical range filters contained in a params dict"""
+    return {key: value for key, value in params.items() if key.partition('_')[0] in BOUNDS}
+
+
+def apply_nutrient_filters(foods, params):
+    """Restrict a Food queryset to the canonical range filters in `params`"""
+    ranges = {}
+    for key, value in nutrient_filters(params).items():
+        bound, _, nutrient = key.partition('_')
+        lookup = BOUNDS[bound]
+        if nutrient in SUMMARY_FIELDS:
+            foods = foods.filter(**{f'nutrition_summary__{nutrient}__{lookup}': value})
+        elif nutrient in SCORE_FIELDS:
+            foods = foods.filter(**{f'scores__{nutrient}__{lookup}': value})
+        else:
+            ranges.setdefault(int(nutrient), {})[f'amount__{lookup}'] = value
+
+    for nutrient_id, bounds in ranges.items():
+        foods = foods.filter(fdc_id__in=FoodNutrient.objects.filter(
+            nutrient_id=nutrient_id, **bounds
+        ).values('fdc_id'))
+    return foods
+
+
+def nutrient_ordering(order_by):
+    """Order expression for a canonical `order_by` value, nulls last"""
+    nutrient = order_by.lstrip('-')
+    if nutrient in SUMMARY_FIELDS:
+        expression = F(f'nutrition_summary__{nutrient}')
+    elif nutrient in SCORE_FIELDS:
+        expression = F(f'scores__{nutrient}')
+    else:
+        expression = Subquery(FoodNutrient.objects.filter(
+            fdc_id=OuterRef('fdc_id'), nutrient_id=int(nutrient)
+        ).order_by().values('amount')[:1])
+    if order_by.startswith('-'):
+        return expression.desc(nulls_last=True)
+    return expression.asc(nulls_last=True)
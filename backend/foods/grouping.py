@@ -0,0 +1,215 @@
+"""
+Canonical groups of near-duplicate foods.
+
+The same food often appears many times: one row per brand, plus the
+foundation, SR legacy and survey versions of it. `build_groups()` clusters
+them at the end of each import, without comparing all pairs:
+
+1. Each description becomes a set of normalized words, and each set a
+   MinHash signature of NUM_BANDS * BAND_ROWS hashes.
+2. Locality-sensitive hashing: foods whose signatures agree on all rows of
+   some band share a bucket. Within a bucket, foods are ordered by calories
+   and each is compared with the next one only, so the work is linear in the
+   number of foods.
+3. A compared pair is linked if its estimated description similarity
+   (the fraction of equal hashes) is at least MIN_SIMILARITY and every
+   nutrient both foods have is within MAX_NUTRIENT_DIFF standard deviations
+   in log1p space (the similarity index profiles).
+4. Linked foods form groups (connected components, i.e. single linkage).
+   The canonical food of a group is its first by DATA_TYPE_PREFERENCE
+   (foundation over SR legacy over survey over branded), then lowest fdc_id.
+
+Groups of two or more foods are stored in FoodGroup, keyed by the canonical
+fdc_id. Search collapses them with `collapse=true`: a window function keeps
+the best-ranked match of each group and reports how many matched.
+"""
+
+import re
+import zlib
+
+from django.db import connection, transaction
+from django.db.models import Count, F, Window
+from django.db.models.functions import Coalesce, RowNumber
+
+from . import matrix
+from .models import Food, FoodGroup
+from .similarity import FEATURE_IDS, FEATURES, profiles
+
+np = matrix.np
+
+NUM_BANDS = 16
+BAND_ROWS = 4
+MIN_SIMILARITY = 0.7
+MAX_NUTRIENT_DIFF = 0.5
+DATA_TYPE_PREFERENCE = ('foundation_food', 'sr_legacy_food', 'survey_fndds_food', 'branded_food')
+STOPWORDS = {'a', 'an', 'and', 'as', 'by', 'for', 'from', 'in', 'of', 'or', 'the', 'to', 'with'}
+WORD_PATTERN = re.compile(r'[a-z0-9]+(?:\.[0-9]+)?')
+SIGNATURE_CHUNK = 50000
+BUILD_BATCH_SIZE = 10000
+SEED = 0
+
+
+def description_words(description):
+    """Normalized word set of a description"""
+    words = set()
+    for word in WORD_PATTERN.findall((description or '').lower()):
+        if word in STOPWORDS:
+            continue
+        if len(word) > 3 and word.endswith('s') and not word.endswith('ss'):
+            word = word[:-1]
+        words.add(word)
+    return words
+
+
+def hash_functions(num_hashes, seed=SEED):
+    """Multiply-shift hash parameters: odd multipliers and offsets, uint64"""
+    rng = np.random.default_rng(seed)
+    multipliers = rng.integers(1, 2 ** 63, num_hashes, dtype=np.uint64) * np.uint64(2) + np.uint64(1)
+    offsets = rng.integers(0, 2 ** 63, num_hashes, dtype=np.uint64)
+    return multipliers, offsets
+
+
+def signatures(word_sets, num_hashes=NUM_BANDS * BAND_ROWS, seed=SEED):
+    """uint32 [len(word_sets), num_hashes] MinHash signatures; every set must be non-empty"""
+    vocabulary = {}
+    ids = [vocabulary.setdefault(word, len(vocabulary)) for words in word_sets for word in words]
+    lengths = np.fromiter((len(words) for words in word_sets), dtype=np.int64, count=len(word_sets))
+    starts = np.concatenate([[0], np.cumsum(lengths)[:-1]]) if len(lengths) else lengths
+    ids = np.asarray(ids, dtype=np.int64)
+
+    word_values = np.fromiter(
+        (zlib.crc32(word.encode()) for word in vocabulary), dtype=np.uint64, count=len(vocabulary)
+    )
+    multipliers, offsets = hash_functions(num_hashes, seed)
+    word_hashes = ((word_values[:, None] * multipliers + offsets) >> np.uint64(32)).astype(np.uint32)
+
+    result = np.empty((len(word_sets), num_hashes), dtype=np.uint32)
+    for chunk in range(0, len(word_sets), SIGNATURE_CHUNK):
+        chunk_starts = starts[chunk:chunk + SIGNATURE_CHUNK]
+        end = starts[chunk + SIGNATURE_CHUNK] if chunk + SIGNATURE_CHUNK < len(starts) else len(ids)
+        result[chunk:chunk + SIGNATURE_CHUNK] = np.minimum.reduceat(
+            word_hashes[ids[chunk_starts[0]:end]], chunk_starts - chunk_starts[0], axis=0
+        )
+    return result
+
+
+def band_keys(signature, band):
+    """uint64 bucket key of each signature in one band"""
+    columns = signature[:, band * BAND_ROWS:(band + 1) * BAND_ROWS].astype(np.uint64)
+    key = np.zeros(len(signature), dtype=np.uint64)
+    for column in columns.T:
+        key = key * np.uint64(0x100000001B3) ^ column
+    return key
+
+
+def candidate_pairs(signature, order_values):
+    """(a, b) row pairs that share a bucket and are adjacent in `order_values` order within it"""
+    pairs = []
+    for band in range(NUM_BANDS):
+        key = band_keys(signature, band)
+        order = np.lexsort((order_values, key))
+        same = key[order[1:]] == key[order[:-1]]
+        pairs.append(np.stack([order[:-1][same], order[1:][same]], axis=1))
+    pairs = np.concatenate(pairs) if pairs else np.zeros((0, 2), dtype=np.int64)
+    pairs.sort(axis=1)
+    return np.unique(pairs, axis=0)
+
+
+def verify_pairs(pairs, signature, nutrient_profiles):
+    """Mask of the candidate pairs that are near-duplicates"""
+    keep = np.zeros(len(pairs), dtype=bool)
+    for chunk in range(0, len(pairs), SIGNATURE_CHUNK):
+        a, b = pairs[chunk:chunk + SIGNATURE_CHUNK].T
+        similar = (signature[a] == signature[b]).mean(axis=1) >= MIN_SIMILARITY
+        # NaN (a nutrient one of the foods lacks) compares as not different
+        different = np.abs(nutrient_profiles[a] - nutrient_profiles[b]) > MAX_NUTRIENT_DIFF
+        keep[chunk:chunk + SIGNATURE_CHUNK] = similar & ~different.any(axis=1)
+    return keep
+
+
+def components(n, pairs):
+    """Connected component label (the smallest member row) of each of n rows"""
+    labels = np.arange(n)
+    if not len(pairs):
+        return labels
+    a, b = pairs.T
+    while True:
+        linked = np.minimum(labels[a], labels[b])
+        updated = labels.copy()
+        np.minimum.at(updated, a, linked)
+        np.minimum.at(updated, b, linked)
+        updated = updated[updated]
+        if np.array_equal(updated, labels):
+            return labels
+        labels = updated
+
+
+def group_arrays(fdc_ids, descriptions, data_types, values):
+    """(group fdc_id, group size) per food for raw [n, len(FEATURES)] nutrient values"""
+    n = len(fdc_ids)
+    word_sets = [description_words(description) for description in descriptions]
+    has_words = np.fromiter((bool(words) for words in word_sets), dtype=bool, count=n)
+    rows = np.flatnonzero(has_words)
+
+    nutrient_profiles = profiles(values)
+    nutrient_profiles[np.isnan(values)] = np.nan
+    signature = signatures([word_sets[row] for row in rows])
+    calories = nutrient_profiles[rows, FEATURES.index('calories')]
+    pairs = candidate_pairs(signature, np.nan_to_num(calories, nan=np.inf))
+    pairs = pairs[verify_pairs(pairs, signature, nutrient_profiles[rows])]
+    labels = np.arange(n)
+    labels[rows] = rows[components(len(rows), pairs)]
+
+    preference = {data_type: rank for rank, data_type in enumerate(DATA_TYPE_PREFERENCE)}
+    ranks = np.array([preference.get(data_type, len(preference)) for data_type in data_types], dtype=np.int64)
+    order = np.lexsort((fdc_ids, ranks, labels))
+    first = np.ones(n, dtype=bool)
+    first[1:] = labels[order[1:]] != labels[order[:-1]]
+    canonical = np.empty(n, dtype=np.int64)
+    canonical[labels[order[first]]] = fdc_ids[order[first]]
+    sizes = np.bincount(labels, minlength=n)
+    return canonical[labels], sizes[labels]
+
+
+def build_groups(version, data_dir=None):
+    """Rebuild FoodGroup from descriptions and the version's nutrient matrix; returns (foods, groups)"""
+    if np is None:
+        raise RuntimeError('NumPy is required to build food groups')
+    foods = list(Food.objects.order_by('fdc_id').values_list('fdc_id', 'description', 'data_type'))
+    fdc_ids = np.array([row[0] for row in foods], dtype=np.int64)
+    nutrient_matrix = matrix.NutrientMatrix(matrix.files.path(version, data_dir), version)
+    values = nutrient_matrix.select(fdc_ids, FEATURE_IDS)
+    group_ids, sizes = group_arrays(
+        fdc_ids, [row[1] for row in foods], [row[2] for row in foods], values
+    )
+    del foods
+
+    grouped = np.flatnonzero(sizes > 1)
+    with transaction.atomic():
+        FoodGroup.objects.all().delete()
+        for start in range(0, len(grouped), BUILD_BATCH_SIZE):
+            batch = grouped[start:start + BUILD_BATCH_SIZE]
+            FoodGroup.objects.bulk_create([
+                FoodGroup(food_id=fdc_id, group_id=group_id, group_size=size)
+                for fdc_id, group_id, size in zip(
+                    fdc_ids[batch].tolist(), group_ids[batch].tolist(), sizes[batch].tolist()
+                )
+            ])
+    with connection.cursor() as cursor:
+        cursor.execute(f'ANALYZE {FoodGroup._meta.db_table}')
+    return len(grouped), len(np.unique(group_ids[grouped]))
+
+
+def collapse_groups(foods):
+    """Keep the first food of each group in a Food queryset's current order.
+
+    Rows gain `group_id` (the canonical fdc_id, or the food's own) and
+    `group_matches` (how many foods of the group matched).
+    """
+    group = Coalesce(F('food_group__group_id'), F('fdc_id'))
+    ordering = list(foods.query.order_by) or ['fdc_id']
+    return foods.annotate(
+        group_id=group,
+        group_matches=Window(Count('fdc_id'), partition_by=[group]),
+        group_position=Window(RowNumber(), partition_by=[group], order_by=ordering),
+    ).filter(group_position=1)
@@ -0,0 +1,225 @@
+"""
+Ingredient and allergen index over BrandedFood.ingredients.
+
+`rebuild_ingredient_index()` parses every branded food's ingredient list at
+the end of each import into a FoodIngredients row:
+
+    tokens     every 1- to MAX_NGRAM-word run of each ingredient, normalized
+               ("Enriched Wheat Flour (Niacin)" -> enriched, wheat, flour,
+               enriched wheat, wheat flour, enriched wheat flour, niacin)
+    allergens  ALLERGENS keys whose terms appear in some ingredient, plus
+               "added_sugar" for sweeteners
+
+Ingredients are split on commas, brackets, colons, semicolons, "and" and
+"or". Words are lowercased and naively singularized, and filler such as
+"contains 2% or less of" is dropped, as are "<x>-free" / "no <x>" claims.
+
+Search filters on the GIN-indexed arrays:
+
+    ingredients=peanut,cocoa butter   contains every listed ingredient
+    exclude_ingredients=palm oil      contains none of them
+    allergens=peanut                  flagged with every listed allergen
+    free_of=milk,gluten,added_sugar   flagged with none of them
+
+Ingredient filter terms are normalized like the tokens and match a run of
+words within one ingredient. Foods without an ingredient list (every
+non-branded food) never match these filters: an unknown list is not "free
+of" anything.
+"""
+
+import re
+
+from django.db import connection, transaction
+from rest_framework.exceptions import ValidationError
+
+from .models import BrandedFood, FoodIngredients
+
+MAX_NGRAM = 3
+BUILD_BATCH_SIZE = 5000
+
+SPLIT_PATTERN = re.compile(r'[,;:()\[\]{}*]|\.(?!\d)|\b(?:and|or)\b|&', re.IGNORECASE)
+FREE_PATTERN = re.compile(r'\b[a-z]+[\s-]free\b|\b(?:no|non)[\s-]+[a-z]+')
+PERCENT_PATTERN = re.compile(r'\d+(?:\.\d+)?\s*%')
+WORD_PATTERN = re.compile(r'[a-z]+')
+FILLER_WORDS = {
+    'a', 'added', 'an', 'as', 'contain', 'contains', 'each', 'following', 'for', 'from', 'ingredient',
+    'ingredients', 'less', 'more', 'of', 'than', 'the', 'to', 'with',
+}
+
+# Allergen -> (ingredient terms, ingredients that contain a term but not the allergen)
+ALLERGENS = {
+    'milk': (
+        ('milk', 'whey', 'casein', 'caseinate', 'lactose', 'butter', 'buttermilk', 'cream', 'cheese',
+         'yogurt', 'ghee', 'curd', 'lactalbumin', 'milkfat', 'butterfat'),
+        ('cocoa butter', 'peanut butter', 'nut butter', 'shea butter', 'coconut milk', 'coconut cream',
+         'almond milk', 'soy milk', 'oat milk', 'rice milk', 'cream of tartar', 'cashew milk'),
+    ),
+    'egg': (('egg', 'albumen', 'albumin', 'yolk', 'ovalbumin', 'lysozyme', 'meringue', 'mayonnaise'), ()),
+    'fish': (
+        ('fish', 'anchovy', 'cod', 'salmon', 'tuna', 'tilapia', 'pollock', 'haddock', 'sardine',
+         'mackerel', 'herring', 'trout', 'catfish', 'halibut', 'swordfish', 'flounder'),
+        (),
+    ),
+    'shellfish': (
+        ('shellfish', 'shrimp', 'crab', 'lobster', 'prawn', 'crayfish', 'crawfish', 'clam', 'oyster',
+         'scallop', 'mussel'),
+        ('oyster mushroom', 'crab apple'),
+    ),
+    'tree_nut': (
+        ('tree nut', 'almond', 'cashew', 'walnut', 'pecan', 'hazelnut', 'pistachio', 'macadamia',
+         'brazil nut', 'filbert', 'pine nut', 'chestnut', 'praline'),
+        ('water chestnut',),
+    ),
+    'peanut': (('peanut', 'groundnut', 'arachis'), ()),
+    'wheat': (
+        ('wheat', 'durum', 'semolina', 'spelt', 'farina', 'einkorn', 'emmer', 'kamut', 'bulgur',
+         'couscous', 'seitan'),
+        (),
+    ),
+    'gluten': (
+        ('gluten', 'wheat', 'durum', 'semolina', 'spelt', 'farina', 'einkorn', 'emmer', 'kamut', 'bulgur',
+         'couscous', 'seitan', 'barley', 'rye', 'malt', 'triticale'),
+        (),
+    ),
+    'soy': (('soy', 'soya', 'soybean', 'tofu', 'edamame', 'miso', 'tempeh'), ()),
+    'sesame': (('sesame', 'tahini'), ()),
+    'added_sugar': (
+        ('sugar', 'syrup', 'dextrose', 'sucrose', 'fructose', 'glucose', 'maltose', 'honey', 'molasses',
+         'agave', 'evaporated cane juice', 'invert sugar'),
+        ('sugar alcohol',),
+    ),
+}
+
+
+def singular(word):
+    if len(word) <= 3 or word.endswith(('ss', 'us', 'is')):
+        return word
+    if word.endswith('ies') and len(word) > 4:
+        return f'{word[:-3]}y'
+    if word.endswith(('oes', 'ches', 'shes', 'xes')):
+        return word[:-2]
+    if word.endswith('s'):
+        return word[:-1]
+    return word
+
+
+def normalize_words(text):
+    """Normalized words of one ingredient"""
+    text = FREE_PATTERN.sub(' ', PERCENT_PATTERN.sub(' ', text.lower()))
+    return [singular(word) for word in WORD_PATTERN.findall(text) if word not in FILLER_WORDS and len(word) > 1]
+
+
+def ngrams(words, n=MAX_NGRAM):
+    return {' '.join(words[start:start + size]) for size in range(1, n + 1) for start in range(len(words) - size + 1)}
+
+
+def normalize_term(term):
+    """Normalized form of an ingredient term, as matched against the tokens"""
+    return ' '.join(normalize_words(term))
+
+
+# Terms normalized like the tokens they are matched against
+ALLERGEN_TERMS = {
+    allergen: ({normalize_term(term) for term in terms}, {normalize_term(term) for term in exceptions})
+    for allergen, (terms, exceptions) in ALLERGENS.items()
+}
+
+
+def parse_ingredients(text):
+    """(tokens, allergens) for an ingredient list, both sorted"""
+    tokens, allergens = set(), set()
+    for ingredient in SPLIT_PATTERN.split(text or ''):
+        words = normalize_words(ingredient)
+        if not words:
+            continue
+        grams = ngrams(words)
+        tokens |= grams
+        for allergen, (terms, exceptions) in ALLERGEN_TERMS.items():
+            if allergen not in allergens and grams & terms and not (grams & exceptions):
+                allergens.add(allergen)
+    return sorted(tokens), sorted(allergens)
+
+
+def parse_ingredient_filters(query_params):
+    """Canonical `ingredients`, `exclude_ingredients`, `allergens` and `free_of` params, for use in cache keys"""
+    params, errors = {}, {}
+    for key in ('ingredients', 'exclude_ingredients'):
+        terms = set()
+        for term in (query_params.get(key) or '').split(','):
+            if not term.strip():
+                continue
+            normalized = normalize_term(term)
+            if not normalized or len(normalized.split()) > MAX_NGRAM:
+                errors[key] = f'Each ingredient must be 1 to {MAX_NGRAM} words: "{term.strip()}".'
+            terms.add(normalized)
+        params[key] = ','.join(sorted(terms))
+
+    for key in ('allergens', 'free_of'):
+        names = {name.strip().lower() for name in (query_params.get(key) or '').split(',') if name.strip()}
+        unknown = sorted(names - set(ALLERGENS))
+        if unknown:
+            errors[key] = f'Unknown allergen(s): {", ".join(unknown)}. One of: {", ".join(ALLERGENS)}.'
+        params[key] = ','.join(sorted(names))
+
+    if errors:
+        raise ValidationError(errors)
+    return params
+
+
+def ingredient_filters(params):
+    """{param: [values]} for the ingredient filters set in canonical search params"""
+    return {
+        key: params[key].split(',')
+        for key in ('ingredients', 'exclude_ingredients', 'allergens', 'free_of') if params.get(key)
+    }
+
+
+def apply_ingredient_filters(foods, params):
+    """Restrict a Food queryset to the ingredient filters in `params`.
+
+    Includes are an array containment (@>) and excludes an anti-join against
+    an overlap (&&) match, so both read the GIN indexes.
+    """
+    filters = ingredient_filters(params)
+    if not filters:
+        return foods
+    indexed = FoodIngredients.objects.all()
+    if 'ingredients' in filters:
+        indexed = indexed.filter(tokens__contains=filters['ingredients'])
+    if 'allergens' in filters:
+        indexed = indexed.filter(allergens__contains=filters['allergens'])
+    foods = foods.filter(fdc_id__in=indexed.values('food_id'))
+
+    if 'exclude_ingredients' in filters:
+        foods = foods.exclude(fdc_id__in=FoodIngredients.objects.filter(
+            tokens__overlap=filters['exclude_ingredients']
+        ).values('food_id'))
+    if 'free_of' in filters:
+        foods = foods.exclude(fdc_id__in=FoodIngredients.objects.filter(
+            allergens__overlap=filters['free_of']
+        ).values('food_id'))
+    return foods
+
+
+def rebuild_ingredient_index():
+    """Reparse every branded food's ingredient list; returns the row count"""
+    table = FoodIngredients._meta.db_table
+    count = 0
+    with transaction.atomic():
+        FoodIngredients.objects.all().delete()
+        rows = []
+        branded = BrandedFood.objects.exclude(ingredients__isnull=True).exclude(ingredients='')
+        for fdc_id, text in branded.values_list('fdc_id', 'ingredients').iterator(chunk_size=BUILD_BATCH_SIZE):
+            tokens, allergens = parse_ingredients(text)
+            if not tokens:
+                continue
+            rows.append(FoodIngredients(food_id=fdc_id, tokens=tokens, allergens=allergens))
+            if len(rows) >= BUILD_BATCH_SIZE:
+                FoodIngredients.objects.bulk_create(rows)
+                count += len(rows)
+                rows = []
+        FoodIngredients.objects.bulk_create(rows)
+        count += len(rows)
+    with connection.cursor() as cursor:
+        cursor.execute(f'ANALYZE {table}')
+    return count
@@ -0,0 +1,152 @@
+"""
+Links between Child Nutrition foods and FoodData Central foods.
+
+`rebuild_cn_links()` resolves every CNFood to Food rows at the end of each
+import with three set-based INSERT ... SELECT statements, in order of
+confidence. A CN food only gets a weaker kind of link if it has none of the
+stronger ones:
+
+1. fdc_id       CNFood.fdc_id names an existing Food.
+2. gtin         CNFood.gtin equals a BrandedFood.gtin_upc once both are
+                normalized to digits without leading zeros, so GTIN-14,
+                EAN-13 and UPC-A spellings of one code match.
+3. description  The Food whose description best matches the CN descriptor:
+                candidates must contain every word of the descriptor (a
+                full-text match on the indexed search_vector) and are scored
+                by the Jaccard similarity of the two lexeme sets; the best
+                one is kept if it scores at least MIN_DESCRIPTION_SCORE.
+
+`unified_search()` ranks USDA and CN foods in one UNION ALL query, and the
+results carry the ids of the linked foods on the other side.
+"""
+
+from django.contrib.postgres.search import SearchQuery, SearchRank
+from django.db import connection, transaction
+from django.db.models import CharField, F, FloatField, Q, Value
+
+from .models import BrandedFood, CNFood, CNFoodLink, Food
+
+MIN_DESCRIPTION_SCORE = 0.6
+
+
+def normalized_gtin_sql(column):
+    """SQL for a GTIN column reduced to digits without leading zeros.
+
+    Migration 0015 indexes this expression on branded_food.gtin_upc; change both together.
+    """
+    return f"LTRIM(REGEXP_REPLACE(COALESCE({column}, ''), '[^0-9]', '', 'g'), '0')"
+
+
+def normalize_gtin(value):
+    """Python counterpart of normalized_gtin_sql()"""
+    # ASCII digits only, like [^0-9]; str.isdigit() also accepts e.g. '²'
+    return ''.join(char for char in (value or '') if '0' <= char <= '9').lstrip('0')
+
+
+def rebuild_cn_links():
+    """Recompute CNFoodLink for every CN food; returns {method: link count}"""
+    link_table = CNFoodLink._meta.db_table
+    cn_table = CNFood._meta.db_table
+    food_table = Food._meta.db_table
+    branded_table = BrandedFood._meta.db_table
+    unlinked = f'NOT EXISTS (SELECT 1 FROM {link_table} l WHERE l.cn_code = cn.cn_code)'
+    food_lexemes = 'tsvector_to_array(f.search_vector)'
+    cn_lexemes = 'tsvector_to_array(to_tsvector(cn.descriptor))'
+
+    statements = {
+        CNFoodLink.METHOD_FDC_ID: (
+            f'INSERT INTO {link_table} (cn_code, fdc_id, method, score) '
+            f'SELECT cn.cn_code, f.fdc_id, %s, 1 '
+            f'FROM {cn_table} cn JOIN {food_table} f ON f.fdc_id = cn.fdc_id'
+        ),
+        CNFoodLink.METHOD_GTIN: (
+            f'INSERT INTO {link_table} (cn_code, fdc_id, method, score) '
+            f'SELECT DISTINCT cn.cn_code, b.fdc_id, %s, 1 '
+            f'FROM {cn_table} cn JOIN {branded_table} b '
+            f'ON {normalized_gtin_sql("b.gtin_upc")} = {normalized_gtin_sql("cn.gtin")} '
+            f'JOIN {food_table} f ON f.fdc_id = b.fdc_id '
+            f"WHERE {normalized_gtin_sql('cn.gtin')} <> '' AND {unlinked}"
+        ),
+        CNFoodLink.METHOD_DESCRIPTION: (
+            f'INSERT INTO {link_table} (cn_code, fdc_id, method, score) '
+            f'SELECT cn.cn_code, m.fdc_id, %s, m.score '
+            f'FROM {cn_table} cn CROSS JOIN LATERAL ('
+            f'SELECT f.fdc_id, '
+            f'CARDINALITY(ARRAY(SELECT unnest({food_lexemes}) INTERSECT SELECT unnest({cn_lexemes})))::float '
+            f'/ GREATEST(CARDINALITY(ARRAY(SELECT unnest({food_lexemes}) UNION SELECT unnest({cn_lexemes}))), 1) '
+            f'AS score '
+            f'FROM {food_table} f '
+            f'WHERE f.search_vector @@ plainto_tsquery(cn.descriptor) '
+            f'ORDER BY score DESC, f.fdc_id LIMIT 1'
+            f') m '
+            f"WHERE numnode(plainto_tsquery(cn.descriptor)) > 0 AND {unlinked} AND m.score >= %s"
+        ),
+    }
+    params = {CNFoodLink.METHOD_DESCRIPTION: [MIN_DESCRIPTION_SCORE]}
+
+    counts = {}
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(f'DELETE FROM {link_table}')
+        for method, sql in statements.items():
+            cursor.execute(sql, [method, *params.get(method, [])])
+            counts[method] = cursor.rowcount
+    with connection.cursor() as cursor:
+        cursor.execute(f'ANALYZE {link_table}')
+    return counts
+
+
+def unified_search(query):
+    """USDA and CN foods matching a text query, best first, as one queryset of dicts.
+
+    Rows have `source` ('usda' or 'cn'), `id` (fdc_id or cn_code),
+    `name` (description or descriptor), `category` (USDA category id or CN
+    category code) and `rank`.
+    """
+    if len(query) > 2:
+        search_query = SearchQuery(query)
+        usda = Food.objects.filter(search_vector=search_query).annotate(
+            rank=SearchRank('search_vector', search_query)
+        )
+        cn = CNFood.objects.filter(search_vector=search_query).annotate(
+            rank=SearchRank('search_vector', search_query)
+        )
+    else:
+        # Short queries: substring match, unranked
+        no_rank = Value(0.0, output_field=FloatField())
+        usda = Food.objects.filter(description__icontains=query).annotate(rank=no_rank)
+        cn = CNFood.objects.filter(
+            Q(descriptor__icontains=query) | Q(abbreviated_descriptor__icontains=query)
+        ).annotate(rank=no_rank)
+
+    usda = usda.annotate(
+        source=Value('usda', output_field=CharField()),
+        id=F('fdc_id'),
+        name=F('description'),
+        category=F('food_category_id'),
+    ).values('source', 'id', 'name', 'category', 'rank')
+    cn = cn.annotate(
+        source=Value('cn', output_field=CharField()),
+        id=F('cn_code'),
+        name=F('descriptor'),
+        category=F('food_category_id'),
+    ).values('source', 'id', 'name', 'category', 'rank')
+    return usda.union(cn, all=True).order_by('-rank', 'name', 'source', 'id')
+
+
+def linked_ids(rows):
+    """Add `linked` to unified search rows: the ids of the linked foods in the other dataset"""
+    fdc_ids = [row['id'] for row in rows if row['source'] == 'usda']
+    cn_codes = [row['id'] for row in rows if row['source'] == 'cn']
+    links = {('usda', fdc_id): [] for fdc_id in fdc_ids}
+    links.update({('cn', cn_code): [] for cn_code in cn_codes})
+    if rows:
+        for cn_code, fdc_id in CNFoodLink.objects.filter(
+            Q(food_id__in=fdc_ids) | Q(cn_food_id__in=cn_codes)
+        ).order_by('cn_food_id', 'food_id').values_list('cn_food_id', 'food_id'):
+            if ('usda', fdc_id) in links:
+                links[('usda', fdc_id)].append(cn_code)
+            if ('cn', cn_code) in links:
+                links[('cn', cn_code)].append(fdc_id)
+    for row in rows:
+        row['linked'] = links[(row['source'], row['id'])]
+    return rows
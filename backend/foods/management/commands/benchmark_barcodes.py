@@ -0,0 +1,104 @@
+import multiprocessing
+import os
+import random
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from foods import barcodes
+from foods.models import BrandedFood, DatasetRelease
+from foods.views import BarcodeSearchView
+
+# Opened before forking, so the pool processes share its mapped pages
+_index = None
+
+
+def _timed_lookups(codes):
+    """Seconds taken by index lookups of codes"""
+    start = time.perf_counter()
+    for code in codes:
+        _index.lookup(code)
+    return time.perf_counter() - start
+
+
+class Command(BaseCommand):
+    help = 'Measure barcode lookup throughput of the GTIN index, per core and across processes, against the database'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--dataset-version',
+            type=int,
+            help='Dataset version of the index to benchmark (default: latest completed import)'
+        )
+        parser.add_argument(
+            '--lookups',
+            type=int,
+            default=200000,
+            help='Index lookups per process'
+        )
+        parser.add_argument(
+            '--db-lookups',
+            type=int,
+            default=500,
+            help='Database lookups, for comparison'
+        )
+        parser.add_argument(
+            '--processes',
+            type=int,
+            nargs='+',
+            default=[1, multiprocessing.cpu_count()],
+            help='Process counts to run the index lookups with'
+        )
+        parser.add_argument(
+            '--miss-rate',
+            type=float,
+            default=0.1,
+            help='Fraction of lookups for codes that are not in the index'
+        )
+
+    def handle(self, *args, **options):
+        global _index
+        version = options['dataset_version']
+        if version is None:
+            version = DatasetRelease.current_version()
+        path = barcodes.files.path(version)
+        if not os.path.isdir(path):
+            raise CommandError(f'No GTIN index has been built for version {version}; run build_barcode_index')
+        barcode_index = _index = barcodes.BarcodeIndex.load(path, version)
+        gtins = list(
+            BrandedFood.objects.exclude(gtin_upc__isnull=True).exclude(gtin_upc='')
+            .values_list('gtin_upc', flat=True)[:100000]
+        )
+        if not gtins:
+            raise CommandError('There are no branded foods with a GTIN')
+
+        rng = random.Random(0)
+        codes = [
+            str(rng.randrange(10 ** 13)) if rng.random() < options['miss_rate'] else rng.choice(gtins)
+            for _ in range(options['lookups'])
+        ]
+        self.stdout.write(f'{len(barcode_index)} GTINs indexed, {options["miss_rate"]:.0%} of lookups miss')
+
+        header = f"{'path':<22}{'lookups':>10}{'per sec':>12}{'per core':>12}{'us each':>10}"
+        self.stdout.write(header)
+        self.stdout.write('-' * len(header))
+
+        db_codes = codes[:options['db_lookups']]
+        start = time.perf_counter()
+        for code in db_codes:
+            BarcodeSearchView.lookup_database(code)
+        self.report('database', len(db_codes), time.perf_counter() - start, 1)
+
+        context = multiprocessing.get_context('fork')
+        for processes in options['processes']:
+            if processes == 1:
+                elapsed = _timed_lookups(codes)
+            else:
+                with context.Pool(processes) as pool:
+                    elapsed = max(pool.map(_timed_lookups, [codes] * processes))
+            self.report(f'index x{processes}', len(codes) * processes, elapsed, processes)
+
+    def report(self, name, lookups, elapsed, processes):
+        rate = lookups / elapsed if elapsed else float('inf')
+        self.stdout.write(
+            f'{name:<22}{lookups:>10}{rate:>12.0f}{rate / processes:>12.0f}{elapsed / lookups * processes * 1e6:>10.2f}'
+        )
@@ -0,0 +1,84 @@
+import gzip
+import time
+
+from django.core.management.base import BaseCommand
+from django.test import Client
+from rest_framework.renderers import JSONRenderer
+from foods.models import Food, FoodNutrient, CNFood
+from foods.serializers import CNFoodDetailSerializer
+from nutriplan_django.middleware import brotli
+from nutriplan_django.renderers import FastJSONRenderer, orjson
+
+
+class Command(BaseCommand):
+    help = 'Measure rendering CPU and compressed size of large API payloads'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--iterations',
+            type=int,
+            default=200,
+            help='Timed repetitions per payload'
+        )
+        parser.add_argument(
+            '--query',
+            type=str,
+            default='milk',
+            help='Search query used for the search payload'
+        )
+
+    def handle(self, *args, **options):
+        iterations = options['iterations']
+        if orjson is None:
+            self.stdout.write(self.style.WARNING('orjson is not installed; the fast renderer falls back to json'))
+        if brotli is None:
+            self.stdout.write(self.style.WARNING('brotli is not installed; only gzip is measured'))
+
+        header = f"{'payload':<22}{'bytes':>10}{'gzip':>10}{'br':>10}{'json ms':>10}{'orjson ms':>11}{'gzip ms':>10}{'br ms':>9}"
+        self.stdout.write(header)
+        self.stdout.write('-' * len(header))
+        for name, data in self.payloads(options['query']):
+            self.report(name, data, iterations)
+
+    def payloads(self, query):
+        """Representative payloads, taken from the live endpoints where they exist"""
+        client = Client()
+        food_id = (
+            FoodNutrient.objects.values_list('fdc_id', flat=True).order_by('fdc_id').first()
+        )
+        if food_id is not None:
+            yield 'food nutrients', client.get(f'/api/foods/foods/{food_id}/nutrients/').data
+        yield 'search (100 rows)', client.get('/api/foods/search/', {'q': query, 'page_size': 100}).data
+        if Food.objects.exists():
+            yield 'food list', client.get('/api/foods/foods/').data
+
+        cn_food = CNFood.objects.prefetch_related('nutrient_values__nutrient', 'weights').first()
+        if cn_food is not None:
+            yield 'CN food detail', CNFoodDetailSerializer(cn_food).data
+
+    def report(self, name, data, iterations):
+        stock, fast = JSONRenderer(), FastJSONRenderer()
+        body = fast.render(data)
+
+        json_ms = self.time_ms(lambda: stock.render(data), iterations)
+        orjson_ms = self.time_ms(lambda: fast.render(data), iterations)
+        gzip_body = gzip.compress(body, compresslevel=6)
+        gzip_ms = self.time_ms(lambda: gzip.compress(body, compresslevel=6), iterations)
+        if brotli is not None:
+            br_size = str(len(brotli.compress(body, quality=4)))
+            br_ms = f'{self.time_ms(lambda: brotli.compress(body, quality=4), iterations):.3f}'
+        else:
+            br_size = br_ms = '-'
+
+        self.stdout.write(
+            f'{name:<22}{len(body):>10}{len(gzip_body):>10}{br_size:>10}'
+            f'{json_ms:>10.3f}{orjson_ms:>11.3f}{gzip_ms:>10.3f}{br_ms:>9}'
+        )
+
+    @staticmethod
+    def time_ms(func, iterations):
+        """Mean wall time of func in milliseconds"""
+        start = time.perf_counter()
+        for _ in range(iterations):
+            func()
+        return (time.perf_counter() - start) * 1000 / iterations
@@ -0,0 +1,98 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from foods import matrix, similarity
+
+
+class Command(BaseCommand):
+    help = 'Measure recall and latency of the similar-foods index against exact search'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--queries',
+            type=int,
+            default=200,
+            help='Number of random query foods'
+        )
+        parser.add_argument(
+            '-k',
+            type=int,
+            default=similarity.DEFAULT_K,
+            help='Neighbours per query'
+        )
+        parser.add_argument(
+            '--nprobe',
+            type=int,
+            nargs='+',
+            default=[1, 4, similarity.NPROBE, 16, 32],
+            help='Probe counts to compare'
+        )
+        parser.add_argument(
+            '--synthetic',
+            type=int,
+            metavar='N',
+            help='Benchmark an in-memory index over N synthetic foods instead of the built index'
+        )
+
+    def handle(self, *args, **options):
+        if not matrix.available():
+            raise CommandError('NumPy is required for the similarity index')
+        np = matrix.np
+
+        if options['synthetic']:
+            index = self.synthetic_index(options['synthetic'])
+        else:
+            index = similarity.get_index()
+            if index is None:
+                raise CommandError('No similarity index has been built; run build_similarity_index')
+        if not len(index):
+            raise CommandError('The similarity index is empty')
+
+        rng = np.random.default_rng(0)
+        queries = index.fdc_ids[rng.choice(len(index), min(options['queries'], len(index)), replace=False)]
+        k = options['k']
+        self.stdout.write(f'{len(index)} foods, {len(index.centroids)} lists, {len(queries)} queries, k={k}')
+
+        exact, exact_times = {}, []
+        for fdc_id in queries:
+            start = time.perf_counter()
+            exact[fdc_id] = {neighbour for neighbour, _ in index.query(fdc_id, k, exact=True)}
+            exact_times.append(time.perf_counter() - start)
+
+        header = f"{'search':<14}{'recall@k':>10}{'p50 ms':>10}{'p95 ms':>10}"
+        self.stdout.write(header)
+        self.stdout.write('-' * len(header))
+        self.report('exact', 1.0, exact_times)
+        for nprobe in options['nprobe']:
+            hits, times = 0, []
+            for fdc_id in queries:
+                start = time.perf_counter()
+                found = index.query(fdc_id, k, nprobe=nprobe)
+                times.append(time.perf_counter() - start)
+                hits += len(exact[fdc_id] & {neighbour for neighbour, _ in found})
+            total = sum(len(neighbours) for neighbours in exact.values())
+            self.report(f'nprobe={nprobe}', hits / total if total else 1.0, times)
+
+    def report(self, name, recall, times):
+        np = matrix.np
+        p50, p95 = np.percentile(np.asarray(times) * 1000, [50, 95])
+        self.stdout.write(f'{name:<14}{recall:>10.3f}{p50:>10.2f}{p95:>10.2f}')
+
+    def synthetic_index(self, n):
+        """Index over clustered, skewed random profiles shaped like nutrient data"""
+        np = matrix.np
+        rng = np.random.default_rng(0)
+        d = len(similarity.FEATURES)
+        centers = rng.normal(0, 1.5, size=(200, d))
+        values = np.expm1(np.clip(
+            centers[rng.integers(0, len(centers), n)] + rng.normal(0, 0.5, size=(n, d)), 0, 8
+        )).astype(np.float32)
+        values[rng.random((n, d)) < 0.2] = np.nan
+
+        start = time.perf_counter()
+        arrays = similarity.build_arrays(
+            np.arange(1, n + 1, dtype=np.int64), values,
+            rng.integers(0, 30, n), np.full(n, 'synthetic'),
+        )
+        self.stdout.write(f'Built synthetic index in {time.perf_counter() - start:.1f}s')
+        return similarity.SimilarityIndex(arrays)
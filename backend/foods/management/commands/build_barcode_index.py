@@ -0,0 +1,25 @@
+import time
+
+from django.core.management.base import BaseCommand
+from foods import barcodes
+from foods.models import DatasetRelease
+
+
+class Command(BaseCommand):
+    help = 'Build the memory-mapped GTIN index that answers barcode lookups'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--dataset-version',
+            type=int,
+            help='Dataset version to build the index for (default: latest completed import)'
+        )
+
+    def handle(self, *args, **options):
+        version = options['dataset_version']
+        if version is None:
+            version = DatasetRelease.current_version()
+
+        start = time.perf_counter()
+        count = barcodes.build_barcodes(version)
+        self.stdout.write(f'Indexed {count} GTINs in {time.perf_counter() - start:.1f}s')
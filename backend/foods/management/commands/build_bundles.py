@@ -0,0 +1,35 @@
+import time
+
+from django.core.management.base import BaseCommand
+from foods import bundles
+from foods.models import DatasetRelease
+
+
+class Command(BaseCommand):
+    help = 'Build the compressed offline bundles: the most popular foods and one per food category'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--dataset-version',
+            type=int,
+            help='Dataset version to build the bundles for (default: latest completed import)'
+        )
+        parser.add_argument(
+            '--top',
+            type=int,
+            default=bundles.DEFAULT_TOP,
+            help='Number of foods in the top bundle'
+        )
+
+    def handle(self, *args, **options):
+        version = options['dataset_version']
+        if version is None:
+            version = DatasetRelease.current_version()
+
+        start = time.perf_counter()
+        manifest = bundles.build_bundles(version, top=options['top'])
+        entries = manifest['bundles'].values()
+        self.stdout.write(
+            f"Built {len(entries)} bundles ({sum(entry['foods'] for entry in entries)} foods, "
+            f"{sum(entry['size'] for entry in entries)} bytes) in {time.perf_counter() - start:.1f}s"
+        )
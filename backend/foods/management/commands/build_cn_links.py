@@ -0,0 +1,14 @@
+import time
+
+from django.core.management.base import BaseCommand
+from foods.linking import rebuild_cn_links
+
+
+class Command(BaseCommand):
+    help = 'Link Child Nutrition foods to FoodData Central foods by fdc_id, GTIN and description'
+
+    def handle(self, *args, **options):
+        start = time.perf_counter()
+        counts = rebuild_cn_links()
+        summary = ', '.join(f'{count} by {method}' for method, count in counts.items())
+        self.stdout.write(f'Rebuilt CN -> FDC links ({summary}) in {time.perf_counter() - start:.1f}s')
@@ -0,0 +1,37 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from foods import facets, matrix
+from foods.models import DatasetRelease
+
+
+class Command(BaseCommand):
+    help = 'Build the per-food facet value codes used for search facet counts'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--dataset-version',
+            type=int,
+            help='Dataset version to build for (default: latest completed import)'
+        )
+        parser.add_argument(
+            '--keep',
+            type=int,
+            default=facets.KEEP_VERSIONS,
+            help='Number of index versions to keep on disk'
+        )
+
+    def handle(self, *args, **options):
+        if not matrix.available():
+            raise CommandError('NumPy is required to build the facet index')
+
+        version = options['dataset_version']
+        if version is None:
+            version = DatasetRelease.current_version()
+
+        start = time.perf_counter()
+        n_foods, n_values = facets.build_facet_index(version, keep=options['keep'])
+        self.stdout.write(
+            f'Built facet index v{version}: {n_foods} foods, {n_values} facet values '
+            f'in {time.perf_counter() - start:.1f}s'
+        )
@@ -0,0 +1,30 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from foods import grouping, matrix
+from foods.models import DatasetRelease
+
+
+class Command(BaseCommand):
+    help = 'Cluster near-duplicate foods into canonical groups (MinHash LSH over descriptions + nutrients)'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--dataset-version',
+            type=int,
+            help='Dataset version whose nutrient matrix to read (default: latest completed import)'
+        )
+
+    def handle(self, *args, **options):
+        if not matrix.available():
+            raise CommandError('NumPy is required to build food groups')
+
+        version = options['dataset_version']
+        if version is None:
+            version = DatasetRelease.current_version()
+
+        start = time.perf_counter()
+        n_foods, n_groups = grouping.build_groups(version)
+        self.stdout.write(
+            f'Grouped {n_foods} foods into {n_groups} canonical groups in {time.perf_counter() - start:.1f}s'
+        )
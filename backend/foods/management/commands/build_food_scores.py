@@ -0,0 +1,30 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from foods import matrix, scores
+from foods.models import DatasetRelease
+
+
+class Command(BaseCommand):
+    help = 'Compute nutrient-density and health scores for every food from the nutrient matrix'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--dataset-version',
+            type=int,
+            help='Dataset version whose nutrient matrix to read (default: latest completed import)'
+        )
+
+    def handle(self, *args, **options):
+        if not matrix.available():
+            raise CommandError('NumPy is required to compute food scores')
+
+        version = options['dataset_version']
+        if version is None:
+            version = DatasetRelease.current_version()
+
+        start = time.perf_counter()
+        count = scores.build_scores(version)
+        self.stdout.write(
+            f'Scored {count} foods ({len(scores.SCORES)} scores) in {time.perf_counter() - start:.1f}s'
+        )
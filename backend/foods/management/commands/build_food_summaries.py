@@ -0,0 +1,15 @@
+import time
+
+from django.core.management.base import BaseCommand
+from foods.summaries import rebuild_nutrition_summary
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the denormalized per-food nutrient summary used by search filters'
+
+    def handle(self, *args, **options):
+        start = time.perf_counter()
+        count = rebuild_nutrition_summary()
+        self.stdout.write(
+            f'Rebuilt nutrition summary for {count} foods in {time.perf_counter() - start:.1f}s'
+        )
@@ -0,0 +1,15 @@
+import time
+
+from django.core.management.base import BaseCommand
+from foods.ingredients import rebuild_ingredient_index
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the ingredient and allergen index over branded food ingredient lists'
+
+    def handle(self, *args, **options):
+        start = time.perf_counter()
+        count = rebuild_ingredient_index()
+        self.stdout.write(
+            f'Rebuilt ingredient index for {count} foods in {time.perf_counter() - start:.1f}s'
+        )
@@ -0,0 +1,37 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from foods import matrix
+from foods.models import DatasetRelease
+
+
+class Command(BaseCommand):
+    help = 'Export food nutrient values as a memory-mapped foods x nutrients matrix'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--dataset-version',
+            type=int,
+            help='Dataset version to build for (default: latest completed import)'
+        )
+        parser.add_argument(
+            '--keep',
+            type=int,
+            default=matrix.KEEP_VERSIONS,
+            help='Number of matrix versions to keep on disk'
+        )
+
+    def handle(self, *args, **options):
+        if not matrix.available():
+            raise CommandError('NumPy is required to build the nutrient matrix')
+
+        version = options['dataset_version']
+        if version is None:
+            version = DatasetRelease.current_version()
+
+        start = time.perf_counter()
+        n_foods, n_nutrients = matrix.build_matrix(version, keep=options['keep'])
+        self.stdout.write(
+            f'Built nutrient matrix v{version}: {n_foods} foods x {n_nutrients} nutrients '
+            f'in {time.perf_counter() - start:.1f}s'
+        )
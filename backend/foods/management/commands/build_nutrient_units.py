@@ -0,0 +1,16 @@
+import time
+
+from django.core.management.base import BaseCommand
+from foods.units import rebuild_unit_mapping
+
+
+class Command(BaseCommand):
+    help = 'Normalize nutrient units, map CN nutrients to USDA nutrients and store CN values in canonical units'
+
+    def handle(self, *args, **options):
+        start = time.perf_counter()
+        mapped, converted = rebuild_unit_mapping()
+        self.stdout.write(
+            f'Mapped {mapped} CN nutrients and converted {converted} CN values '
+            f'in {time.perf_counter() - start:.1f}s'
+        )
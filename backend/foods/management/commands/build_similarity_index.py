@@ -0,0 +1,45 @@
+import os
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from foods import matrix, similarity
+from foods.models import DatasetRelease
+
+
+class Command(BaseCommand):
+    help = 'Build the similar-foods nearest-neighbour index from the nutrient matrix'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--dataset-version',
+            type=int,
+            help='Dataset version to build for (default: latest completed import)'
+        )
+        parser.add_argument(
+            '--lists',
+            type=int,
+            help='Number of k-means lists (default: square root of the number of foods)'
+        )
+        parser.add_argument(
+            '--keep',
+            type=int,
+            default=similarity.KEEP_VERSIONS,
+            help='Number of index versions to keep on disk'
+        )
+
+    def handle(self, *args, **options):
+        if not matrix.available():
+            raise CommandError('NumPy is required to build the similarity index')
+
+        version = options['dataset_version']
+        if version is None:
+            version = DatasetRelease.current_version()
+        if not os.path.isdir(matrix.files.path(version)):
+            raise CommandError(f'No nutrient matrix for v{version}; run build_nutrient_matrix first')
+
+        start = time.perf_counter()
+        n_foods, n_lists = similarity.build_index(version, keep=options['keep'], nlist=options['lists'])
+        self.stdout.write(
+            f'Built similarity index v{version}: {n_foods} foods in {n_lists} lists '
+            f'in {time.perf_counter() - start:.1f}s'
+        )
@@ -0,0 +1,29 @@
+import time
+
+from django.core.management.base import BaseCommand
+from foods import snapshot
+from foods.models import DatasetRelease
+
+
+class Command(BaseCommand):
+    help = 'Export the read-only SQLite snapshot of foods, portions, branded and CN data for edge nodes'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--dataset-version',
+            type=int,
+            help='Dataset version to build the snapshot for (default: latest completed import)'
+        )
+
+    def handle(self, *args, **options):
+        version = options['dataset_version']
+        if version is None:
+            version = DatasetRelease.current_version()
+
+        start = time.perf_counter()
+        foods, cn_foods = snapshot.build_snapshot(version)
+        path = snapshot.files.path(version)
+        self.stdout.write(
+            f'Built snapshot of {foods} foods and {cn_foods} CN foods at {path} '
+            f'in {time.perf_counter() - start:.1f}s'
+        )
@@ -0,0 +1,37 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from foods import conversions, matrix
+from foods.models import DatasetRelease
+
+
+class Command(BaseCommand):
+    help = 'Build the per-food household measure -> grams conversion table'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--dataset-version',
+            type=int,
+            help='Dataset version to build for (default: latest completed import)'
+        )
+        parser.add_argument(
+            '--keep',
+            type=int,
+            default=conversions.KEEP_VERSIONS,
+            help='Number of table versions to keep on disk'
+        )
+
+    def handle(self, *args, **options):
+        if not matrix.available():
+            raise CommandError('NumPy is required to build the unit conversion table')
+
+        version = options['dataset_version']
+        if version is None:
+            version = DatasetRelease.current_version()
+
+        start = time.perf_counter()
+        n_foods, n_rows = conversions.build_conversions(version, keep=options['keep'])
+        self.stdout.write(
+            f'Built unit conversions v{version}: {n_rows} measures for {n_foods} foods '
+            f'in {time.perf_counter() - start:.1f}s'
+        )
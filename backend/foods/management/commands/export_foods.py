@@ -0,0 +1,64 @@
+import sys
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from rest_framework.exceptions import ValidationError
+from foods import export
+
+
+class Command(BaseCommand):
+    help = 'Stream foods with their nutrients as CSV, NDJSON or Parquet (same filters as search)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--format', choices=sorted(export.FORMATS), default='csv', help='Output format')
+        parser.add_argument('--output', default='-', help='Output file (default: stdout)')
+        parser.add_argument(
+            '--since-version',
+            type=int,
+            default=0,
+            help='Only foods inserted or updated by releases after this dataset version'
+        )
+        parser.add_argument(
+            '--filter',
+            action='append',
+            default=[],
+            metavar='NAME=VALUE',
+            help='Search filter, e.g. --filter q=milk --filter min_protein=10 (repeatable)'
+        )
+
+    def handle(self, *args, **options):
+        export_format = options['format']
+        if export_format == 'parquet' and not export.parquet_available():
+            raise CommandError('pyarrow is required for Parquet export')
+
+        query_params = {}
+        for item in options['filter']:
+            name, separator, value = item.partition('=')
+            if not separator:
+                raise CommandError(f'Filters must look like NAME=VALUE, got "{item}"')
+            query_params[name.strip()] = value
+        query_params['since_version'] = str(options['since_version'])
+        try:
+            params = export.parse_export_params(query_params)
+        except ValidationError as error:
+            raise CommandError(' '.join(f'{name}: {message}' for name, message in error.detail.items()))
+
+        binary = export_format == 'parquet'
+        if options['output'] == '-':
+            output = sys.stdout.buffer if binary else sys.stdout
+            close = False
+        else:
+            output = open(options['output'], 'wb') if binary else open(options['output'], 'w', newline='')
+            close = True
+
+        start = time.perf_counter()
+        size = 0
+        try:
+            for chunk in export.export_stream(export_format, params):
+                output.write(chunk)
+                size += len(chunk)
+        finally:
+            if close:
+                output.close()
+        if close:
+            self.stdout.write(f'Wrote {size} bytes to {options["output"]} in {time.perf_counter() - start:.1f}s')
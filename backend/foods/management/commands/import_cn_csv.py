@@ -6,8 +6,9 @@ from django.contrib.postgres.search import SearchVector
 from django.db import transaction
 from foods.models import (
     CNFoodCategory, CNNutrient, CNGPCName, CNFood, 
-    CNNutrientValue, CNWeight
+    CNNutrientValue, CNWeight, DatasetRelease
 )
+from foods.pipeline import begin_import, complete_import
 
 
 class Command(BaseCommand):
@@ -35,6 +36,11 @@ class Command(BaseCommand):
             action='store_true',
             help='Skip importing weight/portion data'
         )
+        parser.add_argument(
+            '--skip-cache-warm',
+            action='store_true',
+            help='Skip re-warming response caches after the import'
+        )
     
     def handle(self, *args, **options):
         csv_dir = options['csv_dir']
@@ -69,6 +75,8 @@ class Command(BaseCommand):
             self.style.SUCCESS('Starting Child Nutrition database import...')
         )
         
+        release = begin_import(DatasetRelease.SOURCE_CN)
+        
         # Import in order
         self.import_food_categories(csv_dir)
         self.import_nutrients(csv_dir)
@@ -84,6 +92,8 @@ class Command(BaseCommand):
         # Update search vectors
         self.update_search_vectors()
         
+        complete_import(release, self.stdout, warm_caches=not options.get('skip_cache_warm'))
+        
         self.stdout.write(
             self.style.SUCCESS('Successfully imported Child Nutrition database!')
         )
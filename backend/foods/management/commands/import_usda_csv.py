@@ -5,8 +5,10 @@ from django.contrib.postgres.search import SearchVector
 from django.db import transaction
 from foods.models import (
     FoodCategory, Nutrient, Food, FoodNutrient, BrandedFood,
-    FoundationFood, SrLegacyFood, SurveyFnddsFood, FoodPortion, MeasureUnit
+    FoundationFood, SrLegacyFood, SurveyFnddsFood, FoodPortion, MeasureUnit,
+    DatasetRelease
 )
+from foods.pipeline import begin_import, complete_import
 
 
 class Command(BaseCommand):
@@ -34,6 +36,11 @@ class Command(BaseCommand):
             action='store_true',
             help='Skip importing food portion data'
         )
+        parser.add_argument(
+            '--skip-cache-warm',
+            action='store_true',
+            help='Skip re-warming response caches after the import'
+        )
     
     def handle(self, *args, **options):
         csv_dir = options['csv_dir']
@@ -51,11 +58,13 @@ class Command(BaseCommand):
             self.style.SUCCESS('Starting USDA FoodData Central import...')
         )
         
+        release = begin_import(DatasetRelease.SOURCE_USDA)
+        
         # Import in order
         self.import_food_categories(csv_dir)
         self.import_nutrients(csv_dir)
         self.import_measure_units(csv_dir)
-        self.import_foods(csv_dir, limit)
+        self.import_foods(csv_dir, limit, release.id)
         
         if not skip_nutrients:
             self.import_food_nutrients(csv_dir, limit)
@@ -72,6 +81,8 @@ class Command(BaseCommand):
         if not skip_nutrients:
             self.update_search_vectors()
         
+        complete_import(release, self.stdout, warm_caches=not options.get('skip_cache_warm'))
+        
         self.stdout.write(
             self.style.SUCCESS('Successfully imported USDA FoodData Central data!')
         )
@@ -167,8 +178,8 @@ class Command(BaseCommand):
         count = MeasureUnit.objects.count()
         self.stdout.write(f'Imported {count} measure units')
     
-    def import_foods(self, csv_dir, limit=None):
-        """Import main food data"""
+    def import_foods(self, csv_dir, limit=None, version=None):
+        """Import main food data; new foods are tagged with the import's dataset version"""
         file_path = os.path.join(csv_dir, 'food.csv')
         if not os.path.exists(file_path):
             self.stdout.write(self.style.ERROR('food.csv not found'))
@@ -198,7 +209,8 @@ class Command(BaseCommand):
                     data_type=row['data_type'],
                     description=row['description'],
                     food_category_id=int(row['food_category_id']) if row.get('food_category_id') else None,
-                    publication_date=pub_date
+                    publication_date=pub_date,
+                    dataset_version=version
                 ))
                 
                 count += 1
@@ -0,0 +1,52 @@
+import json
+import sys
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from foods import planner
+
+
+class Command(BaseCommand):
+    help = 'Solve meal plans for many users in parallel across a process pool'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'input',
+            help='JSON file with a list of plan request bodies, or - for stdin'
+        )
+        parser.add_argument(
+            '--output',
+            help='File to write the list of plans to (default: stdout)'
+        )
+        parser.add_argument(
+            '--workers',
+            type=int,
+            help='Worker processes (default: number of CPUs)'
+        )
+
+    def handle(self, *args, **options):
+        if not planner.available():
+            raise CommandError('NumPy is required for meal planning')
+        try:
+            if options['input'] == '-':
+                bodies = json.load(sys.stdin)
+            else:
+                with open(options['input']) as f:
+                    bodies = json.load(f)
+        except (OSError, ValueError) as exc:
+            raise CommandError(f'Could not read plan requests: {exc}')
+        if not isinstance(bodies, list):
+            raise CommandError('The input must be a JSON list of plan requests')
+
+        start = time.perf_counter()
+        plans = planner.plan_meals_batch(bodies, workers=options['workers'])
+        elapsed = time.perf_counter() - start
+
+        output = json.dumps(plans, default=str)
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                f.write(output)
+        else:
+            self.stdout.write(output)
+        failed = sum(1 for plan in plans if 'errors' in plan)
+        self.stderr.write(f'Planned {len(plans) - failed} of {len(plans)} requests in {elapsed:.1f}s')
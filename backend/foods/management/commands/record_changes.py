@@ -0,0 +1,26 @@
+import time
+
+from django.core.management.base import BaseCommand
+from foods import changes
+from foods.models import DatasetRelease
+
+
+class Command(BaseCommand):
+    help = 'Log the USDA and CN foods inserted, updated or deleted since the last recorded release'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--dataset-version',
+            type=int,
+            help='Dataset version to record the changes under (default: latest completed import)'
+        )
+
+    def handle(self, *args, **options):
+        version = options['dataset_version']
+        if version is None:
+            version = DatasetRelease.current_version()
+
+        start = time.perf_counter()
+        counts = changes.record_changes(version)
+        summary = ', '.join(f'{count} {action}s' for action, count in counts.items())
+        self.stdout.write(f'Recorded changes for version {version}: {summary} in {time.perf_counter() - start:.1f}s')
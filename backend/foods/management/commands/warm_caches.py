@@ -0,0 +1,103 @@
+from django.core.management.base import BaseCommand
+from django.test import RequestFactory
+from rest_framework.exceptions import APIException
+from foods.cache import response_cache
+from foods.querylog import prune_query_log, top_queries
+from foods.views import (
+    FoodSearchView, FoodAutocompleteView, BarcodeSearchView, FoodStatsView, FoodViewSet,
+    CNFoodSearchView, UnifiedSearchView
+)
+
+
+class Command(BaseCommand):
+    help = 'Pre-populate the response caches from the most frequent logged queries'
+
+    # Query log kind -> view that serves it
+    VIEWS = {
+        FoodSearchView.cache_namespace: FoodSearchView,
+        FoodAutocompleteView.cache_namespace: FoodAutocompleteView,
+        BarcodeSearchView.cache_namespace: BarcodeSearchView,
+        CNFoodSearchView.cache_namespace: CNFoodSearchView,
+        UnifiedSearchView.cache_namespace: UnifiedSearchView,
+    }
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--top',
+            type=int,
+            default=500,
+            help='Number of most frequent queries to replay per kind'
+        )
+        parser.add_argument(
+            '--kinds',
+            nargs='+',
+            choices=sorted(self.VIEWS),
+            default=sorted(self.VIEWS),
+            help='Query kinds to replay'
+        )
+        parser.add_argument(
+            '--skip-foods',
+            action='store_true',
+            help='Do not warm detail and macro responses for foods found by the replayed queries'
+        )
+
+    def handle(self, *args, **options):
+        top = options['top']
+
+        pruned = prune_query_log()
+        if pruned:
+            self.stdout.write(f'Pruned {pruned} stale query log entries')
+
+        response_cache.warm(FoodStatsView.cache_namespace, {}, lambda: FoodStatsView().build_response({}))
+
+        fdc_ids = []
+        for kind in options['kinds']:
+            view = self.VIEWS[kind]()
+            built = 0
+            queries = top_queries(kind, top)
+            for params in queries:
+                try:
+                    # Re-normalize, so entries logged by older code map to current cache keys
+                    params = view.get_cache_params(params)
+                    if response_cache.warm(kind, params, lambda: view.build_response(params)):
+                        built += 1
+                except (APIException, ValueError):
+                    continue
+                if not options['skip_foods']:
+                    fdc_ids.extend(self.result_fdc_ids(kind, params))
+            self.stdout.write(f'Warmed {built} of {len(queries)} {kind} queries')
+
+        if not options['skip_foods']:
+            self.warm_foods(list(dict.fromkeys(fdc_ids)))
+
+        self.stdout.write(self.style.SUCCESS('Cache warming complete'))
+
+    def result_fdc_ids(self, kind, params):
+        """fdc_ids referenced by a cached search or barcode response"""
+        cached = response_cache.shared.get(response_cache.make_key(kind, params))
+        if cached is None:
+            return []
+        status_code, data = cached
+        if status_code != 200:
+            return []
+        if kind == BarcodeSearchView.cache_namespace:
+            return [data['fdc_id']] if 'fdc_id' in data else []
+        if kind == FoodSearchView.cache_namespace:
+            return [row['fdc_id'] for row in data['results'] if 'fdc_id' in row]
+        if kind == UnifiedSearchView.cache_namespace:
+            return [row['id'] for row in data['results'] if row['source'] == 'usda']
+        return []
+
+    def warm_foods(self, fdc_ids):
+        """Warm the per-food detail and macro responses"""
+        request = RequestFactory().get('/')
+        built = 0
+        for fdc_id in fdc_ids:
+            view = FoodViewSet(action_map={'get': 'retrieve'}, kwargs={'pk': str(fdc_id)}, format_kwarg=None)
+            view.request = view.initialize_request(request)
+            params = {'fdc_id': str(fdc_id)}
+            built += response_cache.warm(
+                'food-detail', {**params, 'fields': '', 'omit': ''}, view.build_detail_response
+            )
+            built += response_cache.warm('food-macros', params, view.build_macros_response)
+        self.stdout.write(f'Warmed {built} food detail and macro responses for {len(fdc_ids)} foods')
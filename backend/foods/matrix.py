@@ -0,0 +1,160 @@
+"""
+Dense foods x nutrients matrix, memory-mapped from disk.
+
+At the end of every import `build_matrix()` exports `food_nutrient` as a
+float32 matrix with one row per Food (sorted by fdc_id) and one column per
+Nutrient (sorted by id); missing values are NaN. Each dataset version gets
+its own directory under FOODS_DATA_DIR/matrix:
+
+    v<version>/values.npy        float32 [n_foods, n_nutrients]
+    v<version>/fdc_ids.npy       int64   [n_foods], row -> fdc_id
+    v<version>/nutrient_ids.npy  int64   [n_nutrients], column -> Nutrient.id
+
+`get_matrix()` opens the newest matrix for the current dataset version once
+per process with `mmap_mode='r'`, so all workers share the same page cache
+pages. Amounts are per 100 g, as in `food_nutrient`.
+"""
+
+import os
+
+from .datafiles import KEEP_VERSIONS, VersionedDataFiles
+from .models import Food, FoodNutrient, Nutrient
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover - optional dependency
+    np = None
+
+
+BUILD_BATCH_SIZE = 200000
+
+
+def available():
+    """Whether NumPy is installed, which the matrix requires"""
+    return np is not None
+
+
+class NutrientMatrix:
+    """A memory-mapped foods x nutrients matrix and its id indexes"""
+
+    def __init__(self, path, version):
+        self.path = path
+        self.version = version
+        self.values = np.load(os.path.join(path, 'values.npy'), mmap_mode='r')
+        self.fdc_ids = np.load(os.path.join(path, 'fdc_ids.npy'))
+        self.nutrient_ids = np.load(os.path.join(path, 'nutrient_ids.npy'))
+
+    def __len__(self):
+        return len(self.fdc_ids)
+
+    @staticmethod
+    def _positions(index, ids):
+        """Positions of ids in a sorted index array; -1 where absent"""
+        ids = np.asarray(ids, dtype=np.int64)
+        if not len(index):
+            return np.full(ids.shape, -1, dtype=np.int64)
+        positions = np.minimum(np.searchsorted(index, ids), len(index) - 1)
+        return np.where(index[positions] == ids, positions, -1)
+
+    def rows(self, fdc_ids):
+        """Row index of each fdc_id; -1 for foods not in the matrix"""
+        return self._positions(self.fdc_ids, fdc_ids)
+
+    def columns(self, nutrient_ids):
+        """Column index of each nutrient id; -1 for nutrients not in the matrix"""
+        return self._positions(self.nutrient_ids, nutrient_ids)
+
+    def select(self, fdc_ids, nutrient_ids=None):
+        """Dense [len(fdc_ids), len(nutrient_ids)] float32 array, NaN where missing.
+
+        Without `nutrient_ids` every column is returned.
+        """
+        rows = self.rows(fdc_ids)
+        if not len(self):
+            result = np.full((len(rows), len(self.nutrient_ids)), np.nan, dtype=np.float32)
+        else:
+            result = self.values[np.maximum(rows, 0)]
+            result[rows < 0] = np.nan
+        if nutrient_ids is None:
+            return result
+        columns = self.columns(nutrient_ids)
+        if not len(self.nutrient_ids):
+            return np.full((len(rows), len(columns)), np.nan, dtype=np.float32)
+        result = result[:, np.maximum(columns, 0)]
+        result[:, columns < 0] = np.nan
+        return result
+
+    def weighted_sum(self, fdc_ids, grams, nutrient_ids=None):
+        """Nutrient totals for `grams` of each food; missing values count as zero"""
+        values = self.select(fdc_ids, nutrient_ids)
+        weights = np.asarray(grams, dtype=np.float32) / 100
+        return np.nansum(values * weights[:, None], axis=0)
+
+    def food_values(self, fdc_id):
+        """{nutrient_id: amount} for one food, skipping missing values"""
+        row = self.select([fdc_id])[0]
+        present = ~np.isnan(row)
+        return dict(zip(self.nutrient_ids[present].tolist(), row[present].tolist()))
+
+
+files = VersionedDataFiles('matrix', NutrientMatrix)
+
+
+def get_matrix():
+    """Matrix for the current dataset version, or None if none has been built"""
+    if np is None:
+        return None
+    return files.get()
+
+
+def build_matrix(version, data_dir=None, keep=KEEP_VERSIONS):
+    """Export food_nutrient as the matrix for a dataset version; returns its shape.
+
+    Readers never see a partial matrix; see VersionedDataFiles.build().
+    """
+    if np is None:
+        raise RuntimeError('NumPy is required to build the nutrient matrix')
+
+    with files.build(version, data_dir, keep) as tmp_path:
+        fdc_ids = np.fromiter(
+            Food.objects.order_by('fdc_id').values_list('fdc_id', flat=True).iterator(), dtype=np.int64
+        )
+        nutrient_ids = np.fromiter(
+            Nutrient.objects.order_by('id').values_list('id', flat=True).iterator(), dtype=np.int64
+        )
+        values = np.lib.format.open_memmap(
+            os.path.join(tmp_path, 'values.npy'), mode='w+', dtype=np.float32,
+            shape=(len(fdc_ids), len(nutrient_ids))
+        )
+        values[:] = np.nan
+
+        if len(fdc_ids) and len(nutrient_ids):
+            rows = FoodNutrient.objects.filter(amount__isnull=False).values_list(
+                'fdc_id', 'nutrient_id', 'amount'
+            ).iterator(chunk_size=BUILD_BATCH_SIZE)
+            batch = []
+            for row in rows:
+                batch.append(row)
+                if len(batch) >= BUILD_BATCH_SIZE:
+                    _fill(values, fdc_ids, nutrient_ids, batch)
+                    batch = []
+            _fill(values, fdc_ids, nutrient_ids, batch)
+
+        values.flush()
+        del values
+        np.save(os.path.join(tmp_path, 'fdc_ids.npy'), fdc_ids)
+        np.save(os.path.join(tmp_path, 'nutrient_ids.npy'), nutrient_ids)
+    return len(fdc_ids), len(nutrient_ids)
+
+
+def _fill(values, fdc_ids, nutrient_ids, batch):
+    """Write a batch of (fdc_id, nutrient_id, amount) rows into the matrix"""
+    if not batch:
+        return
+    data = np.array(batch, dtype=np.float64)
+    row_ids = data[:, 0].astype(np.int64)
+    column_ids = data[:, 1].astype(np.int64)
+    rows = np.minimum(np.searchsorted(fdc_ids, row_ids), len(fdc_ids) - 1)
+    columns = np.minimum(np.searchsorted(nutrient_ids, column_ids), len(nutrient_ids) - 1)
+    known = (fdc_ids[rows] == row_ids) & (nutrient_ids[columns] == column_ids)
+    values[rows[known], columns[known]] = data[known, 2]
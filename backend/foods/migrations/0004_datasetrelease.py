@@ -0,0 +1,26 @@
+# Generated by Django 4.2.23 on 2026-10-19 09:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('foods', '0003_allow_null_category'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DatasetRelease',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('source', models.CharField(choices=[('usda', 'USDA FoodData Central'), ('cn', 'Child Nutrition')], max_length=10)),
+                ('started_at', models.DateTimeField(auto_now_add=True)),
+                ('completed_at', models.DateTimeField(blank=True, null=True)),
+            ],
+            options={
+                'db_table': 'dataset_release',
+                'ordering': ['-id'],
+            },
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 4.2.23 on 2026-10-19 09:09
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('foods', '0004_datasetrelease'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='QueryLogEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(max_length=20)),
+                ('params_key', models.CharField(help_text='SHA-1 of the normalized parameters', max_length=40)),
+                ('params', models.JSONField()),
+                ('hits', models.IntegerField(default=0)),
+                ('last_seen', models.DateTimeField()),
+            ],
+            options={
+                'db_table': 'query_log_entry',
+                'indexes': [models.Index(fields=['kind', '-hits'], name='query_log_e_kind_466884_idx'), models.Index(fields=['last_seen'], name='query_log_e_last_se_8706f5_idx')],
+                'unique_together': {('kind', 'params_key')},
+            },
+        ),
+    ]
@@ -0,0 +1,82 @@
+# Generated by Django 4.2.23 on 2026-10-19 09:20
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('foods', '0005_querylogentry'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FoodNutritionSummary',
+            fields=[
+                ('food', models.OneToOneField(db_column='fdc_id', db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, primary_key=True, related_name='nutrition_summary', serialize=False, to='foods.food')),
+                ('calories', models.FloatField(blank=True, null=True)),
+                ('protein', models.FloatField(blank=True, null=True)),
+                ('fat', models.FloatField(blank=True, null=True)),
+                ('carbs', models.FloatField(blank=True, null=True)),
+                ('fiber', models.FloatField(blank=True, null=True)),
+                ('sugars', models.FloatField(blank=True, null=True)),
+                ('sodium', models.FloatField(blank=True, null=True)),
+                ('calcium', models.FloatField(blank=True, null=True)),
+                ('iron', models.FloatField(blank=True, null=True)),
+                ('vitamin_c', models.FloatField(blank=True, null=True)),
+                ('vitamin_a', models.FloatField(blank=True, null=True)),
+            ],
+            options={
+                'db_table': 'food_nutrition_summary',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='foodnutrient',
+            index=models.Index(fields=['nutrient_id', 'amount'], include=('fdc_id',), name='food_nutrient_range_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='foodnutritionsummary',
+            index=models.Index(fields=['calories'], name='food_nutrit_calorie_136c4f_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='foodnutritionsummary',
+            index=models.Index(fields=['protein'], name='food_nutrit_protein_eefa48_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='foodnutritionsummary',
+            index=models.Index(fields=['fat'], name='food_nutrit_fat_f23533_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='foodnutritionsummary',
+            index=models.Index(fields=['carbs'], name='food_nutrit_carbs_b6268b_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='foodnutritionsummary',
+            index=models.Index(fields=['fiber'], name='food_nutrit_fiber_8539b8_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='foodnutritionsummary',
+            index=models.Index(fields=['sugars'], name='food_nutrit_sugars_9eaefc_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='foodnutritionsummary',
+            index=models.Index(fields=['sodium'], name='food_nutrit_sodium_5ba497_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='foodnutritionsummary',
+            index=models.Index(fields=['calcium'], name='food_nutrit_calcium_d891e8_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='foodnutritionsummary',
+            index=models.Index(fields=['iron'], name='food_nutrit_iron_ffdc58_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='foodnutritionsummary',
+            index=models.Index(fields=['vitamin_c'], name='food_nutrit_vitamin_29e14b_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='foodnutritionsummary',
+            index=models.Index(fields=['vitamin_a'], name='food_nutrit_vitamin_a44d78_idx'),
+        ),
+    ]
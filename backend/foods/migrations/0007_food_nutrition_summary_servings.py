@@ -0,0 +1,94 @@
+# Generated by Django 4.2.23 on 2026-10-19 09:33
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('foods', '0006_food_nutrition_summary'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='foodnutritionsummary',
+            name='calcium_per_serving',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='foodnutritionsummary',
+            name='calories_per_serving',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='foodnutritionsummary',
+            name='carbs_per_serving',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='foodnutritionsummary',
+            name='fat_per_serving',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='foodnutritionsummary',
+            name='fiber_per_serving',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='foodnutritionsummary',
+            name='iron_per_serving',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='foodnutritionsummary',
+            name='protein_per_serving',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='foodnutritionsummary',
+            name='serving_description',
+            field=models.CharField(blank=True, max_length=500, null=True),
+        ),
+        migrations.AddField(
+            model_name='foodnutritionsummary',
+            name='serving_grams',
+            field=models.FloatField(blank=True, help_text='Serving size in g (ml for liquids)', null=True),
+        ),
+        migrations.AddField(
+            model_name='foodnutritionsummary',
+            name='sodium_per_serving',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='foodnutritionsummary',
+            name='sugars_per_serving',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='foodnutritionsummary',
+            name='vitamin_a_per_serving',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='foodnutritionsummary',
+            name='vitamin_c_per_serving',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='foodnutritionsummary',
+            index=models.Index(fields=['calories_per_serving'], name='food_nutrit_calorie_f565cc_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='foodnutritionsummary',
+            index=models.Index(fields=['protein_per_serving'], name='food_nutrit_protein_dd6926_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='foodnutritionsummary',
+            index=models.Index(fields=['sugars_per_serving'], name='food_nutrit_sugars__732c9c_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='foodnutritionsummary',
+            index=models.Index(fields=['sodium_per_serving'], name='food_nutrit_sodium__4d3791_idx'),
+        ),
+    ]
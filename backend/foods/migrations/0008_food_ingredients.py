@@ -0,0 +1,28 @@
+# Generated by Django 4.2.23 on 2026-10-19 09:37
+
+import django.contrib.postgres.fields
+import django.contrib.postgres.indexes
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('foods', '0007_food_nutrition_summary_servings'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FoodIngredients',
+            fields=[
+                ('food', models.OneToOneField(db_column='fdc_id', db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, primary_key=True, related_name='ingredient_index', serialize=False, to='foods.food')),
+                ('tokens', django.contrib.postgres.fields.ArrayField(base_field=models.TextField(), default=list, help_text='Normalized ingredient words and phrases', size=None)),
+                ('allergens', django.contrib.postgres.fields.ArrayField(base_field=models.CharField(max_length=20), default=list, size=None)),
+            ],
+            options={
+                'db_table': 'food_ingredients',
+                'indexes': [django.contrib.postgres.indexes.GinIndex(fields=['tokens'], name='food_ingred_tokens_1f44ac_gin'), django.contrib.postgres.indexes.GinIndex(fields=['allergens'], name='food_ingred_allerge_01d8df_gin')],
+            },
+        ),
+    ]
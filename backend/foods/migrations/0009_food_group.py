@@ -0,0 +1,25 @@
+# Generated by Django 4.2.23 on 2026-10-19 09:40
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('foods', '0008_food_ingredients'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FoodGroup',
+            fields=[
+                ('food', models.OneToOneField(db_column='fdc_id', db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, primary_key=True, related_name='food_group', serialize=False, to='foods.food')),
+                ('group_id', models.IntegerField(db_index=True, help_text="fdc_id of the group's canonical food")),
+                ('group_size', models.IntegerField()),
+            ],
+            options={
+                'db_table': 'food_group',
+            },
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 4.2.23 on 2026-10-19 09:44
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('foods', '0009_food_group'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CNFoodLink',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('method', models.CharField(choices=[('fdc_id', 'CN food fdc_id'), ('gtin', 'Matching GTIN'), ('description', 'Similar description')], max_length=20)),
+                ('score', models.FloatField(help_text='1 for fdc_id and GTIN links, description similarity otherwise')),
+                ('cn_food', models.ForeignKey(db_column='cn_code', db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, related_name='fdc_links', to='foods.cnfood')),
+                ('food', models.ForeignKey(db_column='fdc_id', db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, related_name='cn_links', to='foods.food')),
+            ],
+            options={
+                'db_table': 'cn_food_link',
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='cnfoodlink',
+            constraint=models.UniqueConstraint(fields=('cn_food', 'food'), name='cn_food_link_unique'),
+        ),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 4.2.23 on 2026-10-19 09:46
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('foods', '0010_cn_food_link'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='cnnutrient',
+            name='canonical_unit',
+            field=models.CharField(blank=True, default='', max_length=20),
+        ),
+        migrations.AddField(
+            model_name='cnnutrient',
+            name='nutrient',
+            field=models.ForeignKey(blank=True, db_constraint=False, help_text='Equivalent USDA nutrient', null=True, on_delete=django.db.models.deletion.DO_NOTHING, related_name='cn_nutrients', to='foods.nutrient'),
+        ),
+        migrations.AddField(
+            model_name='cnnutrient',
+            name='unit_factor',
+            field=models.FloatField(default=1.0, help_text='Multiplier from unit to canonical_unit'),
+        ),
+        migrations.AddField(
+            model_name='cnnutrientvalue',
+            name='amount',
+            field=models.FloatField(blank=True, help_text="nutrient_value in the nutrient's canonical unit; see foods.units", null=True),
+        ),
+        migrations.AddField(
+            model_name='nutrient',
+            name='canonical_unit',
+            field=models.CharField(blank=True, default='', help_text="Normalized unit_name, e.g. 'ug' for UG; see foods.units", max_length=20),
+        ),
+    ]
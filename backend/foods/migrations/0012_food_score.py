@@ -0,0 +1,29 @@
+# Generated by Django 4.2.23 on 2026-10-19 09:48
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('foods', '0011_canonical_nutrient_units'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FoodScore',
+            fields=[
+                ('food', models.OneToOneField(db_column='fdc_id', db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, primary_key=True, related_name='scores', serialize=False, to='foods.food')),
+                ('nrf9_3', models.FloatField(blank=True, help_text='Nutrient Rich Food index 9.3 per 100 kcal', null=True)),
+                ('protein_per_100kcal', models.FloatField(blank=True, null=True)),
+                ('fiber_per_100kcal', models.FloatField(blank=True, null=True)),
+                ('sodium_per_100kcal', models.FloatField(blank=True, null=True)),
+                ('sugars_per_100kcal', models.FloatField(blank=True, null=True)),
+            ],
+            options={
+                'db_table': 'food_score',
+                'indexes': [models.Index(fields=['nrf9_3'], name='food_score_nrf9_3_6ace2a_idx'), models.Index(fields=['protein_per_100kcal'], name='food_score_protein_f8fa86_idx'), models.Index(fields=['fiber_per_100kcal'], name='food_score_fiber_p_0e02b7_idx'), models.Index(fields=['sodium_per_100kcal'], name='food_score_sodium__19e1b3_idx'), models.Index(fields=['sugars_per_100kcal'], name='food_score_sugars__a48001_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 4.2.23 on 2026-10-19 09:51
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('foods', '0012_food_score'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='food',
+            name='dataset_version',
+            field=models.IntegerField(blank=True, help_text='DatasetRelease id of the import that added the food', null=True),
+        ),
+        migrations.AddIndex(
+            model_name='food',
+            index=models.Index(fields=['dataset_version'], name='food_dataset_29bc14_idx'),
+        ),
+    ]
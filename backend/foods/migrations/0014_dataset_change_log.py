@@ -0,0 +1,40 @@
+# Generated by Django 4.2.23 on 2026-10-19 09:54
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('foods', '0013_food_dataset_version'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RecordFingerprint',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('source', models.CharField(choices=[('usda', 'USDA FoodData Central'), ('cn', 'Child Nutrition')], max_length=10)),
+                ('record_id', models.BigIntegerField()),
+                ('digest', models.UUIDField(help_text="md5 of the food's columns, nutrients and portions")),
+            ],
+            options={
+                'db_table': 'record_fingerprint',
+                'unique_together': {('source', 'record_id')},
+            },
+        ),
+        migrations.CreateModel(
+            name='DatasetChange',
+            fields=[
+                ('id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('version', models.IntegerField(help_text='DatasetRelease id')),
+                ('source', models.CharField(choices=[('usda', 'USDA FoodData Central'), ('cn', 'Child Nutrition')], max_length=10)),
+                ('record_id', models.BigIntegerField(help_text='fdc_id (usda) or cn_code (cn)')),
+                ('action', models.CharField(choices=[('insert', 'Inserted'), ('update', 'Updated'), ('delete', 'Deleted')], max_length=10)),
+            ],
+            options={
+                'db_table': 'dataset_change',
+                'indexes': [models.Index(fields=['version', 'source', 'record_id'], name='dataset_cha_version_1c9aeb_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,20 @@
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('foods', '0014_dataset_change_log'),
+    ]
+
+    # Same expression as foods.linking.normalized_gtin_sql('gtin_upc'), so the
+    # barcode view's database fallback is an index lookup
+    operations = [
+        migrations.RunSQL(
+            sql=(
+                "CREATE INDEX branded_food_gtin_normalized_idx ON branded_food "
+                "((LTRIM(REGEXP_REPLACE(COALESCE(gtin_upc, ''), '[^0-9]', '', 'g'), '0')))"
+            ),
+            reverse_sql='DROP INDEX branded_food_gtin_normalized_idx',
+        ),
+    ]
@@ -1,4 +1,6 @@
 from django.db import models
+from django.db.models.functions import Coalesce
+from django.contrib.postgres.fields import ArrayField
 from django.contrib.postgres.search import SearchVectorField
 from django.contrib.postgres.indexes import GinIndex
 
@@ -24,6 +26,9 @@ class Nutrient(models.Model):
     unit_name = models.CharField(max_length=20)
     nutrient_nbr = models.CharField(max_length=10, null=True, blank=True)
     rank = models.FloatField(null=True, blank=True)
+    canonical_unit = models.CharField(
+        max_length=20, blank=True, default='', help_text="Normalized unit_name, e.g. 'ug' for UG; see foods.units"
+    )
     
     class Meta:
         db_table = 'nutrient'
@@ -55,6 +60,9 @@ class Food(models.Model):
     description = models.TextField()
     food_category_id = models.IntegerField(null=True, blank=True)
     publication_date = models.DateField(null=True, blank=True)
+    dataset_version = models.IntegerField(
+        null=True, blank=True, help_text="DatasetRelease id of the import that added the food"
+    )
     search_vector = SearchVectorField(null=True, blank=True)
     
     class Meta:
@@ -62,6 +70,7 @@ class Food(models.Model):
         indexes = [
             models.Index(fields=['data_type']),
             models.Index(fields=['food_category_id']),
+            models.Index(fields=['dataset_version']),
             GinIndex(fields=['search_vector']),
         ]
     
@@ -102,6 +111,10 @@ class FoodNutrient(models.Model):
             models.Index(fields=['fdc_id']),
             models.Index(fields=['nutrient_id']),
             models.Index(fields=['fdc_id', 'nutrient_id']),
+            # Covers nutrient range filters: index-only scans yield matching fdc_ids
+            models.Index(
+                fields=['nutrient_id', 'amount'], include=['fdc_id'], name='food_nutrient_range_idx'
+            ),
         ]
     
     @property
@@ -225,7 +238,69 @@ class FoodPortion(models.Model):
         return f"Portion {self.id} for Food {self.fdc_id}"
 
 
-class NutrientLookup:
+class BulkNutrientLookup:
+    """Batched nutrient reads shared by the USDA and CN lookup helpers.
+    
+    `get_values()` loads any number of foods x nutrients in one query and
+    returns a dense mapping, so callers scale per batch instead of per value.
+    Subclasses implement `fetch_values()` and name their common nutrients in
+    MACROS and VITAMINS_MINERALS.
+    """
+    MACROS = {}
+    VITAMINS_MINERALS = {}
+    
+    @classmethod
+    def fetch_values(cls, food_ids, nutrient_ids):
+        """(food_id, nutrient_id, value) rows for the given foods and nutrients"""
+        raise NotImplementedError
+    
+    @classmethod
+    def get_values(cls, food_ids, nutrient_ids):
+        """{food_id: {nutrient_id: value}} with every requested pair present (None if missing)"""
+        food_ids = list(dict.fromkeys(int(food_id) for food_id in food_ids))
+        nutrient_ids = list(dict.fromkeys(int(nutrient_id) for nutrient_id in nutrient_ids))
+        values = {food_id: dict.fromkeys(nutrient_ids) for food_id in food_ids}
+        if food_ids and nutrient_ids:
+            for food_id, nutrient_id, value in cls.fetch_values(food_ids, nutrient_ids):
+                values[food_id][nutrient_id] = value
+        return values
+    
+    @classmethod
+    def get_named_values(cls, food_ids, names):
+        """{food_id: {name: value}} for a name -> nutrient id mapping"""
+        values = cls.get_values(food_ids, names.values())
+        return {
+            food_id: {name: row[nutrient_id] for name, nutrient_id in names.items()}
+            for food_id, row in values.items()
+        }
+    
+    @classmethod
+    def get_macros_bulk(cls, food_ids):
+        """Macronutrients for many foods in one query"""
+        return cls.get_named_values(food_ids, cls.MACROS)
+    
+    @classmethod
+    def get_vitamins_minerals_bulk(cls, food_ids):
+        """Key vitamins and minerals for many foods in one query"""
+        return cls.get_named_values(food_ids, cls.VITAMINS_MINERALS)
+    
+    @classmethod
+    def get_nutrient_value(cls, food_id, nutrient_id):
+        """Get a single nutrient value for a food"""
+        return cls.get_values([food_id], [nutrient_id])[int(food_id)][int(nutrient_id)]
+    
+    @classmethod
+    def get_macros(cls, food_id):
+        """Get macronutrients for a food"""
+        return cls.get_macros_bulk([food_id])[int(food_id)]
+    
+    @classmethod
+    def get_vitamins_minerals(cls, food_id):
+        """Get key vitamins and minerals for a food"""
+        return cls.get_vitamins_minerals_bulk([food_id])[int(food_id)]
+
+
+class NutrientLookup(BulkNutrientLookup):
     """Helper class for common nutrient lookups"""
     
     # Common nutrient IDs from USDA database
@@ -239,40 +314,30 @@ class NutrientLookup:
     CALCIUM = 1087      # Calcium, Ca
     IRON = 1089         # Iron, Fe
     VITAMIN_C = 1162    # Vitamin C, total ascorbic acid
+    VITAMIN_A = 1106    # Vitamin A, RAE
+    
+    # Output name -> nutrient id for the grouped lookups
+    MACROS = {
+        'calories': ENERGY_KCAL,
+        'protein': PROTEIN,
+        'fat': TOTAL_FAT,
+        'carbs': CARBS,
+        'fiber': FIBER,
+        'sugars': SUGARS,
+    }
+    VITAMINS_MINERALS = {
+        'sodium': SODIUM,
+        'calcium': CALCIUM,
+        'iron': IRON,
+        'vitamin_c': VITAMIN_C,
+        'vitamin_a': VITAMIN_A,
+    }
     
     @classmethod
-    def get_nutrient_value(cls, fdc_id, nutrient_id):
-        """Get nutrient value for a specific food"""
-        try:
-            food_nutrient = FoodNutrient.objects.get(
-                fdc_id=fdc_id, 
-                nutrient_id=nutrient_id
-            )
-            return food_nutrient.amount
-        except FoodNutrient.DoesNotExist:
-            return None
-    
-    @classmethod
-    def get_macros(cls, fdc_id):
-        """Get macronutrients for a food"""
-        return {
-            'calories': cls.get_nutrient_value(fdc_id, cls.ENERGY_KCAL),
-            'protein': cls.get_nutrient_value(fdc_id, cls.PROTEIN),
-            'fat': cls.get_nutrient_value(fdc_id, cls.TOTAL_FAT),
-            'carbs': cls.get_nutrient_value(fdc_id, cls.CARBS),
-            'fiber': cls.get_nutrient_value(fdc_id, cls.FIBER),
-            'sugars': cls.get_nutrient_value(fdc_id, cls.SUGARS),
-        }
-    
-    @classmethod
-    def get_vitamins_minerals(cls, fdc_id):
-        """Get key vitamins and minerals for a food"""
-        return {
-            'sodium': cls.get_nutrient_value(fdc_id, cls.SODIUM),
-            'calcium': cls.get_nutrient_value(fdc_id, cls.CALCIUM),
-            'iron': cls.get_nutrient_value(fdc_id, cls.IRON),
-            'vitamin_c': cls.get_nutrient_value(fdc_id, cls.VITAMIN_C),
-        }
+    def fetch_values(cls, food_ids, nutrient_ids):
+        return FoodNutrient.objects.filter(
+            fdc_id__in=food_ids, nutrient_id__in=nutrient_ids
+        ).values_list('fdc_id', 'nutrient_id', 'amount')
 
 
 class CNFoodCategory(models.Model):
@@ -300,6 +365,14 @@ class CNNutrient(models.Model):
     date_added = models.DateField(null=True, blank=True)
     last_modified = models.DateField(null=True, blank=True)
     
+    # Set at the end of every import; see foods.units
+    nutrient = models.ForeignKey(
+        Nutrient, on_delete=models.DO_NOTHING, db_constraint=False, null=True, blank=True,
+        related_name='cn_nutrients', help_text="Equivalent USDA nutrient"
+    )
+    canonical_unit = models.CharField(max_length=20, blank=True, default='')
+    unit_factor = models.FloatField(default=1.0, help_text="Multiplier from unit to canonical_unit")
+    
     class Meta:
         db_table = 'cn_nutrient'
         verbose_name = 'CN Nutrient'
@@ -373,6 +446,9 @@ class CNNutrientValue(models.Model):
     cn_food = models.ForeignKey(CNFood, on_delete=models.CASCADE, related_name='nutrient_values')
     nutrient = models.ForeignKey(CNNutrient, on_delete=models.CASCADE)
     nutrient_value = models.FloatField(help_text="Nutrient value")
+    amount = models.FloatField(
+        null=True, blank=True, help_text="nutrient_value in the nutrient's canonical unit; see foods.units"
+    )
     per_unit = models.CharField(max_length=20, default='100g', help_text="Per unit (e.g., 100g)")
     value_type_code = models.IntegerField(null=True, blank=True)
     source_code = models.IntegerField(null=True, blank=True)
@@ -391,6 +467,11 @@ class CNNutrientValue(models.Model):
     
     def __str__(self):
         return f"{self.cn_food.cn_code} - {self.nutrient.description}: {self.nutrient_value} {self.nutrient.unit}"
+    
+    @property
+    def canonical_value(self):
+        """Value in the canonical unit (the raw value until units are first normalized)"""
+        return self.nutrient_value if self.amount is None else self.amount
 
 
 class CNWeight(models.Model):
@@ -418,7 +499,7 @@ class CNWeight(models.Model):
         return f"{self.cn_food.cn_code} - {self.amount} {self.measure_description}"
 
 
-class CNNutrientLookup:
+class CNNutrientLookup(BulkNutrientLookup):
     """Helper class for common Child Nutrition nutrient lookups"""
     
     # Common nutrient codes in Child Nutrition database
@@ -434,37 +515,289 @@ class CNNutrientLookup:
     VITAMIN_C = 401    # Vitamin C
     VITAMIN_A = 320    # Vitamin A, RAE
     
-    @classmethod
-    def get_nutrient_value(cls, cn_code, nutrient_code):
-        """Get a specific nutrient value for a CN food"""
-        try:
-            nutrient_value = CNNutrientValue.objects.get(
-                cn_food__cn_code=cn_code,
-                nutrient__code=nutrient_code
-            )
-            return nutrient_value.nutrient_value
-        except CNNutrientValue.DoesNotExist:
-            return None
+    # Output name -> nutrient code for the grouped lookups
+    MACROS = {
+        'calories': ENERGY_KCAL,
+        'protein': PROTEIN,
+        'fat': TOTAL_FAT,
+        'carbs': CARBS,
+        'fiber': FIBER,
+        'sugars': SUGARS,
+    }
+    VITAMINS_MINERALS = {
+        'calcium': CALCIUM,
+        'iron': IRON,
+        'sodium': SODIUM,
+        'vitamin_c': VITAMIN_C,
+        'vitamin_a': VITAMIN_A,
+    }
     
     @classmethod
-    def get_macros(cls, cn_code):
-        """Get macronutrients for a CN food"""
-        return {
-            'calories': cls.get_nutrient_value(cn_code, cls.ENERGY_KCAL),
-            'protein': cls.get_nutrient_value(cn_code, cls.PROTEIN),
-            'fat': cls.get_nutrient_value(cn_code, cls.TOTAL_FAT),
-            'carbs': cls.get_nutrient_value(cn_code, cls.CARBS),
-            'fiber': cls.get_nutrient_value(cn_code, cls.FIBER),
-            'sugars': cls.get_nutrient_value(cn_code, cls.SUGARS),
-        }
+    def fetch_values(cls, food_ids, nutrient_ids):
+        return CNNutrientValue.objects.filter(
+            cn_food_id__in=food_ids, nutrient_id__in=nutrient_ids
+        ).values_list('cn_food_id', 'nutrient_id', Coalesce('amount', 'nutrient_value'))
+
+
+class DatasetRelease(models.Model):
+    """A run of one of the import commands; completed runs version the dataset"""
+    SOURCE_USDA = 'usda'
+    SOURCE_CN = 'cn'
+    SOURCE_CHOICES = [
+        (SOURCE_USDA, 'USDA FoodData Central'),
+        (SOURCE_CN, 'Child Nutrition'),
+    ]
+    
+    source = models.CharField(max_length=10, choices=SOURCE_CHOICES)
+    started_at = models.DateTimeField(auto_now_add=True)
+    completed_at = models.DateTimeField(null=True, blank=True)
+    
+    class Meta:
+        db_table = 'dataset_release'
+        ordering = ['-id']
+    
+    def __str__(self):
+        return f"Release {self.id} ({self.source})"
     
     @classmethod
-    def get_vitamins_minerals(cls, cn_code):
-        """Get key vitamins and minerals for a CN food"""
-        return {
-            'calcium': cls.get_nutrient_value(cn_code, cls.CALCIUM),
-            'iron': cls.get_nutrient_value(cn_code, cls.IRON),
-            'sodium': cls.get_nutrient_value(cn_code, cls.SODIUM),
-            'vitamin_c': cls.get_nutrient_value(cn_code, cls.VITAMIN_C),
-            'vitamin_a': cls.get_nutrient_value(cn_code, cls.VITAMIN_A),
-        }
\ No newline at end of file
+    def current_version(cls):
+        """Id of the most recently completed release, or 0 before any import"""
+        latest = cls.objects.filter(completed_at__isnull=False).order_by('-id').first()
+        return latest.id if latest else 0
+
+
+class DatasetChange(models.Model):
+    """A USDA or CN food inserted, updated or deleted by a dataset release; see foods.changes"""
+    ACTION_INSERT = 'insert'
+    ACTION_UPDATE = 'update'
+    ACTION_DELETE = 'delete'
+    ACTION_CHOICES = [
+        (ACTION_INSERT, 'Inserted'),
+        (ACTION_UPDATE, 'Updated'),
+        (ACTION_DELETE, 'Deleted'),
+    ]
+    
+    id = models.BigAutoField(primary_key=True)
+    version = models.IntegerField(help_text="DatasetRelease id")
+    source = models.CharField(max_length=10, choices=DatasetRelease.SOURCE_CHOICES)
+    record_id = models.BigIntegerField(help_text="fdc_id (usda) or cn_code (cn)")
+    action = models.CharField(max_length=10, choices=ACTION_CHOICES)
+    
+    class Meta:
+        db_table = 'dataset_change'
+        indexes = [
+            models.Index(fields=['version', 'source', 'record_id']),
+        ]
+    
+    def __str__(self):
+        return f"v{self.version} {self.action} {self.source}:{self.record_id}"
+
+
+class RecordFingerprint(models.Model):
+    """Content digest of a USDA or CN food as of the last recorded release"""
+    source = models.CharField(max_length=10, choices=DatasetRelease.SOURCE_CHOICES)
+    record_id = models.BigIntegerField()
+    digest = models.UUIDField(help_text="md5 of the food's columns, nutrients and portions")
+    
+    class Meta:
+        db_table = 'record_fingerprint'
+        unique_together = ['source', 'record_id']
+    
+    def __str__(self):
+        return f"{self.source}:{self.record_id} {self.digest}"
+
+
+class QueryLogEntry(models.Model):
+    """Rolling frequency log of normalized API queries, used to warm caches"""
+    kind = models.CharField(max_length=20)
+    params_key = models.CharField(max_length=40, help_text="SHA-1 of the normalized parameters")
+    params = models.JSONField()
+    hits = models.IntegerField(default=0)
+    last_seen = models.DateTimeField()
+    
+    class Meta:
+        db_table = 'query_log_entry'
+        unique_together = ['kind', 'params_key']
+        indexes = [
+            models.Index(fields=['kind', '-hits']),
+            models.Index(fields=['last_seen']),
+        ]
+    
+    def __str__(self):
+        return f"{self.kind} {self.params} ({self.hits})"
+
+
+class FoodNutritionSummary(models.Model):
+    """Per-food values of the common nutrients, one indexed column each.
+    
+    Denormalized from food_nutrient at the end of every import so search can
+    filter and sort on nutrients with a single join. Foods with a serving
+    size (branded foods) also get every nutrient per serving.
+    """
+    # Column name -> USDA nutrient id
+    NUTRIENT_COLUMNS = {**NutrientLookup.MACROS, **NutrientLookup.VITAMINS_MINERALS}
+    # Per-serving column -> per-100 g column
+    SERVING_COLUMNS = {f'{name}_per_serving': name for name in NUTRIENT_COLUMNS}
+    
+    food = models.OneToOneField(
+        Food, on_delete=models.DO_NOTHING, primary_key=True, db_column='fdc_id',
+        db_constraint=False, related_name='nutrition_summary'
+    )
+    calories = models.FloatField(null=True, blank=True)
+    protein = models.FloatField(null=True, blank=True)
+    fat = models.FloatField(null=True, blank=True)
+    carbs = models.FloatField(null=True, blank=True)
+    fiber = models.FloatField(null=True, blank=True)
+    sugars = models.FloatField(null=True, blank=True)
+    sodium = models.FloatField(null=True, blank=True)
+    calcium = models.FloatField(null=True, blank=True)
+    iron = models.FloatField(null=True, blank=True)
+    vitamin_c = models.FloatField(null=True, blank=True)
+    vitamin_a = models.FloatField(null=True, blank=True)
+    
+    serving_grams = models.FloatField(null=True, blank=True, help_text="Serving size in g (ml for liquids)")
+    serving_description = models.CharField(max_length=500, null=True, blank=True)
+    calories_per_serving = models.FloatField(null=True, blank=True)
+    protein_per_serving = models.FloatField(null=True, blank=True)
+    fat_per_serving = models.FloatField(null=True, blank=True)
+    carbs_per_serving = models.FloatField(null=True, blank=True)
+    fiber_per_serving = models.FloatField(null=True, blank=True)
+    sugars_per_serving = models.FloatField(null=True, blank=True)
+    sodium_per_serving = models.FloatField(null=True, blank=True)
+    calcium_per_serving = models.FloatField(null=True, blank=True)
+    iron_per_serving = models.FloatField(null=True, blank=True)
+    vitamin_c_per_serving = models.FloatField(null=True, blank=True)
+    vitamin_a_per_serving = models.FloatField(null=True, blank=True)
+    
+    class Meta:
+        db_table = 'food_nutrition_summary'
+        indexes = [
+            models.Index(fields=['calories']),
+            models.Index(fields=['protein']),
+            models.Index(fields=['fat']),
+            models.Index(fields=['carbs']),
+            models.Index(fields=['fiber']),
+            models.Index(fields=['sugars']),
+            models.Index(fields=['sodium']),
+            models.Index(fields=['calcium']),
+            models.Index(fields=['iron']),
+            models.Index(fields=['vitamin_c']),
+            models.Index(fields=['vitamin_a']),
+            models.Index(fields=['calories_per_serving']),
+            models.Index(fields=['protein_per_serving']),
+            models.Index(fields=['sugars_per_serving']),
+            models.Index(fields=['sodium_per_serving']),
+        ]
+    
+    def __str__(self):
+        return f"Nutrition summary for food {self.food_id}"
+
+
+class FoodIngredients(models.Model):
+    """Parsed ingredient list of a branded food, as an inverted index.
+    
+    Rebuilt from BrandedFood.ingredients at the end of every import; see
+    foods.ingredients. Both arrays are GIN-indexed, so "contains" and
+    "free of" filters are index lookups.
+    """
+    food = models.OneToOneField(
+        Food, on_delete=models.DO_NOTHING, primary_key=True, db_column='fdc_id',
+        db_constraint=False, related_name='ingredient_index'
+    )
+    tokens = ArrayField(models.TextField(), default=list, help_text="Normalized ingredient words and phrases")
+    allergens = ArrayField(models.CharField(max_length=20), default=list)
+    
+    class Meta:
+        db_table = 'food_ingredients'
+        indexes = [
+            GinIndex(fields=['tokens']),
+            GinIndex(fields=['allergens']),
+        ]
+    
+    def __str__(self):
+        return f"Ingredients of food {self.food_id}"
+
+
+class FoodGroup(models.Model):
+    """Canonical group of a food that has near-duplicates.
+    
+    Rebuilt at the end of every import; see foods.grouping. Foods without
+    near-duplicates have no row and are their own group.
+    """
+    food = models.OneToOneField(
+        Food, on_delete=models.DO_NOTHING, primary_key=True, db_column='fdc_id',
+        db_constraint=False, related_name='food_group'
+    )
+    group_id = models.IntegerField(db_index=True, help_text="fdc_id of the group's canonical food")
+    group_size = models.IntegerField()
+    
+    class Meta:
+        db_table = 'food_group'
+    
+    def __str__(self):
+        return f"Food {self.food_id} in group {self.group_id}"
+
+
+class CNFoodLink(models.Model):
+    """A Child Nutrition food resolved to a FoodData Central food.
+    
+    Rebuilt at the end of every import; see foods.linking.
+    """
+    METHOD_FDC_ID = 'fdc_id'
+    METHOD_GTIN = 'gtin'
+    METHOD_DESCRIPTION = 'description'
+    METHOD_CHOICES = [
+        (METHOD_FDC_ID, 'CN food fdc_id'),
+        (METHOD_GTIN, 'Matching GTIN'),
+        (METHOD_DESCRIPTION, 'Similar description'),
+    ]
+    
+    cn_food = models.ForeignKey(
+        CNFood, on_delete=models.DO_NOTHING, db_column='cn_code', db_constraint=False, related_name='fdc_links'
+    )
+    food = models.ForeignKey(
+        Food, on_delete=models.DO_NOTHING, db_column='fdc_id', db_constraint=False, related_name='cn_links'
+    )
+    method = models.CharField(max_length=20, choices=METHOD_CHOICES)
+    score = models.FloatField(help_text="1 for fdc_id and GTIN links, description similarity otherwise")
+    
+    class Meta:
+        db_table = 'cn_food_link'
+        constraints = [
+            models.UniqueConstraint(fields=['cn_food', 'food'], name='cn_food_link_unique'),
+        ]
+    
+    def __str__(self):
+        return f"CN {self.cn_food_id} -> FDC {self.food_id} ({self.method})"
+
+
+class FoodScore(models.Model):
+    """Per-food nutrient-density and health scores, one indexed column each.
+    
+    Computed from the nutrient matrix at the end of every import; the
+    columns match the definitions in foods.scores.
+    """
+    food = models.OneToOneField(
+        Food, on_delete=models.DO_NOTHING, primary_key=True, db_column='fdc_id',
+        db_constraint=False, related_name='scores'
+    )
+    SCORE_COLUMNS = ('nrf9_3', 'protein_per_100kcal', 'fiber_per_100kcal', 'sodium_per_100kcal', 'sugars_per_100kcal')
+    
+    nrf9_3 = models.FloatField(null=True, blank=True, help_text="Nutrient Rich Food index 9.3 per 100 kcal")
+    protein_per_100kcal = models.FloatField(null=True, blank=True)
+    fiber_per_100kcal = models.FloatField(null=True, blank=True)
+    sodium_per_100kcal = models.FloatField(null=True, blank=True)
+    sugars_per_100kcal = models.FloatField(null=True, blank=True)
+    
+    class Meta:
+        db_table = 'food_score'
+        indexes = [
+            models.Index(fields=['nrf9_3']),
+            models.Index(fields=['protein_per_100kcal']),
+            models.Index(fields=['fiber_per_100kcal']),
+            models.Index(fields=['sodium_per_100kcal']),
+            models.Index(fields=['sugars_per_100kcal']),
+        ]
+    
+    def __str__(self):
+        return f"Scores for food {self.food_id}"
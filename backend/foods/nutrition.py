@@ -0,0 +1,244 @@
+"""
+Nutrition totals for meals and recipes.
+
+A meal is a list of ingredients, each a USDA food (`fdc_id`) or a Child
+Nutrition food (`cn_code`) with an `amount` in grams, or in one of the food's
+household measures: `portion_id` (a FoodPortion of the USDA food),
+`weight_seq` (the sequence number of a CNWeight of the CN food) or a `unit`
+name such as "cup", "slice" or "oz" (see foods.conversions).
+
+Measures come from the in-memory conversion table when it has been built
+(otherwise portions are fetched in one query per table), descriptions and
+nutrient values in one batch per source (USDA values from the memory-mapped
+nutrient matrix when built; CN values already converted to the USDA
+nutrient's unit, see foods.units), and the per-100 g values are scaled and
+summed as one ingredients x nutrients array.
+"""
+
+from rest_framework.exceptions import ValidationError
+
+from . import conversions, matrix
+from .models import (
+    DatasetRelease, Food, FoodPortion, NutrientLookup, CNFood, CNWeight, CNNutrientLookup
+)
+
+np = matrix.np
+
+MAX_INGREDIENTS = 500
+# Grams, portions or units of one ingredient
+MAX_AMOUNT = 100000
+
+# Output nutrient name -> USDA nutrient id / CN nutrient code (same names)
+NUTRIENTS = {**NutrientLookup.MACROS, **NutrientLookup.VITAMINS_MINERALS}
+CN_NUTRIENTS = {**CNNutrientLookup.MACROS, **CNNutrientLookup.VITAMINS_MINERALS}
+NUTRIENT_NAMES = list(NUTRIENTS)
+
+
+def parse_ingredient(item):
+    """Validate one ingredient dict; raises ValueError with a message"""
+    if not isinstance(item, dict):
+        raise ValueError('Each ingredient must be an object.')
+    if ('fdc_id' in item) == ('cn_code' in item):
+        raise ValueError('Give exactly one of fdc_id or cn_code.')
+
+    if 'fdc_id' in item:
+        source, food_id, unit_key = DatasetRelease.SOURCE_USDA, item['fdc_id'], 'portion_id'
+        if 'weight_seq' in item:
+            raise ValueError('weight_seq applies to CN foods; use portion_id.')
+    else:
+        source, food_id, unit_key = DatasetRelease.SOURCE_CN, item['cn_code'], 'weight_seq'
+        if 'portion_id' in item:
+            raise ValueError('portion_id applies to USDA foods; use weight_seq.')
+
+    if item.get('amount') is None:
+        raise ValueError('amount is required.')
+    if item.get('unit') is not None and item.get(unit_key) is not None:
+        raise ValueError(f'Give at most one of unit or {unit_key}.')
+    try:
+        food_id = int(food_id)
+        amount = float(item['amount'])
+        unit_id = int(item[unit_key]) if item.get(unit_key) is not None else None
+    except (TypeError, ValueError):
+        raise ValueError('Food ids, amount and portion ids must be numbers.')
+    # Also rejects NaN, and "inf" or 1e400, which would scale every nutrient to inf
+    if not 0 < amount <= MAX_AMOUNT:
+        raise ValueError(f'amount must be positive and at most {MAX_AMOUNT}.')
+    unit_name = item.get('unit')
+    if unit_name is not None and not (isinstance(unit_name, str) and unit_name.strip()):
+        raise ValueError('unit must be a unit name such as "cup" or "g".')
+
+    return {'source': source, 'id': food_id, 'amount': amount, 'unit_id': unit_id, 'unit_name': unit_name}
+
+
+def parse_ingredients(data):
+    """Validated ingredient dicts from a request body"""
+    items = data.get('ingredients') if isinstance(data, dict) else None
+    if not isinstance(items, list) or not items:
+        raise ValidationError({'ingredients': 'A non-empty list of ingredients is required.'})
+    if len(items) > MAX_INGREDIENTS:
+        raise ValidationError({'ingredients': f'At most {MAX_INGREDIENTS} ingredients are allowed.'})
+
+    ingredients, errors = [], {}
+    for index, item in enumerate(items):
+        try:
+            ingredients.append(parse_ingredient(item))
+        except ValueError as exc:
+            errors[index] = str(exc)
+    if errors:
+        raise ValidationError({'ingredients': errors})
+    return ingredients
+
+
+def resolve_foods(ingredients):
+    """Set `description`, `unit` and `grams` on each ingredient, one query per table"""
+    usda = [item for item in ingredients if item['source'] == DatasetRelease.SOURCE_USDA]
+    cn = [item for item in ingredients if item['source'] == DatasetRelease.SOURCE_CN]
+
+    descriptions = {}
+    if usda:
+        descriptions[DatasetRelease.SOURCE_USDA] = dict(
+            Food.objects.filter(fdc_id__in={item['id'] for item in usda}).values_list('fdc_id', 'description')
+        )
+    if cn:
+        descriptions[DatasetRelease.SOURCE_CN] = dict(
+            CNFood.objects.filter(cn_code__in={item['id'] for item in cn}).values_list('cn_code', 'descriptor')
+        )
+
+    conversion_index = conversions.get_index()
+    units = portion_weights(usda, cn) if conversion_index is None else {}
+
+    errors = {}
+    for index, item in enumerate(ingredients):
+        description = descriptions[item['source']].get(item['id'])
+        if description is None:
+            errors[index] = f"Unknown {'fdc_id' if item['source'] == DatasetRelease.SOURCE_USDA else 'cn_code'} {item['id']}."
+            continue
+        item['description'] = description
+        if item['unit_id'] is None and item['unit_name'] is None:
+            item['unit'], item['grams'] = 'g', item['amount']
+            continue
+
+        if item['unit_name'] is not None:
+            if conversion_index is not None:
+                converted = conversion_index.grams(item['source'], item['id'], item['unit_name'], item['amount'])
+            else:
+                grams = conversions.convert_mass(item['unit_name'], item['amount'])
+                converted = None if grams is None else (grams, conversions.normalize_unit(item['unit_name']))
+            if converted is None:
+                errors[index] = f"Cannot convert {item['unit_name']!r} to grams for this food."
+                continue
+            item['grams'], item['unit'] = converted
+            continue
+
+        if conversion_index is not None:
+            measure = conversion_index.by_ref(item['source'], item['id'], item['unit_id'])
+            unit = None if measure is None else (measure['label'], measure['grams'])
+        else:
+            unit = units.get((item['source'], item['id'], item['unit_id']))
+        if unit is None:
+            errors[index] = f"Unknown unit {item['unit_id']} for this food."
+            continue
+        item['unit'], item['grams'] = unit[0], item['amount'] * unit[1]
+    if errors:
+        raise ValidationError({'ingredients': errors})
+
+
+def portion_weights(usda, cn):
+    """{(source, food id, unit id): (unit label, grams per unit)}, one query per table"""
+    units = {}
+    portion_ids = {item['unit_id'] for item in usda if item['unit_id'] is not None}
+    if portion_ids:
+        for portion_id, fdc_id, amount, gram_weight, description, modifier in FoodPortion.objects.filter(
+            id__in=portion_ids
+        ).values_list('id', 'fdc_id', 'amount', 'gram_weight', 'portion_description', 'modifier'):
+            if gram_weight:
+                label = description or modifier or 'portion'
+                units[(DatasetRelease.SOURCE_USDA, fdc_id, portion_id)] = (label, gram_weight / (amount or 1))
+    weight_seqs = {item['unit_id'] for item in cn if item['unit_id'] is not None}
+    if weight_seqs:
+        for cn_code, sequence_num, amount, unit_amount, description in CNWeight.objects.filter(
+            cn_food_id__in={item['id'] for item in cn}, sequence_num__in=weight_seqs
+        ).values_list('cn_food_id', 'sequence_num', 'amount', 'unit_amount', 'measure_description'):
+            units[(DatasetRelease.SOURCE_CN, cn_code, sequence_num)] = (description, unit_amount / (amount or 1))
+    return units
+
+
+def nutrient_rows(ingredients):
+    """Per-100 g values as [ingredients x NUTRIENT_NAMES] rows; None where missing"""
+    rows = [None] * len(ingredients)
+    usda_index = [i for i, item in enumerate(ingredients) if item['source'] == DatasetRelease.SOURCE_USDA]
+    cn_index = [i for i, item in enumerate(ingredients) if item['source'] == DatasetRelease.SOURCE_CN]
+
+    if usda_index:
+        fdc_ids = [ingredients[i]['id'] for i in usda_index]
+        nutrient_matrix = matrix.get_matrix()
+        if nutrient_matrix is not None:
+            values = nutrient_matrix.select(fdc_ids, list(NUTRIENTS.values())).astype(np.float64)
+            for i, row in zip(usda_index, values):
+                rows[i] = row
+        else:
+            values = NutrientLookup.get_values(fdc_ids, NUTRIENTS.values())
+            for i, fdc_id in zip(usda_index, fdc_ids):
+                rows[i] = [values[fdc_id][nutrient_id] for nutrient_id in NUTRIENTS.values()]
+
+    if cn_index:
+        cn_codes = [ingredients[i]['id'] for i in cn_index]
+        codes = [CN_NUTRIENTS[name] for name in NUTRIENT_NAMES]
+        values = CNNutrientLookup.get_values(cn_codes, codes)
+        for i, cn_code in zip(cn_index, cn_codes):
+            rows[i] = [values[cn_code][code] for code in codes]
+    return rows
+
+
+def scale_and_sum(rows, grams):
+    """(per-ingredient values, totals) for `grams` of each ingredient.
+
+    Totals skip missing values and are None only when no ingredient has a
+    value for the nutrient.
+    """
+    if np is not None:
+        values = np.array(
+            [[np.nan if value is None else value for value in row] for row in rows], dtype=np.float64
+        ) * (np.asarray(grams, dtype=np.float64) / 100)[:, None]
+        present = ~np.isnan(values)
+        totals = np.where(present.any(axis=0), np.nansum(values, axis=0), np.nan)
+        return _nullify(values.round(3).tolist()), _nullify([totals.round(3).tolist()])[0]
+
+    scaled = [
+        [None if value is None else round(value * weight / 100, 3) for value in row]
+        for row, weight in zip(rows, grams)
+    ]
+    totals = []
+    for column in zip(*scaled):
+        present = [value for value in column if value is not None]
+        totals.append(round(sum(present), 3) if present else None)
+    return scaled, totals
+
+
+def _nullify(rows):
+    return [[None if value != value else value for value in row] for row in rows]
+
+
+def meal_nutrition(data):
+    """Total and per-ingredient nutrition for a meal request body"""
+    ingredients = parse_ingredients(data)
+    resolve_foods(ingredients)
+    grams = [item['grams'] for item in ingredients]
+    scaled, totals = scale_and_sum(nutrient_rows(ingredients), grams)
+
+    results = []
+    for item, values in zip(ingredients, scaled):
+        id_field = 'fdc_id' if item['source'] == DatasetRelease.SOURCE_USDA else 'cn_code'
+        results.append({
+            id_field: item['id'],
+            'description': item['description'],
+            'amount': item['amount'],
+            'unit': item['unit'],
+            'grams': round(item['grams'], 3),
+            'nutrients': dict(zip(NUTRIENT_NAMES, values)),
+        })
+    return {
+        'total_grams': round(sum(grams), 3),
+        'totals': dict(zip(NUTRIENT_NAMES, totals)),
+        'ingredients': results,
+    }
@@ -0,0 +1,66 @@
+"""
+Bookkeeping shared by the import commands.
+
+Every import run is recorded as a DatasetRelease. Completing a release
+logs the foods it changed (see foods.changes), rebuilds the derived tables
+and files (canonical nutrient units, the per-food nutrient summary, the
+ingredient index, the CN <-> FDC links, the offline bundles, the GTIN
+index for barcode lookups, the memory-mapped nutrient matrix, the food
+scores, the similar-foods index, the near-duplicate food groups, the unit
+conversion table, the facet index and the SQLite snapshot for edge nodes),
+then publishes its id as the new dataset version, which invalidates all
+cached API responses and switches every worker process to the new files,
+and finally re-warms the caches from the query log.
+"""
+
+from django.core.management import call_command
+from django.utils import timezone
+
+from . import matrix
+from .cache import response_cache
+from .models import DatasetRelease
+
+
+def begin_import(source):
+    """Record the start of an import run"""
+    return DatasetRelease.objects.create(source=source)
+
+
+def complete_import(release, stdout=None, warm_caches=True):
+    """Build an import run's data files, then mark it completed, invalidate and re-warm caches.
+    
+    The release only becomes the current dataset version once every build
+    step has succeeded; if one raises, readers stay on the previous version.
+    """
+    build_data_files(release, stdout)
+    release.completed_at = timezone.now()
+    release.save(update_fields=['completed_at'])
+    response_cache.invalidate(release.id)
+    if stdout is not None:
+        stdout.write(f'Dataset version is now {release.id}; response caches invalidated')
+    
+    if warm_caches:
+        call_command('warm_caches', stdout=stdout)
+    return release
+
+
+def build_data_files(release, stdout=None):
+    """Rebuild the denormalized tables and the files that read paths memory-map"""
+    call_command('record_changes', dataset_version=release.id, stdout=stdout)
+    call_command('build_nutrient_units', stdout=stdout)
+    call_command('build_food_summaries', stdout=stdout)
+    call_command('build_ingredient_index', stdout=stdout)
+    call_command('build_cn_links', stdout=stdout)
+    call_command('build_bundles', dataset_version=release.id, stdout=stdout)
+    call_command('build_barcode_index', dataset_version=release.id, stdout=stdout)
+    if matrix.available():
+        call_command('build_nutrient_matrix', dataset_version=release.id, stdout=stdout)
+        call_command('build_food_scores', dataset_version=release.id, stdout=stdout)
+        call_command('build_similarity_index', dataset_version=release.id, stdout=stdout)
+        call_command('build_food_groups', dataset_version=release.id, stdout=stdout)
+        call_command('build_unit_conversions', dataset_version=release.id, stdout=stdout)
+        call_command('build_facet_index', dataset_version=release.id, stdout=stdout)
+    elif stdout is not None:
+        stdout.write('NumPy is not installed; skipping the nutrient matrix and the search indexes')
+    # Last, so the snapshot carries the summaries and scores built above
+    call_command('build_snapshot', dataset_version=release.id, stdout=stdout)
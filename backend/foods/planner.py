@@ -0,0 +1,382 @@
+"""
+Meal plans optimized against daily nutrient targets.
+
+A plan request names daily targets for the named nutrients
+(foods.nutrition.NUTRIENT_NAMES), a candidate pool of USDA foods, and
+portion constraints:
+
+    {"targets": {"calories": 2000, "protein": {"min": 90},
+                 "sodium": {"max": 2300}, "fiber": {"min": 30}},
+     "pool": {"data_types": ["foundation_food"], "category_ids": [9, 11],
+              "fdc_ids": [171705], "exclude_fdc_ids": [], "size": 200},
+     "days": 7, "foods_per_day": 6, "max_grams": 400, "max_repeats": 3}
+
+A number as a target means within 5% of it. Favorites (`pool.fdc_ids`) are
+always candidates; the rest of the pool is a seeded sample of the matching
+foods that have an energy value.
+
+Solving is split from the database work so that it can run in worker
+processes: `prepare()` loads the pool's per-gram nutrient values (from the
+nutrient matrix when built) and household measures (from the conversion
+table when built), `solve()` is pure NumPy, and `render()` turns the
+solution into the response. Each day is solved as a
+box-constrained least-squares problem over the targets' relative violations
+(accelerated projected gradient), keeping the `foods_per_day` foods with the
+largest amounts, re-solving over them, then rounding to whole portions with a
+coordinate-descent clean-up. Foods already used earlier in the week cost
+more, and none is used more than `max_repeats` times.
+"""
+
+from concurrent.futures import ProcessPoolExecutor
+
+from rest_framework.exceptions import ValidationError
+
+from . import conversions, matrix
+from .models import DatasetRelease, Food, FoodPortion, NutrientLookup
+from .nutrition import NUTRIENTS, NUTRIENT_NAMES
+
+np = matrix.np
+
+DEFAULT_DATA_TYPES = ('foundation_food', 'sr_legacy_food', 'survey_fndds_food')
+TARGET_TOLERANCE = 0.05
+DEFAULTS = {'days': 1, 'foods_per_day': 6, 'max_grams': 400, 'max_repeats': 3, 'seed': 0}
+LIMITS = {'days': (1, 7), 'foods_per_day': (1, 20), 'max_grams': (10, 2000), 'max_repeats': (1, 7), 'seed': (0, 2 ** 31)}
+DEFAULT_POOL_SIZE = 200
+MAX_POOL_SIZE = 1000
+GRAM_STEP = 10
+ITERATIONS = 300
+# Costs are per gram; a 1% target violation costs VIOLATION_WEIGHT * 1e-4,
+# so costs only decide between plans that fit the targets about as well
+VIOLATION_WEIGHT = 1e4
+VARIETY_COST = 0.05
+GRAM_COST = 1e-5
+
+
+def available():
+    """Whether NumPy is installed, which the solver requires"""
+    return np is not None
+
+
+def parse_targets(targets):
+    """{nutrient: (min, max)} from a targets object; raises ValueError"""
+    if not isinstance(targets, dict) or not targets:
+        raise ValueError('A non-empty object of nutrient targets is required.')
+    bounds = {}
+    for name, target in targets.items():
+        nutrient = 'calories' if name == 'energy' else name
+        if nutrient not in NUTRIENTS:
+            raise ValueError(f'Unknown nutrient "{name}"; use one of: {", ".join(NUTRIENT_NAMES)}.')
+        try:
+            if isinstance(target, dict):
+                low = float(target['min']) if target.get('min') is not None else 0.0
+                high = float(target['max']) if target.get('max') is not None else float('inf')
+            else:
+                low = float(target) * (1 - TARGET_TOLERANCE)
+                high = float(target) * (1 + TARGET_TOLERANCE)
+        except (TypeError, ValueError):
+            raise ValueError(f'Target for "{name}" must be a number or {{"min": ..., "max": ...}}.')
+        # The solver scales each nutrient by its bound, so a zero max is rejected too
+        if low < 0 or high < low or high == 0 or (low == 0 and high == float('inf')):
+            raise ValueError(f'Target for "{name}" needs 0 <= min <= max, max > 0 and at least one bound.')
+        bounds[nutrient] = (low, high)
+    return bounds
+
+
+def parse_pool(pool):
+    pool = pool if pool is not None else {}
+    if not isinstance(pool, dict):
+        raise ValueError('pool must be an object.')
+    try:
+        parsed = {
+            'data_types': [str(value) for value in pool.get('data_types') or DEFAULT_DATA_TYPES],
+            'category_ids': [int(value) for value in pool.get('category_ids') or []],
+            'fdc_ids': [int(value) for value in pool.get('fdc_ids') or []],
+            'exclude_fdc_ids': [int(value) for value in pool.get('exclude_fdc_ids') or []],
+            'size': int(pool.get('size') or DEFAULT_POOL_SIZE),
+        }
+    except (TypeError, ValueError):
+        raise ValueError('Pool ids and size must be numbers.')
+    if not 1 <= parsed['size'] <= MAX_POOL_SIZE:
+        raise ValueError(f'pool.size must be between 1 and {MAX_POOL_SIZE}.')
+    return parsed
+
+
+def parse_plan_request(data):
+    """Validated plan request; raises ValidationError keyed by field"""
+    if not isinstance(data, dict):
+        raise ValidationError({'non_field_errors': 'A JSON object is required.'})
+    request, errors = {}, {}
+    for key, parse in (('targets', parse_targets), ('pool', parse_pool)):
+        try:
+            request[key] = parse(data.get(key))
+        except ValueError as exc:
+            errors[key] = str(exc)
+    for key, default in DEFAULTS.items():
+        low, high = LIMITS[key]
+        try:
+            request[key] = int(data.get(key, default))
+            if not low <= request[key] <= high:
+                raise ValueError
+        except (TypeError, ValueError):
+            errors[key] = f'An integer between {low} and {high} is required.'
+    if errors:
+        raise ValidationError(errors)
+    return request
+
+
+def per_gram_values(fdc_ids, names):
+    """[len(fdc_ids), len(names)] nutrient amounts per gram, 0 where missing"""
+    nutrient_ids = [NUTRIENTS[name] for name in names]
+    nutrient_matrix = matrix.get_matrix()
+    if nutrient_matrix is not None:
+        values = nutrient_matrix.select(fdc_ids, nutrient_ids).astype(np.float64)
+    else:
+        lookup = NutrientLookup.get_values(fdc_ids, nutrient_ids)
+        values = np.array([
+            [np.nan if lookup[fdc_id][nid] is None else lookup[fdc_id][nid] for nid in nutrient_ids]
+            for fdc_id in fdc_ids
+        ], dtype=np.float64).reshape(len(fdc_ids), len(nutrient_ids))
+    return np.nan_to_num(values) / 100
+
+
+def candidate_pool(pool, seed):
+    """Favorites plus a seeded sample of matching foods with an energy value"""
+    excluded = set(pool['exclude_fdc_ids'])
+    favorites = list(Food.objects.filter(fdc_id__in=set(pool['fdc_ids']) - excluded).order_by(
+        'fdc_id'
+    ).values_list('fdc_id', flat=True))
+    foods = Food.objects.filter(
+        data_type__in=pool['data_types'], nutrition_summary__calories__gt=0
+    ).exclude(fdc_id__in=excluded | set(favorites))
+    if pool['category_ids']:
+        foods = foods.filter(food_category_id__in=pool['category_ids'])
+    fdc_ids = np.fromiter(foods.order_by('fdc_id').values_list('fdc_id', flat=True).iterator(), dtype=np.int64)
+    size = max(pool['size'] - len(favorites), 0)
+    if len(fdc_ids) > size:
+        fdc_ids = np.sort(np.random.default_rng(seed).choice(fdc_ids, size, replace=False))
+    return favorites + fdc_ids.tolist()
+
+
+def portion_units(fdc_ids):
+    """{fdc_id: (portion id, label, grams per unit)} for the first household measure of each food"""
+    conversion_index = conversions.get_index()
+    if conversion_index is not None:
+        units = {}
+        for fdc_id in fdc_ids:
+            measure = conversion_index.default_unit(DatasetRelease.SOURCE_USDA, fdc_id)
+            if measure is not None:
+                units[fdc_id] = (measure['ref'], measure['label'], measure['grams'])
+        return units
+
+    units = {}
+    for portion_id, fdc_id, amount, gram_weight, description, modifier in FoodPortion.objects.filter(
+        fdc_id__in=fdc_ids, gram_weight__gt=0
+    ).order_by('fdc_id', 'seq_num', 'id').values_list(
+        'id', 'fdc_id', 'amount', 'gram_weight', 'portion_description', 'modifier'
+    ):
+        if fdc_id not in units:
+            units[fdc_id] = (portion_id, description or modifier or 'portion', gram_weight / (amount or 1))
+    return units
+
+
+def prepare(request):
+    """Load everything `solve()` needs for a parsed plan request"""
+    names = list(request['targets'])
+    fdc_ids = candidate_pool(request['pool'], request['seed'])
+    portions = portion_units(fdc_ids)
+    unit_grams = [portions[fdc_id][2] if fdc_id in portions else GRAM_STEP for fdc_id in fdc_ids]
+    return {
+        'request': request,
+        'fdc_ids': fdc_ids,
+        'portions': portions,
+        'nutrients': NUTRIENT_NAMES,
+        'values': per_gram_values(fdc_ids, NUTRIENT_NAMES),
+        'target_columns': [NUTRIENT_NAMES.index(name) for name in names],
+        'low': np.array([request['targets'][name][0] for name in names]),
+        'high': np.array([request['targets'][name][1] for name in names]),
+        'unit_grams': np.array(unit_grams, dtype=np.float64),
+    }
+
+
+class DaySolver:
+    """Box-constrained least squares over relative target violations for one day"""
+
+    def __init__(self, values, low, high):
+        # Scale each nutrient by its target so violations are relative
+        scale = np.where(np.isfinite(high), high, low)
+        scale = np.where(low > 0, low, scale) / np.sqrt(VIOLATION_WEIGHT)
+        self.values = values / scale
+        self.low = low / scale
+        self.high = high / scale
+
+    def violations(self, totals):
+        return np.maximum(self.low - totals, 0), np.maximum(totals - self.high, 0)
+
+    def objective(self, grams, costs):
+        under, over = self.violations(grams @ self.values)
+        return float((under ** 2).sum() + (over ** 2).sum() + costs @ grams)
+
+    def solve(self, rows, costs, max_grams, iterations=ITERATIONS):
+        """Optimal grams of each food in `rows` (accelerated projected gradient)"""
+        values = self.values[rows]
+        costs = costs[rows]
+        lipschitz = 2 * np.linalg.norm(values, 2) ** 2 if len(rows) else 0
+        if not lipschitz:
+            return np.zeros(len(rows))
+        step = 1 / lipschitz
+        grams = momentum = np.zeros(len(rows))
+        t = 1.0
+        for _ in range(iterations):
+            under, over = self.violations(momentum @ values)
+            gradient = 2 * values @ (over - under) + costs
+            updated = np.clip(momentum - step * gradient, 0, max_grams)
+            t_next = (1 + np.sqrt(1 + 4 * t * t)) / 2
+            momentum = updated + ((t - 1) / t_next) * (updated - grams)
+            if np.abs(updated - grams).max() < 1e-2:
+                grams = updated
+                break
+            grams, t = updated, t_next
+        return grams
+
+    def round_to_units(self, rows, grams, unit_grams, costs, max_grams, passes=3):
+        """Whole units of each food, improved one unit at a time"""
+        units = unit_grams[rows]
+        max_units = np.maximum(np.floor(max_grams / units), 1)
+        counts = np.clip(np.round(grams / units), 0, max_units)
+        counts[(counts == 0) & (grams > 0.5 * units)] = 1
+        full = np.zeros(len(self.values))
+
+        def amounts():
+            full[:] = 0
+            full[rows] = counts * units
+            return full
+
+        best = self.objective(amounts(), costs)
+        for _ in range(passes):
+            improved = False
+            for i in range(len(rows)):
+                for delta in (1, -1):
+                    if not 0 <= counts[i] + delta <= max_units[i]:
+                        continue
+                    counts[i] += delta
+                    score = self.objective(amounts(), costs)
+                    if score < best - 1e-12:
+                        best, improved = score, True
+                        break
+                    counts[i] -= delta
+            if not improved:
+                break
+        return counts, best
+
+
+def solve(problem):
+    """[(day objective, [(pool index, units), ...]), ...] for a prepared problem"""
+    request = problem['request']
+    values = problem['values'][:, problem['target_columns']]
+    solver = DaySolver(values, problem['low'], problem['high'])
+    uses = np.zeros(len(values))
+    max_grams = float(request['max_grams'])
+    days = []
+
+    for _ in range(request['days']):
+        costs = GRAM_COST + VARIETY_COST * uses / max_grams
+        allowed = np.flatnonzero(uses < request['max_repeats'])
+        grams = solver.solve(allowed, costs, max_grams)
+        largest = np.argsort(-grams, kind='stable')[:request['foods_per_day']]
+        chosen = np.sort(allowed[largest[grams[largest] > 0]])
+        grams = solver.solve(chosen, costs, max_grams)
+        counts, score = solver.round_to_units(chosen, grams, problem['unit_grams'], costs, max_grams)
+        foods = [(int(row), float(count)) for row, count in zip(chosen, counts) if count > 0]
+        for row, _ in foods:
+            uses[row] += 1
+        days.append((score, foods))
+    return days
+
+
+def render(problem, days):
+    """Response data for a solved problem"""
+    request = problem['request']
+    fdc_ids, portions = problem['fdc_ids'], problem['portions']
+    used = {fdc_ids[row] for _, foods in days for row, _ in foods}
+    descriptions = dict(Food.objects.filter(fdc_id__in=used).values_list('fdc_id', 'description'))
+
+    plan, day_totals = [], []
+    for number, (score, foods) in enumerate(days, start=1):
+        items = []
+        totals = np.zeros(len(problem['nutrients']))
+        for row, count in foods:
+            fdc_id = fdc_ids[row]
+            grams = count * problem['unit_grams'][row]
+            nutrients = problem['values'][row] * grams
+            totals += nutrients
+            portion = portions.get(fdc_id)
+            items.append({
+                'fdc_id': fdc_id,
+                'description': descriptions.get(fdc_id),
+                'grams': round(float(grams), 1),
+                'portion': {'id': portion[0], 'description': portion[1], 'quantity': count} if portion else None,
+                'nutrients': _rounded(problem['nutrients'], nutrients),
+            })
+        day_totals.append(totals)
+        plan.append({
+            'day': number,
+            'foods': items,
+            'totals': _rounded(problem['nutrients'], totals),
+            'targets': _target_status(request['targets'], problem['nutrients'], totals),
+            'score': round(score, 6),
+        })
+    return {
+        'days': plan,
+        'average': _rounded(problem['nutrients'], np.mean(day_totals, axis=0)) if day_totals else {},
+        'pool_size': len(fdc_ids),
+    }
+
+
+def _rounded(names, values):
+    return {name: round(float(value), 3) for name, value in zip(names, values)}
+
+
+def _target_status(targets, names, totals):
+    status = {}
+    for name, (low, high) in targets.items():
+        value = float(totals[names.index(name)])
+        status[name] = {
+            'min': low,
+            'max': None if high == float('inf') else high,
+            'value': round(value, 3),
+            'met': low - 1e-9 <= value <= high + 1e-9,
+        }
+    return status
+
+
+def plan_meals(data):
+    """Optimized meal plan for one request body"""
+    if not available():
+        raise RuntimeError('NumPy is required for meal planning')
+    problem = prepare(parse_plan_request(data))
+    return render(problem, solve(problem))
+
+
+def plan_meals_batch(bodies, workers=None):
+    """Plans for many request bodies, solving across a process pool.
+
+    Database reads happen in this process; only the NumPy solves are sent to
+    the workers. Invalid bodies yield {"errors": ...} in their slot.
+    """
+    if not available():
+        raise RuntimeError('NumPy is required for meal planning')
+    problems, results = [], [None] * len(bodies)
+    for index, body in enumerate(bodies):
+        try:
+            problems.append((index, prepare(parse_plan_request(body))))
+        except ValidationError as exc:
+            results[index] = {'errors': exc.detail}
+
+    if workers == 1 or len(problems) <= 1:
+        solutions = [solve(problem) for _, problem in problems]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            solutions = list(executor.map(solve, [problem for _, problem in problems], chunksize=4))
+    for (index, problem), days in zip(problems, solutions):
+        results[index] = render(problem, days)
+    return results
@@ -0,0 +1,182 @@
+"""
+Rolling frequency log of the queries the foods API serves.
+
+Views record their normalized parameters here. Counts are buffered in
+memory and folded into QueryLogEntry rows in small batches (every
+FLUSH_EVERY queries or FLUSH_INTERVAL seconds) by a background thread, so
+requests never do database work for logging and a database error can't
+fail a request; counts that could not be written are kept for the next
+flush. The warm_caches command replays the most frequent entries after
+each import.
+"""
+
+import atexit
+import hashlib
+import json
+import logging
+import threading
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import DatabaseError, IntegrityError, connection, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .models import QueryLogEntry
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SETTINGS = {
+    'ENABLED': True,
+    'FLUSH_IN_BACKGROUND': True,
+    'FLUSH_EVERY': 200,
+    'FLUSH_INTERVAL': 30,
+    'WINDOW_DAYS': 14,
+    'MAX_ENTRIES': 50000,
+}
+
+
+def get_query_log_settings():
+    """FOODS_QUERY_LOG settings merged over the defaults"""
+    return {**DEFAULT_SETTINGS, **getattr(settings, 'FOODS_QUERY_LOG', {})}
+
+
+def params_key(params):
+    payload = json.dumps(params, sort_keys=True, separators=(',', ':'), default=str)
+    return hashlib.sha1(payload.encode('utf-8')).hexdigest()
+
+
+class QueryRecorder:
+    """Buffers query counts in memory and flushes them to the database"""
+
+    def __init__(self, options=None):
+        self.options = options or get_query_log_settings()
+        self._pending = {}
+        self._pending_total = 0
+        self._last_flush = time.monotonic()
+        self._lock = threading.Lock()
+        self._flush_thread = None
+
+    def record(self, kind, params):
+        if not self.options['ENABLED']:
+            return
+        key = (kind, params_key(params))
+        with self._lock:
+            if key in self._pending:
+                self._pending[key][1] += 1
+            else:
+                self._pending[key] = [params, 1]
+            self._pending_total += 1
+            due = (
+                self._pending_total >= self.options['FLUSH_EVERY']
+                or time.monotonic() - self._last_flush >= self.options['FLUSH_INTERVAL']
+            )
+        if due:
+            self.schedule_flush()
+
+    def schedule_flush(self):
+        """Flush on a background thread, unless one is already running"""
+        if not self.options['FLUSH_IN_BACKGROUND']:
+            self.flush()
+            return
+        with self._lock:
+            if self._flush_thread is not None and self._flush_thread.is_alive():
+                return
+            self._last_flush = time.monotonic()
+            self._flush_thread = threading.Thread(target=self._flush_in_thread, name='query-log-flush', daemon=True)
+            self._flush_thread.start()
+
+    def _flush_in_thread(self):
+        try:
+            self.flush()
+        finally:
+            # The thread's own connection; request threads are unaffected
+            connection.close()
+
+    def flush(self):
+        """Write buffered counts to QueryLogEntry; returns False if the database failed"""
+        with self._lock:
+            pending, self._pending, self._pending_total = self._pending, {}, 0
+            self._last_flush = time.monotonic()
+        try:
+            self._write(pending)
+        except DatabaseError:
+            logger.exception('Could not write %d query log entries; keeping them for the next flush', len(pending))
+            self._requeue(pending)
+            return False
+        return True
+
+    def clear(self):
+        """Drop buffered counts without writing them"""
+        with self._lock:
+            self._pending, self._pending_total = {}, 0
+
+    def _requeue(self, pending):
+        # Not added to the pending total, so a database outage is retried
+        # every FLUSH_INTERVAL rather than on every request
+        with self._lock:
+            for key, (params, count) in pending.items():
+                if key in self._pending:
+                    self._pending[key][1] += count
+                else:
+                    self._pending[key] = [params, count]
+
+    def _write(self, pending):
+        """Fold counts into QueryLogEntry, removing each from `pending` once written"""
+        now = timezone.now()
+        for (kind, key), (params, count) in list(pending.items()):
+            updated = QueryLogEntry.objects.filter(kind=kind, params_key=key).update(
+                hits=F('hits') + count, last_seen=now
+            )
+            if not updated:
+                try:
+                    with transaction.atomic():
+                        QueryLogEntry.objects.create(
+                            kind=kind, params_key=key, params=params, hits=count, last_seen=now
+                        )
+                except IntegrityError:
+                    # Another worker created the row first
+                    QueryLogEntry.objects.filter(kind=kind, params_key=key).update(
+                        hits=F('hits') + count, last_seen=now
+                    )
+            del pending[(kind, key)]
+
+
+def top_queries(kind, limit):
+    """Most frequent parameter dicts recorded for a kind"""
+    return list(
+        QueryLogEntry.objects.filter(kind=kind)
+        .order_by('-hits', '-last_seen')
+        .values_list('params', flat=True)[:limit]
+    )
+
+
+def prune_query_log(window_days=None, max_entries=None):
+    """Drop entries outside the rolling window and keep at most `max_entries` per kind"""
+    options = get_query_log_settings()
+    window_days = options['WINDOW_DAYS'] if window_days is None else window_days
+    max_entries = options['MAX_ENTRIES'] if max_entries is None else max_entries
+
+    deleted, _ = QueryLogEntry.objects.filter(
+        last_seen__lt=timezone.now() - timedelta(days=window_days)
+    ).delete()
+    for kind in QueryLogEntry.objects.values_list('kind', flat=True).distinct():
+        cutoff_ids = (
+            QueryLogEntry.objects.filter(kind=kind)
+            .order_by('-hits', '-last_seen')
+            .values_list('id', flat=True)[max_entries:]
+        )
+        deleted += QueryLogEntry.objects.filter(id__in=list(cutoff_ids)).delete()[0]
+    return deleted
+
+
+def _flush_at_exit():
+    # A recorder disabled since startup (e.g. by a finished test run, whose
+    # database is gone) must not write its counts anywhere else
+    if query_recorder.options['ENABLED']:
+        query_recorder.flush()
+
+
+query_recorder = QueryRecorder()
+atexit.register(_flush_at_exit)
@@ -0,0 +1,160 @@
+"""
+Nutrient-density and health scores, precomputed per food.
+
+A score is a weighted sum over nutrients, expressed per 100 kcal or per
+100 g:
+
+    score = scale * sum(weight * min(amount / daily_value, cap)) / basis
+
+where `daily_value` (optional) turns an amount into a fraction of the daily
+value and `cap` (optional) limits how much one nutrient can contribute.
+Missing nutrients count as 0; a food gets no score when it has none of the
+score's nutrients, or (per 100 kcal) no positive energy value.
+
+`build_scores()` evaluates every definition in SCORES over the nutrient
+matrix in vectorized chunks at the end of each import and replaces the
+FoodScore table, which has one indexed column per score. Search and the
+food list sort and filter on scores like on nutrients (`order_by=-nrf9_3`,
+`min_protein_per_100kcal=10`; see foods.filters). Adding a score means
+adding a definition here and a matching FoodScore column.
+"""
+
+from django.db import connection, transaction
+
+from . import matrix
+from .models import FoodScore, NutrientLookup
+
+np = matrix.np
+
+CHUNK_SIZE = 200000
+BUILD_BATCH_SIZE = 10000
+
+POTASSIUM = 1092
+MAGNESIUM = 1090
+VITAMIN_E = 1109
+SATURATED_FAT = 1258
+ADDED_SUGARS = 1235
+# Energy (kcal), then the Atwater energies foundation foods report instead
+ENERGY_IDS = (NutrientLookup.ENERGY_KCAL, 2047, 2048)
+
+
+class ScoreDefinition:
+    """A weighted set of nutrients, normalized per 100 kcal or per 100 g.
+
+    `components` are (nutrient_id, weight, daily_value, cap) tuples;
+    daily_value and cap may be None.
+    """
+    BASES = ('100kcal', '100g')
+
+    def __init__(self, name, components, basis='100kcal', scale=1.0, description=''):
+        if basis not in self.BASES:
+            raise ValueError(f'basis must be one of {self.BASES}')
+        self.name = name
+        self.components = components
+        self.basis = basis
+        self.scale = scale
+        self.description = description
+
+    @property
+    def nutrient_ids(self):
+        return [component[0] for component in self.components]
+
+    def compute(self, values, columns, energy):
+        """Scores for [n, len(columns)] per-100 g values; NaN where undefined"""
+        total = np.zeros(len(values), dtype=np.float64)
+        present = np.zeros(len(values), dtype=bool)
+        per_basis = 100 / energy if self.basis == '100kcal' else np.ones(len(values))
+        for nutrient_id, weight, daily_value, cap in self.components:
+            amounts = values[:, columns[nutrient_id]].astype(np.float64)
+            present |= ~np.isnan(amounts)
+            amounts = np.nan_to_num(amounts) * per_basis
+            if daily_value:
+                amounts = amounts / daily_value
+            if cap is not None:
+                amounts = np.minimum(amounts, cap)
+            total += weight * amounts
+        valid = present & np.isfinite(total)
+        return np.where(valid, total * self.scale, np.nan)
+
+
+NRF_ENCOURAGED = (
+    (NutrientLookup.PROTEIN, 50), (NutrientLookup.FIBER, 28), (NutrientLookup.VITAMIN_A, 900),
+    (NutrientLookup.VITAMIN_C, 90), (VITAMIN_E, 15), (NutrientLookup.CALCIUM, 1300),
+    (NutrientLookup.IRON, 18), (POTASSIUM, 4700), (MAGNESIUM, 420),
+)
+NRF_LIMITED = ((SATURATED_FAT, 20), (ADDED_SUGARS, 50), (NutrientLookup.SODIUM, 2300))
+
+SCORES = (
+    ScoreDefinition(
+        'nrf9_3',
+        [(nutrient_id, 1, daily_value, 1.0) for nutrient_id, daily_value in NRF_ENCOURAGED]
+        + [(nutrient_id, -1, daily_value, None) for nutrient_id, daily_value in NRF_LIMITED],
+        scale=100,
+        description='Nutrient Rich Food index 9.3: %DV of 9 nutrients to encourage (each capped at 100) '
+                    'minus %DV of 3 to limit, per 100 kcal',
+    ),
+    ScoreDefinition(
+        'protein_per_100kcal', [(NutrientLookup.PROTEIN, 1, None, None)], description='Protein (g) per 100 kcal'
+    ),
+    ScoreDefinition(
+        'fiber_per_100kcal', [(NutrientLookup.FIBER, 1, None, None)], description='Fiber (g) per 100 kcal'
+    ),
+    ScoreDefinition(
+        'sodium_per_100kcal', [(NutrientLookup.SODIUM, 1, None, None)], description='Sodium (mg) per 100 kcal'
+    ),
+    ScoreDefinition(
+        'sugars_per_100kcal', [(NutrientLookup.SUGARS, 1, None, None)], description='Total sugars (g) per 100 kcal'
+    ),
+)
+SCORE_COLUMNS = [score.name for score in SCORES]
+assert SCORE_COLUMNS == list(FoodScore.SCORE_COLUMNS), "every score needs a FoodScore column"
+
+
+def energy_values(values, columns):
+    """kcal per 100 g from the first energy nutrient present; NaN if none is positive"""
+    energy = np.full(len(values), np.nan)
+    for nutrient_id in reversed(ENERGY_IDS):
+        column = values[:, columns[nutrient_id]].astype(np.float64)
+        energy = np.where(np.isnan(column), energy, column)
+    return np.where(energy > 0, energy, np.nan)
+
+
+def compute_scores(values, nutrient_ids):
+    """[n, len(SCORES)] scores for [n, len(nutrient_ids)] per-100 g values"""
+    columns = {nutrient_id: index for index, nutrient_id in enumerate(nutrient_ids)}
+    energy = energy_values(values, columns)
+    return np.stack([score.compute(values, columns, energy) for score in SCORES], axis=1)
+
+
+def score_nutrient_ids():
+    """Every nutrient id a score reads, energy first"""
+    return list(dict.fromkeys([*ENERGY_IDS, *(nutrient_id for score in SCORES for nutrient_id in score.nutrient_ids)]))
+
+
+def build_scores(version, data_dir=None):
+    """Recompute FoodScore from the version's nutrient matrix; returns the number of scored foods"""
+    if np is None:
+        raise RuntimeError('NumPy is required to compute food scores')
+    nutrient_matrix = matrix.NutrientMatrix(matrix.files.path(version, data_dir), version)
+    fdc_ids = np.asarray(nutrient_matrix.fdc_ids)
+    nutrient_ids = score_nutrient_ids()
+
+    count = 0
+    with transaction.atomic():
+        FoodScore.objects.all().delete()
+        for start in range(0, len(fdc_ids), CHUNK_SIZE):
+            chunk_ids = fdc_ids[start:start + CHUNK_SIZE]
+            scores = compute_scores(nutrient_matrix.select(chunk_ids, nutrient_ids), nutrient_ids)
+            scored = np.flatnonzero(~np.isnan(scores).all(axis=1))
+            rows = [
+                FoodScore(food_id=fdc_id, **{
+                    name: None if np.isnan(value) else round(float(value), 4)
+                    for name, value in zip(SCORE_COLUMNS, row)
+                })
+                for fdc_id, row in zip(chunk_ids[scored].tolist(), scores[scored])
+            ]
+            FoodScore.objects.bulk_create(rows, batch_size=BUILD_BATCH_SIZE)
+            count += len(rows)
+    with connection.cursor() as cursor:
+        cursor.execute(f'ANALYZE {FoodScore._meta.db_table}')
+    return count
@@ -1,3 +1,4 @@
+from django.db import models
 from rest_framework import serializers
 from .models import (
     FoodCategory, Nutrient, Food, FoodNutrient, BrandedFood,
@@ -6,6 +7,35 @@ from .models import (
 )
 
 
+class BatchNutrientMixin:
+    """Load nutrient values for the whole batch being serialized in one query.
+    
+    With `many=True` the first lookup fetches `batch_nutrient_ids` for every
+    instance of the parent list serializer; a single instance costs one query.
+    """
+    nutrient_lookup = NutrientLookup
+    food_id_field = 'fdc_id'
+    batch_nutrient_ids = ()
+    
+    def batch_instances(self, obj):
+        instances = getattr(self.parent, 'instance', None)
+        if instances is None:
+            return [obj]
+        if isinstance(instances, models.Manager):
+            instances = instances.all()
+        # An evaluated QuerySet iterates its result cache without a new query
+        return list(instances)
+    
+    def batch_nutrient_value(self, obj, nutrient_id):
+        food_id = getattr(obj, self.food_id_field)
+        values = getattr(self, '_batch_values', {})
+        if food_id not in values:
+            food_ids = [getattr(instance, self.food_id_field) for instance in self.batch_instances(obj)]
+            values = self.nutrient_lookup.get_values(food_ids + [food_id], self.batch_nutrient_ids)
+            self._batch_values = values
+        return values[food_id][nutrient_id]
+
+
 class FoodCategorySerializer(serializers.ModelSerializer):
     class Meta:
         model = FoodCategory
@@ -15,7 +45,7 @@ class FoodCategorySerializer(serializers.ModelSerializer):
 class NutrientSerializer(serializers.ModelSerializer):
     class Meta:
         model = Nutrient
-        fields = ['id', 'name', 'unit_name', 'nutrient_nbr', 'rank']
+        fields = ['id', 'name', 'unit_name', 'nutrient_nbr', 'rank', 'canonical_unit']
 
 
 class FoodSerializer(serializers.ModelSerializer):
@@ -26,7 +56,7 @@ class FoodSerializer(serializers.ModelSerializer):
         fields = ['fdc_id', 'data_type', 'description', 'food_category_id', 'food_category', 'publication_date']
 
 
-class FoodSearchSerializer(serializers.ModelSerializer):
+class FoodSearchSerializer(BatchNutrientMixin, serializers.ModelSerializer):
     """Serializer for food search results with nutrition preview"""
     food_category = serializers.CharField(read_only=True)
     calories = serializers.SerializerMethodField()
@@ -38,17 +68,22 @@ class FoodSearchSerializer(serializers.ModelSerializer):
         model = Food
         fields = ['fdc_id', 'data_type', 'description', 'food_category', 'calories', 'protein', 'fat', 'carbs']
     
+    batch_nutrient_ids = (
+        NutrientLookup.ENERGY_KCAL, NutrientLookup.PROTEIN,
+        NutrientLookup.TOTAL_FAT, NutrientLookup.CARBS,
+    )
+    
     def get_calories(self, obj):
-        return NutrientLookup.get_nutrient_value(obj.fdc_id, NutrientLookup.ENERGY_KCAL)
+        return self.batch_nutrient_value(obj, NutrientLookup.ENERGY_KCAL)
     
     def get_protein(self, obj):
-        return NutrientLookup.get_nutrient_value(obj.fdc_id, NutrientLookup.PROTEIN)
+        return self.batch_nutrient_value(obj, NutrientLookup.PROTEIN)
     
     def get_fat(self, obj):
-        return NutrientLookup.get_nutrient_value(obj.fdc_id, NutrientLookup.TOTAL_FAT)
+        return self.batch_nutrient_value(obj, NutrientLookup.TOTAL_FAT)
     
     def get_carbs(self, obj):
-        return NutrientLookup.get_nutrient_value(obj.fdc_id, NutrientLookup.CARBS)
+        return self.batch_nutrient_value(obj, NutrientLookup.CARBS)
 
 
 class FoodNutrientSerializer(serializers.ModelSerializer):
@@ -87,6 +122,19 @@ from .models import (
 )
 
 
+def cn_nutrient_values(food):
+    """Nutrient values of a CN food keyed by nutrient code.
+
+    Reads `food.nutrient_values.all()`, so with `nutrient_values` prefetched
+    this costs no queries; the mapping is memoized on the instance.
+    """
+    values = getattr(food, '_nutrient_values_by_code', None)
+    if values is None:
+        values = {value.nutrient_id: value.canonical_value for value in food.nutrient_values.all()}
+        food._nutrient_values_by_code = values
+    return values
+
+
 class CNFoodCategorySerializer(serializers.ModelSerializer):
     class Meta:
         model = CNFoodCategory
@@ -96,19 +144,24 @@ class CNFoodCategorySerializer(serializers.ModelSerializer):
 class CNNutrientSerializer(serializers.ModelSerializer):
     class Meta:
         model = CNNutrient
-        fields = ['code', 'description', 'description_abbrev', 'unit', 'date_added', 'last_modified']
+        fields = [
+            'code', 'description', 'description_abbrev', 'unit', 'date_added', 'last_modified',
+            'nutrient', 'canonical_unit', 'unit_factor'
+        ]
 
 
 class CNNutrientValueSerializer(serializers.ModelSerializer):
     nutrient_name = serializers.CharField(source='nutrient.description', read_only=True)
     nutrient_unit = serializers.CharField(source='nutrient.unit', read_only=True)
     nutrient_abbrev = serializers.CharField(source='nutrient.description_abbrev', read_only=True)
+    canonical_unit = serializers.CharField(source='nutrient.canonical_unit', read_only=True)
+    usda_nutrient_id = serializers.IntegerField(source='nutrient.nutrient_id', read_only=True)
     
     class Meta:
         model = CNNutrientValue
         fields = [
             'nutrient_value', 'per_unit', 'nutrient_name', 
-            'nutrient_unit', 'nutrient_abbrev'
+            'nutrient_unit', 'nutrient_abbrev', 'amount', 'canonical_unit', 'usda_nutrient_id'
         ]
 
 
@@ -121,7 +174,7 @@ class CNWeightSerializer(serializers.ModelSerializer):
         ]
 
 
-class CNFoodListSerializer(serializers.ModelSerializer):
+class CNFoodListSerializer(BatchNutrientMixin, serializers.ModelSerializer):
     """Serializer for CN food list views (minimal data)"""
     food_category_name = serializers.CharField(source='food_category.description', read_only=True)
     
@@ -139,17 +192,24 @@ class CNFoodListSerializer(serializers.ModelSerializer):
             'calories', 'protein', 'fat', 'carbs'
         ]
     
+    nutrient_lookup = CNNutrientLookup
+    food_id_field = 'cn_code'
+    batch_nutrient_ids = (
+        CNNutrientLookup.ENERGY_KCAL, CNNutrientLookup.PROTEIN,
+        CNNutrientLookup.TOTAL_FAT, CNNutrientLookup.CARBS,
+    )
+    
     def get_calories(self, obj):
-        return CNNutrientLookup.get_nutrient_value(obj.cn_code, CNNutrientLookup.ENERGY_KCAL)
+        return self.batch_nutrient_value(obj, CNNutrientLookup.ENERGY_KCAL)
     
     def get_protein(self, obj):
-        return CNNutrientLookup.get_nutrient_value(obj.cn_code, CNNutrientLookup.PROTEIN)
+        return self.batch_nutrient_value(obj, CNNutrientLookup.PROTEIN)
     
     def get_fat(self, obj):
-        return CNNutrientLookup.get_nutrient_value(obj.cn_code, CNNutrientLookup.TOTAL_FAT)
+        return self.batch_nutrient_value(obj, CNNutrientLookup.TOTAL_FAT)
     
     def get_carbs(self, obj):
-        return CNNutrientLookup.get_nutrient_value(obj.cn_code, CNNutrientLookup.CARBS)
+        return self.batch_nutrient_value(obj, CNNutrientLookup.CARBS)
 
 
 class CNFoodDetailSerializer(serializers.ModelSerializer):
@@ -173,8 +233,10 @@ class CNFoodDetailSerializer(serializers.ModelSerializer):
         ]
     
     def get_macros(self, obj):
-        return CNNutrientLookup.get_macros(obj.cn_code)
+        values = cn_nutrient_values(obj)
+        return {name: values.get(code) for name, code in CNNutrientLookup.MACROS.items()}
     
     def get_vitamins_minerals(self, obj):
-        return CNNutrientLookup.get_vitamins_minerals(obj.cn_code)
+        values = cn_nutrient_values(obj)
+        return {name: values.get(code) for name, code in CNNutrientLookup.VITAMINS_MINERALS.items()}
 
@@ -0,0 +1,276 @@
+"""
+Nearest-neighbour search over food nutrient profiles.
+
+A food's profile is its FoodNutritionSummary nutrients per 100 g,
+log1p-compressed and standardized to z-scores. Missing values are imputed
+with the mean, i.e. 0. Similar foods are the nearest profiles by Euclidean
+distance.
+
+The index is an inverted file (IVF): k-means splits the profiles into
+about sqrt(N) lists, and a query scans only the lists with the nearest
+centroids (`nprobe`), widening the probe when filters leave fewer than k
+candidates. Queries restricted to a category or data type with few members
+scan those members exactly instead.
+
+`build_index()` runs at the end of each import from the nutrient matrix and
+writes FOODS_DATA_DIR/similarity/v<version>/:
+
+    centroids.npy   float32 [nlist, d]
+    offsets.npy     int64   [nlist + 1], list i is rows offsets[i]:offsets[i + 1]
+    vectors.npy     float32 [n, d] profiles, grouped by list
+    values.npy      float32 [n, d] raw amounts (NaN if missing), same rows
+    fdc_ids.npy     int64   [n]
+    categories.npy  int64   [n] food_category_id, -1 if none
+    data_types.npy  str     [n]
+"""
+
+import os
+
+from rest_framework.exceptions import ValidationError
+
+from . import matrix
+from .datafiles import KEEP_VERSIONS, VersionedDataFiles
+from .filters import canonical_nutrient
+from .models import Food, FoodNutritionSummary
+
+np = matrix.np
+
+FEATURES = list(FoodNutritionSummary.NUTRIENT_COLUMNS)
+FEATURE_IDS = list(FoodNutritionSummary.NUTRIENT_COLUMNS.values())
+# categories.npy value of foods without a category
+NO_CATEGORY = -1
+ARRAYS = ('centroids', 'offsets', 'vectors', 'values', 'fdc_ids', 'categories', 'data_types')
+MMAP_ARRAYS = ('vectors', 'values')
+
+NPROBE = 8
+BRUTE_FORCE_LIMIT = 50000
+KMEANS_ITERATIONS = 20
+KMEANS_SAMPLE = 100000
+CHUNK_SIZE = 65536
+DEFAULT_K = 10
+MAX_K = 100
+TRUE_VALUES = ('1', 'true', 'yes')
+
+
+def profiles(values):
+    """Standardized log1p profiles for raw per-100 g values (NaN -> 0)"""
+    logged = np.log1p(np.clip(values.astype(np.float64), 0, None))
+    counts = np.maximum((~np.isnan(logged)).sum(axis=0), 1)
+    mean = np.nansum(logged, axis=0) / counts
+    std = np.sqrt(np.nansum((logged - mean) ** 2, axis=0) / counts)
+    std[std == 0] = 1.0
+    return np.nan_to_num((logged - mean) / std).astype(np.float32)
+
+
+def squared_distances(points, centers):
+    """[len(points), len(centers)] squared Euclidean distances"""
+    distances = (
+        (points ** 2).sum(axis=1)[:, None]
+        - 2 * points @ centers.T
+        + (centers ** 2).sum(axis=1)[None, :]
+    )
+    return np.maximum(distances, 0)
+
+
+def nearest_centers(points, centers):
+    return np.concatenate([
+        squared_distances(points[start:start + CHUNK_SIZE], centers).argmin(axis=1)
+        for start in range(0, len(points), CHUNK_SIZE)
+    ]) if len(points) else np.zeros(0, dtype=np.int64)
+
+
+def kmeans(points, k, iterations=KMEANS_ITERATIONS, seed=0):
+    """Lloyd's k-means on a sample of the points; returns the centroids"""
+    rng = np.random.default_rng(seed)
+    sample = points
+    if len(points) > KMEANS_SAMPLE:
+        sample = points[rng.choice(len(points), KMEANS_SAMPLE, replace=False)]
+    centers = sample[rng.choice(len(sample), k, replace=False)].astype(np.float32)
+
+    for _ in range(iterations):
+        labels = nearest_centers(sample, centers)
+        counts = np.bincount(labels, minlength=k)
+        sums = np.zeros_like(centers)
+        np.add.at(sums, labels, sample)
+        empty = counts == 0
+        centers = np.where(empty[:, None], centers, sums / np.maximum(counts, 1)[:, None])
+        if empty.any():
+            # Re-seed empty lists with random points
+            centers[empty] = sample[rng.choice(len(sample), int(empty.sum()))]
+    return centers.astype(np.float32)
+
+
+def build_arrays(fdc_ids, values, categories, data_types, nlist=None, seed=0):
+    """Index arrays for raw [n, len(FEATURES)] values; foods without any value are skipped"""
+    keep = ~np.isnan(values).all(axis=1)
+    fdc_ids, values = fdc_ids[keep], values[keep]
+    categories, data_types = categories[keep], data_types[keep]
+    vectors = profiles(values)
+
+    n = len(vectors)
+    nlist = nlist or max(1, int(np.sqrt(n)))
+    nlist = min(nlist, max(n, 1))
+    centroids = kmeans(vectors, nlist, seed=seed) if n else np.zeros((1, len(FEATURES)), np.float32)
+    labels = nearest_centers(vectors, centroids)
+    order = np.argsort(labels, kind='stable')
+    offsets = np.concatenate([[0], np.cumsum(np.bincount(labels, minlength=len(centroids)))])
+    return {
+        'centroids': centroids,
+        'offsets': offsets.astype(np.int64),
+        'vectors': vectors[order],
+        'values': values[order].astype(np.float32),
+        'fdc_ids': fdc_ids[order].astype(np.int64),
+        'categories': categories[order].astype(np.int64),
+        'data_types': data_types[order],
+    }
+
+
+class SimilarityIndex:
+    """IVF index over food nutrient profiles"""
+
+    def __init__(self, arrays, version=None, path=None):
+        self.version = version
+        self.path = path
+        for name in ARRAYS:
+            setattr(self, name, arrays[name])
+        self.sorted_positions = np.argsort(self.fdc_ids)
+        self.sorted_ids = self.fdc_ids[self.sorted_positions]
+
+    @classmethod
+    def load(cls, path, version):
+        arrays = {
+            name: np.load(os.path.join(path, f'{name}.npy'), mmap_mode='r' if name in MMAP_ARRAYS else None)
+            for name in ARRAYS
+        }
+        return cls(arrays, version, path)
+
+    def __len__(self):
+        return len(self.fdc_ids)
+
+    def row(self, fdc_id):
+        """Index row of a food, or None if it is not indexed"""
+        position = np.searchsorted(self.sorted_ids, fdc_id)
+        if position < len(self.sorted_ids) and self.sorted_ids[position] == fdc_id:
+            return int(self.sorted_positions[position])
+        return None
+
+    def _allowed(self, rows, row, category_id, data_type, lower):
+        allowed = rows != row
+        if category_id is not None:
+            allowed &= self.categories[rows] == category_id
+        if data_type is not None:
+            allowed &= self.data_types[rows] == data_type
+        if lower is not None:
+            column = FEATURES.index(lower)
+            allowed &= self.values[rows, column] < self.values[row, column]
+        return rows[allowed]
+
+    def _nearest(self, query, rows, k):
+        if not len(rows):
+            return []
+        distances = ((self.vectors[rows] - query) ** 2).sum(axis=1)
+        if len(rows) > k:
+            top = np.argpartition(distances, k)[:k]
+        else:
+            top = np.arange(len(rows))
+        top = top[np.argsort(distances[top], kind='stable')]
+        return [(int(self.fdc_ids[rows[i]]), float(np.sqrt(distances[i]))) for i in top]
+
+    def query(self, fdc_id, k=10, category_id=None, data_type=None, lower=None, nprobe=NPROBE, exact=False):
+        """[(fdc_id, distance)] of the k nearest foods, or None if fdc_id is not indexed.
+
+        `category_id` / `data_type` restrict results to that category (NO_CATEGORY
+        for foods without one) or data type; `lower` (a FEATURES name) keeps only foods with less of that
+        nutrient than the query food.
+        """
+        row = self.row(fdc_id)
+        if row is None:
+            return None
+        query = np.asarray(self.vectors[row])
+
+        if exact:
+            rows = self._allowed(np.arange(len(self)), row, category_id, data_type, lower)
+            return self._nearest(query, rows, k)
+
+        if category_id is not None or data_type is not None:
+            members = np.arange(len(self))
+            members = members[
+                (self.categories == category_id if category_id is not None else True)
+                & (self.data_types == data_type if data_type is not None else True)
+            ]
+            if len(members) <= BRUTE_FORCE_LIMIT:
+                return self._nearest(query, self._allowed(members, row, None, None, lower), k)
+
+        list_order = squared_distances(query[None, :], self.centroids)[0].argsort()
+        probe = min(nprobe, len(list_order))
+        while True:
+            rows = np.concatenate([
+                np.arange(self.offsets[i], self.offsets[i + 1]) for i in list_order[:probe]
+            ])
+            rows = self._allowed(rows, row, category_id, data_type, lower)
+            if len(rows) >= k or probe >= len(list_order):
+                return self._nearest(query, rows, k)
+            probe = min(probe * 2, len(list_order))
+
+
+def parse_similar_params(query_params):
+    """Canonical `k`, `same_category`, `same_data_type` and `lower` params"""
+    errors = {}
+    try:
+        k = int(query_params.get('k') or DEFAULT_K)
+        if not 1 <= k <= MAX_K:
+            raise ValueError
+    except ValueError:
+        errors['k'] = f'An integer between 1 and {MAX_K} is required.'
+        k = DEFAULT_K
+
+    lower = (query_params.get('lower') or '').strip()
+    if lower:
+        lower = canonical_nutrient(lower)
+        if lower not in FEATURES:
+            errors['lower'] = f'One of: {", ".join(FEATURES)}.'
+
+    if errors:
+        raise ValidationError(errors)
+    return {
+        'k': k,
+        'same_category': (query_params.get('same_category') or '').lower() in TRUE_VALUES,
+        'same_data_type': (query_params.get('same_data_type') or '').lower() in TRUE_VALUES,
+        'lower': lower or '',
+    }
+
+
+files = VersionedDataFiles('similarity', SimilarityIndex.load)
+
+
+def get_index():
+    """Similarity index for the current dataset version, or None if none has been built"""
+    if np is None:
+        return None
+    return files.get()
+
+
+def build_index(version, data_dir=None, keep=KEEP_VERSIONS, nlist=None):
+    """Build the similarity index from the version's nutrient matrix; returns (foods, lists)"""
+    if np is None:
+        raise RuntimeError('NumPy is required to build the similarity index')
+    nutrient_matrix = matrix.NutrientMatrix(matrix.files.path(version, data_dir), version)
+    fdc_ids = np.asarray(nutrient_matrix.fdc_ids)
+    values = nutrient_matrix.select(fdc_ids, FEATURE_IDS)
+
+    categories = np.full(len(fdc_ids), NO_CATEGORY, dtype=np.int64)
+    data_types = np.full(len(fdc_ids), '', dtype=object)
+    for fdc_id, category_id, data_type in Food.objects.values_list(
+        'fdc_id', 'food_category_id', 'data_type'
+    ).iterator(chunk_size=CHUNK_SIZE):
+        position = np.searchsorted(fdc_ids, fdc_id)
+        if position < len(fdc_ids) and fdc_ids[position] == fdc_id:
+            categories[position] = NO_CATEGORY if category_id is None else category_id
+            data_types[position] = data_type
+    data_types = data_types.astype(str)
+
+    arrays = build_arrays(fdc_ids, values, categories, data_types, nlist=nlist)
+    with files.build(version, data_dir, keep) as tmp_path:
+        for name in ARRAYS:
+            np.save(os.path.join(tmp_path, f'{name}.npy'), arrays[name])
+    return len(arrays['fdc_ids']), len(arrays['centroids'])
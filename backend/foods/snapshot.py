@@ -0,0 +1,290 @@
+"""
+Read-only SQLite snapshot of the food database, for nodes without Postgres.
+
+`build_snapshot()` runs at the end of each import and exports, to
+FOODS_DATA_DIR/snapshot/v<version>/foods.sqlite3:
+
+    food                 one row per USDA food: its columns, category name,
+                         the nutrition summary (per 100 g and per serving)
+                         and the food scores
+    food_fts             FTS5 index of food descriptions (porter stemming,
+                         2- and 3-letter prefix indexes)
+    food_portion         portions with their measure unit name
+    branded_food         brand, GTIN, ingredients and serving columns
+    cn_food, cn_food_fts, cn_food_category, cn_nutrient, cn_nutrient_value,
+    cn_weight            Child Nutrition foods; values in canonical units
+    meta                 dataset version
+
+The file is written once, indexed, and then only ever opened read-only
+(`mode=ro&immutable=1`, memory-mapped), so any number of processes and
+threads share it through the page cache. `SnapshotReader` answers the hot
+read paths (food detail, text search, autocomplete) from it with the same
+result shapes as the API; edge services can also query the tables directly.
+
+Text search ranks with FTS5's bm25 instead of Postgres' ts_rank, and
+autocomplete matches word prefixes rather than substrings, so results can
+differ slightly in order from the database-backed views.
+"""
+
+import os
+import re
+import sqlite3
+import threading
+
+from .datafiles import KEEP_VERSIONS, VersionedDataFiles
+from .models import (
+    BrandedFood, CNFood, CNFoodCategory, CNNutrient, CNNutrientValue, CNWeight, Food, FoodCategory,
+    FoodNutritionSummary, FoodPortion, FoodScore, MeasureUnit,
+)
+
+FILENAME = 'foods.sqlite3'
+BUILD_BATCH_SIZE = 10000
+MMAP_SIZE = 1 << 30
+TOKEN_PATTERN = re.compile(r'\w+')
+
+NUTRIENT_COLUMNS = tuple(FoodNutritionSummary.NUTRIENT_COLUMNS)
+SERVING_COLUMNS = tuple(FoodNutritionSummary.SERVING_COLUMNS)
+SCORE_COLUMNS = FoodScore.SCORE_COLUMNS
+FOOD_COLUMNS = (
+    'fdc_id', 'data_type', 'description', 'food_category_id', 'food_category', 'publication_date',
+    *NUTRIENT_COLUMNS, 'serving_grams', 'serving_description', *SERVING_COLUMNS, *SCORE_COLUMNS,
+)
+BRANDED_COLUMNS = (
+    'fdc_id', 'brand_owner', 'brand_name', 'gtin_upc', 'ingredients', 'serving_size', 'serving_size_unit',
+    'household_serving_fulltext', 'branded_food_category', 'market_country',
+)
+CN_FOOD_COLUMNS = (
+    'cn_code', 'descriptor', 'abbreviated_descriptor', 'food_category_id', 'gtin', 'brand_owner_name',
+    'brand_name', 'fdc_id',
+)
+
+SCHEMA = f"""
+CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT);
+CREATE TABLE food (fdc_id INTEGER PRIMARY KEY, {', '.join(FOOD_COLUMNS[1:])});
+CREATE TABLE food_portion (
+    fdc_id INTEGER, seq_num INTEGER, amount REAL, measure_unit TEXT, portion_description TEXT,
+    modifier TEXT, gram_weight REAL
+);
+CREATE TABLE branded_food (fdc_id INTEGER PRIMARY KEY, {', '.join(BRANDED_COLUMNS[1:])});
+CREATE TABLE cn_food (cn_code INTEGER PRIMARY KEY, {', '.join(CN_FOOD_COLUMNS[1:])});
+CREATE TABLE cn_food_category (code INTEGER PRIMARY KEY, description TEXT);
+CREATE TABLE cn_nutrient (code INTEGER PRIMARY KEY, description TEXT, unit TEXT, usda_nutrient_id INTEGER);
+CREATE TABLE cn_nutrient_value (cn_food_id INTEGER, nutrient_id INTEGER, amount REAL);
+CREATE TABLE cn_weight (
+    cn_food_id INTEGER, sequence_num INTEGER, amount REAL, measure_description TEXT, unit_amount REAL,
+    type_of_unit TEXT
+);
+"""
+INDEXES = """
+CREATE INDEX food_data_type ON food (data_type, fdc_id);
+CREATE INDEX food_category ON food (food_category_id, fdc_id);
+CREATE INDEX food_portion_fdc_id ON food_portion (fdc_id, seq_num);
+CREATE INDEX branded_food_gtin ON branded_food (gtin_upc);
+CREATE INDEX cn_food_fdc_id ON cn_food (fdc_id);
+CREATE INDEX cn_nutrient_value_food ON cn_nutrient_value (cn_food_id, nutrient_id);
+CREATE INDEX cn_weight_food ON cn_weight (cn_food_id, sequence_num);
+CREATE VIRTUAL TABLE food_fts USING fts5(
+    description, content='food', content_rowid='fdc_id', tokenize='porter unicode61', prefix='2 3'
+);
+INSERT INTO food_fts (rowid, description) SELECT fdc_id, description FROM food;
+INSERT INTO food_fts (food_fts) VALUES ('optimize');
+CREATE VIRTUAL TABLE cn_food_fts USING fts5(
+    descriptor, abbreviated_descriptor, content='cn_food', content_rowid='cn_code', tokenize='porter unicode61'
+);
+INSERT INTO cn_food_fts (rowid, descriptor, abbreviated_descriptor)
+    SELECT cn_code, descriptor, abbreviated_descriptor FROM cn_food;
+ANALYZE;
+"""
+
+
+def _insert(connection, table, columns, rows):
+    sql = f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})"
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= BUILD_BATCH_SIZE:
+            connection.executemany(sql, batch)
+            batch = []
+    connection.executemany(sql, batch)
+
+
+def _food_rows():
+    categories = dict(FoodCategory.objects.values_list('id', 'description'))
+    lookups = (
+        'fdc_id', 'data_type', 'description', 'food_category_id', 'publication_date',
+        *(f'nutrition_summary__{column}' for column in (
+            *NUTRIENT_COLUMNS, 'serving_grams', 'serving_description', *SERVING_COLUMNS
+        )),
+        *(f'scores__{column}' for column in SCORE_COLUMNS),
+    )
+    for row in Food.objects.order_by('fdc_id').values_list(*lookups).iterator(chunk_size=BUILD_BATCH_SIZE):
+        publication_date = row[4].isoformat() if row[4] else None
+        yield (*row[:4], categories.get(row[3]), publication_date, *row[5:])
+
+
+def _portion_rows():
+    unit_names = dict(MeasureUnit.objects.values_list('id', 'name'))
+    for fdc_id, seq_num, amount, unit_id, description, modifier, grams in FoodPortion.objects.order_by(
+        'fdc_id', 'seq_num', 'id'
+    ).values_list(
+        'fdc_id', 'seq_num', 'amount', 'measure_unit_id', 'portion_description', 'modifier', 'gram_weight'
+    ).iterator(chunk_size=BUILD_BATCH_SIZE):
+        yield fdc_id, seq_num, amount, unit_names.get(unit_id), description, modifier, grams
+
+
+def build_snapshot(version, data_dir=None, keep=KEEP_VERSIONS):
+    """Export the version's foods to a new SQLite snapshot; returns (foods, CN foods)"""
+    with files.build(version, data_dir, keep) as tmp_path:
+        connection = sqlite3.connect(os.path.join(tmp_path, FILENAME))
+        try:
+            connection.execute('PRAGMA journal_mode = OFF')
+            connection.execute('PRAGMA synchronous = OFF')
+            connection.executescript(SCHEMA)
+            connection.execute("INSERT INTO meta VALUES ('version', ?)", [str(version)])
+            _insert(connection, 'food', FOOD_COLUMNS, _food_rows())
+            _insert(connection, 'food_portion', (
+                'fdc_id', 'seq_num', 'amount', 'measure_unit', 'portion_description', 'modifier', 'gram_weight'
+            ), _portion_rows())
+            _insert(connection, 'branded_food', BRANDED_COLUMNS, BrandedFood.objects.order_by('fdc_id').values_list(
+                *BRANDED_COLUMNS
+            ).iterator(chunk_size=BUILD_BATCH_SIZE))
+            _insert(connection, 'cn_food', CN_FOOD_COLUMNS, CNFood.objects.order_by('cn_code').values_list(
+                *CN_FOOD_COLUMNS
+            ).iterator(chunk_size=BUILD_BATCH_SIZE))
+            _insert(connection, 'cn_food_category', ('code', 'description'), CNFoodCategory.objects.values_list(
+                'code', 'description'
+            ))
+            _insert(connection, 'cn_nutrient', ('code', 'description', 'unit', 'usda_nutrient_id'), (
+                (code, description, canonical_unit or unit, nutrient_id)
+                for code, description, unit, canonical_unit, nutrient_id in CNNutrient.objects.values_list(
+                    'code', 'description', 'unit', 'canonical_unit', 'nutrient_id'
+                )
+            ))
+            _insert(connection, 'cn_nutrient_value', ('cn_food_id', 'nutrient_id', 'amount'), (
+                (cn_food_id, nutrient_id, value if amount is None else amount)
+                for cn_food_id, nutrient_id, value, amount in CNNutrientValue.objects.values_list(
+                    'cn_food_id', 'nutrient_id', 'nutrient_value', 'amount'
+                ).iterator(chunk_size=BUILD_BATCH_SIZE)
+            ))
+            weight_columns = (
+                'cn_food_id', 'sequence_num', 'amount', 'measure_description', 'unit_amount', 'type_of_unit'
+            )
+            _insert(connection, 'cn_weight', weight_columns, CNWeight.objects.values_list(
+                *weight_columns
+            ).iterator(chunk_size=BUILD_BATCH_SIZE))
+            connection.executescript(INDEXES)
+            connection.commit()
+            counts = tuple(
+                connection.execute(f'SELECT COUNT(*) FROM {table}').fetchone()[0] for table in ('food', 'cn_food')
+            )
+        finally:
+            connection.close()
+    return counts
+
+
+def match_expression(query, prefix=False):
+    """FTS5 query requiring every word of `query`; the last one as a prefix if `prefix`"""
+    tokens = TOKEN_PATTERN.findall(query.lower())
+    terms = [f'"{token}"' for token in tokens]
+    if prefix and terms:
+        terms[-1] += '*'
+    return ' '.join(terms)
+
+
+class SnapshotReader:
+    """Read-only access to one snapshot file, with a connection per thread"""
+
+    def __init__(self, path, version=None):
+        self.path = path
+        self.version = version
+        self._local = threading.local()
+
+    @classmethod
+    def load(cls, path, version):
+        return cls(os.path.join(path, FILENAME), version)
+
+    @property
+    def connection(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(f'file:{self.path}?mode=ro&immutable=1', uri=True, check_same_thread=False)
+            connection.row_factory = sqlite3.Row
+            connection.execute(f'PRAGMA mmap_size = {MMAP_SIZE}')
+            self._local.connection = connection
+        return connection
+
+    @staticmethod
+    def food_result(row):
+        """API field values for a food row: the search and detail fields"""
+        per_serving = None
+        if row['serving_grams'] is not None:
+            per_serving = {
+                'grams': row['serving_grams'],
+                'description': row['serving_description'],
+                **{
+                    name: None if row[column] is None else round(row[column], 2)
+                    for column, name in FoodNutritionSummary.SERVING_COLUMNS.items()
+                },
+            }
+        scores = {column: row[column] for column in SCORE_COLUMNS}
+        return {
+            'fdc_id': row['fdc_id'],
+            'data_type': row['data_type'],
+            'description': row['description'],
+            'food_category_id': row['food_category_id'],
+            'food_category': row['food_category'],
+            'publication_date': row['publication_date'],
+            **{name: row[name] for name in NUTRIENT_COLUMNS},
+            'per_serving': per_serving,
+            'scores': scores if any(value is not None for value in scores.values()) else None,
+        }
+
+    def food(self, fdc_id):
+        """food_result() for one food, or None"""
+        row = self.connection.execute('SELECT * FROM food WHERE fdc_id = ?', [fdc_id]).fetchone()
+        return None if row is None else self.food_result(row)
+
+    def search(self, query, data_type='', category_id='', offset=0, limit=20):
+        """(food_result() rows, total matches) for a text query, best first"""
+        # Like the database views, queries of up to 2 characters match word
+        # prefixes ordered by description instead of ranking
+        short = len(query) <= 2
+        expression = match_expression(query, prefix=short)
+        if not expression:
+            return [], 0
+        conditions, params = ['food_fts MATCH ?'], [expression]
+        order = 'food.description, food.fdc_id' if short else 'bm25(food_fts), food.fdc_id'
+        if data_type:
+            conditions.append('food.data_type = ?')
+            params.append(data_type)
+        if category_id:
+            conditions.append('food.food_category_id = ?')
+            params.append(int(category_id))
+        where = ' AND '.join(conditions)
+        source = 'food_fts JOIN food ON food.fdc_id = food_fts.rowid'
+        total = self.connection.execute(f'SELECT COUNT(*) FROM {source} WHERE {where}', params).fetchone()[0]
+        rows = self.connection.execute(
+            f'SELECT food.* FROM {source} WHERE {where} ORDER BY {order} LIMIT ? OFFSET ?',
+            [*params, limit, offset]
+        ).fetchall()
+        return [self.food_result(row) for row in rows], total
+
+    def autocomplete(self, query, limit=10):
+        """Distinct descriptions with words starting with the query's words"""
+        expression = match_expression(query, prefix=True)
+        if not expression:
+            return []
+        rows = self.connection.execute(
+            'SELECT DISTINCT food.description FROM food_fts JOIN food ON food.fdc_id = food_fts.rowid '
+            'WHERE food_fts MATCH ? ORDER BY bm25(food_fts), food.fdc_id LIMIT ?',
+            [expression, limit]
+        ).fetchall()
+        return [row[0] for row in rows]
+
+
+files = VersionedDataFiles('snapshot', SnapshotReader.load)
+
+
+def get_snapshot():
+    """Snapshot for the current dataset version, or None if none has been built"""
+    return files.get()
@@ -0,0 +1,69 @@
+"""
+Denormalized per-food tables rebuilt at the end of every import.
+
+`rebuild_nutrition_summary()` pivots the common nutrients out of the tall
+food_nutrient table into FoodNutritionSummary with a single INSERT ...
+SELECT. The old rows are deleted in the same transaction, so readers keep
+seeing the previous summary until the new one is committed.
+
+Branded foods also get per-serving values. The serving weight is
+`serving_size` when its unit is grams or ml; branded nutrients are per 100 ml
+for liquids, so ml scale the same way. Otherwise the weight comes from a
+"(56 g)" note in `household_serving_fulltext`. This matches the "serving"
+measure in foods.conversions.
+"""
+
+from django.db import connection, transaction
+
+from .conversions import UNIT_ALIASES
+from .models import BrandedFood, Food, FoodNutrient, FoodNutritionSummary
+
+# serving_size_unit spellings that mean grams or ml ('' is treated as grams)
+SERVING_UNITS = sorted(
+    {'', 'g', 'ml'} | {alias for alias, unit in UNIT_ALIASES.items() if unit in ('g', 'ml')}
+)
+HOUSEHOLD_WEIGHT_PATTERN = r'\(\s*(\d*\.?\d+)\s*(?:g|ml|grams?)\s*\)'
+
+
+def rebuild_nutrition_summary():
+    """Recompute FoodNutritionSummary for every food; returns the row count"""
+    columns = FoodNutritionSummary.NUTRIENT_COLUMNS
+    serving_columns = FoodNutritionSummary.SERVING_COLUMNS
+    summary_table = FoodNutritionSummary._meta.db_table
+    food_table = Food._meta.db_table
+    nutrient_table = FoodNutrient._meta.db_table
+    branded_table = BrandedFood._meta.db_table
+    quote = connection.ops.quote_name
+
+    column_list = ', '.join(quote(name) for name in [*columns, 'serving_grams', 'serving_description', *serving_columns])
+    pivots = ', '.join(
+        f'MAX(fn.amount) FILTER (WHERE fn.nutrient_id = %s) AS {quote(name)}' for name in columns
+    )
+    per_serving = ', '.join(f'p.{quote(name)} * p.serving_grams / 100' for name in serving_columns.values())
+    sql = (
+        f'INSERT INTO {summary_table} (fdc_id, {column_list}) '
+        f'SELECT p.fdc_id, {", ".join(f"p.{quote(name)}" for name in columns)}, '
+        f'p.serving_grams, p.serving_description, {per_serving} '
+        f'FROM ('
+        f'SELECT f.fdc_id, {pivots}, '
+        f'CASE WHEN b.serving_size > 0 AND LOWER(COALESCE(b.serving_size_unit, \'\')) IN '
+        f'({", ".join(["%s"] * len(SERVING_UNITS))}) THEN b.serving_size '
+        f'ELSE CAST(SUBSTRING(LOWER(b.household_serving_fulltext) FROM %s) AS double precision) '
+        f'END AS serving_grams, '
+        f'NULLIF(TRIM(b.household_serving_fulltext), \'\') AS serving_description '
+        f'FROM {food_table} f '
+        f'LEFT JOIN {branded_table} b ON b.fdc_id = f.fdc_id '
+        f'LEFT JOIN {nutrient_table} fn '
+        f'ON fn.fdc_id = f.fdc_id AND fn.nutrient_id IN ({", ".join(["%s"] * len(columns))}) '
+        f'GROUP BY f.fdc_id, b.fdc_id'
+        f') p'
+    )
+    params = [*columns.values(), *SERVING_UNITS, HOUSEHOLD_WEIGHT_PATTERN, *columns.values()]
+
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(f'DELETE FROM {summary_table}')
+        cursor.execute(sql, params)
+        count = cursor.rowcount
+    with connection.cursor() as cursor:
+        cursor.execute(f'ANALYZE {summary_table}')
+    return count
@@ -1,3 +1,1566 @@
-from django.test import TestCase
+import datetime
+import decimal
+import gzip
+import hashlib
+import io
+import json
+import os
+import tempfile
+import threading
+import time
+import uuid
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from django.contrib.postgres.search import SearchVector
+from django.core.management import call_command
+from django.db import DatabaseError, connection
+from django.http import HttpResponse, StreamingHttpResponse
+from django.test import RequestFactory, SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.renderers import JSONRenderer
+from rest_framework.response import Response
+from rest_framework.test import APIClient
+
+from nutriplan_django.cache import SQLiteCache
+from nutriplan_django.middleware import CompressionMiddleware, choose_encoding, parse_accept_encoding
+from nutriplan_django.renderers import FastJSONRenderer
+
+from . import (
+    barcodes, bundles, conversions, export, facets, grouping, matrix, planner, querylog, scores, similarity, snapshot
+)
+from .cache import CacheMetrics, TieredResponseCache, get_cache_settings, response_cache
+from .models import (
+    CNFoodLink, DatasetChange, DatasetRelease, Food, FoodCategory, FoodGroup, FoodNutrient, FoodScore, FoodPortion, Nutrient, NutrientLookup, MeasureUnit, BrandedFood,
+    FoodNutritionSummary, QueryLogEntry, CNFoodCategory, CNNutrient, CNFood, CNNutrientValue, CNWeight, CNNutrientLookup
+)
+from .ingredients import parse_ingredients, rebuild_ingredient_index
+from .changes import record_changes
+from .linking import rebuild_cn_links
+from .pipeline import begin_import, complete_import
+from .querylog import QueryRecorder, get_query_log_settings, query_recorder
+from .serializers import FoodSearchSerializer, CNFoodListSerializer
+from .summaries import rebuild_nutrition_summary
+from .units import rebuild_unit_mapping, unit_factor
+from .views import BarcodeSearchView
+
+
+TEST_CACHES = {
+    'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+}
+
+
+def setUpModule():
+    # Background flushes would write outside each test's transaction
+    query_recorder.options = {**query_recorder.options, 'FLUSH_IN_BACKGROUND': False}
+
+
+def tearDownModule():
+    # Counts recorded by the tests must not be flushed at exit, when the
+    # connection points at the real database again
+    query_recorder.options = {**get_query_log_settings(), 'ENABLED': False}
+    query_recorder.clear()
+
+
+class DataDirMixin:
+    """Gives each test an empty FOODS_DATA_DIR, fresh data_files handles and an empty response cache"""
+    
+    data_files = ()
+    
+    def setUp(self):
+        super().setUp()
+        self.client = APIClient()
+        response_cache.local.clear()
+        response_cache.invalidate(0)
+        data_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(data_dir.cleanup)
+        settings_override = self.settings(FOODS_DATA_DIR=data_dir.name)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        for files in self.data_files:
+            files.reset()
+            self.addCleanup(files.reset)
+
+
+@override_settings(CACHES=TEST_CACHES)
+class CNFoodEndpointTests(TestCase):
+    """CN endpoints issue a fixed number of queries however many rows they return"""
+    
+    @classmethod
+    def setUpTestData(cls):
+        cls.categories = [
+            CNFoodCategory.objects.create(code=code, description=f'Category {code}')
+            for code in (1, 2)
+        ]
+        nutrient_codes = list(CNNutrientLookup.MACROS.values()) + list(CNNutrientLookup.VITAMINS_MINERALS.values())
+        for code in nutrient_codes:
+            CNNutrient.objects.create(
+                code=code, description=f'Nutrient {code}', description_abbrev=f'N{code}', unit='g'
+            )
+        for cn_code in range(100, 125):
+            food = CNFood.objects.create(
+                cn_code=cn_code,
+                food_category=cls.categories[cn_code % 2],
+                descriptor=f'Chicken nuggets style {cn_code}',
+                abbreviated_descriptor=f'Nuggets {cn_code}',
+            )
+            CNNutrientValue.objects.bulk_create([
+                CNNutrientValue(cn_food=food, nutrient_id=code, nutrient_value=cn_code + code)
+                for code in nutrient_codes
+            ])
+            CNWeight.objects.bulk_create([
+                CNWeight(cn_food=food, sequence_num=seq, amount=1, measure_description='piece', unit_amount=20 * seq)
+                for seq in (1, 2, 3)
+            ])
+        CNFood.objects.update(search_vector=SearchVector('descriptor', 'abbreviated_descriptor'))
+    
+    def setUp(self):
+        self.client = APIClient()
+        response_cache.local.clear()
+        response_cache.invalidate(0)
+    
+    def test_list_queries_bounded(self):
+        # count + page with joined category name + one batch of macros
+        with self.assertNumQueries(3):
+            response = self.client.get('/api/foods/cn/foods/', {'page_size': 25})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['count'], 25)
+        first = response.data['results'][0]
+        self.assertEqual(first['cn_code'], 100)
+        self.assertEqual(first['food_category_name'], 'Category 1')
+        self.assertEqual(first['calories'], 100 + CNNutrientLookup.ENERGY_KCAL)
+    
+    def test_detail_queries_bounded(self):
+        # food with category + nutrient values + nutrients + weights
+        with self.assertNumQueries(4):
+            response = self.client.get('/api/foods/cn/foods/101/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data['nutrient_values']), 11)
+        self.assertEqual(len(response.data['weights']), 3)
+        self.assertEqual(response.data['macros']['protein'], 101 + CNNutrientLookup.PROTEIN)
+        self.assertEqual(response.data['vitamins_minerals']['iron'], 101 + CNNutrientLookup.IRON)
+        
+        with self.assertNumQueries(0):
+            cached = self.client.get('/api/foods/cn/foods/101/')
+        self.assertEqual(cached.data, response.data)
+    
+    def test_detail_not_found(self):
+        response = self.client.get('/api/foods/cn/foods/999/')
+        self.assertEqual(response.status_code, 404)
+    
+    def test_search_queries_bounded(self):
+        # count + page + one batch of macros
+        with self.assertNumQueries(3):
+            response = self.client.get('/api/foods/cn/search/', {'q': 'nuggets', 'page_size': 50})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['total_count'], 25)
+        self.assertTrue(all(row['fat'] is not None for row in response.data['results']))
+    
+    def test_search_category_filter(self):
+        response = self.client.get('/api/foods/cn/search/', {'q': 'nuggets', 'category': 2})
+        self.assertEqual(response.data['total_count'], 12)
+    
+    def test_list_serializer_batches_macros(self):
+        foods = list(CNFood.objects.select_related('food_category').order_by('cn_code'))
+        with self.assertNumQueries(1):
+            data = CNFoodListSerializer(foods, many=True).data
+        self.assertEqual(data[3]['carbs'], 103 + CNNutrientLookup.CARBS)
+
+
+class BulkNutrientLookupTests(TestCase):
+    """Nutrient lookups load many foods x nutrients in one query"""
+    
+    @classmethod
+    def setUpTestData(cls):
+        rows = []
+        for fdc_id in range(1, 31):
+            Food.objects.create(fdc_id=fdc_id, data_type='foundation_food', description=f'Food {fdc_id}')
+            for nutrient_id in NutrientLookup.MACROS.values():
+                # Food 30 has no fiber value
+                if fdc_id == 30 and nutrient_id == NutrientLookup.FIBER:
+                    continue
+                rows.append(FoodNutrient(
+                    id=len(rows) + 1, fdc_id=fdc_id, nutrient_id=nutrient_id, amount=fdc_id * 10 + 0.5
+                ))
+        FoodNutrient.objects.bulk_create(rows)
+        Nutrient.objects.bulk_create([
+            Nutrient(id=nutrient_id, name=name, unit_name='G')
+            for name, nutrient_id in NutrientLookup.MACROS.items()
+        ])
+    
+    def test_get_values_is_dense(self):
+        with self.assertNumQueries(1):
+            values = NutrientLookup.get_values(range(1, 32), [NutrientLookup.PROTEIN, NutrientLookup.FIBER])
+        self.assertEqual(len(values), 31)
+        self.assertEqual(values[5][NutrientLookup.PROTEIN], 50.5)
+        self.assertIsNone(values[30][NutrientLookup.FIBER])
+        self.assertEqual(values[31], {NutrientLookup.PROTEIN: None, NutrientLookup.FIBER: None})
+    
+    def test_macros(self):
+        with self.assertNumQueries(1):
+            macros = NutrientLookup.get_macros_bulk(range(1, 31))
+        self.assertEqual(macros[7]['calories'], 70.5)
+        with self.assertNumQueries(1):
+            self.assertEqual(NutrientLookup.get_macros('7'), macros[7])
+        self.assertIsNone(NutrientLookup.get_vitamins_minerals(7)['sodium'])
+    
+    def test_search_serializer_batches_macros(self):
+        with self.assertNumQueries(2):
+            data = FoodSearchSerializer(Food.objects.order_by('fdc_id'), many=True).data
+        self.assertEqual([row['fat'] for row in data[:2]], [10.5, 20.5])
+    
+    @skipUnless(matrix.available(), 'NumPy is not installed')
+    def test_matrix_matches_lookup(self):
+        with tempfile.TemporaryDirectory() as data_dir:
+            self.assertEqual(matrix.build_matrix(1, data_dir=data_dir), (30, 6))
+            nutrient_matrix = matrix.NutrientMatrix(matrix.files.path(1, data_dir), 1)
+            
+            values = nutrient_matrix.select([3, 30, 99], [NutrientLookup.FIBER, NutrientLookup.PROTEIN, 1])
+            self.assertEqual(values[0].tolist()[:2], [30.5, 30.5])
+            self.assertTrue(all(value != value for value in [values[1][0], values[2][1], values[0][2]]))
+            
+            totals = nutrient_matrix.weighted_sum([1, 30], [200, 50], [NutrientLookup.FIBER])
+            self.assertAlmostEqual(float(totals[0]), 21.0)
+
+
+@override_settings(CACHES=TEST_CACHES, FOODS_DATA_DIR=tempfile.gettempdir() + '/nutriplan-tests-missing')
+class MealNutritionTests(TestCase):
+    """Meal totals scale per-100 g values by grams, portions and CN weights"""
+    
+    @classmethod
+    def setUpTestData(cls):
+        Food.objects.create(fdc_id=1, data_type='foundation_food', description='Oats')
+        Food.objects.create(fdc_id=2, data_type='foundation_food', description='Milk')
+        FoodNutrient.objects.bulk_create([
+            FoodNutrient(id=1, fdc_id=1, nutrient_id=NutrientLookup.ENERGY_KCAL, amount=380),
+            FoodNutrient(id=2, fdc_id=1, nutrient_id=NutrientLookup.PROTEIN, amount=13),
+            FoodNutrient(id=3, fdc_id=2, nutrient_id=NutrientLookup.ENERGY_KCAL, amount=60),
+        ])
+        FoodPortion.objects.create(id=10, fdc_id=2, amount=1, gram_weight=244, portion_description='cup')
+        CNNutrient.objects.create(code=CNNutrientLookup.ENERGY_KCAL, description='Energy', description_abbrev='kcal', unit='kcal')
+        food = CNFood.objects.create(cn_code=500, descriptor='Apple slices', abbreviated_descriptor='Apple')
+        CNNutrientValue.objects.create(cn_food=food, nutrient_id=CNNutrientLookup.ENERGY_KCAL, nutrient_value=50)
+        CNWeight.objects.create(cn_food=food, sequence_num=1, amount=2, measure_description='bag', unit_amount=100)
+    
+    def setUp(self):
+        self.client = APIClient()
+        response_cache.invalidate(0)
+        matrix.files.reset()
+    
+    def test_totals(self):
+        with self.assertNumQueries(6):
+            response = self.client.post('/api/foods/nutrition/', {'ingredients': [
+                {'fdc_id': 1, 'amount': 40},
+                {'fdc_id': 2, 'amount': 0.5, 'portion_id': 10},
+                {'cn_code': 500, 'amount': 1, 'weight_seq': 1},
+            ]}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['total_grams'], 212.0)
+        self.assertEqual(response.data['totals']['calories'], 152 + 73.2 + 25)
+        self.assertEqual(response.data['totals']['protein'], 5.2)
+        self.assertIsNone(response.data['totals']['fiber'])
+        self.assertEqual(response.data['ingredients'][1]['unit'], 'cup')
+        self.assertIsNone(response.data['ingredients'][1]['nutrients']['protein'])
+    
+    def test_invalid_ingredients(self):
+        response = self.client.post('/api/foods/nutrition/', {'ingredients': [
+            {'fdc_id': 1, 'amount': 10, 'portion_id': 10},
+            {'cn_code': 999, 'amount': 1},
+        ]}, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(set(response.data['ingredients']), {0, 1})
+        
+        for amount in ('inf', '1e400', 'nan', -1, 0, 10 ** 6):
+            response = self.client.post(
+                '/api/foods/nutrition/', {'ingredients': [{'fdc_id': 1, 'amount': amount}]}, format='json'
+            )
+            self.assertEqual(response.status_code, 400, amount)
+
+
+class NutrientUnitTests(TestCase):
+    """CN values are stored in the unit of the matching USDA nutrient"""
+    
+    @classmethod
+    def setUpTestData(cls):
+        Nutrient.objects.bulk_create([
+            Nutrient(id=NutrientLookup.CALCIUM, name='Calcium, Ca', unit_name='MG', nutrient_nbr='301'),
+            Nutrient(id=1114, name='Vitamin D (D2 + D3)', unit_name='UG', nutrient_nbr='328'),
+        ])
+        CNNutrient.objects.bulk_create([
+            CNNutrient(code=CNNutrientLookup.CALCIUM, description='Calcium', description_abbrev='Ca', unit='g'),
+            CNNutrient(code=328, description='Vitamin D', description_abbrev='Vit D', unit='IU'),
+            CNNutrient(code=999, description='pH', description_abbrev='pH', unit='PH'),
+        ])
+        Food.objects.create(fdc_id=1, data_type='foundation_food', description='Milk')
+        FoodNutrient.objects.create(id=1, fdc_id=1, nutrient_id=NutrientLookup.CALCIUM, amount=120)
+        food = CNFood.objects.create(cn_code=500, descriptor='Cheese sticks', abbreviated_descriptor='Cheese')
+        for code, value in ((CNNutrientLookup.CALCIUM, 0.7), (328, 40), (999, 6.5)):
+            CNNutrientValue.objects.create(cn_food=food, nutrient_id=code, nutrient_value=value)
+        rebuild_unit_mapping()
+    
+    def test_factors(self):
+        self.assertEqual(unit_factor('MCG', 'ug'), 1.0)
+        self.assertAlmostEqual(unit_factor('kJ', 'KCAL'), 1 / 4.184)
+        self.assertEqual(unit_factor('IU', 'UG', 328), 0.025)
+        self.assertIsNone(unit_factor('IU', 'MG', 301))
+    
+    def test_mapping(self):
+        nutrients = CNNutrient.objects.in_bulk()
+        self.assertEqual(nutrients[CNNutrientLookup.CALCIUM].nutrient_id, NutrientLookup.CALCIUM)
+        self.assertEqual(nutrients[CNNutrientLookup.CALCIUM].canonical_unit, 'mg')
+        self.assertEqual(nutrients[328].canonical_unit, 'ug')
+        self.assertIsNone(nutrients[999].nutrient_id)
+        self.assertEqual(nutrients[999].canonical_unit, 'ph')
+        
+        values = CNNutrientLookup.get_values([500], [CNNutrientLookup.CALCIUM, 328, 999])[500]
+        self.assertEqual(values, {CNNutrientLookup.CALCIUM: 700, 328: 1, 999: 6.5})
+    
+    def test_meal_totals(self):
+        response = APIClient().post('/api/foods/nutrition/', {'ingredients': [
+            {'fdc_id': 1, 'amount': 100},
+            {'cn_code': 500, 'amount': 50},
+        ]}, format='json')
+        self.assertEqual(response.data['totals']['calcium'], 470)
+
+
+@override_settings(CACHES=TEST_CACHES)
+class SearchNutrientFilterTests(TestCase):
+    """Search filters and sorts on nutrient ranges through the summary table"""
+    
+    @classmethod
+    def setUpTestData(cls):
+        rows = []
+        for fdc_id in range(1, 11):
+            Food.objects.create(fdc_id=fdc_id, data_type='foundation_food', description=f'Bean salad {fdc_id}')
+            rows.append(FoodNutrient(id=fdc_id * 10 + 1, fdc_id=fdc_id, nutrient_id=NutrientLookup.PROTEIN, amount=fdc_id * 3))
+            rows.append(FoodNutrient(id=fdc_id * 10 + 2, fdc_id=fdc_id, nutrient_id=NutrientLookup.ENERGY_KCAL, amount=fdc_id * 40))
+            rows.append(FoodNutrient(id=fdc_id * 10 + 3, fdc_id=fdc_id, nutrient_id=1258, amount=10 - fdc_id))
+        FoodNutrient.objects.bulk_create(rows)
+        Food.objects.update(search_vector=SearchVector('description'))
+        rebuild_nutrition_summary()
+    
+    def setUp(self):
+        self.client = APIClient()
+        response_cache.local.clear()
+        response_cache.invalidate(0)
+    
+    def search(self, **params):
+        response = self.client.get('/api/foods/search/', {'fields': 'fdc_id', **params})
+        self.assertEqual(response.status_code, 200)
+        return [row['fdc_id'] for row in response.data['results']]
+    
+    def test_summary_ranges_and_order(self):
+        self.assertEqual(self.search(min_protein=12, max_energy=280, order_by='-protein'), [7, 6, 5, 4])
+        self.assertEqual(set(self.search(q='bean', min_1003=27)), {9, 10})
+    
+    def test_any_nutrient_id(self):
+        self.assertEqual(self.search(min_1258=3, max_1258=5, order_by='1258'), [7, 6, 5])
+    
+    def test_invalid_filters(self):
+        response = self.client.get('/api/foods/search/', {'min_unknown': 1, 'order_by': 'x'})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(set(response.data), {'min_unknown', 'order_by'})
+
+
+@skipUnless(matrix.available(), 'NumPy is not installed')
+@override_settings(CACHES=TEST_CACHES)
+class SimilarFoodsTests(DataDirMixin, TestCase):
+    """The similar-foods index returns the nearest nutrient profiles"""
+    
+    @classmethod
+    def setUpTestData(cls):
+        rows = []
+        for fdc_id in range(1, 41):
+            data_type = 'foundation_food' if fdc_id % 2 else 'sr_legacy_food'
+            Food.objects.create(fdc_id=fdc_id, data_type=data_type, description=f'Food {fdc_id}')
+            rows.append(FoodNutrient(id=fdc_id * 10 + 1, fdc_id=fdc_id, nutrient_id=NutrientLookup.PROTEIN, amount=fdc_id))
+            rows.append(FoodNutrient(id=fdc_id * 10 + 2, fdc_id=fdc_id, nutrient_id=NutrientLookup.SODIUM, amount=fdc_id * 5))
+        FoodNutrient.objects.bulk_create(rows)
+        Nutrient.objects.bulk_create([
+            Nutrient(id=NutrientLookup.PROTEIN, name='Protein', unit_name='G'),
+            Nutrient(id=NutrientLookup.SODIUM, name='Sodium, Na', unit_name='MG'),
+        ])
+    
+    data_files = (matrix.files, similarity.files)
+    
+    def setUp(self):
+        super().setUp()
+        matrix.build_matrix(0)
+        similarity.build_index(0, nlist=4)
+    
+    def similar(self, **params):
+        response = self.client.get('/api/foods/foods/20/similar/', params)
+        self.assertEqual(response.status_code, 200)
+        return [row['fdc_id'] for row in response.data['results']]
+    
+    def test_matches_exact_search(self):
+        index = similarity.get_index()
+        for fdc_id in (1, 20, 40):
+            self.assertEqual(index.query(fdc_id, 5, nprobe=len(index.centroids)), index.query(fdc_id, 5, exact=True))
+        self.assertEqual(set(self.similar(k=2)), {19, 21})
+    
+    def test_filters(self):
+        self.assertEqual(set(self.similar(k=2, same_data_type='true')), {18, 22})
+        self.assertEqual(self.similar(k=3, lower='sodium'), [19, 18, 17])
+    
+    def test_same_category(self):
+        FoodCategory.objects.create(id=1, code='0100', description='Dairy')
+        Food.objects.filter(fdc_id__in=[19, 21, 30]).update(food_category_id=1)
+        similarity.build_index(0, nlist=4)
+        similarity.files.reset()
+        # Food 20 has no category, so only other uncategorized foods match
+        self.assertEqual(set(self.similar(k=2, same_category='true')), {18, 22})
+        response = self.client.get('/api/foods/foods/19/similar/', {'k': 3, 'same_category': 'true'})
+        self.assertEqual([row['fdc_id'] for row in response.data['results']], [21, 30])
+    
+    def test_invalid_params(self):
+        response = self.client.get('/api/foods/foods/20/similar/', {'k': 1000, 'lower': 'gold'})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(set(response.data), {'k', 'lower'})
+
+
+@skipUnless(planner.available(), 'NumPy is not installed')
+@override_settings(CACHES=TEST_CACHES, FOODS_DATA_DIR=tempfile.gettempdir() + '/nutriplan-tests-missing')
+class MealPlanTests(TestCase):
+    """Plans meet feasible targets using whole portions"""
+    
+    @classmethod
+    def setUpTestData(cls):
+        rows = []
+        profiles = {1: (150, 25, 5), 2: (350, 10, 10), 3: (50, 2, 8), 4: (600, 20, 2)}
+        for fdc_id, (calories, protein, fiber) in profiles.items():
+            Food.objects.create(fdc_id=fdc_id, data_type='foundation_food', description=f'Food {fdc_id}')
+            for offset, (nutrient_id, amount) in enumerate(
+                ((NutrientLookup.ENERGY_KCAL, calories), (NutrientLookup.PROTEIN, protein), (NutrientLookup.FIBER, fiber))
+            ):
+                rows.append(FoodNutrient(id=fdc_id * 10 + offset, fdc_id=fdc_id, nutrient_id=nutrient_id, amount=amount))
+        FoodNutrient.objects.bulk_create(rows)
+        FoodPortion.objects.create(id=1, fdc_id=1, seq_num=1, amount=1, portion_description='fillet', gram_weight=120)
+        rebuild_nutrition_summary()
+    
+    def setUp(self):
+        self.client = APIClient()
+        matrix.files.reset()
+    
+    def test_week_plan_meets_targets(self):
+        targets = {'calories': {'min': 1800, 'max': 2200}, 'protein': {'min': 100}, 'fiber': {'min': 25}}
+        response = self.client.post(
+            '/api/foods/plan/', {'targets': targets, 'days': 3, 'max_repeats': 3}, format='json'
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data['days']), 3)
+        for day in response.data['days']:
+            self.assertTrue(all(status['met'] for status in day['targets'].values()), day['targets'])
+            for food in day['foods']:
+                if food['fdc_id'] == 1:
+                    self.assertEqual(food['grams'], 120 * food['portion']['quantity'])
+    
+    def test_invalid_request(self):
+        response = self.client.post(
+            '/api/foods/plan/', {'targets': {'gold': 1}, 'days': 30}, format='json'
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(set(response.data), {'targets', 'days'})
+    
+    def test_zero_max_rejected(self):
+        for target in ({'min': 0, 'max': 0}, 0):
+            response = self.client.post('/api/foods/plan/', {'targets': {'fiber': target}}, format='json')
+            self.assertEqual(response.status_code, 400)
+            self.assertIn('max > 0', str(response.data['targets']))
+    
+    def test_batch_matches_single(self):
+        body = {'targets': {'calories': 2000, 'protein': {'min': 80}}, 'days': 2}
+        plans = planner.plan_meals_batch([body, {'targets': {}}], workers=1)
+        self.assertEqual(plans[0], planner.plan_meals(body))
+        self.assertIn('targets', plans[1]['errors'])
+
+
+@skipUnless(matrix.available(), 'NumPy is not installed')
+@override_settings(CACHES=TEST_CACHES)
+class UnitConversionTests(DataDirMixin, TestCase):
+    """Household measures convert to grams from the in-memory table"""
+    
+    @classmethod
+    def setUpTestData(cls):
+        MeasureUnit.objects.create(id=1000, name='cup')
+        MeasureUnit.objects.create(id=9999, name='undetermined')
+        Food.objects.create(fdc_id=1, data_type='sr_legacy_food', description='Milk')
+        Food.objects.create(fdc_id=2, data_type='branded_food', description='Bread')
+        FoodNutrient.objects.create(id=1, fdc_id=1, nutrient_id=NutrientLookup.ENERGY_KCAL, amount=60)
+        FoodPortion.objects.create(id=10, fdc_id=1, seq_num=1, amount=1, measure_unit_id=1000, gram_weight=244)
+        FoodPortion.objects.create(
+            id=11, fdc_id=1, seq_num=2, amount=2, measure_unit_id=9999, modifier='slice, thin', gram_weight=30
+        )
+        BrandedFood.objects.create(
+            fdc_id=2, serving_size=56, serving_size_unit='GRM', household_serving_fulltext='2 slices (56 g)'
+        )
+    
+    data_files = (conversions.files, matrix.files)
+    
+    def setUp(self):
+        super().setUp()
+        conversions.build_conversions(0)
+    
+    def test_parse_measure(self):
+        self.assertEqual(conversions.parse_measure('2 slices (56 g)'), (2.0, 'slice', 56.0))
+        self.assertEqual(conversions.parse_measure('1 1/2 Cups'), (1.5, 'cup', None))
+        self.assertIsNone(conversions.parse_measure('1/0 cup'))
+        self.assertIsNone(conversions.parse_measure('1 1/0 cup'))
+        self.assertEqual(conversions.parse_measure('12 FL. OZ'), (12.0, 'fl oz', None))
+    
+    def test_table(self):
+        index = conversions.get_index()
+        self.assertEqual([unit['unit'] for unit in index.units('usda', 1)], ['cup', 'slice'])
+        self.assertEqual(index.grams('usda', 1, 'slice', 2), (30.0, '2 slice, thin'))
+        self.assertAlmostEqual(index.grams('usda', 1, 'tbsp')[0], 244 / 16, places=2)
+        self.assertEqual(index.grams('usda', 2, 'slices'), (28.0, '2 slices (56 g)'))
+        self.assertEqual(index.grams('usda', 2, 'serving')[0], 56.0)
+        self.assertIsNone(index.grams('usda', 2, 'cup'))
+        self.assertAlmostEqual(index.grams('usda', 2, 'oz', 2)[0], 56.699, places=3)
+    
+    def test_meal_units_need_no_portion_queries(self):
+        ingredients = [
+            {'fdc_id': 1, 'amount': 1, 'unit': 'cup'},
+            {'fdc_id': 1, 'amount': 1, 'portion_id': 10},
+            {'fdc_id': 1, 'amount': 3, 'unit': 'fl oz'},
+        ]
+        with self.assertNumQueries(2):
+            response = self.client.post('/api/foods/nutrition/', {'ingredients': ingredients}, format='json')
+        self.assertEqual(response.status_code, 200)
+        grams = [item['grams'] for item in response.data['ingredients']]
+        self.assertEqual(grams[:2], [244.0, 244.0])
+        self.assertAlmostEqual(grams[2], 3 * 244 / 8, places=0)
+        
+        response = self.client.post(
+            '/api/foods/nutrition/', {'ingredients': [{'fdc_id': 2, 'amount': 1, 'unit': 'cup'}]}, format='json'
+        )
+        self.assertEqual(response.status_code, 400)
+
+
+@override_settings(CACHES=TEST_CACHES)
+class ServingNutritionTests(TestCase):
+    """Branded per-serving values are precomputed in the nutrition summary"""
+    
+    @classmethod
+    def setUpTestData(cls):
+        servings = {
+            1: (30, 'GRM', '1 cup'),
+            2: (None, 'g', '2 slices (56 g)'),
+            3: (250, 'MLT', ''),
+            4: (2, 'ONZ', ''),
+        }
+        for fdc_id, (size, unit, household) in servings.items():
+            Food.objects.create(fdc_id=fdc_id, data_type='branded_food', description=f'Cereal {fdc_id}')
+            BrandedFood.objects.create(
+                fdc_id=fdc_id, gtin_upc=f'000{fdc_id}', serving_size=size, serving_size_unit=unit,
+                household_serving_fulltext=household
+            )
+            FoodNutrient.objects.create(id=fdc_id, fdc_id=fdc_id, nutrient_id=NutrientLookup.ENERGY_KCAL, amount=400)
+        rebuild_nutrition_summary()
+    
+    def setUp(self):
+        self.client = APIClient()
+        response_cache.local.clear()
+        response_cache.invalidate(0)
+    
+    def test_summary(self):
+        summaries = FoodNutritionSummary.objects.in_bulk()
+        self.assertEqual(summaries[1].serving_grams, 30)
+        self.assertEqual(summaries[1].calories_per_serving, 120)
+        self.assertEqual(summaries[2].calories_per_serving, 224)
+        self.assertEqual(summaries[3].calories_per_serving, 1000)
+        self.assertIsNone(summaries[4].serving_grams)
+    
+    def test_search_sort_and_barcode(self):
+        response = self.client.get(
+            '/api/foods/search/', {'order_by': 'calories_per_serving', 'fields': 'fdc_id,per_serving'}
+        )
+        self.assertEqual([row['fdc_id'] for row in response.data['results']], [1, 2, 3, 4])
+        self.assertEqual(response.data['results'][1]['per_serving']['description'], '2 slices (56 g)')
+        self.assertIsNone(response.data['results'][3]['per_serving'])
+        
+        response = self.client.get('/api/foods/barcode/', {'barcode': '0001'})
+        self.assertEqual(response.data['per_serving']['calories'], 120)
+
+
+class IngredientIndexTests(TestCase):
+    """Ingredient and allergen filters read the parsed ingredient index"""
+    
+    @classmethod
+    def setUpTestData(cls):
+        ingredients = {
+            1: 'PEANUTS, SUGAR, COCOA BUTTER, CONTAINS 2% OR LESS OF: SALT, SOY LECITHIN',
+            2: 'Enriched Wheat Flour (Wheat Flour, Niacin), Whey, Palm Oil, Salt',
+            3: 'ROLLED OATS, ALMONDS, GLUTEN-FREE OAT FLOUR',
+            4: '',
+        }
+        for fdc_id, text in ingredients.items():
+            Food.objects.create(fdc_id=fdc_id, data_type='branded_food', description=f'Snack bar {fdc_id}')
+            BrandedFood.objects.create(fdc_id=fdc_id, ingredients=text)
+        Food.objects.create(fdc_id=5, data_type='foundation_food', description='Apples')
+        rebuild_ingredient_index()
+    
+    def setUp(self):
+        self.client = APIClient()
+        response_cache.local.clear()
+        response_cache.invalidate(0)
+    
+    def search(self, **params):
+        response = self.client.get('/api/foods/search/', {'fields': 'fdc_id', **params})
+        self.assertEqual(response.status_code, 200)
+        return [row['fdc_id'] for row in response.data['results']]
+    
+    def test_parse(self):
+        tokens, allergens = parse_ingredients(
+            'Enriched Wheat Flour (Niacin), COCOA BUTTER, no sugar added, Tomatoes'
+        )
+        self.assertEqual(tokens, [
+            'butter', 'cocoa', 'cocoa butter', 'enriched', 'enriched wheat', 'enriched wheat flour',
+            'flour', 'niacin', 'tomato', 'wheat', 'wheat flour',
+        ])
+        self.assertEqual(allergens, ['gluten', 'wheat'])
+    
+    def test_filters(self):
+        self.assertEqual(self.search(ingredients='salt'), [1, 2])
+        self.assertEqual(self.search(ingredients='Salt, wheat flour'), [2])
+        self.assertEqual(self.search(exclude_ingredients='palm oil'), [1, 3])
+        self.assertEqual(self.search(allergens='peanut'), [1])
+        self.assertEqual(self.search(free_of='milk,gluten'), [1, 3])
+        self.assertEqual(self.search(free_of='added_sugar,tree_nut'), [2])
+        
+        response = self.client.get('/api/foods/search/', {'free_of': 'nuts'})
+        self.assertEqual(response.status_code, 400)
+
+
+@skipUnless(matrix.available(), 'NumPy is not installed')
+@override_settings(CACHES=TEST_CACHES)
+class FoodGroupTests(DataDirMixin, TestCase):
+    """Near-duplicate foods share a canonical group that search can collapse"""
+    
+    @classmethod
+    def setUpTestData(cls):
+        foods = [
+            (1, 'branded_food', 'WHOLE MILK', 62),
+            (2, 'sr_legacy_food', 'Milk, whole', 61),
+            (3, 'branded_food', 'Whole milk', 60),
+            (4, 'branded_food', 'WHOLE MILK', 150),
+            (5, 'sr_legacy_food', 'Milk, skim', 35),
+        ]
+        for fdc_id, data_type, description, calories in foods:
+            Food.objects.create(fdc_id=fdc_id, data_type=data_type, description=description)
+            FoodNutrient.objects.create(id=fdc_id, fdc_id=fdc_id, nutrient_id=NutrientLookup.ENERGY_KCAL, amount=calories)
+        Nutrient.objects.create(id=NutrientLookup.ENERGY_KCAL, name='Energy', unit_name='KCAL')
+        Food.objects.update(search_vector=SearchVector('description'))
+    
+    data_files = (matrix.files,)
+    
+    def setUp(self):
+        super().setUp()
+        matrix.build_matrix(0)
+        grouping.build_groups(0)
+    
+    def test_groups(self):
+        self.assertEqual(
+            set(FoodGroup.objects.values_list('food_id', 'group_id', 'group_size')),
+            {(1, 2, 3), (2, 2, 3), (3, 2, 3)}
+        )
+    
+    def test_collapsed_search(self):
+        response = self.client.get('/api/foods/search/', {'q': 'milk', 'collapse': 'true', 'fields': 'fdc_id'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['total_count'], 3)
+        groups = {row['group_id']: row['group_matches'] for row in response.data['results']}
+        self.assertEqual(groups, {2: 3, 4: 1, 5: 1})
+        
+        response = self.client.get('/api/foods/search/', {'q': 'whole', 'collapse': 'true', 'fields': 'fdc_id'})
+        self.assertEqual(len(response.data['results']), 2)
+
+
+@override_settings(CACHES=TEST_CACHES)
+class CNFoodLinkTests(TestCase):
+    """CN foods link to FDC foods by fdc_id, GTIN and description"""
+    
+    @classmethod
+    def setUpTestData(cls):
+        Food.objects.create(fdc_id=1, data_type='sr_legacy_food', description='Milk, chocolate, whole')
+        Food.objects.create(fdc_id=2, data_type='branded_food', description='CHOCO BAR')
+        BrandedFood.objects.create(fdc_id=2, gtin_upc='012345678905')
+        cn_foods = [
+            (10, 'CHOCOLATE SYRUP', None, 1),
+            (11, 'CANDY BAR, CHOCOLATE', '00012345678905', None),
+            (12, 'MILK, WHOLE, CHOCOLATE', None, None),
+            (13, 'PIZZA, CHEESE', '', 999),
+        ]
+        for cn_code, descriptor, gtin, fdc_id in cn_foods:
+            CNFood.objects.create(
+                cn_code=cn_code, descriptor=descriptor, abbreviated_descriptor=descriptor[:20],
+                gtin=gtin, fdc_id=fdc_id
+            )
+        Food.objects.update(search_vector=SearchVector('description'))
+        CNFood.objects.update(search_vector=SearchVector('descriptor', 'abbreviated_descriptor'))
+        rebuild_cn_links()
+    
+    def setUp(self):
+        self.client = APIClient()
+        response_cache.local.clear()
+        response_cache.invalidate(0)
+    
+    def test_links(self):
+        self.assertEqual(
+            set(CNFoodLink.objects.values_list('cn_food_id', 'food_id', 'method')),
+            {(10, 1, 'fdc_id'), (11, 2, 'gtin'), (12, 1, 'description')}
+        )
+    
+    def test_unified_search(self):
+        with self.assertNumQueries(3):
+            response = self.client.get('/api/foods/search/unified/', {'q': 'chocolate'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['total_count'], 4)
+        results = {(row['source'], row['id']): row['linked'] for row in response.data['results']}
+        self.assertEqual(results, {('usda', 1): [10, 12], ('cn', 10): [1], ('cn', 11): [2], ('cn', 12): [1]})
+
+
+@skipUnless(matrix.available(), 'NumPy is not installed')
+@override_settings(CACHES=TEST_CACHES)
+class FacetSearchTests(DataDirMixin, TestCase):
+    """Facet counts come from the facet index and match the filtered results"""
+    
+    @classmethod
+    def setUpTestData(cls):
+        for fdc_id in range(1, 13):
+            branded = fdc_id <= 8
+            Food.objects.create(
+                fdc_id=fdc_id, data_type='branded_food' if branded else 'foundation_food',
+                description=f'Oat bar {fdc_id}', food_category_id=fdc_id % 2 + 1
+            )
+            if branded:
+                BrandedFood.objects.create(
+                    fdc_id=fdc_id, brand_owner='Acme' if fdc_id <= 5 else 'Globex',
+                    market_country='United States' if fdc_id % 4 else 'Canada'
+                )
+        Food.objects.update(search_vector=SearchVector('description'))
+    
+    data_files = (facets.files,)
+    
+    def setUp(self):
+        super().setUp()
+        facets.build_facet_index(0)
+    
+    def search(self, **params):
+        response = self.client.get('/api/foods/search/', {'fields': 'fdc_id', **params})
+        self.assertEqual(response.status_code, 200)
+        return response.data
+    
+    def test_browse_from_index(self):
+        with self.assertNumQueries(1):
+            data = self.search(data_type='branded_food', brand_owner='Acme', facets='all', page_size=2, page=2)
+        self.assertEqual(data['total_count'], 5)
+        self.assertEqual([row['fdc_id'] for row in data['results']], [3, 4])
+        self.assertEqual(data['facets']['brand_owner'], [{'value': 'Acme', 'count': 5}])
+        self.assertEqual(
+            data['facets']['market_country'],
+            [{'value': 'United States', 'count': 4}, {'value': 'Canada', 'count': 1}]
+        )
+    
+    def test_text_search_counts(self):
+        with self.assertNumQueries(2):
+            data = self.search(q='oat bar', facets='data_type,brand_owner', page_size=3)
+        self.assertEqual(data['total_count'], 12)
+        self.assertEqual(data['facets']['data_type'], [
+            {'value': 'branded_food', 'count': 8}, {'value': 'foundation_food', 'count': 4}
+        ])
+        self.assertEqual(data['facets']['brand_owner'], [
+            {'value': 'Acme', 'count': 5}, {'value': 'Globex', 'count': 3}
+        ])
+        
+        data = self.search(q='oat bar', market_country='Canada')
+        self.assertEqual({row['fdc_id'] for row in data['results']}, {4, 8})
+
+
+@skipUnless(matrix.available(), 'NumPy is not installed')
+@override_settings(CACHES=TEST_CACHES)
+class FoodScoreTests(DataDirMixin, TestCase):
+    """Scores are computed per 100 kcal and can be filtered and sorted on"""
+    
+    @classmethod
+    def setUpTestData(cls):
+        values = {
+            1: {NutrientLookup.ENERGY_KCAL: 200, NutrientLookup.PROTEIN: 20, NutrientLookup.FIBER: 5, NutrientLookup.SODIUM: 460},
+            2: {2047: 100, NutrientLookup.PROTEIN: 2, NutrientLookup.SODIUM: 1150},
+            3: {NutrientLookup.PROTEIN: 5},
+        }
+        Nutrient.objects.bulk_create([
+            Nutrient(id=nutrient_id, name=str(nutrient_id), unit_name='G')
+            for nutrient_id in {nutrient_id for amounts in values.values() for nutrient_id in amounts}
+        ])
+        row_id = 0
+        for fdc_id, amounts in values.items():
+            Food.objects.create(fdc_id=fdc_id, data_type='sr_legacy_food', description=f'Food {fdc_id}')
+            for nutrient_id, amount in amounts.items():
+                row_id += 1
+                FoodNutrient.objects.create(id=row_id, fdc_id=fdc_id, nutrient_id=nutrient_id, amount=amount)
+    
+    data_files = (matrix.files,)
+    
+    def setUp(self):
+        super().setUp()
+        matrix.build_matrix(0)
+        self.assertEqual(scores.build_scores(0), 2)
+    
+    def test_scores(self):
+        first = FoodScore.objects.get(food_id=1)
+        self.assertAlmostEqual(first.protein_per_100kcal, 10)
+        self.assertAlmostEqual(first.sodium_per_100kcal, 230)
+        self.assertIsNone(first.sugars_per_100kcal)
+        self.assertAlmostEqual(first.nrf9_3, 100 * (10 / 50 + 2.5 / 28 - 230 / 2300), places=3)
+        # Atwater energy stands in for missing kcal
+        self.assertAlmostEqual(FoodScore.objects.get(food_id=2).nrf9_3, 100 * (2 / 50 - 1150 / 2300), places=3)
+        # No energy, no score
+        self.assertFalse(FoodScore.objects.filter(food_id=3).exists())
+    
+    def test_sort_and_filter(self):
+        response = self.client.get('/api/foods/foods/', {'order_by': '-nrf9_3', 'fields': 'fdc_id,scores'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([row['fdc_id'] for row in response.data['results']], [1, 2, 3])
+        self.assertIsNone(response.data['results'][2]['scores'])
+        
+        response = self.client.get('/api/foods/search/', {'min_protein_per_100kcal': 5, 'fields': 'fdc_id'})
+        self.assertEqual([row['fdc_id'] for row in response.data['results']], [1])
+        
+        response = self.client.get('/api/foods/search/', {'order_by': 'nrf9_3', 'fields': 'fdc_id'})
+        self.assertEqual([row['fdc_id'] for row in response.data['results']], [2, 1, 3])
+
+
+class FoodExportTests(TestCase):
+    """Exports stream every matching food with its nutrients"""
+    
+    @classmethod
+    def setUpTestData(cls):
+        Nutrient.objects.create(id=NutrientLookup.PROTEIN, name='Protein', unit_name='G')
+        Nutrient.objects.create(id=NutrientLookup.ENERGY_KCAL, name='Energy', unit_name='KCAL')
+        Food.objects.create(fdc_id=1, data_type='sr_legacy_food', description='Milk, whole')
+        Food.objects.create(fdc_id=2, data_type='branded_food', description='OAT MILK', dataset_version=3)
+        Food.objects.create(fdc_id=3, data_type='branded_food', description='WATER', dataset_version=4)
+        FoodNutrient.objects.create(id=1, fdc_id=1, nutrient_id=NutrientLookup.PROTEIN, amount=3.3)
+        FoodNutrient.objects.create(id=2, fdc_id=1, nutrient_id=NutrientLookup.ENERGY_KCAL, amount=61)
+        FoodNutrient.objects.create(id=3, fdc_id=2, nutrient_id=NutrientLookup.ENERGY_KCAL, amount=48)
+        DatasetChange.objects.create(version=3, source='usda', record_id=2, action=DatasetChange.ACTION_INSERT)
+        DatasetChange.objects.create(version=4, source='usda', record_id=3, action=DatasetChange.ACTION_INSERT)
+        rebuild_nutrition_summary()
+    
+    def setUp(self):
+        self.client = APIClient()
+    
+    def fetch(self, export_format, **params):
+        response = self.client.get(f'/api/foods/export/{export_format}/', params, HTTP_ACCEPT_ENCODING='identity')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        return b''.join(response.streaming_content)
+    
+    def test_csv(self):
+        lines = self.fetch('csv').decode().splitlines()
+        self.assertEqual(lines[0].split(',')[-4:], ['nutrient_id', 'nutrient_name', 'unit_name', 'amount'])
+        self.assertEqual(len(lines), 5)
+        self.assertTrue(lines[1].startswith('1,sr_legacy_food,"Milk, whole"'))
+        self.assertTrue(lines[4].startswith('3,branded_food,WATER') and lines[4].endswith(',,,'))
+    
+    def test_ndjson_filters(self):
+        rows = [json.loads(line) for line in self.fetch('ndjson', min_calories=50).splitlines()]
+        self.assertEqual([(row['fdc_id'], row['nutrients']) for row in rows], [(1, {'1003': 3.3, '1008': 61.0})])
+        
+        rows = [json.loads(line) for line in self.fetch('ndjson', since_version=3, nutrients='1008').splitlines()]
+        self.assertEqual([(row['fdc_id'], row['nutrients']) for row in rows], [(3, {})])
+        
+        response = self.client.get('/api/foods/export/xml/')
+        self.assertEqual(response.status_code, 400)
+    
+    @skipUnless(export.parquet_available(), 'pyarrow is not installed')
+    def test_parquet(self):
+        import pyarrow.parquet as pq
+        table = pq.read_table(io.BytesIO(self.fetch('parquet', data_type='sr_legacy_food')))
+        self.assertEqual(table.column('nutrient_id').to_pylist(), [NutrientLookup.PROTEIN, NutrientLookup.ENERGY_KCAL])
+        self.assertEqual(table.column('amount').to_pylist(), [3.3, 61.0])
+
+
+@override_settings(CACHES=TEST_CACHES)
+class ChangeFeedTests(TestCase):
+    """Releases log the foods they changed, and clients page through the deltas"""
+    
+    def setUp(self):
+        self.client = APIClient()
+        response_cache.local.clear()
+        response_cache.invalidate(0)
+    
+    def release(self):
+        release = DatasetRelease.objects.create(source=DatasetRelease.SOURCE_USDA, completed_at=timezone.now())
+        return release.id, record_changes(release.id)
+    
+    def test_change_log(self):
+        for fdc_id in (1, 2, 3):
+            Food.objects.create(fdc_id=fdc_id, data_type='sr_legacy_food', description=f'Food {fdc_id}')
+        CNFood.objects.create(cn_code=10, descriptor='PIZZA', abbreviated_descriptor='PIZZA')
+        first, counts = self.release()
+        self.assertEqual(counts, {'insert': 4, 'update': 0, 'delete': 0})
+        
+        Food.objects.filter(fdc_id=1).update(description='Food one')
+        FoodNutrient.objects.create(id=1, fdc_id=3, nutrient_id=NutrientLookup.PROTEIN, amount=1)
+        Food.objects.filter(fdc_id=2).delete()
+        Food.objects.create(fdc_id=4, data_type='sr_legacy_food', description='Food 4')
+        second, counts = self.release()
+        self.assertEqual(counts, {'insert': 1, 'update': 2, 'delete': 1})
+        self.assertEqual(self.release()[1], {'insert': 0, 'update': 0, 'delete': 0})
+        
+        response = self.client.get('/api/foods/changes/', {'since': first})
+        self.assertEqual(response.status_code, 200)
+        usda = response.data['changes']['usda']
+        self.assertEqual((sorted(usda['upserted']), usda['deleted']), ([1, 3, 4], [2]))
+        self.assertEqual(response.data['changes']['cn'], {'upserted': [], 'deleted': []})
+        self.assertIsNone(response.data['next_cursor'])
+        
+        # A full sync pages through the latest change of each food once
+        seen, params = [], {'since': 0, 'limit': 2}
+        while True:
+            data = self.client.get('/api/foods/changes/', params).data
+            seen += [(source, key, record_id) for source, lists in data['changes'].items()
+                     for key, ids in lists.items() for record_id in ids]
+            if data['next_cursor'] is None:
+                break
+            params['cursor'] = data['next_cursor']
+        self.assertEqual(sorted(seen), [
+            ('cn', 'upserted', 10), ('usda', 'deleted', 2),
+            ('usda', 'upserted', 1), ('usda', 'upserted', 3), ('usda', 'upserted', 4),
+        ])
+        self.assertEqual(data['version'], second + 1)
+        
+        response = self.client.get('/api/foods/changes/', {'cursor': '!!'})
+        self.assertEqual(response.status_code, 400)
+
+
+@override_settings(CACHES=TEST_CACHES)
+class OfflineBundleTests(DataDirMixin, TestCase):
+    """Bundles hold the most searched foods and are served as immutable files"""
+    
+    @classmethod
+    def setUpTestData(cls):
+        FoodCategory.objects.create(id=1, code='0100', description='Dairy')
+        foods = [
+            (1, 'branded_food', 'CHEDDAR CHEESE', None),
+            (2, 'sr_legacy_food', 'Milk, whole', 1),
+            (3, 'branded_food', 'OAT MILK', None),
+            (4, 'foundation_food', 'Apples, raw', None),
+        ]
+        for fdc_id, data_type, description, category_id in foods:
+            Food.objects.create(
+                fdc_id=fdc_id, data_type=data_type, description=description, food_category_id=category_id
+            )
+        Food.objects.update(search_vector=SearchVector('description'))
+        FoodNutrient.objects.create(id=1, fdc_id=2, nutrient_id=NutrientLookup.ENERGY_KCAL, amount=61)
+        Nutrient.objects.create(id=NutrientLookup.ENERGY_KCAL, name='Energy', unit_name='KCAL')
+        MeasureUnit.objects.create(id=1000, name='cup')
+        FoodPortion.objects.create(id=1, fdc_id=2, seq_num=1, amount=1, measure_unit_id=1000, gram_weight=244)
+        rebuild_nutrition_summary()
+        QueryLogEntry.objects.create(
+            kind='search', params_key='a', params={'q': 'oat milk'}, hits=5, last_seen=timezone.now()
+        )
+    
+    data_files = (bundles.files,)
+    
+    def setUp(self):
+        super().setUp()
+        self.manifest = bundles.build_bundles(0, top=3)
+    
+    def test_barcode_popularity(self):
+        BrandedFood.objects.create(fdc_id=1, gtin_upc='012345678905')
+        for key, barcode, hits in (('b', '00012345678905', 3), ('c', '12345678905', 2), ('d', '42', 9)):
+            QueryLogEntry.objects.create(
+                kind='barcode', params_key=key, params={'barcode': barcode}, hits=hits, last_seen=timezone.now()
+            )
+        # Every rendering of the stored GTIN counts for its food
+        self.assertEqual(bundles.popularity()[1], 5)
+    
+    def fetch_bundle(self, name):
+        response = self.client.get('/api/foods/bundles/')
+        self.assertEqual(response.status_code, 200)
+        url = response.data['bundles'][name]['url']
+        response = self.client.get(url, HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertIn('immutable', response['Cache-Control'])
+        content = b''.join(response.streaming_content)
+        self.assertEqual(hashlib.sha256(content).hexdigest(), self.manifest['bundles'][name]['sha256'])
+        return json.loads(gzip.decompress(content))
+    
+    def test_top_bundle(self):
+        bundle = self.fetch_bundle('top')
+        # Search hits first, then foundation, SR legacy, ... foods
+        self.assertEqual([food['fdc_id'] for food in bundle['foods']], [3, 4, 2])
+        milk = bundle['foods'][2]
+        self.assertEqual(milk['macros']['calories'], 61)
+        self.assertEqual(milk['portions'], [['1 cup', 244]])
+        self.assertEqual(bundle['prefixes']['mil'], [3, 2])
+    
+    def test_category_bundle(self):
+        self.assertEqual(set(self.manifest['bundles']), {'top', 'category-1'})
+        self.assertEqual([food['fdc_id'] for food in self.fetch_bundle('category-1')['foods']], [2])
+        
+        filename = self.manifest['bundles']['category-1']['file']
+        for accept_encoding in ('identity', 'gzip;q=0', 'deflate, *;q=0', ''):
+            response = self.client.get(f'/api/foods/bundles/{filename}', HTTP_ACCEPT_ENCODING=accept_encoding)
+            self.assertFalse(response.has_header('Content-Encoding'), accept_encoding)
+            self.assertEqual(json.loads(response.content)['name'], 'category-1')
+        response = self.client.get(f'/api/foods/bundles/{filename}', HTTP_ACCEPT_ENCODING='deflate, *;q=0.5')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(self.client.get('/api/foods/bundles/manifest.json').status_code, 404)
+
+
+@override_settings(CACHES=TEST_CACHES, FOODS_READ_BACKEND='foods.backends.SnapshotBackend')
+class SnapshotTests(DataDirMixin, TestCase):
+    """The SQLite snapshot answers detail, search and autocomplete like the database"""
+    
+    @classmethod
+    def setUpTestData(cls):
+        FoodCategory.objects.create(id=1, code='0100', description='Dairy')
+        foods = [
+            (1, 'sr_legacy_food', 'Milk, whole', 1),
+            (2, 'branded_food', 'OAT MILK', None),
+            (3, 'foundation_food', 'Apples, raw', None),
+        ]
+        for fdc_id, data_type, description, category_id in foods:
+            Food.objects.create(
+                fdc_id=fdc_id, data_type=data_type, description=description, food_category_id=category_id
+            )
+        Food.objects.update(search_vector=SearchVector('description'))
+        BrandedFood.objects.create(fdc_id=2, gtin_upc='00012345678905', serving_size=240, serving_size_unit='ml')
+        Nutrient.objects.create(id=NutrientLookup.PROTEIN, name='Protein', unit_name='G')
+        FoodNutrient.objects.create(id=1, fdc_id=1, nutrient_id=NutrientLookup.PROTEIN, amount=3.2)
+        FoodNutrient.objects.create(id=2, fdc_id=2, nutrient_id=NutrientLookup.PROTEIN, amount=1)
+        MeasureUnit.objects.create(id=1000, name='cup')
+        FoodPortion.objects.create(id=1, fdc_id=1, seq_num=1, amount=1, measure_unit_id=1000, gram_weight=244)
+        rebuild_nutrition_summary()
+    
+    data_files = (snapshot.files,)
+    
+    def setUp(self):
+        super().setUp()
+        self.counts = snapshot.build_snapshot(0)
+    
+    def test_reader(self):
+        self.assertEqual(self.counts, (3, 0))
+        reader = snapshot.get_snapshot()
+        with self.assertNumQueries(0):
+            results, total = reader.search('milk')
+            self.assertEqual((sorted(food['fdc_id'] for food in results), total), ([1, 2], 2))
+            self.assertEqual(reader.search('milk', data_type='branded_food')[1], 1)
+            self.assertEqual(reader.search('mi')[0][0]['description'], 'Milk, whole')
+            self.assertEqual(reader.autocomplete('app'), ['Apples, raw'])
+            food = reader.food(1)
+        self.assertEqual(food['food_category'], 'Dairy')
+        self.assertEqual(food['protein'], 3.2)
+        self.assertIsNone(reader.food(4))
+        portion = reader.connection.execute('SELECT measure_unit, gram_weight FROM food_portion').fetchone()
+        self.assertEqual(tuple(portion), ('cup', 244))
+        gtin = reader.connection.execute('SELECT fdc_id FROM branded_food WHERE gtin_upc = ?', ['00012345678905'])
+        self.assertEqual(gtin.fetchone()[0], 2)
+    
+    def test_views_match_database(self):
+        urls = ['/api/foods/foods/1/', '/api/foods/search/?q=milk', '/api/foods/autocomplete/?q=oat']
+        with self.assertNumQueries(0):
+            from_snapshot = [self.client.get(url).json() for url in urls]
+        with self.settings(FOODS_READ_BACKEND=''):
+            response_cache.local.clear()
+            response_cache.invalidate(1)
+            from_database = [self.client.get(url).json() for url in urls]
+        self.assertEqual(from_snapshot[0], from_database[0])
+        self.assertEqual(from_snapshot[2], from_database[2])
+        self.assertEqual(
+            sorted(from_snapshot[1]['results'], key=lambda food: food['fdc_id']),
+            sorted(from_database[1]['results'], key=lambda food: food['fdc_id'])
+        )
+        self.assertEqual(from_snapshot[1]['total_count'], 2)
+    
+    def test_no_database_queries(self):
+        query_recorder.flush()
+        # Forget the version set in setUp, so it is looked up again
+        response_cache._version = None
+        response_cache.shared.clear()
+        with self.assertNumQueries(0):
+            self.assertEqual(response_cache.get_dataset_version(), 0)
+            self.assertEqual(self.client.get('/api/foods/foods/1/')['X-Cache'], 'MISS')
+            self.assertEqual(self.client.get('/api/foods/foods/4/').status_code, 404)
+            self.assertEqual(self.client.get('/api/foods/foods/²/').status_code, 404)
+            self.assertEqual(self.client.get('/api/foods/search/', {'q': 'milk'}).data['total_count'], 2)
+            self.assertEqual(self.client.get('/api/foods/autocomplete/', {'q': 'oat'}).data, ['OAT MILK'])
+        self.assertEqual(query_recorder._pending, {})
+        
+        with tempfile.TemporaryDirectory() as data_dir, self.settings(FOODS_DATA_DIR=data_dir):
+            snapshot.files.reset()
+            response_cache.invalidate(0)
+            with self.assertNumQueries(0):
+                self.assertEqual(self.client.get('/api/foods/foods/2/').status_code, 404)
+                response = self.client.get('/api/foods/search/', {'q': 'oat', 'page': 2})
+                self.assertEqual((response.data['results'], response.data['total_count']), ([], 0))
+                self.assertEqual(self.client.get('/api/foods/autocomplete/', {'q': 'app'}).data, [])
+
+
+@override_settings(CACHES=TEST_CACHES)
+class BarcodeIndexTests(DataDirMixin, TestCase):
+    """Barcode lookups are answered from the memory-mapped GTIN index"""
+    
+    @classmethod
+    def setUpTestData(cls):
+        branded = [
+            (1, '0016000275270', 'CEREAL', 'General Mills', 30),
+            (2, '00012345678905', 'OLD JUICE', 'Acme', None),
+            (3, '012345678905', 'JUICE', 'Acme', 240),
+        ]
+        for fdc_id, gtin, description, brand_owner, serving_size in branded:
+            Food.objects.create(fdc_id=fdc_id, data_type='branded_food', description=description)
+            BrandedFood.objects.create(
+                fdc_id=fdc_id, gtin_upc=gtin, brand_owner=brand_owner, serving_size=serving_size,
+                serving_size_unit='g', ingredients='OATS, SUGAR'
+            )
+            FoodNutrient.objects.create(
+                id=fdc_id, fdc_id=fdc_id, nutrient_id=NutrientLookup.ENERGY_KCAL, amount=100 * fdc_id
+            )
+        # Not found by either path: a branded row without its food
+        BrandedFood.objects.create(fdc_id=4, gtin_upc='0099999999999')
+        rebuild_nutrition_summary()
+    
+    data_files = (barcodes.files,)
+    
+    def setUp(self):
+        super().setUp()
+        self.count = barcodes.build_barcodes(0)
+    
+    def test_lookup_matches_database(self):
+        self.assertEqual(self.count, 2)
+        barcode_index = barcodes.get_index()
+        for gtin in ('0016000275270', '012345678905'):
+            # branded row (FastBrandedFoodSerializer columns) + description + macros + serving
+            with self.assertNumQueries(4):
+                from_database = BarcodeSearchView.lookup_database(gtin)
+            self.assertEqual(barcode_index.lookup(gtin), from_database)
+        # Any rendering of a GTIN finds the newest food carrying it
+        self.assertEqual(barcode_index.lookup('12345678905')['fdc_id'], 3)
+        self.assertEqual(barcode_index.lookup('00012345678905')['fdc_id'], 3)
+        self.assertEqual(barcode_index.lookup('016000275270')['per_serving']['calories'], 30)
+        self.assertIsNone(barcode_index.lookup('0099999999999'))
+        self.assertIsNone(barcode_index.lookup('123'))
+        self.assertIsNone(barcode_index.lookup('abc'))
+        # Non-ASCII digits are dropped, as the SQL normalization drops them
+        self.assertIsNone(barcode_index.lookup('²'))
+        self.assertEqual(barcode_index.lookup('12345678905²')['fdc_id'], 3)
+        self.assertEqual(self.client.get('/api/foods/barcode/', {'barcode': '²'}).status_code, 404)
+    
+    def test_view(self):
+        with self.assertNumQueries(0):
+            response = self.client.get('/api/foods/barcode/', {'barcode': '0016000275270', 'portion': 'oz'})
+        self.assertEqual(response.data['description'], 'CEREAL')
+        self.assertEqual(response.data['nutrition']['calories'], 100)
+        self.assertEqual(response.data['portion']['grams'], 28.35)
+        
+        # Codes missing from the index fall back to the database
+        BrandedFood.objects.filter(fdc_id=4).update(gtin_upc='0088888888888')
+        Food.objects.create(fdc_id=4, data_type='branded_food', description='NEW FOOD')
+        response = self.client.get('/api/foods/barcode/', {'barcode': '0088888888888'})
+        self.assertEqual(response.data['fdc_id'], 4)
+        self.assertEqual(self.client.get('/api/foods/barcode/', {'barcode': '42'}).status_code, 404)
+    
+    def test_database_fallback_normalizes_gtin(self):
+        barcodes.files.reset()
+        with self.settings(FOODS_DATA_DIR=tempfile.gettempdir() + '/nutriplan-tests-missing'):
+            self.assertIsNone(barcodes.get_index())
+            for barcode in ('12345678905', '0012345678905', '0-12345-67890-5'):
+                response = self.client.get('/api/foods/barcode/', {'barcode': barcode})
+                self.assertEqual((response.status_code, response.data.get('fdc_id')), (200, 3), barcode)
+            self.assertIsNone(BarcodeSearchView.lookup_database('000'))
+    
+    def test_database_fallback_uses_index(self):
+        with CaptureQueriesContext(connection) as queries:
+            BarcodeSearchView.lookup_database('0-12345-67890-5')
+        with connection.cursor() as cursor:
+            # The table is tiny, so make the planner show whether the index applies
+            cursor.execute('SET LOCAL enable_seqscan = off')
+            cursor.execute(f"EXPLAIN {queries[0]['sql']}")
+            plan = '\n'.join(row[0] for row in cursor.fetchall())
+        self.assertIn('branded_food_gtin_normalized_idx', plan)
+    
+    def test_logging_stays_off_the_request_thread(self):
+        query_recorder.flush()
+        options = {**query_recorder.options, 'FLUSH_IN_BACKGROUND': True, 'FLUSH_EVERY': 1}
+        with mock.patch.object(query_recorder, 'options', options), \
+                mock.patch.object(query_recorder, '_flush_in_thread') as flush_in_thread:
+            with self.assertNumQueries(0):
+                response = self.client.get('/api/foods/barcode/', {'barcode': '0016000275270'})
+            query_recorder._flush_thread.join()
+        self.assertEqual(response.data['fdc_id'], 1)
+        flush_in_thread.assert_called_once_with()
+        self.assertEqual(list(query_recorder._pending.values()), [[{'barcode': '0016000275270', 'portion': ''}, 1]])
+        query_recorder.flush()
+
+
+@override_settings(CACHES=TEST_CACHES)
+class ResponseCacheTests(TestCase):
+    """Responses are served from the local LRU, then the shared cache, keyed on the dataset version"""
+    
+    def setUp(self):
+        self.cache = TieredResponseCache({**get_cache_settings(), 'LOCK_WAIT': 1})
+        self.cache.metrics = CacheMetrics(flush_every=1)
+        self.cache.shared.clear()
+        self.cache.invalidate(0)
+        self.builds = 0
+    
+    def build(self, status_code=200):
+        self.builds += 1
+        return Response({'build': self.builds}, status=status_code)
+    
+    def respond(self, namespace='test', params=None, status_code=200):
+        return self.cache.respond(namespace, params or {'q': 'milk'}, lambda: self.build(status_code))
+    
+    def test_miss_then_hit(self):
+        self.assertEqual(self.respond()['X-Cache'], 'MISS')
+        response = self.respond()
+        self.assertEqual((response['X-Cache'], response.data), ('HIT-LOCAL', {'build': 1}))
+        
+        # Another process only sees the shared entry, and promotes it to its LRU
+        self.cache.local.clear()
+        self.assertEqual(self.respond()['X-Cache'], 'HIT-SHARED')
+        self.assertEqual(self.respond()['X-Cache'], 'HIT-LOCAL')
+        self.assertEqual(self.respond(params={'q': 'oats'})['X-Cache'], 'MISS')
+        self.assertEqual(self.builds, 2)
+    
+    def test_invalidate(self):
+        self.respond()
+        self.cache.invalidate(1)
+        response = self.respond()
+        self.assertEqual((response['X-Cache'], response.data), ('MISS', {'build': 2}))
+        self.assertEqual(self.cache.get_dataset_version(), 1)
+        
+        # A process still on the old version picks the new one up from the shared cache
+        other = TieredResponseCache({**get_cache_settings(), 'VERSION_CHECK_INTERVAL': 0})
+        self.assertEqual(other.respond('test', {'q': 'milk'}, self.build)['X-Cache'], 'HIT-SHARED')
+    
+    def test_metrics_per_namespace(self):
+        self.respond('a')
+        self.respond('a')
+        self.respond('b')
+        namespaces = self.cache.stats()['namespaces']
+        self.assertEqual(
+            namespaces['a']['shared'], {'local_hits': 1, 'shared_hits': 0, 'misses': 1, 'coalesced': 0, 'hit_rate': 0.5}
+        )
+        self.assertEqual(namespaces['b']['process']['misses'], 1)
+        self.assertEqual(namespaces['b']['shared']['local_hits'], 0)
+    
+    def test_errors_not_cached(self):
+        self.assertEqual(self.respond(status_code=500).status_code, 500)
+        self.assertEqual(self.respond(status_code=400)['X-Cache'], 'MISS')
+        self.assertEqual(self.respond()['X-Cache'], 'MISS')
+        self.assertEqual(self.builds, 3)
+        
+        # Definite "not found" answers are reused
+        self.respond('missing', status_code=404)
+        self.assertEqual(self.respond('missing', status_code=404)['X-Cache'], 'HIT-LOCAL')
+    
+    def test_concurrent_misses_coalesce(self):
+        def slow_build():
+            time.sleep(0.2)
+            return self.build()
+        
+        callers = 8
+        barrier = threading.Barrier(callers)
+        responses = [None] * callers
+        
+        def call(i):
+            barrier.wait()
+            responses[i] = self.cache.respond('test', {'q': 'milk'}, slow_build)
+        
+        threads = [threading.Thread(target=call, args=(i,)) for i in range(callers)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(self.builds, 1)
+        self.assertEqual([response.data for response in responses], [{'build': 1}] * callers)
+        self.assertEqual(sorted(response['X-Cache'] for response in responses), ['COALESCED'] * 7 + ['MISS'])
+        self.assertEqual(self.cache.stats()['namespaces']['test']['shared']['coalesced'], callers - 1)
+    
+    def test_waits_for_other_process(self):
+        # Another process holds the lock and stores its result while we wait
+        key = self.cache.make_key('test', {'q': 'milk'})
+        self.cache.shared.add(f'{key}:lock', 'other', 30)
+        threading.Timer(0.1, lambda: self.cache.shared.set(key, (200, {'build': 'other'}))).start()
+        response = self.respond()
+        self.assertEqual((response['X-Cache'], response.data), ('COALESCED', {'build': 'other'}))
+        self.assertEqual(self.builds, 0)
+        
+        # A lock holder that never answers is given up on after LOCK_WAIT
+        key = self.cache.make_key('test', {'q': 'oats'})
+        self.cache.shared.add(f'{key}:lock', 'crashed', 30)
+        self.assertEqual(self.respond(params={'q': 'oats'})['X-Cache'], 'MISS')
+        self.assertEqual(self.builds, 1)
+
+
+@override_settings(CACHES=TEST_CACHES)
+class CompleteImportTests(TestCase):
+    """A release becomes the dataset version only after all of its data files are built"""
+    
+    def setUp(self):
+        response_cache.local.clear()
+        response_cache.invalidate(0)
+    
+    def test_failed_build_keeps_previous_version(self):
+        release = begin_import(DatasetRelease.SOURCE_USDA)
+        with mock.patch('foods.pipeline.build_data_files', side_effect=RuntimeError('build failed')):
+            with self.assertRaises(RuntimeError):
+                complete_import(release, warm_caches=False)
+        release.refresh_from_db()
+        self.assertIsNone(release.completed_at)
+        self.assertEqual(DatasetRelease.current_version(), 0)
+        self.assertEqual(response_cache.get_dataset_version(), 0)
+        
+        with mock.patch('foods.pipeline.build_data_files'):
+            complete_import(release, warm_caches=False)
+        self.assertEqual(DatasetRelease.current_version(), release.id)
+        self.assertEqual(response_cache.get_dataset_version(), release.id)
+
+
+class SQLiteCacheTests(SimpleTestCase):
+    """The shared SQLite cache culls old entries but keeps keys stored without an expiry"""
+    
+    def setUp(self):
+        data_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(data_dir.cleanup)
+        self.cache = SQLiteCache(
+            os.path.join(data_dir.name, 'cache.sqlite3'), {'OPTIONS': {'MAX_ENTRIES': 10, 'CULL_FREQUENCY': 2}}
+        )
+    
+    def test_cull_keeps_persistent_keys(self):
+        self.cache.set('version', 7, None)
+        self.cache.add('counter', 1, None)
+        for i in range(30):
+            self.cache.set(f'entry-{i}', i, 60)
+        self.cache.cull()
+        self.assertEqual(self.cache.get('version'), 7)
+        self.assertEqual(self.cache.incr('counter'), 2)
+        kept = [i for i in range(30) if self.cache.has_key(f'entry-{i}')]
+        self.assertEqual(kept, list(range(25, 30)))
+
+
+@override_settings(CACHES=TEST_CACHES)
+class QueryLogTests(TestCase):
+    """Query counts are buffered, flushed off the request thread and replayed by warm_caches"""
+    
+    def setUp(self):
+        self.client = APIClient()
+        response_cache.local.clear()
+        response_cache.invalidate(0)
+    
+    def recorder(self, **options):
+        return QueryRecorder({**get_query_log_settings(), 'FLUSH_IN_BACKGROUND': False, **options})
+    
+    def hits(self):
+        return dict(QueryLogEntry.objects.values_list('params__q', 'hits'))
+    
+    def test_record_and_flush(self):
+        recorder = self.recorder(FLUSH_EVERY=3)
+        recorder.record('search', {'q': 'milk'})
+        recorder.record('search', {'q': 'milk'})
+        self.assertEqual(self.hits(), {})
+        recorder.record('search', {'q': 'oats'})
+        self.assertEqual(self.hits(), {'milk': 2, 'oats': 1})
+        recorder.record('search', {'q': 'milk'})
+        recorder.flush()
+        self.assertEqual(self.hits(), {'milk': 3, 'oats': 1})
+    
+    def test_flush_in_background(self):
+        recorder = self.recorder(FLUSH_IN_BACKGROUND=True, FLUSH_EVERY=1)
+        threads = []
+        with mock.patch.object(recorder, 'flush', side_effect=lambda: threads.append(threading.current_thread())):
+            with self.assertNumQueries(0):
+                recorder.record('search', {'q': 'milk'})
+            recorder._flush_thread.join()
+        self.assertEqual(len(threads), 1)
+        self.assertIsNot(threads[0], threading.current_thread())
+    
+    def test_no_exit_flush_once_disabled(self):
+        recorder = self.recorder(ENABLED=False)
+        with mock.patch.object(querylog, 'query_recorder', recorder), mock.patch.object(recorder, 'flush') as flush:
+            querylog._flush_at_exit()
+            flush.assert_not_called()
+            recorder.options['ENABLED'] = True
+            querylog._flush_at_exit()
+            flush.assert_called_once_with()
+    
+    def test_database_error_keeps_counts(self):
+        recorder = self.recorder()
+        recorder.record('search', {'q': 'milk'})
+        recorder.record('search', {'q': 'milk'})
+        with mock.patch.object(QueryLogEntry.objects, 'filter', side_effect=DatabaseError('down')):
+            with self.assertLogs('foods.querylog', 'ERROR'):
+                self.assertFalse(recorder.flush())
+        self.assertTrue(recorder.flush())
+        self.assertEqual(self.hits(), {'milk': 2})
+    
+    def test_warm_caches(self):
+        Food.objects.create(fdc_id=1, data_type='sr_legacy_food', description='Milk, whole')
+        Food.objects.update(search_vector=SearchVector('description'))
+        QueryLogEntry.objects.create(
+            kind='search', params_key='a', params={'q': 'Milk'}, hits=3, last_seen=timezone.now()
+        )
+        call_command('warm_caches', stdout=io.StringIO())
+        response_cache.local.clear()
+        
+        with self.assertNumQueries(0):
+            search = self.client.get('/api/foods/search/', {'q': 'milk'})
+            detail = self.client.get('/api/foods/foods/1/')
+        self.assertEqual(search['X-Cache'], 'HIT-SHARED')
+        self.assertEqual(search.data['results'][0]['fdc_id'], 1)
+        self.assertEqual(detail['X-Cache'], 'HIT-SHARED')
+
+
+@override_settings(COMPRESSION_MIN_SIZE=100)
+class CompressionMiddlewareTests(SimpleTestCase):
+    """Responses are compressed as negotiated, above the size threshold"""
+    
+    body = b'{"description": "Milk, whole"}' * 20
+    
+    def process(self, response, accept_encoding='gzip'):
+        request = RequestFactory().get('/', HTTP_ACCEPT_ENCODING=accept_encoding)
+        return CompressionMiddleware(lambda request: response)(request)
+    
+    def test_size_threshold(self):
+        response = self.process(HttpResponse(self.body[:50]))
+        self.assertFalse(response.has_header('Content-Encoding'))
+        self.assertEqual(response['Vary'], 'Accept-Encoding')
+        
+        response = self.process(HttpResponse(self.body))
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(response['Content-Length'], str(len(response.content)))
+        self.assertEqual(gzip.decompress(response.content), self.body)
+    
+    def test_accept_encoding_q_values(self):
+        self.assertEqual(choose_encoding('deflate, gzip;q=0.5'), 'gzip')
+        self.assertEqual(choose_encoding('GZIP'), 'gzip')
+        self.assertIsNone(choose_encoding('gzip;q=0'))
+        self.assertIsNone(choose_encoding('gzip;q=0, br;q=0'))
+        self.assertIsNone(choose_encoding('identity'))
+        self.assertIsNone(choose_encoding('*;q=0'))
+        self.assertIn(choose_encoding('*'), ('br', 'gzip'))
+        self.assertEqual(parse_accept_encoding('gzip;q=0.8, br;q=oops'), {'gzip': 0.8, 'br': 0.0})
+        
+        response = self.process(HttpResponse(self.body), 'gzip;q=0')
+        self.assertFalse(response.has_header('Content-Encoding'))
+        self.assertEqual(response.content, self.body)
+    
+    def test_already_encoded(self):
+        content = gzip.compress(self.body)
+        response = HttpResponse(content)
+        response['Content-Encoding'] = 'gzip'
+        response = self.process(response)
+        self.assertEqual(response.content, content)
+        self.assertFalse(response.has_header('Vary'))
+    
+    def test_streaming(self):
+        response = StreamingHttpResponse(iter([self.body, self.body]))
+        response['ETag'] = '"abc"'
+        response = self.process(response)
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(response['ETag'], 'W/"abc"')
+        self.assertFalse(response.has_header('Content-Length'))
+        self.assertEqual(gzip.decompress(b''.join(response.streaming_content)), self.body * 2)
+
+
+class FastJSONRendererTests(SimpleTestCase):
+    """The orjson renderer writes the same bytes as DRF's JSONRenderer"""
+    
+    def test_matches_drf(self):
+        data = {
+            'date': datetime.date(2024, 1, 2),
+            'utc': datetime.datetime(2024, 1, 2, 3, 4, 5, 123456, tzinfo=datetime.timezone.utc),
+            'offset': datetime.datetime(2024, 1, 2, 3, 4, 5, tzinfo=datetime.timezone(datetime.timedelta(hours=5))),
+            'naive': datetime.datetime(2024, 1, 2, 3, 4, 5),
+            'time': datetime.time(1, 2, 3, 456789),
+            'decimal': decimal.Decimal('1.10'),
+            'uuid': uuid.UUID(int=5),
+            'duration': datetime.timedelta(seconds=90),
+            'text': 'Crème brûlée',
+            'values': [1, None, 2.5, True],
+            7: 'integer key',
+        }
+        self.assertEqual(FastJSONRenderer().render(data), JSONRenderer().render(data))
+        self.assertEqual(FastJSONRenderer().render(None), JSONRenderer().render(None))
+
+
+@override_settings(CACHES=TEST_CACHES)
+class SparseFieldsetTests(TestCase):
+    """?fields= and ?omit= pick the output keys and narrow the SQL projection"""
+    
+    @classmethod
+    def setUpTestData(cls):
+        FoodCategory.objects.create(id=1, code='0100', description='Dairy')
+        Food.objects.create(
+            fdc_id=1, data_type='sr_legacy_food', description='Milk, whole', food_category_id=1,
+            publication_date=datetime.date(2020, 1, 1)
+        )
+        Food.objects.update(search_vector=SearchVector('description'))
+        FoodNutrient.objects.create(id=1, fdc_id=1, nutrient_id=NutrientLookup.PROTEIN, amount=3.2)
+    
+    def setUp(self):
+        self.client = APIClient()
+        response_cache.local.clear()
+        response_cache.invalidate(0)
+    
+    def food_selects(self, queries):
+        """Column lists of the SELECTs reading the food table"""
+        table = Food._meta.db_table
+        return [
+            query['sql'].split(' FROM ')[0] for query in queries
+            if query['sql'].startswith('SELECT') and f'FROM "{table}"' in query['sql'] and 'COUNT(' not in query['sql']
+        ]
+    
+    def test_fields(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/api/foods/foods/', {'fields': 'description,fdc_id'})
+        self.assertEqual(list(response.data['results'][0]), ['fdc_id', 'description'])
+        # count + page, and no category, serving or score lookups
+        self.assertEqual(len(queries), 2)
+        [select] = self.food_selects(queries)
+        self.assertIn('"description"', select)
+        self.assertNotIn('"publication_date"', select)
+        self.assertNotIn('"data_type"', select)
+    
+    def test_macro_fields(self):
+        # count + page + macros
+        with self.assertNumQueries(3):
+            response = self.client.get('/api/foods/foods/', {'fields': 'fdc_id,description,calories,protein'})
+        self.assertEqual(
+            response.data['results'], [{'fdc_id': 1, 'description': 'Milk, whole', 'calories': None, 'protein': 3.2}]
+        )
+        # Only returned when asked for
+        self.assertNotIn('protein', self.client.get('/api/foods/foods/1/').data)
+    
+    def test_empty_selection(self):
+        every_field = 'fdc_id,data_type,description,food_category_id,food_category,publication_date,per_serving,scores'
+        for params in ({'omit': every_field}, {'fields': 'fdc_id', 'omit': 'fdc_id'}):
+            with self.assertNumQueries(0):
+                response = self.client.get('/api/foods/foods/', params)
+            self.assertEqual(response.status_code, 400)
+            self.assertEqual(self.client.get('/api/foods/foods/1/', params).status_code, 400)
+    
+    def test_omit(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/api/foods/foods/1/', {'omit': 'per_serving,scores,publication_date'})
+        self.assertEqual(
+            list(response.data), ['fdc_id', 'data_type', 'description', 'food_category_id', 'food_category']
+        )
+        self.assertEqual(response.data['food_category'], 'Dairy')
+        [select] = self.food_selects(queries)
+        self.assertNotIn('"publication_date"', select)
+    
+    def test_search_fields(self):
+        with self.assertNumQueries(3):
+            response = self.client.get('/api/foods/search/', {'q': 'milk', 'fields': 'fdc_id,protein'})
+        self.assertEqual(response.data['results'], [{'fdc_id': 1, 'protein': 3.2}])
+        
+        response = self.client.get('/api/foods/foods/', {'fields': 'fdc_id,bogus'})
+        self.assertEqual(response.status_code, 400)
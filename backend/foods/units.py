@@ -0,0 +1,121 @@
+"""
+Canonical units for nutrient amounts, and the USDA <-> CN nutrient mapping.
+
+USDA reports each nutrient (Nutrient.id) in a single unit, so food_nutrient
+amounts are already in one unit per nutrient; only the spelling varies
+(G, MG, UG, KCAL, kJ, IU). Child Nutrition nutrients are identified by their
+SR nutrient number, which is USDA's Nutrient.nutrient_nbr, and use their own
+unit spellings (mcg, ...).
+
+`rebuild_unit_mapping()` runs at the end of every import and
+
+1. sets Nutrient.canonical_unit to the normalized unit_name;
+2. maps each CNNutrient to the USDA nutrient with the same number
+   (CNNutrient.nutrient) and adopts its canonical unit, with the factor
+   from the CN unit (CNNutrient.unit_factor). A CN nutrient whose unit
+   cannot be converted to the USDA one keeps its own unit and no mapping;
+3. stores every CN value in the canonical unit (CNNutrientValue.amount)
+   with one set-based UPDATE.
+
+Readers then combine USDA amounts and CN `amount`s, e.g. in meal totals,
+with plain arithmetic.
+
+Conversions are mass (g, mg, ug), energy (kcal, kJ) and, for the vitamins
+in IU_EQUIVALENTS, IU to mass.
+"""
+
+from django.db import connection, transaction
+
+from .models import CNNutrient, CNNutrientValue, Nutrient
+
+UNIT_ALIASES = {
+    'g': 'g', 'gm': 'g', 'grm': 'g', 'gram': 'g', 'grams': 'g',
+    'mg': 'mg', 'milligram': 'mg', 'milligrams': 'mg',
+    'ug': 'ug', 'mcg': 'ug', 'µg': 'ug', 'μg': 'ug', 'microgram': 'ug', 'micrograms': 'ug',
+    'kcal': 'kcal', 'cal': 'kcal', 'calories': 'kcal',
+    'kj': 'kj', 'kilojoule': 'kj', 'kilojoules': 'kj',
+    'iu': 'iu',
+}
+MASS_UNITS = {'g': 1.0, 'mg': 1e-3, 'ug': 1e-6}
+ENERGY_UNITS = {'kcal': 1.0, 'kj': 1 / 4.184}
+# SR nutrient number -> (mass unit, amount of that unit in one IU)
+IU_EQUIVALENTS = {
+    318: ('ug', 0.3),    # Vitamin A, IU (as retinol)
+    320: ('ug', 0.3),    # Vitamin A, RAE
+    319: ('ug', 0.3),    # Retinol
+    324: ('ug', 0.025),  # Vitamin D (D2 + D3), IU
+    328: ('ug', 0.025),  # Vitamin D (D2 + D3)
+    323: ('mg', 0.67),   # Vitamin E (alpha-tocopherol), natural form
+}
+
+
+def canonical_unit(unit):
+    """Normalized spelling of a unit name ('UG' -> 'ug'); unknown units are lowercased"""
+    unit = (unit or '').strip().lower()
+    return UNIT_ALIASES.get(unit, unit)
+
+
+def nutrient_number(value):
+    """SR nutrient number as an int ('208', '208.0' -> 208), or None"""
+    try:
+        return int(float(value))
+    except (TypeError, ValueError):
+        return None
+
+
+def unit_factor(from_unit, to_unit, number=None):
+    """Multiplier converting an amount in from_unit to to_unit, or None if they are not convertible"""
+    source, target = canonical_unit(from_unit), canonical_unit(to_unit)
+    if source == target:
+        return 1.0
+    for table in (MASS_UNITS, ENERGY_UNITS):
+        if source in table and target in table:
+            return table[source] / table[target]
+    if number in IU_EQUIVALENTS:
+        mass_unit, per_iu = IU_EQUIVALENTS[number]
+        if source == 'iu' and target in MASS_UNITS:
+            return per_iu * MASS_UNITS[mass_unit] / MASS_UNITS[target]
+        if target == 'iu' and source in MASS_UNITS:
+            return MASS_UNITS[source] / (per_iu * MASS_UNITS[mass_unit])
+    return None
+
+
+def rebuild_unit_mapping():
+    """Recompute canonical units, the CN -> USDA nutrient mapping and CN canonical amounts.
+
+    Returns (mapped CN nutrients, CN values converted).
+    """
+    with transaction.atomic():
+        nutrients = list(Nutrient.objects.order_by('rank', 'id'))
+        by_number = {}
+        for nutrient in nutrients:
+            nutrient.canonical_unit = canonical_unit(nutrient.unit_name)
+            # Several USDA nutrients can share a number; the first by rank wins
+            by_number.setdefault(nutrient_number(nutrient.nutrient_nbr), nutrient)
+        Nutrient.objects.bulk_update(nutrients, ['canonical_unit'])
+
+        cn_nutrients = list(CNNutrient.objects.all())
+        mapped = 0
+        for cn_nutrient in cn_nutrients:
+            usda = by_number.get(cn_nutrient.code)
+            factor = None if usda is None else unit_factor(cn_nutrient.unit, usda.canonical_unit, cn_nutrient.code)
+            if factor is None:
+                cn_nutrient.nutrient = None
+                cn_nutrient.canonical_unit = canonical_unit(cn_nutrient.unit)
+                cn_nutrient.unit_factor = 1.0
+            else:
+                cn_nutrient.nutrient = usda
+                cn_nutrient.canonical_unit = usda.canonical_unit
+                cn_nutrient.unit_factor = factor
+                mapped += 1
+        CNNutrient.objects.bulk_update(cn_nutrients, ['nutrient', 'canonical_unit', 'unit_factor'])
+
+        value_table = CNNutrientValue._meta.db_table
+        nutrient_table = CNNutrient._meta.db_table
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'UPDATE {value_table} v SET amount = v.nutrient_value * n.unit_factor '
+                f'FROM {nutrient_table} n WHERE n.code = v.nutrient_id'
+            )
+            converted = cursor.rowcount
+    return mapped, converted
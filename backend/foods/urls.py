@@ -6,12 +6,24 @@ router = DefaultRouter()
 router.register(r'categories', views.FoodCategoryViewSet)
 router.register(r'nutrients', views.NutrientViewSet)
 router.register(r'foods', views.FoodViewSet)
+router.register(r'cn/categories', views.CNFoodCategoryViewSet)
+router.register(r'cn/nutrients', views.CNNutrientViewSet)
+router.register(r'cn/foods', views.CNFoodViewSet)
 
 urlpatterns = [
     path('', include(router.urls)),
     path('search/', views.FoodSearchView.as_view(), name='food-search'),
+    path('search/unified/', views.UnifiedSearchView.as_view(), name='unified-search'),
     path('stats/', views.FoodStatsView.as_view(), name='food-stats'),
     path('autocomplete/', views.FoodAutocompleteView.as_view(), name='food-autocomplete'),
     path('barcode/', views.BarcodeSearchView.as_view(), name='barcode-search'),
+    path('nutrition/', views.MealNutritionView.as_view(), name='meal-nutrition'),
+    path('plan/', views.MealPlanView.as_view(), name='meal-plan'),
+    path('bundles/', views.BundleManifestView.as_view(), name='food-bundles'),
+    path('bundles/<str:filename>', views.BundleFileView.as_view(), name='food-bundle'),
+    path('changes/', views.ChangeFeedView.as_view(), name='change-feed'),
+    path('export/<str:export_format>/', views.FoodExportView.as_view(), name='food-export'),
+    path('cn/search/', views.CNFoodSearchView.as_view(), name='cn-food-search'),
+    path('cache/stats/', views.CacheStatsView.as_view(), name='cache-stats'),
 ]
 
@@ -1,19 +1,49 @@
+import gzip
+
 from rest_framework import viewsets, status
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework.decorators import action
 from django.contrib.postgres.search import SearchQuery, SearchRank
-from django.db.models import Q, Count
+from django.db.models import Q, Count, QuerySet
+from django.db.models.expressions import RawSQL
 from django.core.paginator import Paginator
+from django.http import FileResponse, Http404, HttpResponse, StreamingHttpResponse
+from django.urls import reverse
+from nutriplan_django.middleware import parse_accept_encoding
 from .models import (
     FoodCategory, Nutrient, Food, FoodNutrient, BrandedFood,
     FoundationFood, SrLegacyFood, SurveyFnddsFood, FoodPortion,
-    MeasureUnit, NutrientLookup
+    MeasureUnit, NutrientLookup, CNFoodCategory, CNNutrient, CNFood, DatasetRelease
 )
 from .serializers import (
-    FoodCategorySerializer, NutrientSerializer, FoodSerializer, FoodSearchSerializer,
-    BrandedFoodSerializer, FoodNutrientSerializer, FoodPortionSerializer
+    FoodCategorySerializer, NutrientSerializer, FoodSerializer,
+    BrandedFoodSerializer, FoodNutrientSerializer, FoodPortionSerializer,
+    CNFoodCategorySerializer, CNNutrientSerializer, CNFoodListSerializer, CNFoodDetailSerializer
+)
+from .fast_serializers import (
+    FastFoodSerializer, FastFoodSearchSerializer, FastBrandedFoodSerializer, FastCNFoodListSerializer,
+    FastCNFoodDetailSerializer, normalize_fieldset, serving_nutrition
+)
+from .filters import (
+    apply_nutrient_filters, nutrient_filters, nutrient_ordering, parse_nutrient_filters
 )
+from .facets import (
+    FACET_SCAN_LIMIT, apply_branded_filters, facet_filters, get_index as get_facet_index, parse_facet_params
+)
+from .backends import get_read_backend
+from .barcodes import get_index as get_barcode_index
+from .bundles import find_bundle_file, get_bundles
+from .changes import change_page, parse_change_params
+from .export import FORMATS as EXPORT_FORMATS, export_stream, parquet_available, parse_export_params
+from .grouping import collapse_groups
+from .linking import linked_ids, normalize_gtin, normalized_gtin_sql, unified_search
+from .ingredients import apply_ingredient_filters, ingredient_filters, parse_ingredient_filters
+from .nutrition import meal_nutrition
+from .planner import available as planner_available, plan_meals
+from .conversions import get_index as get_conversion_index, normalize_unit, portion_nutrition
+from .similarity import NO_CATEGORY, TRUE_VALUES, get_index as get_similarity_index, parse_similar_params
+from .cache import CachedObjectMixin, CachedResponseMixin, normalize_params, response_cache
 
 
 class FoodCategoryViewSet(viewsets.ReadOnlyModelViewSet):
@@ -28,10 +58,11 @@ class NutrientViewSet(viewsets.ReadOnlyModelViewSet):
     serializer_class = NutrientSerializer
 
 
-class FoodViewSet(viewsets.ReadOnlyModelViewSet):
+class FoodViewSet(CachedObjectMixin, viewsets.ReadOnlyModelViewSet):
     """ViewSet for USDA Foods"""
     queryset = Food.objects.all()
     serializer_class = FoodSerializer
+    cache_lookup_param = 'fdc_id'
     
     def get_queryset(self):
         queryset = Food.objects.all()
@@ -48,31 +79,68 @@ class FoodViewSet(viewsets.ReadOnlyModelViewSet):
         
         return queryset
     
+    def list(self, request, *args, **kwargs):
+        """Paginated food list; supports ?fields= / ?omit= sparse fieldsets and
+        nutrient or score ranges and ordering (?min_nrf9_3=20&order_by=-nrf9_3)"""
+        serializer = FastFoodSerializer.from_query_params(request.query_params)
+        params = parse_nutrient_filters(request.query_params)
+        queryset = apply_nutrient_filters(self.filter_queryset(self.get_queryset()), params)
+        ordering = [nutrient_ordering(params['order_by'])] if params['order_by'] else []
+        queryset = queryset.order_by(*ordering, 'fdc_id')
+        page = self.paginate_queryset(queryset.values(*serializer.columns()))
+        return self.get_paginated_response(serializer.serialize(page))
+    
+    def retrieve(self, request, *args, **kwargs):
+        return self.cached(
+            'food-detail', self.build_detail_response, **normalize_fieldset(request.query_params)
+        )
+    
+    def build_detail_response(self):
+        serializer = FastFoodSerializer.from_query_params(self.request.query_params)
+        pk = self.kwargs[self.lookup_url_kwarg or self.lookup_field]
+        backend = get_read_backend()
+        if str(pk).isascii() and str(pk).isdigit():
+            food = backend.food(int(pk))
+            if food is not None:
+                return Response({name: food[name] for name in serializer.selected})
+        if not backend.uses_database:
+            raise Http404('No Food matches the given query.')
+        row = self.get_queryset().filter(pk=pk).values(*serializer.columns()).first()
+        if row is None:
+            raise Http404('No Food matches the given query.')
+        return Response(serializer.serialize_one(row))
+    
     @action(detail=True, methods=['get'])
     def nutrients(self, request, pk=None):
         """Get all nutrients for a specific food"""
+        return self.cached('food-nutrients', self.build_nutrients_response)
+    
+    def build_nutrients_response(self):
         food = self.get_object()
-        nutrients = FoodNutrient.objects.filter(fdc_id=food.fdc_id).select_related()
+        food_nutrients = list(FoodNutrient.objects.filter(fdc_id=food.fdc_id))
+        nutrients = Nutrient.objects.in_bulk({fn.nutrient_id for fn in food_nutrients})
         
         # Group nutrients by type for better organization
         nutrient_data = {}
-        for fn in nutrients:
-            try:
-                nutrient = Nutrient.objects.get(id=fn.nutrient_id)
-                nutrient_data[nutrient.name] = {
-                    'amount': fn.amount,
-                    'unit': nutrient.unit_name,
-                    'nutrient_id': nutrient.id,
-                    'percent_daily_value': fn.percent_daily_value
-                }
-            except Nutrient.DoesNotExist:
+        for fn in food_nutrients:
+            nutrient = nutrients.get(fn.nutrient_id)
+            if nutrient is None:
                 continue
+            nutrient_data[nutrient.name] = {
+                'amount': fn.amount,
+                'unit': nutrient.unit_name,
+                'nutrient_id': nutrient.id,
+                'percent_daily_value': fn.percent_daily_value
+            }
         
         return Response(nutrient_data)
     
     @action(detail=True, methods=['get'])
     def macros(self, request, pk=None):
         """Get macronutrients for a specific food"""
+        return self.cached('food-macros', self.build_macros_response)
+    
+    def build_macros_response(self):
         food = self.get_object()
         macros = NutrientLookup.get_macros(food.fdc_id)
         return Response(macros)
@@ -80,23 +148,130 @@ class FoodViewSet(viewsets.ReadOnlyModelViewSet):
     @action(detail=True, methods=['get'])
     def portions(self, request, pk=None):
         """Get portion information for a specific food"""
+        return self.cached('food-portions', self.build_portions_response)
+    
+    def build_portions_response(self):
         food = self.get_object()
         portions = FoodPortion.objects.filter(fdc_id=food.fdc_id)
         serializer = FoodPortionSerializer(portions, many=True)
         return Response(serializer.data)
+    
+    @action(detail=True, methods=['get'])
+    def units(self, request, pk=None):
+        """Household measures of a food in grams, from the conversion table"""
+        return self.cached('food-units', self.build_units_response)
+    
+    def build_units_response(self):
+        pk = self.kwargs[self.lookup_url_kwarg or self.lookup_field]
+        if not Food.objects.filter(pk=pk).exists():
+            raise Http404('No Food matches the given query.')
+        conversion_index = get_conversion_index()
+        if conversion_index is None:
+            return Response(
+                {'error': 'The unit conversion table has not been built.'},
+                status=status.HTTP_503_SERVICE_UNAVAILABLE
+            )
+        return Response({
+            'fdc_id': int(pk),
+            'density': conversion_index.density(DatasetRelease.SOURCE_USDA, pk),
+            'units': conversion_index.units(DatasetRelease.SOURCE_USDA, pk),
+        })
+    
+    @action(detail=True, methods=['get'])
+    def similar(self, request, pk=None):
+        """Foods with the closest nutrient profile, e.g. for substitutions.
+        
+        `k` results (default 10), optionally limited to the food's category
+        (`same_category=true`) or data type (`same_data_type=true`), or to foods
+        with less of a nutrient (`lower=sodium`); see foods.similarity.
+        """
+        params = parse_similar_params(request.query_params)
+        return self.cached('food-similar', lambda: self.build_similar_response(params), **params)
+    
+    def build_similar_response(self, params):
+        index = get_similarity_index()
+        if index is None:
+            return Response(
+                {'error': 'The similarity index has not been built.'},
+                status=status.HTTP_503_SERVICE_UNAVAILABLE
+            )
+        
+        pk = self.kwargs[self.lookup_url_kwarg or self.lookup_field]
+        food = Food.objects.filter(pk=pk).values('fdc_id', 'food_category_id', 'data_type').first()
+        if food is None:
+            raise Http404('No Food matches the given query.')
+        
+        category_id = None
+        if params['same_category']:
+            # None would mean "any category"; uncategorized foods match each other
+            category_id = NO_CATEGORY if food['food_category_id'] is None else food['food_category_id']
+        neighbours = index.query(
+            food['fdc_id'],
+            k=params['k'],
+            category_id=category_id,
+            data_type=food['data_type'] if params['same_data_type'] else None,
+            lower=params['lower'] or None,
+        ) or []
+        
+        serializer = FastFoodSearchSerializer()
+        rows = Food.objects.filter(fdc_id__in=[fdc_id for fdc_id, _ in neighbours]).values(*serializer.columns())
+        results = {row['fdc_id']: row for row in serializer.serialize(rows)}
+        return Response({
+            'fdc_id': food['fdc_id'],
+            'results': [
+                {**results[fdc_id], 'distance': round(distance, 4)}
+                for fdc_id, distance in neighbours if fdc_id in results
+            ],
+        })
 
 
-class FoodSearchView(APIView):
-    """Advanced food search with full-text search and filtering"""
+class FoodSearchView(CachedResponseMixin, APIView):
+    """Advanced food search with full-text search and filtering.
     
-    def get(self, request):
-        query = request.GET.get('q', '').strip()
-        data_type = request.GET.get('data_type', '')
-        category_id = request.GET.get('category_id', '')
-        page = int(request.GET.get('page', 1))
-        page_size = int(request.GET.get('page_size', 20))
+    Besides the text query, foods can be filtered by nutrient ranges
+    (`min_protein=20&max_energy=200`, `min_1258=0.5`) and sorted by a
+    nutrient (`order_by=-protein`); see foods.filters. `portion=cup` (or
+    `portion=default` for each food's first household measure) adds the
+    macros scaled to that measure; see foods.conversions. `facets=all` adds
+    facet value counts, and `brand_owner=`, `branded_food_category=` and
+    `market_country=` filter on facet values; see foods.facets.
+    `ingredients=`, `exclude_ingredients=`, `allergens=` and `free_of=`
+    filter on branded ingredient lists; see foods.ingredients.
+    `collapse=true` returns one food per group of near-duplicates; see
+    foods.grouping.
+    """
+    cache_namespace = 'search'
+    
+    def get_cache_params(self, query_params):
+        params = normalize_params(query_params, {
+            'q': '', 'data_type': '', 'category_id': '', 'page': '1', 'page_size': '20',
+        }, casefold=('q',))
+        params['page'] = int(params['page'])
+        params['page_size'] = int(params['page_size'])
+        params.update(normalize_fieldset(query_params))
+        params.update(parse_nutrient_filters(query_params))
+        params.update(parse_facet_params(query_params))
+        params.update(parse_ingredient_filters(query_params))
+        params['portion'] = normalize_portion(query_params)
+        params['collapse'] = (query_params.get('collapse') or '').lower() in TRUE_VALUES
+        return params
+    
+    def should_log_query(self, params):
+        return bool(
+            params['q'] or params['order_by'] or nutrient_filters(params) or params['facets']
+            or ingredient_filters(params)
+        )
+    
+    def build_response(self, params):
+        query = params['q']
+        page = params['page']
+        page_size = params['page_size']
+        order_by = params['order_by']
+        serializer = FastFoodSearchSerializer(fields=params['fields'], omit=params['omit'])
+        facet_names = [name for name in params['facets'].split(',') if name]
+        filters = facet_filters(params)
         
-        if not query:
+        if not (query or order_by or nutrient_filters(params) or facet_names or filters or ingredient_filters(params)):
             return Response({
                 'results': [],
                 'total_count': 0,
@@ -105,18 +280,48 @@ class FoodSearchView(APIView):
                 'total_pages': 0
             })
         
+        # Plain text searches may be answered by the read backend
+        if query and not (
+            order_by or nutrient_filters(params) or facet_names or filters or ingredient_filters(params)
+            or params['collapse']
+        ):
+            response = self.backend_response(params, serializer)
+            if response is not None:
+                return response
+        
+        # Browsing by facet filters alone is answered from the facet index
+        facets, count, approximate = None, None, False
+        facet_index = get_facet_index() if (facet_names or filters) else None
+        browsing = (
+            facet_index is not None and not query and not nutrient_filters(params)
+            and not ingredient_filters(params) and not params['collapse']
+        )
+        if browsing:
+            rows = facet_index.match(filters)
+            if facet_names:
+                facets = facet_index.counts(rows, facet_names, params['facet_limit'])
+            if not order_by:
+                return self.paginated_response(facet_index.fdc_ids[rows], params, serializer, facets=facets)
+            count = len(rows)
+        
         # Start with base queryset
         foods = Food.objects.all()
         
         # Apply filters
-        if data_type:
-            foods = foods.filter(data_type=data_type)
+        if params['data_type']:
+            foods = foods.filter(data_type=params['data_type'])
         
-        if category_id:
-            foods = foods.filter(food_category_id=category_id)
+        if params['category_id']:
+            foods = foods.filter(food_category_id=params['category_id'])
+        
+        foods = apply_branded_filters(foods, params)
+        foods = apply_nutrient_filters(foods, params)
+        foods = apply_ingredient_filters(foods, params)
         
         # Full-text search
-        if len(query) > 2:
+        if not query:
+            foods = foods.order_by('fdc_id')
+        elif len(query) > 2:
             try:
                 search_query = SearchQuery(query)
                 foods = foods.filter(search_vector=search_query)
@@ -134,26 +339,126 @@ class FoodSearchView(APIView):
                 Q(description__icontains=query)
             ).order_by('description')
         
-        # Pagination
-        paginator = Paginator(foods, page_size)
-        page_obj = paginator.get_page(page)
+        if order_by:
+            # The nutrient sort takes precedence; text rank then breaks ties
+            ordering = [nutrient_ordering(order_by)]
+            if query:
+                ordering.extend(foods.query.order_by)
+            foods = foods.order_by(*ordering, 'fdc_id')
+        
+        if params['collapse']:
+            foods = collapse_groups(foods)
         
-        # Serialize results
-        serializer = FoodSearchSerializer(page_obj.object_list, many=True)
+        # Facets count the matching ids, fetched instead of COUNT(*)
+        if facet_names and facet_index is not None and not browsing:
+            ids = list(foods.order_by().values_list('fdc_id', flat=True)[:FACET_SCAN_LIMIT + 1])
+            approximate = len(ids) > FACET_SCAN_LIMIT
+            count = foods.count() if approximate else len(ids)
+            scale = count / FACET_SCAN_LIMIT if approximate else 1.0
+            facets = facet_index.counts(
+                facet_index.rows(ids[:FACET_SCAN_LIMIT]), facet_names, params['facet_limit'], scale
+            )
         
+        return self.paginated_response(
+            foods, params, serializer, count=count, facets=facets, approximate=approximate
+        )
+    
+    def backend_response(self, params, serializer):
+        """The search page from the read backend, paginated like the database path, or None to use the database"""
+        backend = get_read_backend()
+        page_size = params['page_size']
+        args = (params['q'], params['data_type'], params['category_id'])
+        answer = backend.search(*args, offset=(params['page'] - 1) * page_size, limit=page_size)
+        if answer is None:
+            if backend.uses_database:
+                return None
+            answer = ([], 0)
+        foods, total = answer
+        paginator = Paginator(range(total), page_size)
+        page_obj = paginator.get_page(params['page'])
+        if page_obj.number != params['page'] and total:
+            # Out-of-range pages fall back to the last page, as Paginator.get_page() does
+            foods, total = backend.search(*args, offset=(page_obj.number - 1) * page_size, limit=page_size)
+        results = [{name: food[name] for name in serializer.selected} for food in foods]
+        if params['portion']:
+            add_portions(results, [food['fdc_id'] for food in foods], params['portion'])
         return Response({
-            'results': serializer.data,
+            'results': results,
             'total_count': paginator.count,
-            'page': page,
+            'page': params['page'],
             'page_size': page_size,
             'total_pages': paginator.num_pages
         })
+    
+    def paginated_response(self, foods, params, serializer, count=None, facets=None, approximate=False):
+        """A page of `foods` (a queryset, or an array of fdc_ids in page order)"""
+        page = params['page']
+        page_size = params['page_size']
+        columns = serializer.columns()
+        if params['portion'] and 'fdc_id' not in columns:
+            columns.append('fdc_id')
+        if params['collapse']:
+            columns.extend(['group_id', 'group_matches'])
+        
+        # Pagination, fetching only the columns the selected fields need
+        if isinstance(foods, QuerySet):
+            paginator = Paginator(foods.values(*columns), page_size)
+        else:
+            paginator = Paginator(foods, page_size)
+        if count is not None:
+            paginator.count = count
+        page_obj = paginator.get_page(page)
+        
+        rows = page_obj.object_list
+        if not isinstance(foods, QuerySet):
+            ids = [int(fdc_id) for fdc_id in rows]
+            by_id = {row['fdc_id']: row for row in Food.objects.filter(fdc_id__in=ids).values('fdc_id', *columns)}
+            rows = [by_id[fdc_id] for fdc_id in ids if fdc_id in by_id]
+        results = serializer.serialize(rows)
+        if params['portion']:
+            add_portions(results, [row['fdc_id'] for row in rows], params['portion'])
+        if params['collapse']:
+            for result, row in zip(results, rows):
+                result['group_id'] = row['group_id']
+                result['group_matches'] = row['group_matches']
+        
+        data = {
+            'results': results,
+            'total_count': paginator.count,
+            'page': page,
+            'page_size': page_size,
+            'total_pages': paginator.num_pages
+        }
+        if facets is not None:
+            data['facets'] = facets
+            data['facets_approximate'] = approximate
+        return Response(data)
+
+
+def normalize_portion(query_params):
+    """Canonical `portion` param: a unit key, "default", or '' for none"""
+    portion = (query_params.get('portion') or '').strip().lower()
+    return portion if portion in ('', 'default') else normalize_unit(portion)
+
+
+def add_portions(results, fdc_ids, unit):
+    """Add each USDA food's macros scaled to one `unit`, from the in-memory conversion table"""
+    conversion_index = get_conversion_index()
+    for result, fdc_id in zip(results, fdc_ids):
+        per_100g = {name: result[name] for name in FastFoodSearchSerializer.nutrient_fields if name in result}
+        result['portion'] = portion_nutrition(
+            DatasetRelease.SOURCE_USDA, fdc_id, per_100g, unit, conversion_index
+        )
 
 
-class FoodStatsView(APIView):
+class FoodStatsView(CachedResponseMixin, APIView):
     """Get database statistics - Clean version without legacy models"""
+    cache_namespace = 'stats'
     
-    def get(self, request):
+    def get_cache_params(self, query_params):
+        return {}
+    
+    def build_response(self, params):
         try:
             stats = {
                 'total_foods': Food.objects.count(),
@@ -193,7 +498,7 @@ class FoodStatsView(APIView):
             return Response(stats)
             
         except Exception as e:
-            # Return basic stats if there's an error
+            # Return basic stats if there's an error (never cached)
             return Response({
                 'total_foods': 0,
                 'branded_foods': 0,
@@ -206,19 +511,33 @@ class FoodStatsView(APIView):
                 'top_categories': [],
                 'status': 'error',
                 'error': str(e)
-            })
+            }, headers={'Cache-Control': 'no-store'})
 
 
-class FoodAutocompleteView(APIView):
+class FoodAutocompleteView(CachedResponseMixin, APIView):
     """Autocomplete suggestions for food search"""
+    cache_namespace = 'autocomplete'
     
-    def get(self, request):
-        query = request.GET.get('q', '').strip()
-        limit = int(request.GET.get('limit', 10))
+    def get_cache_params(self, query_params):
+        params = normalize_params(query_params, {'q': '', 'limit': '10'}, casefold=('q',))
+        params['limit'] = int(params['limit'])
+        return params
+    
+    def should_log_query(self, params):
+        return len(params['q']) >= 2
+    
+    def build_response(self, params):
+        query = params['q']
+        limit = params['limit']
         
         if len(query) < 2:
             return Response([])
         
+        backend = get_read_backend()
+        suggestions = backend.autocomplete(query, limit)
+        if suggestions is not None or not backend.uses_database:
+            return Response(suggestions or [])
+        
         # Get suggestions from food descriptions
         suggestions = Food.objects.filter(
             description__icontains=query
@@ -227,41 +546,390 @@ class FoodAutocompleteView(APIView):
         return Response(list(suggestions))
 
 
-class BarcodeSearchView(APIView):
-    """Search foods by barcode (UPC/GTIN)"""
+class BarcodeSearchView(CachedResponseMixin, APIView):
+    """Search foods by barcode (UPC/GTIN); `portion=serving` adds the macros per serving.
     
-    def get(self, request):
-        barcode = request.GET.get('barcode', '').strip()
+    Answered from the memory-mapped GTIN index (foods.barcodes) without
+    touching the database; codes missing from the index fall back to the
+    stored GTINs, normalized the way the index normalizes them. Lookups are
+    counted in the query log, which is written off the request thread.
+    """
+    cache_namespace = 'barcode'
+    branded_fields = 'fdc_id,brand_owner,brand_name,ingredients,serving_size,serving_size_unit,gtin_upc'
+    
+    def get_cache_params(self, query_params):
+        params = normalize_params(query_params, {'barcode': ''})
+        params['portion'] = normalize_portion(query_params)
+        return params
+    
+    def should_log_query(self, params):
+        return bool(params['barcode'])
+    
+    def build_response(self, params):
+        barcode = params['barcode']
         
         if not barcode:
             return Response({
                 'error': 'Barcode parameter is required'
             }, status=status.HTTP_400_BAD_REQUEST)
         
-        # Search in branded foods
-        try:
-            branded_food = BrandedFood.objects.get(gtin_upc=barcode)
-            food = Food.objects.get(fdc_id=branded_food.fdc_id)
-            
-            # Get nutrition info
-            macros = NutrientLookup.get_macros(food.fdc_id)
-            
-            result = {
-                'fdc_id': food.fdc_id,
-                'description': food.description,
-                'brand_owner': branded_food.brand_owner,
-                'brand_name': branded_food.brand_name,
-                'ingredients': branded_food.ingredients,
-                'serving_size': branded_food.serving_size,
-                'serving_size_unit': branded_food.serving_size_unit,
-                'gtin_upc': branded_food.gtin_upc,
-                'nutrition': macros
-            }
-            
-            return Response(result)
-            
-        except (BrandedFood.DoesNotExist, Food.DoesNotExist):
+        result = self.lookup_index(barcode)
+        if result is None and get_read_backend().uses_database:
+            result = self.lookup_database(barcode)
+        if result is None:
             return Response({
                 'error': 'Food not found for this barcode'
             }, status=status.HTTP_404_NOT_FOUND)
+        
+        if params['portion']:
+            result['portion'] = portion_nutrition(
+                DatasetRelease.SOURCE_USDA, result['fdc_id'], result['nutrition'], params['portion']
+            )
+        return Response(result)
+    
+    @staticmethod
+    def lookup_index(barcode):
+        """Result from the GTIN index, or None if it is not built or lacks the code"""
+        barcode_index = get_barcode_index()
+        return None if barcode_index is None else barcode_index.lookup(barcode)
+    
+    @classmethod
+    def lookup_database(cls, barcode):
+        """Result for the stored GTIN matching the barcode once both are normalized, or None"""
+        gtin = normalize_gtin(barcode)
+        if not gtin:
+            return None
+        serializer = FastBrandedFoodSerializer(fields=cls.branded_fields)
+        # Like the GTIN index, the newest food wins when several share a code. The
+        # normalized expression has its own index (branded_food_gtin_normalized_idx)
+        row = BrandedFood.objects.annotate(
+            gtin_key=RawSQL(normalized_gtin_sql('gtin_upc'), [])
+        ).filter(gtin_key=gtin).order_by('-fdc_id').values(*serializer.columns()).first()
+        if row is None:
+            return None
+        description = Food.objects.filter(fdc_id=row['fdc_id']).values_list('description', flat=True).first()
+        if description is None:
+            return None
+        
+        branded = serializer.serialize_one(row)
+        fdc_id = branded.pop('fdc_id')
+        return {
+            'fdc_id': fdc_id,
+            'description': description,
+            **branded,
+            'nutrition': NutrientLookup.get_macros(fdc_id),
+            'per_serving': serving_nutrition([fdc_id]).get(fdc_id),
+        }
+
 
+class CNFoodCategoryViewSet(viewsets.ReadOnlyModelViewSet):
+    """ViewSet for Child Nutrition food categories"""
+    queryset = CNFoodCategory.objects.all().order_by('code')
+    serializer_class = CNFoodCategorySerializer
+
+
+class CNNutrientViewSet(viewsets.ReadOnlyModelViewSet):
+    """ViewSet for Child Nutrition nutrients"""
+    queryset = CNNutrient.objects.all().order_by('code')
+    serializer_class = CNNutrientSerializer
+
+
+class CNFoodViewSet(CachedObjectMixin, viewsets.ReadOnlyModelViewSet):
+    """ViewSet for Child Nutrition foods.
+    
+    The list reads only the selected columns (joining the category name) and
+    fetches macros for the whole page in one query. The detail selects the
+    category and prefetches nutrient values, nutrients and weights, so its
+    query count does not depend on how many nutrients a food has.
+    """
+    queryset = CNFood.objects.all()
+    serializer_class = CNFoodListSerializer
+    cache_lookup_param = 'cn_code'
+    
+    def get_queryset(self):
+        queryset = CNFood.objects.all()
+        
+        # Filter by food category
+        category = self.request.query_params.get('category')
+        if category:
+            queryset = queryset.filter(food_category_id=category)
+        
+        return queryset
+    
+    def get_serializer_class(self):
+        if self.action == 'retrieve':
+            return CNFoodDetailSerializer
+        return CNFoodListSerializer
+    
+    def list(self, request, *args, **kwargs):
+        """Paginated CN food list; supports ?fields= / ?omit= sparse fieldsets"""
+        serializer = FastCNFoodListSerializer.from_query_params(request.query_params)
+        queryset = self.filter_queryset(self.get_queryset()).order_by('cn_code')
+        page = self.paginate_queryset(queryset.values(*serializer.columns()))
+        return self.get_paginated_response(serializer.serialize(page))
+    
+    def retrieve(self, request, *args, **kwargs):
+        return self.cached(
+            'cn-food-detail', self.build_detail_response, **normalize_fieldset(request.query_params)
+        )
+    
+    def build_detail_response(self):
+        serializer = FastCNFoodDetailSerializer.from_query_params(self.request.query_params)
+        pk = self.kwargs[self.lookup_url_kwarg or self.lookup_field]
+        food = (
+            CNFood.objects.filter(pk=pk)
+            .select_related('food_category')
+            .prefetch_related(*self.detail_prefetches(serializer))
+            .first()
+        )
+        if food is None:
+            raise Http404('No CN Food matches the given query.')
+        return Response(serializer.serialize_one(food))
+    
+    @staticmethod
+    def detail_prefetches(serializer):
+        """Related lookups needed by the selected detail fields"""
+        prefetches = []
+        if serializer.is_selected('nutrient_values'):
+            prefetches.append('nutrient_values__nutrient')
+        elif serializer.is_selected('macros') or serializer.is_selected('vitamins_minerals'):
+            prefetches.append('nutrient_values')
+        if serializer.is_selected('weights'):
+            prefetches.append('weights')
+        return prefetches
+
+
+class CNFoodSearchView(CachedResponseMixin, APIView):
+    """Full-text search over Child Nutrition foods"""
+    cache_namespace = 'cn-search'
+    
+    def get_cache_params(self, query_params):
+        params = normalize_params(query_params, {
+            'q': '', 'category': '', 'page': '1', 'page_size': '20',
+        }, casefold=('q',))
+        params['page'] = int(params['page'])
+        params['page_size'] = int(params['page_size'])
+        params.update(normalize_fieldset(query_params))
+        return params
+    
+    def should_log_query(self, params):
+        return bool(params['q'])
+    
+    def build_response(self, params):
+        query = params['q']
+        category = params['category']
+        page = params['page']
+        page_size = params['page_size']
+        serializer = FastCNFoodListSerializer(fields=params['fields'], omit=params['omit'])
+        
+        if not query:
+            return Response({
+                'results': [],
+                'total_count': 0,
+                'page': page,
+                'page_size': page_size,
+                'total_pages': 0
+            })
+        
+        foods = CNFood.objects.all()
+        
+        if category:
+            foods = foods.filter(food_category_id=category)
+        
+        if len(query) > 2:
+            search_query = SearchQuery(query)
+            foods = foods.filter(search_vector=search_query).annotate(
+                rank=SearchRank('search_vector', search_query)
+            ).order_by('-rank', 'cn_code')
+        else:
+            # Simple text search for short queries
+            foods = foods.filter(
+                Q(descriptor__icontains=query) | Q(abbreviated_descriptor__icontains=query)
+            ).order_by('descriptor', 'cn_code')
+        
+        paginator = Paginator(foods.values(*serializer.columns()), page_size)
+        page_obj = paginator.get_page(page)
+        
+        return Response({
+            'results': serializer.serialize(page_obj.object_list),
+            'total_count': paginator.count,
+            'page': page,
+            'page_size': page_size,
+            'total_pages': paginator.num_pages
+        })
+
+
+class UnifiedSearchView(CachedResponseMixin, APIView):
+    """Full-text search over USDA and Child Nutrition foods, ranked together.
+    
+    Each result names its `source` ('usda' or 'cn') and `id` (fdc_id or
+    cn_code), and lists the `linked` foods of the other dataset; see
+    foods.linking.
+    """
+    cache_namespace = 'unified-search'
+    
+    def get_cache_params(self, query_params):
+        params = normalize_params(query_params, {
+            'q': '', 'page': '1', 'page_size': '20',
+        }, casefold=('q',))
+        params['page'] = int(params['page'])
+        params['page_size'] = int(params['page_size'])
+        return params
+    
+    def should_log_query(self, params):
+        return bool(params['q'])
+    
+    def build_response(self, params):
+        query = params['q']
+        page = params['page']
+        page_size = params['page_size']
+        
+        if not query:
+            return Response({
+                'results': [],
+                'total_count': 0,
+                'page': page,
+                'page_size': page_size,
+                'total_pages': 0
+            })
+        
+        paginator = Paginator(unified_search(query), page_size)
+        page_obj = paginator.get_page(page)
+        results = [
+            {
+                'source': row['source'],
+                'id': row['id'],
+                'description': row['name'],
+                'category': row['category'],
+                'rank': row['rank'],
+                'linked': row['linked'],
+            }
+            for row in linked_ids(list(page_obj.object_list))
+        ]
+        
+        return Response({
+            'results': results,
+            'total_count': paginator.count,
+            'page': page,
+            'page_size': page_size,
+            'total_pages': paginator.num_pages
+        })
+
+
+class MealNutritionView(APIView):
+    """Total and per-ingredient nutrition for a meal or recipe.
+    
+    POST {"ingredients": [{"fdc_id": 171705, "amount": 2, "portion_id": 81234},
+                          {"cn_code": 500123, "amount": 150}, ...]}
+    Amounts are grams unless a USDA `portion_id` or CN `weight_seq` is given.
+    """
+    
+    def post(self, request):
+        return Response(meal_nutrition(request.data))
+
+
+class MealPlanView(APIView):
+    """Day or week meal plan optimized against daily nutrient targets.
+    
+    POST {"targets": {"calories": 2000, "protein": {"min": 90}, "sodium": {"max": 2300}},
+          "pool": {"data_types": [...], "category_ids": [...], "fdc_ids": [favorites]},
+          "days": 7, "foods_per_day": 6, "max_grams": 400}
+    See foods.planner for all options.
+    """
+    
+    def post(self, request):
+        if not planner_available():
+            return Response(
+                {'error': 'Meal planning requires NumPy, which is not installed.'},
+                status=status.HTTP_503_SERVICE_UNAVAILABLE
+            )
+        return Response(plan_meals(request.data))
+
+
+class ChangeFeedView(CachedResponseMixin, APIView):
+    """Foods inserted, updated or deleted after a dataset version.
+    
+    `?since=<version>` returns the ids to re-fetch (`upserted`) and to drop
+    (`deleted`) per source, `limit` per page; follow `next_cursor` until it
+    is null, then sync from `version` next time. See foods.changes.
+    """
+    cache_namespace = 'changes'
+    
+    def get_cache_params(self, query_params):
+        return parse_change_params(query_params)
+    
+    def build_response(self, params):
+        return Response(change_page(params['since'], params['cursor'], params['limit']))
+
+
+class BundleManifestView(APIView):
+    """Offline bundles of the current dataset version, with their immutable URLs; see foods.bundles"""
+    
+    def get(self, request):
+        bundle_set = get_bundles()
+        if bundle_set is None:
+            return Response(
+                {'error': 'The offline bundles have not been built.'},
+                status=status.HTTP_503_SERVICE_UNAVAILABLE
+            )
+        bundles = {
+            name: {**entry, 'url': request.build_absolute_uri(reverse('food-bundle', args=[entry['file']]))}
+            for name, entry in bundle_set.manifest['bundles'].items()
+        }
+        response = Response({'version': bundle_set.manifest['version'], 'bundles': bundles})
+        response['Cache-Control'] = 'public, max-age=60'
+        return response
+
+
+class BundleFileView(APIView):
+    """A content-hashed bundle file, cached forever; gzip-encoded when Accept-Encoding allows gzip"""
+    
+    def get(self, request, filename):
+        path = find_bundle_file(filename)
+        if path is None:
+            raise Http404('No such bundle.')
+        codings = parse_accept_encoding(request.META.get('HTTP_ACCEPT_ENCODING', ''))
+        if codings.get('gzip', codings.get('*', 0.0)) > 0:
+            response = FileResponse(open(path, 'rb'), content_type='application/json')
+            response['Content-Encoding'] = 'gzip'
+        else:
+            with gzip.open(path, 'rb') as f:
+                response = HttpResponse(f.read(), content_type='application/json')
+        response['Cache-Control'] = 'public, max-age=31536000, immutable'
+        response['ETag'] = f'"{filename.split(".")[1]}"'
+        response['Vary'] = 'Accept-Encoding'
+        return response
+
+
+class FoodExportView(APIView):
+    """Stream foods with their nutrients as CSV, NDJSON or Parquet.
+    
+    Takes the search filters plus `since_version` (foods inserted or updated
+    after that dataset version) and `nutrients` (nutrient ids to include); output is
+    written as it is read, in fdc_id order. See foods.export.
+    """
+    
+    def get(self, request, export_format):
+        if export_format not in EXPORT_FORMATS:
+            return Response(
+                {'error': f"Unknown format; use one of {', '.join(EXPORT_FORMATS)}."},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        if export_format == 'parquet' and not parquet_available():
+            return Response(
+                {'error': 'Parquet export requires pyarrow, which is not installed.'},
+                status=status.HTTP_503_SERVICE_UNAVAILABLE
+            )
+        params = parse_export_params(request.query_params)
+        response = StreamingHttpResponse(
+            export_stream(export_format, params), content_type=EXPORT_FORMATS[export_format]
+        )
+        response['Content-Disposition'] = f'attachment; filename="foods.{export_format}"'
+        return response
+
+
+class CacheStatsView(APIView):
+    """Hit/miss metrics for the foods response cache"""
+    
+    def get(self, request):
+        return Response(response_cache.stats())
@@ -0,0 +1,163 @@
+"""
+SQLite-backed cache shared by every worker process on a host.
+
+Used as the default cache when no Redis server is configured. Entries live in
+a single WAL-mode database file, so readers in different processes don't block
+each other, and add()/incr() are atomic across processes.
+"""
+
+import os
+import pickle
+import sqlite3
+import threading
+import time
+
+from django.core.cache.backends.base import DEFAULT_TIMEOUT, BaseCache
+
+
+class SQLiteCache(BaseCache):
+    """Cross-process cache stored in a local SQLite database"""
+
+    pickle_protocol = pickle.HIGHEST_PROTOCOL
+
+    def __init__(self, location, params):
+        super().__init__(params)
+        self._path = location
+        self._local = threading.local()
+        self._sets_since_cull = 0
+
+    def _connection(self):
+        """Return a connection owned by the current thread and process"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            os.makedirs(os.path.dirname(self._path) or '.', exist_ok=True)
+            conn = sqlite3.connect(self._path, timeout=10, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS cache ('
+                'key TEXT PRIMARY KEY, value BLOB NOT NULL, expires REAL)'
+            )
+            conn.execute('CREATE INDEX IF NOT EXISTS cache_expires ON cache (expires)')
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def _dumps(self, value):
+        return pickle.dumps(value, self.pickle_protocol)
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self.make_and_validate_key(key, version=version)
+        cursor = self._connection().execute(
+            'INSERT INTO cache (key, value, expires) VALUES (?, ?, ?) '
+            'ON CONFLICT (key) DO UPDATE SET value = excluded.value, expires = excluded.expires '
+            'WHERE cache.expires IS NOT NULL AND cache.expires <= ?',
+            (key, self._dumps(value), self.get_backend_timeout(timeout), time.time())
+        )
+        return cursor.rowcount == 1
+
+    def get(self, key, default=None, version=None):
+        key = self.make_and_validate_key(key, version=version)
+        row = self._connection().execute(
+            'SELECT value, expires FROM cache WHERE key = ?', (key,)
+        ).fetchone()
+        if row is None or (row[1] is not None and row[1] <= time.time()):
+            return default
+        return pickle.loads(row[0])
+
+    def get_many(self, keys, version=None):
+        key_map = {self.make_and_validate_key(key, version=version): key for key in keys}
+        if not key_map:
+            return {}
+        placeholders = ', '.join('?' * len(key_map))
+        rows = self._connection().execute(
+            f'SELECT key, value, expires FROM cache WHERE key IN ({placeholders})',
+            list(key_map)
+        ).fetchall()
+        now = time.time()
+        return {
+            key_map[key]: pickle.loads(value)
+            for key, value, expires in rows
+            if expires is None or expires > now
+        }
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self.make_and_validate_key(key, version=version)
+        self._connection().execute(
+            'INSERT OR REPLACE INTO cache (key, value, expires) VALUES (?, ?, ?)',
+            (key, self._dumps(value), self.get_backend_timeout(timeout))
+        )
+        self._maybe_cull()
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self.make_and_validate_key(key, version=version)
+        cursor = self._connection().execute(
+            'UPDATE cache SET expires = ? WHERE key = ? AND (expires IS NULL OR expires > ?)',
+            (self.get_backend_timeout(timeout), key, time.time())
+        )
+        return cursor.rowcount == 1
+
+    def delete(self, key, version=None):
+        key = self.make_and_validate_key(key, version=version)
+        cursor = self._connection().execute('DELETE FROM cache WHERE key = ?', (key,))
+        return cursor.rowcount == 1
+
+    def has_key(self, key, version=None):
+        key = self.make_and_validate_key(key, version=version)
+        row = self._connection().execute(
+            'SELECT 1 FROM cache WHERE key = ? AND (expires IS NULL OR expires > ?)',
+            (key, time.time())
+        ).fetchone()
+        return row is not None
+
+    def incr(self, key, delta=1, version=None):
+        key = self.make_and_validate_key(key, version=version)
+        conn = self._connection()
+        # BEGIN IMMEDIATE takes the write lock up front so concurrent
+        # increments from other processes serialize instead of racing.
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            row = conn.execute(
+                'SELECT value, expires FROM cache WHERE key = ?', (key,)
+            ).fetchone()
+            if row is None or (row[1] is not None and row[1] <= time.time()):
+                raise ValueError("Key '%s' not found" % key)
+            new_value = pickle.loads(row[0]) + delta
+            conn.execute(
+                'UPDATE cache SET value = ? WHERE key = ?', (self._dumps(new_value), key)
+            )
+            conn.execute('COMMIT')
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        return new_value
+
+    def clear(self):
+        self._connection().execute('DELETE FROM cache')
+
+    def _maybe_cull(self):
+        """Drop expired rows, then the oldest rows once over MAX_ENTRIES.
+
+        Keys stored without an expiry (the dataset version, metrics counters)
+        are bookkeeping rather than cached data, so culling never drops them
+        and they don't count towards MAX_ENTRIES.
+        """
+        self._sets_since_cull += 1
+        if self._sets_since_cull < 100:
+            return
+        self._sets_since_cull = 0
+        self.cull()
+
+    def cull(self):
+        conn = self._connection()
+        conn.execute('DELETE FROM cache WHERE expires IS NOT NULL AND expires <= ?', (time.time(),))
+        count = conn.execute('SELECT COUNT(*) FROM cache WHERE expires IS NOT NULL').fetchone()[0]
+        if count > self._max_entries and self._cull_frequency == 0:
+            conn.execute('DELETE FROM cache WHERE expires IS NOT NULL')
+        elif count > self._max_entries:
+            excess = count - self._max_entries + self._max_entries // self._cull_frequency
+            conn.execute(
+                'DELETE FROM cache WHERE rowid IN '
+                '(SELECT rowid FROM cache WHERE expires IS NOT NULL ORDER BY rowid LIMIT ?)',
+                (excess,)
+            )
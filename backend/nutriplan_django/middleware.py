@@ -0,0 +1,97 @@
+"""
+Response compression negotiated from Accept-Encoding.
+
+Brotli is preferred when the brotli package is installed and the client
+accepts it, then gzip. Bodies smaller than COMPRESSION_MIN_SIZE are sent as
+is, since compressing them costs more CPU than the bytes it saves.
+"""
+
+import gzip
+
+from django.conf import settings
+from django.utils.cache import patch_vary_headers
+from django.utils.text import compress_sequence
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover - optional dependency
+    brotli = None
+
+
+def parse_accept_encoding(header):
+    """Map each coding in an Accept-Encoding header to its q-value"""
+    codings = {}
+    for part in header.split(','):
+        name, _, params = part.strip().partition(';')
+        name = name.strip().lower()
+        if not name:
+            continue
+        quality = 1.0
+        params = params.strip()
+        if params.startswith('q='):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        codings[name] = quality
+    return codings
+
+
+def choose_encoding(header):
+    """Best supported content coding for an Accept-Encoding header, or None"""
+    codings = parse_accept_encoding(header)
+    wildcard = codings.get('*', 0.0)
+    supported = ['br', 'gzip'] if brotli is not None else ['gzip']
+    best, best_quality = None, 0.0
+    for name in supported:
+        quality = codings.get(name, wildcard)
+        if quality > best_quality:
+            best, best_quality = name, quality
+    return best
+
+
+class CompressionMiddleware:
+    """Compress responses with brotli or gzip above a size threshold"""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.min_size = getattr(settings, 'COMPRESSION_MIN_SIZE', 1024)
+        self.gzip_level = getattr(settings, 'COMPRESSION_GZIP_LEVEL', 6)
+        self.brotli_quality = getattr(settings, 'COMPRESSION_BROTLI_QUALITY', 4)
+
+    def __call__(self, request):
+        response = self.get_response(request)
+        if response.has_header('Content-Encoding'):
+            return response
+
+        patch_vary_headers(response, ('Accept-Encoding',))
+        encoding = choose_encoding(request.META.get('HTTP_ACCEPT_ENCODING', ''))
+        if encoding is None:
+            return response
+
+        if response.streaming:
+            if encoding != 'gzip' or getattr(response, 'is_async', False):
+                return response
+            # Length is unknown up front; compress chunk by chunk
+            response.streaming_content = compress_sequence(response.streaming_content)
+            del response.headers['Content-Length']
+        else:
+            if len(response.content) < self.min_size:
+                return response
+            compressed = self.compress(response.content, encoding)
+            if len(compressed) >= len(response.content):
+                return response
+            response.content = compressed
+            response.headers['Content-Length'] = str(len(compressed))
+
+        # A compressed body is not byte-for-byte equal to the original
+        etag = response.get('ETag')
+        if etag and etag.startswith('"'):
+            response.headers['ETag'] = 'W/' + etag
+        response.headers['Content-Encoding'] = encoding
+        return response
+
+    def compress(self, content, encoding):
+        if encoding == 'br':
+            return brotli.compress(content, quality=self.brotli_quality)
+        return gzip.compress(content, compresslevel=self.gzip_level, mtime=0)
@@ -0,0 +1,35 @@
+"""
+JSON renderer that serializes with orjson when it is installed.
+
+orjson is several times faster than the stdlib json module for the large
+nutrient, search and batch payloads the foods API returns. Without orjson,
+or when a client asks for indented output, the stock DRF renderer is used.
+"""
+
+from rest_framework.renderers import JSONRenderer
+from rest_framework.utils.encoders import JSONEncoder
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - optional dependency
+    orjson = None
+
+
+class FastJSONRenderer(JSONRenderer):
+    """DRF JSONRenderer backed by orjson"""
+
+    if orjson is not None:
+        # OPT_UTC_Z: UTC datetimes end in "Z", as DRF's encoder writes them
+        options = orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS | orjson.OPT_UTC_Z
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if orjson is None or data is None:
+            return super().render(data, accepted_media_type, renderer_context)
+        if self.get_indent(accepted_media_type, renderer_context or {}):
+            return super().render(data, accepted_media_type, renderer_context)
+        return orjson.dumps(data, default=self.encode_fallback, option=self.options)
+
+    @staticmethod
+    def encode_fallback(obj):
+        """Types orjson doesn't know (Decimal, lazy strings, ...) go through DRF's encoder"""
+        return JSONEncoder().default(obj)
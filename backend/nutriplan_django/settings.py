@@ -40,6 +40,7 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'corsheaders.middleware.CorsMiddleware',
+    'nutriplan_django.middleware.CompressionMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -135,13 +136,18 @@ REST_FRAMEWORK = {
     'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.PageNumberPagination',
     'PAGE_SIZE': 20,
     'DEFAULT_RENDERER_CLASSES': [
-        'rest_framework.renderers.JSONRenderer',
+        'nutriplan_django.renderers.FastJSONRenderer',
     ],
     'DEFAULT_PARSER_CLASSES': [
         'rest_framework.parsers.JSONParser',
     ],
 }
 
+# Response compression (brotli when installed, otherwise gzip)
+COMPRESSION_MIN_SIZE = config('COMPRESSION_MIN_SIZE', default=1024, cast=int)
+COMPRESSION_GZIP_LEVEL = 6
+COMPRESSION_BROTLI_QUALITY = 4
+
 # CORS settings
 CORS_ALLOWED_ORIGINS = [
     "http://localhost:3000",
@@ -192,14 +198,61 @@ LOGGING = {
     },
 }
 
-# Cache configuration (optional)
-CACHES = {
-    'default': {
-        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
-        'LOCATION': 'unique-snowflake',
+# Cache configuration
+# The default cache is shared by all worker processes: Redis when REDIS_URL is
+# set, otherwise a SQLite file on the local host.
+REDIS_URL = config('REDIS_URL', default='')
+
+if REDIS_URL:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': REDIS_URL,
+        }
     }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'nutriplan_django.cache.SQLiteCache',
+            'LOCATION': config('CACHE_PATH', default=os.path.join(BASE_DIR, 'var', 'cache.sqlite3')),
+            'OPTIONS': {
+                'MAX_ENTRIES': 200000,
+            },
+        }
+    }
+
+# Foods API response cache: a small per-process LRU in front of the shared cache
+FOODS_CACHE = {
+    'CACHE_ALIAS': 'default',
+    'TIMEOUT': config('FOODS_CACHE_TIMEOUT', default=60 * 60 * 24, cast=int),
+    'LOCAL_MAX_ENTRIES': config('FOODS_CACHE_LOCAL_MAX_ENTRIES', default=1024, cast=int),
+    'LOCAL_TIMEOUT': 60,
+    'VERSION_CHECK_INTERVAL': 5,
+    # Single-flight: concurrent misses for one key wait for a single computation
+    'LOCK_TIMEOUT': 30,
+    'LOCK_WAIT': 10,
+    'LOCK_POLL_INTERVAL': 0.05,
 }
 
+# Rolling log of search/autocomplete/barcode queries, replayed by warm_caches
+FOODS_QUERY_LOG = {
+    'ENABLED': config('FOODS_QUERY_LOG_ENABLED', default=True, cast=bool),
+    # Counts are written by a background thread, never on the request thread
+    'FLUSH_IN_BACKGROUND': True,
+    'FLUSH_EVERY': 200,
+    'FLUSH_INTERVAL': 30,
+    'WINDOW_DAYS': 14,
+    'MAX_ENTRIES': 50000,
+}
+
+# Derived data files built at the end of each import (nutrient matrix etc.),
+# memory-mapped by every worker process
+FOODS_DATA_DIR = config('FOODS_DATA_DIR', default=os.path.join(BASE_DIR, 'var', 'foods'))
+
+# Backend answering food detail, search and autocomplete before the database,
+# e.g. 'foods.backends.SnapshotBackend' on edge nodes; see foods.backends
+FOODS_READ_BACKEND = config('FOODS_READ_BACKEND', default='')
+
 # Security settings for production
 if not DEBUG:
     SECURE_BROWSER_XSS_FILTER = True